@@ -7,7 +7,7 @@ Optimized for low bandwidth with text-only responses
 import json
 import json_repair
 import re
-from typing import TypedDict, Literal, Optional, Dict, Any, List, Callable, Awaitable
+from typing import TypedDict, Literal, Optional, Dict, Any, List, Callable, Awaitable, AsyncIterator
 from dataclasses import dataclass
 import httpx
 import os
@@ -166,24 +166,28 @@ async def call_llm(
     max_tokens: int = 600,
     tools: Optional[List[Dict[str, Any]]] = None,
     attachments: Optional[List[Dict[str, Any]]] = None,
+    license_id: Any = None,
 ) -> Any: # Returns str or LLMResponse
     """
     Call LLM using multi-provider service with automatic failover.
+    license_id (if known) gives the license its fair share of the rate limit.
     """
     try:
         from services.llm_provider import llm_generate
+        from services.rate_limiter import llm_request_context
         
         effective_system = system or BASE_SYSTEM_PROMPT
         
-        response = await llm_generate(
-            prompt=prompt,
-            system=effective_system,
-            json_mode=json_mode,
-            max_tokens=max_tokens,
-            temperature=0.3,
-            attachments=attachments,
-            tools=tools
-        )
+        with llm_request_context(license_id=license_id):
+            response = await llm_generate(
+                prompt=prompt,
+                system=effective_system,
+                json_mode=json_mode,
+                max_tokens=max_tokens,
+                temperature=0.3,
+                attachments=attachments,
+                tools=tools
+            )
         
         # If tools were requested and present in response, return full object
         # Safety Check: Ensure response is valid object with tool_calls
@@ -750,6 +754,85 @@ def get_agent():
     return _agent
 
 
+def _filtered_result(reason: str) -> dict:
+    """Result for a message dropped by the local filters (no LLM call)"""
+    return {
+        "success": True, # It's a success that we filtered it
+        "data": {
+            "intent": "آلي" if "Automated" in reason else "ignored",
+            "urgency": "منخفض",
+            "sentiment": "محايد",
+            "summary": f"تم تجاهل الرسالة: {reason}",
+            "draft_response": "", # No response for filtered messages
+            "processing_notes": f"Filtered by: {reason}"
+        }
+    }
+
+
+def _analysis_result(data: dict, sender_name: str = None, sender_contact: str = None, message_type: str = None) -> dict:
+    """Normalize parsed LLM analysis JSON into the process_message result shape"""
+    # Ensure critical fields exist
+    return {
+        "success": True,
+        "data": {
+            "intent": data.get("intent", "أخرى"),
+            "urgency": data.get("urgency", "عادي"),
+            "sentiment": data.get("sentiment", "محايد"),
+            "language": data.get("language", "ar"),
+            "dialect": data.get("dialect", "فصحى"),
+            "sender_name": data.get("sender_name") or sender_name,
+            "sender_contact": data.get("sender_contact") or sender_contact,
+            "key_points": data.get("key_points", []),
+            "action_items": data.get("action_items", []),
+            "extracted_entities": {}, # Legacy field, can be empty
+            "summary": data.get("summary", "رسالة جديدة"),
+            "draft_response": data.get("draft_response", ""),
+            "suggested_actions": [], # Can be inferred or left empty
+            "message_type": message_type or "general"
+        }
+    }
+
+
+# Per-message fields that must not be replayed to another customer
+_SEMANTIC_CACHE_PRIVATE_FIELDS = ("sender_name", "sender_contact")
+
+
+def _semantic_cacheable(data: dict) -> Optional[dict]:
+    """Analysis to keep in the semantic cache, or None if the draft is personalized"""
+    sender = (data.get("sender_name") or "").strip()
+    if sender and sender != "..." and sender in (data.get("draft_response") or ""):
+        return None
+    return {k: v for k, v in data.items() if k not in _SEMANTIC_CACHE_PRIVATE_FIELDS}
+
+
+async def _verify_semantic_hit(cache, cached: dict, prompt: str, system: str, license_id: Any = None):
+    """Background quality sample: does a fresh LLM answer agree with the reused one?"""
+    from services.rate_limiter import llm_request_context, PRIORITY_BACKGROUND
+    try:
+        with llm_request_context(priority=PRIORITY_BACKGROUND):
+            fresh = await call_llm(prompt, system=system, json_mode=True, max_tokens=2500, license_id=license_id)
+        fresh_data = json_repair.loads(fresh) if isinstance(fresh, str) else None
+        if isinstance(fresh_data, dict):
+            cache.record_verification(fresh_data.get("intent") == cached.get("intent"))
+    except Exception as e:
+        print(f"Semantic cache verification failed: {e}")
+
+
+async def _knowledge_base_context(text: str) -> str:
+    """Knowledge Base (RAG) block for one message of a batch (as process_message adds it), "" if nothing relevant"""
+    try:
+        from services.knowledge_base import get_knowledge_base
+        kb_results = await get_knowledge_base().search(text, k=2)
+    except Exception as e:
+        print(f"KB search failed: {e}")
+        return ""
+    if not kb_results:
+        return ""
+    print(f"Added {len(kb_results)} KB results to context")
+    kb_context = "\n".join([f"- {r['text']}" for r in kb_results])
+    return f"\n\n[System: Knowledge Base Info]\n{kb_context}"
+
+
 async def process_message(
     message: str, 
     attachment_text: str = None, 
@@ -867,17 +950,7 @@ async def process_message(
     
     if not should_process:
         print(f"Message filtered locally: {reason}")
-        return {
-            "success": True, # It's a success that we filtered it
-            "data": {
-                "intent": "آلي" if "Automated" in reason else "ignored",
-                "urgency": "منخفض",
-                "sentiment": "محايد",
-                "summary": f"تم تجاهل الرسالة: {reason}",
-                "draft_response": "", # No response for filtered messages
-                "processing_notes": f"Filtered by: {reason}"
-            }
-        }
+        return _filtered_result(reason)
 
     # URL Fetching Logic (from ingest_node)
 
@@ -937,6 +1010,28 @@ async def process_message(
     "draft_response": "..."
 }}"""
 
+    # --- Step 2.5: Semantic Cache ---
+    # A near-identical earlier question from the same license reuses its analysis.
+    # Only stateless messages: history, attachments and links change the answer.
+    from services.semantic_cache import get_semantic_cache
+    semantic_cache = get_semantic_cache()
+    semantic_scope = semantic_lookup = None
+    if (
+        semantic_cache and not history and not attachments and not attachment_text and not urls
+        and preferences and preferences.get("license_key_id")
+    ):
+        semantic_scope = semantic_cache.scope(preferences["license_key_id"], system_prompt)
+        semantic_lookup = await semantic_cache.lookup(semantic_scope, message)
+        if semantic_lookup.value is not None:
+            if semantic_lookup.verify:
+                asyncio.create_task(
+                    _verify_semantic_hit(
+                        semantic_cache, semantic_lookup.value, mega_prompt, system_prompt,
+                        license_id=preferences["license_key_id"]
+                    )
+                )
+            return _analysis_result(dict(semantic_lookup.value), sender_name, sender_contact, message_type)
+
     # --- Step 3: Single API Call ---
     # --- Step 3: Tool Execution Loop (Active Agent) ---
     max_turns = 3
@@ -948,6 +1043,7 @@ async def process_message(
     # Result container
     response_json = None
     response_obj = None
+    used_tools = False
 
     for turn in range(max_turns):
         try:
@@ -960,7 +1056,8 @@ async def process_message(
                 json_mode=True, # We ask for JSON, but Gemini might return function call instead
                 max_tokens=2500,
                 attachments=attachments if turn == 0 else None, # Attachments only needed once
-                tools=TOOLS_SCHEMA if turn < max_turns - 1 else None # Don't allow tools on last turn
+                tools=TOOLS_SCHEMA if turn < max_turns - 1 else None, # Don't allow tools on last turn
+                license_id=preferences.get("license_key_id") if preferences else None
             )
             
             # If standard response (string), break and return
@@ -972,6 +1069,7 @@ async def process_message(
             # (Since we check string above, it must be the object if not None)
             if response_obj and hasattr(response_obj, 'tool_calls') and response_obj.tool_calls:
                 tool_outputs = []
+                used_tools = True
                 print(f"Agent requested tools: {[t['name'] for t in response_obj.tool_calls]}")
                 
                 for tool_call in response_obj.tool_calls:
@@ -1043,28 +1141,189 @@ async def process_message(
 
     # Use json_repair to handle truncated/malformed JSON from LLM
     data = json_repair.loads(response_json)
+
+    # Tool results (leads, stock lookups) are specific to this conversation
+    if semantic_lookup is not None and not used_tools and isinstance(data, dict):
+        cacheable = _semantic_cacheable(data)
+        if cacheable is not None:
+            semantic_cache.store(semantic_scope, semantic_lookup, cacheable)
         
-    # Ensure critical fields exist
-    return {
-        "success": True,
-        "data": {
-            "intent": data.get("intent", "أخرى"),
-            "urgency": data.get("urgency", "عادي"),
-            "sentiment": data.get("sentiment", "محايد"),
-            "language": data.get("language", "ar"),
-            "dialect": data.get("dialect", "فصحى"),
-            "sender_name": data.get("sender_name") or sender_name,
-            "sender_contact": data.get("sender_contact") or sender_contact,
-            "key_points": data.get("key_points", []),
-            "action_items": data.get("action_items", []),
-            "extracted_entities": {}, # Legacy field, can be empty
-            "summary": data.get("summary", "رسالة جديدة"),
-            "draft_response": data.get("draft_response", ""),
-            "suggested_actions": [], # Can be inferred or left empty
-            "message_type": message_type or "general"
-        }
-    }
+    return _analysis_result(data, sender_name, sender_contact, message_type)
 
     # except block removed
 
 
+async def stream_draft(
+    message: str,
+    history: str = None,
+    sender_name: str = None,
+    preferences: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """
+    Stream a reply draft (plain text) for a customer message as it is generated.
+    
+    The streaming counterpart of the draft in process_message(): no
+    classification/extraction JSON, so the user sees the first words as
+    soon as the provider produces them.
+    """
+    from services.llm_provider import llm_generate_stream
+    from services.rate_limiter import llm_request_context
+
+    clean_message = message.strip()
+
+    # Knowledge Base Search (RAG), same as process_message
+    kb_block = ""
+    try:
+        from services.knowledge_base import get_knowledge_base
+        kb_results = await get_knowledge_base().search(clean_message, k=2)
+        if kb_results:
+            kb_block = "\n[System: Knowledge Base Info]\n" + "\n".join(f"- {r['text']}" for r in kb_results) + "\n"
+    except Exception as e:
+        print(f"KB search failed: {e}")
+
+    history_block = ""
+    if history:
+        history_block = f"\nسياق المحادثة السابقة:\n---\n{history}\n---\n"
+    sender_line = f" (من {sender_name})" if sender_name else ""
+
+    prompt = f"""أنت خبير خدمة عملاء ذكي.
+مهمتك: صياغة رد على رسالة العميل.
+   - اكتب رداً احترافياً وطبيعياً (غير روبوتي)
+   - استخدم نفس لغة ولهجة العميل بالضبط (مهم جداً!)
+   - كن موجزاً ومباشراً (3-5 أسطر)
+   - تجنب العبارات الروتينية المملة مثل "تم استلام رسالتك"
+{history_block}{kb_block}
+رسالة العميل{sender_line}:
+{clean_message}
+
+اكتب نص الرد فقط، بدون مقدمات أو JSON."""
+
+    license_id = preferences.get("license_key_id") if preferences else None
+    with llm_request_context(license_id=license_id):
+        async for text in llm_generate_stream(prompt, system=build_system_prompt(preferences), max_tokens=600):
+            yield text
+
+
+
+
+# ============ Batched Analysis ============
+
+URL_PATTERN = re.compile(r'http[s]?://\S+')
+
+
+@dataclass
+class BatchAnalysis:
+    """Outcome of process_message_batch"""
+    results: List[Optional[dict]]  # One per input; None = process individually
+    llm_calls: int = 0
+    filtered: int = 0
+    parse_failed: bool = False
+
+
+async def process_message_batch(
+    items: List[Dict[str, Any]],
+    preferences: Optional[Dict[str, Any]] = None,
+) -> BatchAnalysis:
+    """
+    Analyze several independent messages with a single LLM call.
+
+    Each item is a dict with "message" and optional "sender_name",
+    "sender_contact" and "message_type". Results have the same shape as
+    process_message(). Messages with links (which need fetching) and any
+    message missing from the combined response come back as None so the
+    caller can fall back to process_message() for them.
+    """
+    results: List[Optional[dict]] = [None] * len(items)
+    batch = BatchAnalysis(results=results)
+    license_id = preferences.get("license_key_id", 0) if preferences else 0
+
+    # Local filtering first so blocked messages never reach the prompt
+    pending = []
+    for index, item in enumerate(items):
+        text = (item.get("message") or "").strip()
+        should_process, reason = await apply_filters(
+            message={"body": text, "sender_contact": item.get("sender_contact") or ""},
+            license_id=license_id,
+            recent_messages=None
+        )
+        if not should_process:
+            results[index] = _filtered_result(reason)
+            batch.filtered += 1
+        elif not URL_PATTERN.search(text):
+            pending.append((index, text))
+
+    if len(pending) < 2:
+        # Nothing to share a call with; the per-message path is just as cheap
+        return batch
+
+    # Same Knowledge Base grounding process_message() adds, looked up per message
+    kb_blocks = await asyncio.gather(*(_knowledge_base_context(text) for _, text in pending))
+    sections = "\n\n".join(
+        f"[الرسالة رقم {number}]\n{text}{kb_block}"
+        for number, ((_, text), kb_block) in enumerate(zip(pending, kb_blocks), 1)
+    )
+    prompt = f"""أنت خبير خدمة عملاء ذكي وشامل.
+أمامك {len(pending)} رسائل مستقلة من عملاء مختلفين. حلل كل رسالة على حدة، واستخرج بياناتها، واكتب رداً مناسباً لها.
+
+- النية: استفسار، طلب خدمة، شكوى، متابعة، عرض، تسويق، آلي (OTP/تنبيهات)، أخرى
+- مشاعر العميل: إيجابي، محايد، سلبي
+- الأهمية: عاجل، عادي، منخفض
+- الرد: احترافي وموجز (3-5 أسطر) بنفس لغة ولهجة العميل. إذا كانت النية "آلي" أو "تسويق" اترك الرد فارغاً ("").
+
+{sections}
+
+أرجع النتيجة بصيغة JSON فقط، بعنصر واحد لكل رسالة ورقمها في "index":
+{{
+    "results": [
+        {{
+            "index": 1,
+            "intent": "...",
+            "sentiment": "...",
+            "urgency": "...",
+            "language": "...",
+            "dialect": "...",
+            "sender_name": "...",
+            "sender_contact": "...",
+            "key_points": ["..."],
+            "action_items": ["..."],
+            "summary": "ملخص من سطر واحد",
+            "draft_response": "..."
+        }}
+    ]
+}}"""
+
+    batch.llm_calls = 1
+    response = await call_llm(
+        prompt,
+        system=build_system_prompt(preferences),
+        json_mode=True,
+        max_tokens=min(600 * len(pending), 6000),
+        license_id=license_id or None,
+    )
+
+    try:
+        data = json_repair.loads(response) if isinstance(response, str) else None
+    except Exception:
+        data = None
+    entries = data.get("results") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        batch.parse_failed = True
+        return batch
+
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            number = int(entry.get("index"))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= number <= len(pending) and entry.get("intent"):
+            index = pending[number - 1][0]
+            item = items[index]
+            results[index] = _analysis_result(
+                entry, item.get("sender_name"), item.get("sender_contact"), item.get("message_type")
+            )
+
+    if any(results[index] is None for index, _ in pending):
+        batch.parse_failed = True
+    return batch
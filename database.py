@@ -9,25 +9,16 @@ from typing import Optional
 import hashlib
 import secrets
 
+import aiosqlite
+
+# Connections come from the shared pool (db_helper checks the PostgreSQL driver)
+from db_helper import get_db, POSTGRES_AVAILABLE
+
 # Database configuration
 DB_TYPE = os.getenv("DB_TYPE", "sqlite").lower()
 DATABASE_PATH = os.getenv("DATABASE_PATH", "almudeer.db")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Import appropriate database driver
-if DB_TYPE == "postgresql":
-    try:
-        import asyncpg
-        POSTGRES_AVAILABLE = True
-    except ImportError:
-        raise ImportError(
-            "PostgreSQL selected but asyncpg not installed. "
-            "Install with: pip install asyncpg"
-        )
-else:
-    import aiosqlite
-    POSTGRES_AVAILABLE = False
-
 
 def _adapt_sql_for_db(sql: str) -> str:
     """Adapt SQL syntax for current database type"""
@@ -41,7 +32,6 @@ def _adapt_sql_for_db(sql: str) -> str:
 async def init_database():
     """Initialize the database with required tables (supports both SQLite and PostgreSQL)"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        from db_helper import get_db
         async with get_db() as conn:
             try:
                 await _init_postgresql_tables(conn)
@@ -57,7 +47,7 @@ async def init_database():
             except Exception:
                 pass
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db() as db:
             await _init_sqlite_tables(db)
             # Migrations for existing SQLite tables
             try:
@@ -357,8 +347,7 @@ async def generate_license_key(
     expires_at = datetime.now() + timedelta(days=days_valid)
     
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db() as conn:
             # Get the next ID manually to avoid sequence issues
             max_id = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM license_keys")
             next_id = max_id + 1
@@ -374,10 +363,8 @@ async def generate_license_key(
             # If referred, increment referrer's count
             if referred_by_id:
                 await conn.execute("UPDATE license_keys SET referral_count = referral_count + 1 WHERE id = $1", referred_by_id)
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db() as db:
             cursor = await db.execute("""
                 INSERT INTO license_keys (key_hash, license_key_encrypted, company_name, expires_at, max_requests_per_day, is_trial, referred_by_id, referral_code, username)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -400,8 +387,7 @@ async def get_license_key_by_id(license_id: int) -> Optional[str]:
     logger = get_logger(__name__)
     
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             row = await conn.fetchrow("""
                 SELECT license_key_encrypted FROM license_keys WHERE id = $1
             """, license_id)
@@ -421,10 +407,8 @@ async def get_license_key_by_id(license_id: int) -> Optional[str]:
             except Exception as e:
                 logger.error(f"Failed to decrypt license key for subscription {license_id}: {e}")
                 return None
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT license_key_encrypted FROM license_keys WHERE id = ?
@@ -463,8 +447,7 @@ async def validate_license_key(key: str) -> dict:
     key_hash = hash_license_key(key)
     
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             row = await conn.fetchrow("""
                 SELECT * FROM license_keys WHERE key_hash = $1
             """, key_hash)
@@ -473,10 +456,8 @@ async def validate_license_key(key: str) -> dict:
                 return {"valid": False, "error": "مفتاح الاشتراك غير صالح"}
             
             row_dict = dict(row)
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM license_keys WHERE key_hash = ?
@@ -559,8 +540,7 @@ async def increment_usage(license_id: int, action_type: str, input_preview: str
     today = datetime.now().date().isoformat()
     
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db() as conn:
             # Update request counter
             await conn.execute("""
                 UPDATE license_keys 
@@ -571,10 +551,8 @@ async def increment_usage(license_id: int, action_type: str, input_preview: str
                 last_request_date = $1
                 WHERE id = $2
             """, today, license_id)
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db() as db:
             # Update request counter
             await db.execute("""
                 UPDATE license_keys 
@@ -600,8 +578,7 @@ async def save_crm_entry(
 ) -> int:
     """Save a CRM entry and return its ID"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db() as conn:
             result = await conn.fetchval("""
                 INSERT INTO crm_entries 
                 (license_key_id, sender_name, sender_contact, message_type, intent, 
@@ -611,10 +588,8 @@ async def save_crm_entry(
             """, license_id, sender_name, sender_contact, message_type, intent,
                   extracted_data, original_message, draft_response)
             return result
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db() as db:
             cursor = await db.execute("""
                 INSERT INTO crm_entries 
                 (license_key_id, sender_name, sender_contact, message_type, intent, 
@@ -629,8 +604,7 @@ async def save_crm_entry(
 async def get_crm_entries(license_id: int, limit: int = 50) -> list:
     """Get CRM entries for a license"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             rows = await conn.fetch("""
                 SELECT * FROM crm_entries 
                 WHERE license_key_id = $1 
@@ -638,10 +612,8 @@ async def get_crm_entries(license_id: int, limit: int = 50) -> list:
                 LIMIT $2
             """, license_id, limit)
             return [dict(row) for row in rows]
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM crm_entries 
@@ -656,17 +628,14 @@ async def get_crm_entries(license_id: int, limit: int = 50) -> list:
 async def get_entry_by_id(entry_id: int, license_id: int) -> Optional[dict]:
     """Get a specific CRM entry"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             row = await conn.fetchrow("""
                 SELECT * FROM crm_entries 
                 WHERE id = $1 AND license_key_id = $2
             """, entry_id, license_id)
             return dict(row) if row else None
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM crm_entries 
@@ -680,13 +649,10 @@ async def get_entry_by_id(entry_id: int, license_id: int) -> Optional[dict]:
 async def create_demo_license():
     """Create a demo license key if none exists"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             count = await conn.fetchval("SELECT COUNT(*) FROM license_keys")
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             async with db.execute("SELECT COUNT(*) FROM license_keys") as cursor:
                 count = (await cursor.fetchone())[0]
     
@@ -706,7 +672,7 @@ async def get_customer(contact: str) -> Optional[dict]:
     """Get customer details by contact (SQLite only for now for simplicity)"""
     # Assuming SQLite for tools MVP
     if DB_TYPE != "postgresql":
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("SELECT * FROM customers WHERE contact = ?", (contact,)) as cursor:
                 row = await cursor.fetchone()
@@ -716,7 +682,7 @@ async def get_customer(contact: str) -> Optional[dict]:
 async def get_order_by_ref(order_ref: str) -> Optional[dict]:
     """Get order details by reference"""
     if DB_TYPE != "postgresql":
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("SELECT * FROM orders WHERE order_ref = ?", (order_ref,)) as cursor:
                 row = await cursor.fetchone()
@@ -726,7 +692,7 @@ async def get_order_by_ref(order_ref: str) -> Optional[dict]:
 async def upsert_customer_lead(name: str, contact: str, notes: str) -> int:
     """Create or update a customer lead"""
     if DB_TYPE != "postgresql":
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db() as db:
             # Check if exists
             async with db.execute("SELECT id FROM customers WHERE contact = ?", (contact,)) as cursor:
                 row = await cursor.fetchone()
@@ -757,17 +723,14 @@ async def save_update_event(
 ):
     """Save an update event to the database"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db() as conn:
             await conn.execute("""
                 INSERT INTO update_events 
                 (event, from_build, to_build, device_id, device_type, license_key)
                 VALUES ($1, $2, $3, $4, $5, $6)
             """, event, from_build, to_build, device_id, device_type, license_key)
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db() as db:
             await db.execute("""
                 INSERT INTO update_events 
                 (event, from_build, to_build, device_id, device_type, license_key)
@@ -779,18 +742,15 @@ async def save_update_event(
 async def get_update_events(limit: int = 100) -> list:
     """Get recent update events"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             rows = await conn.fetch("""
                 SELECT * FROM update_events 
                 ORDER BY timestamp DESC 
                 LIMIT $1
             """, limit)
             return [dict(row) for row in rows]
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM update_events 
@@ -806,13 +766,10 @@ async def get_update_events(limit: int = 100) -> list:
 async def get_app_config(key: str) -> Optional[str]:
     """Get a configuration value by key"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             return await conn.fetchval("SELECT value FROM app_config WHERE key = $1", key)
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             async with db.execute("SELECT value FROM app_config WHERE key = ?", (key,)) as cursor:
                 row = await cursor.fetchone()
                 return row[0] if row else None
@@ -821,18 +778,15 @@ async def get_app_config(key: str) -> Optional[str]:
 async def set_app_config(key: str, value: str):
     """Set a configuration value"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db() as conn:
             await conn.execute("""
                 INSERT INTO app_config (key, value, updated_at) 
                 VALUES ($1, $2, NOW())
                 ON CONFLICT (key) DO UPDATE 
                 SET value = EXCLUDED.value, updated_at = NOW()
             """, key, value)
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db() as db:
             await db.execute("""
                 INSERT INTO app_config (key, value, updated_at) 
                 VALUES (?, ?, CURRENT_TIMESTAMP)
@@ -851,17 +805,14 @@ async def add_version_history(
 ):
     """Add a new version to history"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db() as conn:
             await conn.execute("""
                 INSERT INTO version_history 
                 (version, build_number, changelog_ar, changelog_en, changes_json)
                 VALUES ($1, $2, $3, $4, $5)
             """, version, build_number, changelog_ar, changelog_en, changes_json)
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db() as db:
             await db.execute("""
                 INSERT INTO version_history 
                 (version, build_number, changelog_ar, changelog_en, changes_json)
@@ -873,18 +824,15 @@ async def add_version_history(
 async def get_version_history_list(limit: int = 10) -> list:
     """Get recent version history"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             rows = await conn.fetch("""
                 SELECT * FROM version_history 
                 ORDER BY build_number DESC 
                 LIMIT $1
             """, limit)
             return [dict(row) for row in rows]
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("""
                 SELECT * FROM version_history 
@@ -900,8 +848,7 @@ async def get_version_history_list(limit: int = 10) -> list:
 async def get_version_distribution() -> list:
     """Get distribution of users across build numbers based on update events"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             # Get latest build per device from update events
             rows = await conn.fetch("""
                 WITH latest_builds AS (
@@ -923,10 +870,8 @@ async def get_version_distribution() -> list:
                 ORDER BY build_number DESC
             """)
             return [dict(row) for row in rows]
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             db.row_factory = aiosqlite.Row
             # SQLite version using subquery
             async with db.execute("""
@@ -951,8 +896,7 @@ async def get_update_funnel(days: int = 30) -> dict:
     cutoff_str = cutoff.isoformat()
     
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             row = await conn.fetchrow("""
                 SELECT 
                     COUNT(*) FILTER (WHERE event = 'viewed') as views,
@@ -964,10 +908,8 @@ async def get_update_funnel(days: int = 30) -> dict:
                 WHERE timestamp >= $1
             """, cutoff)
             return dict(row) if row else {}
-        finally:
-            await conn.close()
     else:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             async with db.execute("""
                 SELECT 
                     SUM(CASE WHEN event = 'viewed' THEN 1 ELSE 0 END) as views,
@@ -993,8 +935,7 @@ async def get_update_funnel(days: int = 30) -> dict:
 async def get_time_to_update_metrics() -> dict:
     """Calculate median and average time from update release to adoption"""
     if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-        conn = await asyncpg.connect(DATABASE_URL)
-        try:
+        async with get_db(readonly=True) as conn:
             # Get time between 'viewed' and 'installed' events per device
             row = await conn.fetchrow("""
                 WITH update_times AS (
@@ -1023,11 +964,9 @@ async def get_time_to_update_metrics() -> dict:
                     "median_hours": round((row["median_seconds"] or 0) / 3600, 1)
                 }
             return {"total_updates": 0, "avg_hours": 0, "median_hours": 0}
-        finally:
-            await conn.close()
     else:
         # SQLite doesn't have PERCENTILE_CONT, return simpler metrics
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with get_db(readonly=True) as db:
             async with db.execute("""
                 SELECT COUNT(DISTINCT device_id) as total_updates
                 FROM update_events
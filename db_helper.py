@@ -5,11 +5,13 @@ Database Helper - Unified interface for SQLite and PostgreSQL
 import os
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Iterable, List, Any
 
 DB_TYPE = os.getenv("DB_TYPE", "sqlite").lower()
 DATABASE_PATH = os.getenv("DATABASE_PATH", "almudeer.db")
 DATABASE_URL = os.getenv("DATABASE_URL")
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "512"))
 
 if DB_TYPE == "postgresql":
     try:
@@ -23,15 +25,19 @@ else:
 
 
 @asynccontextmanager
-async def get_db():
-    """Get database connection context manager using global pool"""
+async def get_db(readonly: bool = False):
+    """
+    Get database connection context manager using global pool.
+
+    Pooled SQLite connections already have their pragmas applied; pass
+    readonly=True for pure reads so they don't queue behind the writer.
+    A plain block holds the single SQLite writer until it exits, so keep
+    network calls and sleeps outside it.
+    """
     from db_pool import db_pool
     
-    conn = await db_pool.acquire()
+    conn = await db_pool.acquire(readonly=readonly)
     try:
-        # SQLite specific: ensure foreign keys are enabled if it's a new connection
-        if DB_TYPE == "sqlite":
-            await conn.execute("PRAGMA foreign_keys = ON")
         yield conn
     finally:
         await db_pool.release(conn)
@@ -39,13 +45,75 @@ async def get_db():
 
 def adapt_sql_for_db(sql: str) -> str:
     """Adapt SQL syntax for current database type"""
-    if DB_TYPE == "postgresql":
+    return _adapt_sql(sql, DB_TYPE)
+
+
+def _adapt_sql(sql: str, db_type: str) -> str:
+    if db_type == "postgresql":
         sql = sql.replace("INTEGER PRIMARY KEY AUTOINCREMENT", "SERIAL PRIMARY KEY")
         sql = sql.replace("AUTOINCREMENT", "")
         sql = sql.replace("TIMESTAMP DEFAULT CURRENT_TIMESTAMP", "TIMESTAMP DEFAULT NOW()")
     return sql
 
 
+def _number_placeholders(sql: str) -> str:
+    """
+    Replace ? placeholders with $1, $2, ..., leaving string literals, quoted
+    identifiers and -- comments alone.
+    """
+    parts: List[str] = []
+    count = 0
+    start = 0
+    quote = None
+    i = 0
+    n = len(sql)
+    while i < n:
+        ch = sql[i]
+        if quote:
+            if ch == quote:
+                if i + 1 < n and sql[i + 1] == quote:
+                    # Doubled quote is an escaped quote inside the literal
+                    i += 2
+                    continue
+                quote = None
+        elif ch == "'" or ch == '"':
+            quote = ch
+        elif ch == "-" and sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        elif ch == "?":
+            count += 1
+            parts.append(sql[start:i])
+            parts.append(f"${count}")
+            start = i + 1
+        i += 1
+
+    parts.append(sql[start:])
+    return "".join(parts)
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _compile_sql(sql: str, db_type: str, numbered: bool) -> str:
+    sql = _adapt_sql(sql, db_type)
+    if numbered and db_type == "postgresql":
+        sql = _number_placeholders(sql)
+    return sql
+
+
+def compile_sql(sql: str, params=None) -> str:
+    """
+    Translate a statement for the current database.
+
+    On PostgreSQL, ? placeholders become $1, $2, ... only when params are
+    supplied; a parameterless statement keeps any literal ? (e.g. the jsonb
+    ? operator). Results are memoized per SQL text, so the hot statements
+    are translated once and asyncpg always sees the identical query string,
+    which lets its per-connection prepared statement cache hit.
+    """
+    return _compile_sql(sql, DB_TYPE, bool(params))
+
+
 def _normalize_params(params: Iterable[Any] | None):
     """
     Normalize parameters before sending to the database.
@@ -75,12 +143,11 @@ def _normalize_params(params: Iterable[Any] | None):
 
 async def execute_sql(db, sql: str, params=None):
     """Execute SQL with proper parameter handling"""
-    sql = adapt_sql_for_db(sql)
+    # Placeholders come back already converted to $1, $2, ... for asyncpg
+    sql = compile_sql(sql, params)
     if DB_TYPE == "postgresql":
-        # Convert SQLite-style ? placeholders to $1, $2, ... for asyncpg
         if params:
             params = list(_normalize_params(params))
-            sql = _convert_sql_params(sql, params)
             return await db.execute(sql, *params)
         else:
             return await db.execute(sql)
@@ -91,31 +158,12 @@ async def execute_sql(db, sql: str, params=None):
             return await db.execute(sql)
 
 
-def _convert_sql_params(sql: str, params: list) -> str:
-    """Convert SQLite ? placeholders to PostgreSQL $1, $2, etc."""
-    if DB_TYPE == "postgresql" and params:
-        # Replace ? with $1, $2, etc.
-        param_index = 1
-        result = ""
-        i = 0
-        while i < len(sql):
-            if sql[i] == '?' and (i == 0 or sql[i-1] != "'"):
-                result += f"${param_index}"
-                param_index += 1
-            else:
-                result += sql[i]
-            i += 1
-        return result
-    return sql
-
-
 async def fetch_all(db, sql: str, params=None):
     """Fetch all rows"""
-    sql = adapt_sql_for_db(sql)
+    sql = compile_sql(sql, params)
     if DB_TYPE == "postgresql":
         if params:
             params = list(_normalize_params(params))
-            sql = _convert_sql_params(sql, params)
             rows = await db.fetch(sql, *params)
         else:
             rows = await db.fetch(sql)
@@ -134,11 +182,10 @@ async def fetch_all(db, sql: str, params=None):
 
 async def fetch_one(db, sql: str, params=None):
     """Fetch one row"""
-    sql = adapt_sql_for_db(sql)
+    sql = compile_sql(sql, params)
     if DB_TYPE == "postgresql":
         if params:
             params = list(_normalize_params(params))
-            sql = _convert_sql_params(sql, params)
             row = await db.fetchrow(sql, *params)
         else:
             row = await db.fetchrow(sql)
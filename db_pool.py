@@ -4,7 +4,11 @@ Supports both SQLite (current) and PostgreSQL (future migration)
 """
 
 import os
-from typing import Optional, Any
+import re
+import sys
+import time
+import asyncio
+from typing import Optional, Any, Dict, List
 import aiosqlite
 
 # Try to import asyncpg for PostgreSQL (optional)
@@ -16,6 +20,21 @@ except ImportError:
     asyncpg = None
 
 
+# Direct driver connects that bypass the pool
+_RAW_CONNECT_PATTERN = re.compile(r"\b(?:asyncpg|aiosqlite)\.connect\(")
+
+class _WriterLease:
+    """
+    Ownership of the SQLite writer connection by one task, so nested get_db()
+    calls in that task reuse the writer instead of deadlocking on the lock.
+    Tasks it spawns are not owners and queue for the lock like anyone else.
+    """
+    
+    def __init__(self, owner: Optional[asyncio.Task]):
+        self.owner = owner
+        self.depth = 0
+
+
 class DatabasePool:
     """Unified database connection pool manager"""
     
@@ -26,6 +45,26 @@ class DatabasePool:
         
         # PostgreSQL connection string
         self.postgres_url = os.getenv("DATABASE_URL")
+        
+        # SQLite pool: one serialized writer plus N read-only connections
+        self.sqlite_readers = int(os.getenv("SQLITE_POOL_READERS", "4"))
+        self.sqlite_busy_timeout = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock: Optional[asyncio.Lock] = None
+        self._writer_lease: Optional[_WriterLease] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle_readers: Optional[asyncio.Queue] = None
+        self._sqlite_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sqlite_init_lock: Optional[asyncio.Lock] = None
+        
+        self.stats: Dict[str, Any] = {
+            "acquired": 0,
+            "released": 0,
+            "in_use": 0,
+            "connections_opened": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
     
     async def initialize(self):
         """Initialize the appropriate database connection pool"""
@@ -33,13 +72,64 @@ class DatabasePool:
             await self._init_postgres()
         else:
             # Use SQLite (current default)
-            self._init_sqlite()
+            await self._init_sqlite()
     
-    def _init_sqlite(self):
-        """Initialize SQLite (no pooling, but prepared for future)"""
-        # SQLite doesn't need explicit pooling, but we prepare the interface
+    async def _init_sqlite(self):
+        """Initialize SQLite pool (warm writer + reader connections)"""
         self.pool = None
         self.db_type = "sqlite"
+        await self._ensure_sqlite()
+    
+    async def _open_sqlite(self, readonly: bool = False) -> aiosqlite.Connection:
+        """Open a SQLite connection and apply per-connection pragmas once"""
+        conn = aiosqlite.connect(self.sqlite_path)
+        # Pooled connections live for the whole process; don't block interpreter exit
+        conn.daemon = True
+        await conn
+        if self.sqlite_path != ":memory:":
+            await conn.execute("PRAGMA journal_mode = WAL")
+            await conn.execute("PRAGMA synchronous = NORMAL")
+        await conn.execute(f"PRAGMA busy_timeout = {self.sqlite_busy_timeout}")
+        await conn.execute("PRAGMA foreign_keys = ON")
+        if readonly:
+            await conn.execute("PRAGMA query_only = ON")
+        self.stats["connections_opened"] += 1
+        return conn
+    
+    async def _ensure_sqlite(self):
+        """Lazily open the SQLite pool and bind its primitives to the running loop"""
+        loop = asyncio.get_running_loop()
+        if self._writer is not None and self._sqlite_loop is loop:
+            return
+        
+        if self._sqlite_init_lock is None or self._sqlite_loop is not loop:
+            self._sqlite_init_lock = asyncio.Lock()
+            self._sqlite_loop = loop
+        
+        async with self._sqlite_init_lock:
+            if self._writer is None:
+                self._writer = await self._open_sqlite()
+                # An in-memory database is private to its connection, so readers share the writer
+                if self.sqlite_path != ":memory:":
+                    for _ in range(self.sqlite_readers):
+                        self._readers.append(await self._open_sqlite(readonly=True))
+            
+            # asyncio primitives are bound to a loop; rebuild them (keeping the
+            # connections, which are loop-agnostic) when a new loop takes over
+            self._writer_lock = asyncio.Lock()
+            self._writer_lease = None
+            self._idle_readers = asyncio.Queue()
+            for reader in self._readers:
+                self._idle_readers.put_nowait(reader)
+    
+    def _record_acquire(self, started: float):
+        """Track acquire count and wait time"""
+        wait_ms = (time.perf_counter() - started) * 1000
+        self.stats["acquired"] += 1
+        self.stats["in_use"] += 1
+        self.stats["wait_ms_total"] += wait_ms
+        if wait_ms > self.stats["wait_ms_max"]:
+            self.stats["wait_ms_max"] = wait_ms
     
     async def _init_postgres(self):
         """Initialize PostgreSQL connection pool"""
@@ -56,26 +146,61 @@ class DatabasePool:
             min_size=5,  # Keep 5 connections warm (was 2)
             max_size=20,  # Allow up to 20 concurrent (was 10)
             command_timeout=query_timeout,  # Configurable query timeout
-            statement_cache_size=100,  # Cache prepared statements
+            # Cache prepared statements; sized to match db_helper's compiled SQL cache
+            statement_cache_size=int(os.getenv("SQL_CACHE_SIZE", "512")),
         )
         self.db_type = "postgresql"
     
-    async def acquire(self):
-        """Acquire a database connection"""
+    async def acquire(self, readonly: bool = False):
+        """
+        Acquire a database connection.
+        
+        On SQLite, writes are serialized through a single writer connection;
+        pass readonly=True to borrow one of the read-only WAL connections.
+        """
+        started = time.perf_counter()
         if self.db_type == "postgresql" and self.pool:
-            return await self.pool.acquire()
+            conn = await self.pool.acquire()
         elif self.db_type == "sqlite":
-            # Return SQLite connection (no pooling)
-            return await aiosqlite.connect(self.sqlite_path)
+            await self._ensure_sqlite()
+            if readonly and self._readers:
+                conn = await self._idle_readers.get()
+            elif self._writer_lease is not None and self._writer_lease.owner is asyncio.current_task():
+                # Nested acquire within a task that already holds the writer
+                self._writer_lease.depth += 1
+                conn = self._writer
+            else:
+                await self._writer_lock.acquire()
+                self._writer_lease = _WriterLease(asyncio.current_task())
+                conn = self._writer
         else:
             raise RuntimeError("Database not initialized")
+        self._record_acquire(started)
+        return conn
     
     async def release(self, conn):
         """Release a database connection"""
+        self.stats["released"] += 1
+        self.stats["in_use"] -= 1
         if self.db_type == "postgresql" and self.pool:
             await self.pool.release(conn)
         elif self.db_type == "sqlite":
-            await conn.close()
+            if conn is self._writer:
+                if self._writer_lease is not None and self._writer_lease.depth > 0:
+                    # Inner release of a nested acquire; the outer owner finishes the work
+                    self._writer_lease.depth -= 1
+                    return
+                self._writer_lease = None
+                try:
+                    # Match close() semantics: uncommitted work is discarded
+                    if conn.in_transaction:
+                        await conn.rollback()
+                    conn.row_factory = None
+                finally:
+                    self._writer_lock.release()
+            else:
+                conn.row_factory = None
+                self._idle_readers.put_nowait(conn)
     
     async def execute(self, query: str, params: tuple = None):
         """Execute a query (convenience method)"""
@@ -96,7 +221,7 @@ class DatabasePool:
     
     async def fetch(self, query: str, params: tuple = None):
         """Fetch rows from database"""
-        conn = await self.acquire()
+        conn = await self.acquire(readonly=True)
         try:
             if self.db_type == "postgresql":
                 if params:
@@ -114,7 +239,7 @@ class DatabasePool:
     
     async def fetchone(self, query: str, params: tuple = None):
         """Fetch a single row"""
-        conn = await self.acquire()
+        conn = await self.acquire(readonly=True)
         try:
             if self.db_type == "postgresql":
                 if params:
@@ -130,12 +255,64 @@ class DatabasePool:
         finally:
             await self.release(conn)
     
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pool acquire/release metrics"""
+        stats = dict(self.stats)
+        stats["db_type"] = self.db_type
+        stats["wait_ms_avg"] = (
+            stats["wait_ms_total"] / stats["acquired"] if stats["acquired"] else 0.0
+        )
+        if self.db_type == "postgresql" and self.pool:
+            stats["size"] = self.pool.get_size()
+            stats["idle"] = self.pool.get_idle_size()
+        elif self.db_type == "sqlite":
+            stats["readers"] = len(self._readers)
+            stats["idle_readers"] = self._idle_readers.qsize() if self._idle_readers else 0
+            stats["writer_busy"] = bool(self._writer_lock and self._writer_lock.locked())
+        return stats
+    
     async def close(self):
         """Close the connection pool"""
         if self.db_type == "postgresql" and self.pool:
             await self.pool.close()
+        elif self.db_type == "sqlite":
+            connections = self._readers + ([self._writer] if self._writer else [])
+            self._writer = None
+            self._readers = []
+            self._idle_readers = None
+            self._writer_lock = None
+            self._writer_lease = None
+            for conn in connections:
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+
+
+def find_raw_connections(root: Optional[str] = None) -> List[str]:
+    """
+    List "file:line" sites in loaded project modules that still open
+    asyncpg/aiosqlite connections directly instead of going through db_pool.
+    """
+    this_file = os.path.abspath(__file__)
+    root = os.path.abspath(root or os.path.dirname(this_file))
+    sites = []
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if not path or not path.endswith(".py"):
+            continue
+        path = os.path.abspath(path)
+        if path == this_file or not path.startswith(root + os.sep) or "site-packages" in path:
+            continue
+        try:
+            with open(path, encoding="utf-8") as f:
+                for lineno, line in enumerate(f, 1):
+                    if _RAW_CONNECT_PATTERN.search(line):
+                        sites.append(f"{os.path.relpath(path, root)}:{lineno}")
+        except (OSError, UnicodeDecodeError):
+            continue
+    return sorted(sites)
 
 
 # Global database pool instance
 db_pool = DatabasePool()
-
@@ -137,6 +137,34 @@ async def readiness_check():
     }
 
 
+@router.get("/health/task-queue")
+async def task_queue_metrics():
+    """
+    Task queue depth and latency per task_type.
+    Pending/processing/dead counts and the age of the oldest task.
+    """
+    from models.task_queue import get_queue_metrics
+    
+    try:
+        return {"status": "ok", **await get_queue_metrics()}
+    except Exception as e:
+        return {"status": "unavailable", "error": str(e)}
+
+
+@router.get("/health/notification-outbox")
+async def notification_outbox_metrics():
+    """
+    Notification outbox depth per channel (FCM, web push).
+    Pending/processing/dead counts and the age of the oldest pending delivery.
+    """
+    from models.notification_outbox import get_outbox_metrics
+    
+    try:
+        return {"status": "ok", **await get_outbox_metrics()}
+    except Exception as e:
+        return {"status": "unavailable", "error": str(e)}
+
+
 @router.get("/health/detailed")
 async def detailed_health():
     """
@@ -146,6 +174,13 @@ async def detailed_health():
     import platform
     import sys
     
+    from db_pool import db_pool
+    from services.request_batcher import get_batcher_stats
+    from services.dedup_store import get_dedup_stats
+    from services.websocket_manager import get_websocket_manager
+    from services.llm_provider import get_llm_stats
+    from services.semantic_cache import get_semantic_cache_stats
+    
     db_health = await check_database_health()
     redis_health = await check_redis_health()
     
@@ -160,6 +195,12 @@ async def detailed_health():
             "database": db_health,
             "redis": redis_health,
         },
+        "database_pool": db_pool.get_stats(),
+        "request_batcher": get_batcher_stats(),
+        "dedup": get_dedup_stats(),
+        "websocket": get_websocket_manager().get_stats(),
+        "llm": get_llm_stats(),
+        "semantic_cache": get_semantic_cache_stats(),
         "system": {
             "python_version": sys.version.split()[0],
             "platform": platform.system(),
@@ -63,7 +63,7 @@ from schemas import (
     CRMListResponse,
     HealthCheck
 )
-from agent import process_message
+from agent import process_message, stream_draft
 from models import (
     init_enhanced_tables,
     init_enhanced_tables,
@@ -98,11 +98,12 @@ except ImportError as e:
     raise e
 from routes.subscription import router as subscription_router
 from security import sanitize_message, sanitize_string
-from workers import start_message_polling, stop_message_polling, start_subscription_reminders, stop_subscription_reminders, start_token_cleanup_worker, stop_token_cleanup_worker
+from workers import start_message_polling, stop_message_polling, start_subscription_reminders, stop_subscription_reminders, start_token_cleanup_worker, stop_token_cleanup_worker, start_conversation_reconcile_worker, stop_conversation_reconcile_worker
 from db_pool import db_pool
 from services.websocket_manager import get_websocket_manager, broadcast_new_message
 from services.pagination import paginate_inbox, paginate_crm, paginate_customers, PaginationParams
 from services.request_batcher import get_request_batcher, batch_analyze
+from services.sse import sse_response
 from services.db_indexes import create_indexes
 from services.telegram_listener_service import get_telegram_listener
 
@@ -124,6 +125,15 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.warning(f"Database pool initialization failed (fallback to direct connections): {e}")
         
+        # Report code paths that still bypass the pool with raw driver connections
+        try:
+            from db_pool import find_raw_connections
+            raw_sites = find_raw_connections()
+            if raw_sites:
+                logger.warning(f"Raw database connections outside db_pool: {', '.join(raw_sites)}")
+        except Exception as e:
+            logger.warning(f"Raw connection check failed: {e}")
+        
         # Run migrations first
         try:
             from migrations import migration_manager
@@ -149,7 +159,9 @@ async def lifespan(app: FastAPI):
         from migrations.fix_customers_serial import fix_customers_serial
         from migrations.backfill_queue_table import create_backfill_queue_table
         from migrations.task_queue_table import create_task_queue_table
+        from migrations.notification_outbox_table import create_notification_outbox_table
         from migrations.purchases_table import create_purchases_table
+        from migrations.contact_aliases_table import create_contact_aliases_table
 
         # Parallelize independent table initializations to speed up startup
         init_tasks = [
@@ -164,7 +176,9 @@ async def lifespan(app: FastAPI):
             fix_customers_serial(),
             create_backfill_queue_table(),
             create_task_queue_table(),
-            create_purchases_table()
+            create_notification_outbox_table(),
+            create_purchases_table(),
+            create_contact_aliases_table()
         ]
         
         results = await asyncio.gather(*init_tasks, return_exceptions=True)
@@ -243,10 +257,17 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.warning(f"Failed to start FCM token cleanup worker: {e}")
         
+        # Start conversation state reconciliation worker (repairs incremental drift)
+        try:
+            await start_conversation_reconcile_worker()
+            logger.info("Conversation reconcile worker started")
+        except Exception as e:
+            logger.warning(f"Failed to start conversation reconcile worker: {e}")
+        
         # Initialize task queue worker
         try:
-            from workers import TaskWorker
-            task_worker = TaskWorker()
+            from workers import TaskWorker, worker_instance_id
+            task_worker = TaskWorker(worker_id=worker_instance_id("tasks"))
             await task_worker.start()
             logger.info("Persistent Task Queue Worker started")
             
@@ -255,6 +276,16 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.warning(f"Task queue initialization warning: {e}")
         
+        # Drain the notification outbox (mobile/web push deliveries)
+        try:
+            from workers import NotificationDeliveryWorker, worker_instance_id
+            notification_worker = NotificationDeliveryWorker(worker_id=worker_instance_id("notifications"))
+            await notification_worker.start()
+            logger.info("Notification Delivery Worker started")
+            app.state.notification_worker = notification_worker
+        except Exception as e:
+            logger.warning(f"Notification delivery worker initialization warning: {e}")
+        
         # Start Telegram Listener Service (Persistent)
         try:
             telegram_listener = get_telegram_listener()
@@ -287,18 +318,48 @@ async def lifespan(app: FastAPI):
         logger.info("FCM token cleanup worker stopped")
     except Exception as e:
         logger.warning(f"Error stopping token cleanup worker: {e}")
+    try:
+        await stop_conversation_reconcile_worker()
+        logger.info("Conversation reconcile worker stopped")
+    except Exception as e:
+        logger.warning(f"Error stopping conversation reconcile worker: {e}")
     try:
         if hasattr(app.state, "task_worker"):
             await app.state.task_worker.stop()
             logger.info("Persistent Task Queue Worker stopped")
     except Exception as e:
         logger.warning(f"Error stopping task queue: {e}")
+    try:
+        if hasattr(app.state, "notification_worker"):
+            await app.state.notification_worker.stop()
+            logger.info("Notification Delivery Worker stopped")
+    except Exception as e:
+        logger.warning(f"Error stopping notification delivery worker: {e}")
     try:
         telegram_listener = get_telegram_listener()
         await telegram_listener.stop()
         logger.info("Telegram Persistent Listener stopped")
     except Exception as e:
         logger.warning(f"Error stopping Telegram Listener: {e}")
+    try:
+        await get_websocket_manager().close()
+    except Exception as e:
+        logger.warning(f"Error closing WebSocket manager: {e}")
+    try:
+        from services.gmail_api_service import close_http_client
+        await close_http_client()
+    except Exception as e:
+        logger.warning(f"Error closing Gmail HTTP client: {e}")
+    try:
+        from services.fcm_mobile_service import close_http_client as close_fcm_client
+        await close_fcm_client()
+    except Exception as e:
+        logger.warning(f"Error closing FCM HTTP client: {e}")
+    try:
+        from services.email_service import close_imap_connections
+        close_imap_connections()
+    except Exception as e:
+        logger.warning(f"Error closing IMAP connections: {e}")
     try:
         await db_pool.close()
         logger.info("Database pool closed")
@@ -879,6 +940,56 @@ async def draft_response(
         )
 
 
+@app.post("/api/draft/stream", tags=["Analysis"])
+@limiter.limit("30/minute")  # Rate limit: 30 requests per minute per IP
+async def draft_response_stream(
+    request: Request,
+    data: MessageInput,
+    license: dict = Depends(verify_license)
+):
+    """
+    Stream a draft response for a message as server-sent events.
+    
+    Requires: X-License-Key header
+    
+    Args:
+        data: Message input with text and metadata
+        
+    Returns:
+        text/event-stream: "token" events ({"text": chunk}) as the draft is
+        generated, then "done" ({"text": full draft}) or "error"
+    """
+    sanitized_message = sanitize_message(data.message)
+    sanitized_sender_name = sanitize_string(data.sender_name) if data.sender_name else None
+    sanitized_sender_contact = sanitize_string(data.sender_contact) if data.sender_contact else None
+    
+    license_id = license["license_id"]
+
+    await increment_usage(
+        license_id,
+        "draft",
+        sanitized_message[:100]
+    )
+    
+    prefs = await get_preferences(license_id)
+
+    conversation_history = ""
+    if sanitized_sender_contact:
+        from models.inbox import get_chat_history_for_llm
+        conversation_history = await get_chat_history_for_llm(
+            license_id=license_id,
+            sender_contact=sanitized_sender_contact,
+            limit=10,
+        )
+
+    return sse_response(stream_draft(
+        message=sanitized_message,
+        history=conversation_history,
+        sender_name=sanitized_sender_name,
+        preferences=prefs,
+    ))
+
+
 @app.post("/api/crm/save", tags=["CRM"])
 async def save_to_crm(
     data: CRMEntryCreate,
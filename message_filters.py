@@ -5,9 +5,20 @@ Advanced filtering rules for messages before processing
 
 from typing import Dict, List, Optional, Callable
 from datetime import datetime
+import os
 import re
+import json
+import time
 from logging_config import get_logger
 
+# Aho-Corasick keyword automaton (optional, falls back to substring scans)
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+    ahocorasick = None
+
 logger = get_logger(__name__)
 
 
@@ -93,42 +104,75 @@ def filter_empty(message: Dict) -> tuple[bool, Optional[str]]:
     return True, None
 
 
-def filter_duplicate(message: Dict, recent_messages: List[Dict], time_window_minutes: int = 5) -> tuple[bool, Optional[str]]:
-    """Filter duplicate messages from same sender"""
+def _received_time(message: Dict) -> Optional[datetime]:
+    """received_at as a naive local datetime (None when missing/unparseable)"""
+    raw_received = message.get("received_at")
+    if isinstance(raw_received, str):
+        try:
+            raw_received = datetime.fromisoformat(raw_received)
+        except ValueError:
+            return None
+    if not isinstance(raw_received, datetime):
+        return None
+    if raw_received.tzinfo is not None:
+        raw_received = raw_received.astimezone().replace(tzinfo=None)
+    return raw_received
+
+
+class RecentMessageIndex:
+    """
+    Hashed view of recent messages for filter_duplicate: (sender, first 100
+    chars of body) -> latest received time, for both sender_contact and
+    sender_id. A message without a usable time counts as received now.
+    """
+    
+    def __init__(self, recent_messages: List[Dict]):
+        self._latest: Dict[tuple, Optional[datetime]] = {}
+        for recent in recent_messages:
+            body = (recent.get("body") or "").strip()[:100]
+            received = _received_time(recent)
+            for sender in (recent.get("sender_contact"), recent.get("sender_id")):
+                if not sender:
+                    continue
+                key = (sender, body)
+                if key in self._latest:
+                    current = self._latest[key]
+                    if current is None or (received is not None and received <= current):
+                        continue
+                self._latest[key] = received
+    
+    def is_duplicate(self, sender: str, body: str, time_window_minutes: int = 5) -> bool:
+        key = (sender, body)
+        if key not in self._latest:
+            return False
+        received = self._latest[key]
+        if received is None:
+            return True
+        return (datetime.now() - received).total_seconds() / 60 < time_window_minutes
+
+
+def filter_duplicate(message: Dict, recent_messages, time_window_minutes: int = 5) -> tuple[bool, Optional[str]]:
+    """
+    Filter duplicate messages from same sender.
+    
+    recent_messages may be a list of message dicts or a prebuilt
+    RecentMessageIndex (reuse one index when checking many messages).
+    """
     sender = message.get("sender_contact") or message.get("sender_id")
-    body = message.get("body", "").strip()[:100]  # First 100 chars
+    body = (message.get("body") or "").strip()[:100]  # First 100 chars
     
     if not sender:
         return True, None
     
-    # Check recent messages
-    now = datetime.now()
-    for recent in recent_messages:
-        if recent.get("sender_contact") == sender or recent.get("sender_id") == sender:
-            recent_body = recent.get("body", "").strip()[:100]
-
-            raw_received = recent.get("received_at")
-            if isinstance(raw_received, str):
-                try:
-                    recent_time = datetime.fromisoformat(raw_received)
-                except ValueError:
-                    recent_time = now
-            elif isinstance(raw_received, datetime):
-                recent_time = raw_received
-            else:
-                recent_time = now
-            
-            # Check if same content and within time window
-            if recent_body == body:
-                time_diff = (now - recent_time).total_seconds() / 60
-                if time_diff < time_window_minutes:
-                    return False, "Duplicate message"
+    index = recent_messages if isinstance(recent_messages, RecentMessageIndex) else RecentMessageIndex(recent_messages)
+    if index.is_duplicate(sender, body, time_window_minutes):
+        return False, "Duplicate message"
     
     return True, None
 
 
-def filter_blocked_senders(message: Dict, blocked_list: List[str]) -> tuple[bool, Optional[str]]:
-    """Filter messages from blocked senders"""
+def filter_blocked_senders(message: Dict, blocked_list) -> tuple[bool, Optional[str]]:
+    """Filter messages from blocked senders (blocked_list may be a list or set)"""
     sender = message.get("sender_contact") or message.get("sender_id", "")
     
     if sender in blocked_list:
@@ -136,6 +180,295 @@ def filter_blocked_senders(message: Dict, blocked_list: List[str]) -> tuple[bool
     
     return True, None
 
+# ============ Automated Message Patterns ============
+# Compiled once into AutomatedMessageMatcher; all text is matched lowercased.
+
+# Common automated sender patterns (email addresses)
+AUTOMATED_SENDER_PATTERNS = (
+    r"^noreply@", r"^no-reply@", r"^no\.reply@",
+    r"^notifications?@", r"^newsletter@", r"^newsletters@",
+    r"^marketing@", r"^promo@", r"^promotions?@",
+    r"^ads?@", r"^advertising@", r"^campaign@",
+    r"^info@", r"^support@.*noreply", r"^alerts?@",
+    r"^security@", r"^account@", r"^billing@",
+    r"^mailer-daemon@", r"^postmaster@", r"^bounce@",
+    r"^updates?@", r"^news@", r"^digest@",
+    r"^subscriptions?@", r"^automated@", r"^system@",
+    r"^donotreply@", r"^do-not-reply@", r"^reply-.*@",
+    r"^help@", r"^welcome@", r"^hello@", r"^team@",
+    r"^account-security@", r"^account-security-noreply@",
+    r"^elsa@", r"^support@", r"^sales@",
+    r"@.*\.noreply\.", r"@bounce\.", r"@email\.",
+    r"@mail\.", r"@mailer\.", r"@notifications?\.",
+    r"@campaign\.", r"@newsletter\.", r"@promo\.",
+    r"@help\.",
+)
+
+OTP_PATTERNS = (
+    r"code\s*is\s*\d+", r"code\s*:\s*\d+",
+    r"verification\s*code", r"one-time\s*password",
+    r"\botp\b", r"passcode", r"pin\s*code",
+    r"رمز\s*التحقق", r"كود\s*التفعيل", r"كلمة\s*المرور\s*المؤقتة",
+    r"رمز\s*الدخول", r"كود\s*التأكيد", r"رمز\s*التأكيد",
+    r"\b\d{4,6}\b.*code", r"code.*\b\d{4,6}\b",
+    r"رقم\s*سري", r"رمز\s*أمان",
+)
+
+MARKETING_KEYWORDS_STRICT = (
+    # English
+    "unsubscribe", "opt-out", "stop to end", "manage preferences",
+    "promotional", "limited time offer", "special offer", "exclusive deal", 
+    "advertisement", "sponsored", "promoted", "[ad]",
+    "flash sale", "today only", "sale ends",
+    # Arabic
+    "إلغاء الاشتراك", "أرسل توقف", "عرض خاص", "لفترة محدودة",
+    "تخفيضات", "خصم خاص", "اشترك الآن", "عرض حصري",
+    "تسوق الآن", "اطلب الآن", "خصم اليوم", "عرض اليوم",
+    "تنزيلات", "خصم حصري", "أسعار مخفضة", "فرصة لا تعوض",
+    "كوبون", "قسيمة", "رمز الخصم", "برعاية", "إعلان", "ترويج",
+)
+
+# Keywords that are common in REAL chats but also ads (False Positive risks)
+# We only block these in [NON-PRIVATE] chats
+MARKETING_RISK_KEYWORDS = (
+    "discount", "click here", "click below", "act now", "ad:", "save now",
+    "best price", "clearance", "buy now", "shop now", "order now",
+    "free shipping", "free trial", "free gift", "bonus",
+    "you've been selected", "congratulations", "winner",
+    "claim your", "redeem", "expires soon", "last chance",
+    "خصم", "مجاني", "هدية", "جائزة", "فائز", "فوز", "احصل على"
+)
+
+INFO_KEYWORDS = (
+    # English  
+    "do not reply", "auto-generated", "system message",
+    "no-reply", "noreply", "automated message", "this is an automated",
+    "order confirmation", "shipping update", "delivery update",
+    "tracking number", "your order has", "has been shipped",
+    "payment received", "payment confirmed", "receipt",
+    "invoice", "statement", "transaction", "purchase confirmation",
+    # Arabic
+    "لا ترد", "رسالة تلقائية", "تمت العملية بنجاح",
+    "عزيزي العميل، تم", "تم سحب", "تم إيداع",
+    "تأكيد الطلب", "تحديث الشحن", "رقم التتبع",
+    "تم شحن", "إيصال", "فاتورة", "كشف حساب",
+    "تم الدفع", "تأكيد الدفع", "عملية ناجحة",
+)
+
+ACCOUNT_KEYWORDS = (
+    # English
+    "password reset", "reset your password", "forgot password",
+    "account update", "account created", "account activated",
+    "login attempt", "new sign-in", "new device", "new login",
+    "verify your email", "confirm your email", "email verification",
+    "two-factor", "2fa", "mfa", "authenticator",
+    "security code", "access code", "account security",
+    "profile update", "settings changed", "preferences updated",
+    # Arabic
+    "تحديث الحساب", "تسجيل دخول جديد", "جهاز جديد",
+    "إعادة تعيين كلمة المرور", "استعادة كلمة المرور",
+    "تفعيل الحساب", "تأكيد البريد", "التحقق من البريد",
+    "رمز الأمان", "رمز الوصول", "أمان الحساب",
+    "تم تحديث الملف", "تم تغيير الإعدادات",
+)
+
+SECURITY_KEYWORDS = (
+    # English
+    "security alert", "security notice", "security warning",
+    "suspicious activity", "unusual activity", "unauthorized",
+    "breach", "compromised", "hacked", "fraud alert",
+    "action required", "immediate action", "urgent action",
+    "your account may", "we noticed", "we detected",
+    "blocked", "restricted", "suspended", "locked",
+    # Arabic
+    "تنبيه أمني", "تحذير أمني", "إشعار أمني",
+    "نشاط مشبوه", "نشاط غير عادي", "غير مصرح به",
+    "اختراق", "تم حظر", "تم تعليق", "تم تقييد",
+    "إجراء مطلوب", "إجراء فوري", "إجراء عاجل",
+)
+
+NEWSLETTER_KEYWORDS = (
+    # English
+    "newsletter", "weekly digest", "daily digest", "monthly digest",
+    "weekly update", "daily update", "monthly update",
+    "news roundup", "news summary", "this week in",
+    "top stories", "headlines", "what's new",
+    "edition", "issue #", "issue no",
+    "curator", "curated", "editorial",
+    # Arabic
+    "النشرة الإخبارية", "ملخص أسبوعي", "ملخص يومي",
+    "تحديث أسبوعي", "تحديث يومي", "أخبار الأسبوع",
+    "أهم الأخبار", "عناوين اليوم", "ما الجديد",
+)
+
+POLICY_KEYWORDS = (
+    # English
+    "terms of use", "terms of service", "privacy policy",
+    "policy update", "terms update", "legal update",
+    "we've updated", "we have updated", "changes to our",
+    "updated our terms", "updated our policy", "updated our privacy",
+    "service agreement", "user agreement", "license agreement",
+    "effective date", "these changes will take effect",
+    "by continuing to use", "data protection", "gdpr",
+    # Arabic
+    "شروط الاستخدام", "سياسة الخصوصية", "تحديث الشروط",
+    "تغييرات على", "تم تحديث", "الاتفاقية",
+)
+
+WELCOME_KEYWORDS = (
+    # English
+    "welcome to", "thanks for signing up", "thank you for signing up",
+    "thanks for joining", "thank you for joining", "get started",
+    "getting started", "welcome aboard", "you're in", "you are in",
+    "account is ready", "account has been created",
+    "first steps", "next steps", "start using",
+    "activate your", "complete your profile", "set up your",
+    "explore our", "discover our", "learn how to",
+    # Arabic
+    "مرحبا بك في", "أهلا بك في", "شكرا للتسجيل",
+    "شكرا للانضمام", "ابدأ الآن", "حسابك جاهز",
+    "الخطوات الأولى", "أكمل ملفك الشخصي",
+)
+
+DEVOPS_KEYWORDS = (
+    # Build notifications
+    "build failed", "build succeeded", "build passed", "build completed",
+    "deployment failed", "deployment succeeded", "deploy failed",
+    "pipeline failed", "pipeline succeeded", "pipeline completed",
+    "workflow failed", "workflow succeeded", "workflow completed",
+    # Git notifications
+    "pull request", "merge request", "commit", "push notification",
+    "code review", "branch", "repository",
+    # CI/CD platforms
+    "github actions", "gitlab ci", "jenkins", "travis ci",
+    "circleci", "azure devops", "bitbucket pipelines",
+    "railway", "vercel", "netlify", "heroku", "aws codebuild",
+    # Server/monitoring
+    "server alert", "server down", "server error", "uptime",
+    "monitoring alert", "health check", "crash report",
+    "cpu usage", "memory usage", "disk space",
+    "error rate", "latency alert",
+)
+
+# Additional service-specific noreply senders
+SERVICE_NOREPLY_PATTERNS = (
+    r"googleone-noreply", r"google-noreply", r"@google\.com$",
+    r"@notify\.railway\.app", r"@github\.com", r"@gitlab\.com",
+    r"@microsoft\.com", r"clarity@microsoft", r"@azure\.com",
+    r"@accountprotection\.microsoft\.com",
+    r"@vercel\.com", r"@netlify\.com", r"@heroku\.com",
+    r"@dropbox\.com", r"@slack\.com", r"@zoom\.us",
+    r"@stripe\.com", r"@paypal\.com", r"@linkedin\.com",
+    r"@twitter\.com", r"@x\.com", r"@facebook\.com",
+    r"@meta\.com", r"@apple\.com", r"@amazon\.com",
+    r"@openrouter\.ai", r"@elsanow\.io", r"@help\.elsanow\.io",
+    r"@openai\.com", r"@anthropic\.com", r"@deepmind\.com",
+    r"@aws\.amazon\.com", r"@cloud\.google\.com",
+)
+
+# Keyword categories in evaluation order: (reason, keywords, blocks private chats)
+KEYWORD_CATEGORIES = (
+    ("Automated: Marketing/Ad", MARKETING_KEYWORDS_STRICT, True),
+    ("Automated: Marketing/Ad (Group/Channel Content)", MARKETING_RISK_KEYWORDS, False),
+    ("Automated: System/Transactional", INFO_KEYWORDS, True),
+    ("Automated: Account Notification", ACCOUNT_KEYWORDS, True),
+    ("Automated: Security Alert", SECURITY_KEYWORDS, True),
+    ("Automated: Newsletter", NEWSLETTER_KEYWORDS, True),
+    ("Automated: Terms/Policy Update", POLICY_KEYWORDS, True),
+    ("Automated: Welcome/Onboarding", WELCOME_KEYWORDS, True),
+    ("Automated: CI/CD/DevOps", DEVOPS_KEYWORDS, True),
+)
+
+
+class AutomatedMessageMatcher:
+    """
+    Single-pass matcher for filter_automated_messages.
+    
+    Sender, OTP and service-provider patterns are each joined into one
+    regex alternation; all keyword categories go into one Aho-Corasick
+    automaton (pyahocorasick) that reports every category present in a
+    single scan of the text. Without pyahocorasick the keyword step falls
+    back to substring scans over the precompiled tuples.
+    """
+    
+    def __init__(self, use_automaton: Optional[bool] = None):
+        self.sender_re = self._combine(AUTOMATED_SENDER_PATTERNS)
+        self.otp_re = self._combine(OTP_PATTERNS)
+        self.service_re = self._combine(SERVICE_NOREPLY_PATTERNS)
+        
+        if use_automaton is None:
+            use_automaton = AHOCORASICK_AVAILABLE
+        self.automaton = None
+        if use_automaton:
+            categories_by_keyword: Dict[str, set] = {}
+            for index, (_, keywords, _) in enumerate(KEYWORD_CATEGORIES):
+                for keyword in keywords:
+                    categories_by_keyword.setdefault(keyword, set()).add(index)
+            self.automaton = ahocorasick.Automaton()
+            for keyword, categories in categories_by_keyword.items():
+                self.automaton.add_word(keyword, frozenset(categories))
+            self.automaton.make_automaton()
+    
+    @staticmethod
+    def _combine(patterns) -> "re.Pattern":
+        return re.compile("|".join(f"(?:{p})" for p in patterns))
+    
+    def _keyword_reason(self, text: str, is_private: bool) -> Optional[str]:
+        """Reason of the first keyword category (in order) present in text"""
+        if self.automaton is not None:
+            found = set()
+            for _, categories in self.automaton.iter(text):
+                found.update(categories)
+            for index in sorted(found):
+                reason, _, blocks_private = KEYWORD_CATEGORIES[index]
+                if blocks_private or not is_private:
+                    return reason
+            return None
+        
+        for reason, keywords, blocks_private in KEYWORD_CATEGORIES:
+            if (blocks_private or not is_private) and any(k in text for k in keywords):
+                return reason
+        return None
+    
+    def match(self, message: Dict) -> Optional[str]:
+        """Return the block reason for an automated message, or None if clean"""
+        body = (message.get("body") or "").lower()
+        sender_contact = (message.get("sender_contact") or "").lower()
+        sender_name = (message.get("sender_name") or "").lower()
+        subject = (message.get("subject") or "").lower()
+        
+        # Combine all searchable text
+        full_text = f"{body} {subject} {sender_name}"
+        
+        if self.sender_re.search(sender_contact):
+            return "Automated: Sender pattern detected"
+        
+        if self.otp_re.search(full_text):
+            return "Automated: OTP/Verification"
+        
+        # Check if this is a private chat (based on metadata)
+        is_private = not (message.get("is_group", False) or message.get("is_channel", False))
+        reason = self._keyword_reason(full_text, is_private)
+        if reason:
+            return reason
+        
+        if self.service_re.search(sender_contact):
+            return "Automated: Service Provider"
+        
+        return None
+
+
+_automated_matcher: Optional[AutomatedMessageMatcher] = None
+
+
+def get_automated_matcher() -> AutomatedMessageMatcher:
+    """Shared matcher, compiled on first use"""
+    global _automated_matcher
+    if _automated_matcher is None:
+        _automated_matcher = AutomatedMessageMatcher()
+    return _automated_matcher
+
+
 def filter_automated_messages(message: Dict) -> tuple[bool, Optional[str]]:
     """
     Filter automated messages (OTP, Marketing, System Info, Ads, Special Offers, 
@@ -144,246 +477,9 @@ def filter_automated_messages(message: Dict) -> tuple[bool, Optional[str]]:
     Returns (True, None) if message is CLEAN (from a real customer).
     Returns (False, Reason) if message should be BLOCKED (automated/marketing).
     """
-    body = message.get("body", "").lower()
-    sender_contact = (message.get("sender_contact") or "").lower()
-    sender_name = (message.get("sender_name") or "").lower()
-    subject = (message.get("subject") or "").lower()
-    
-    # Combine all searchable text
-    full_text = f"{body} {subject} {sender_name}"
-    
-    # ============ SENDER-BASED FILTERING ============
-    # Common automated sender patterns (email addresses)
-    automated_sender_patterns = [
-        r"^noreply@", r"^no-reply@", r"^no\.reply@",
-        r"^notifications?@", r"^newsletter@", r"^newsletters@",
-        r"^marketing@", r"^promo@", r"^promotions?@",
-        r"^ads?@", r"^advertising@", r"^campaign@",
-        r"^info@", r"^support@.*noreply", r"^alerts?@",
-        r"^security@", r"^account@", r"^billing@",
-        r"^mailer-daemon@", r"^postmaster@", r"^bounce@",
-        r"^updates?@", r"^news@", r"^digest@",
-        r"^subscriptions?@", r"^automated@", r"^system@",
-        r"^donotreply@", r"^do-not-reply@", r"^reply-.*@",
-        r"^help@", r"^welcome@", r"^hello@", r"^team@",
-        r"^account-security@", r"^account-security-noreply@",
-        r"^elsa@", r"^support@", r"^sales@",
-        r"@.*\.noreply\.", r"@bounce\.", r"@email\.",
-        r"@mail\.", r"@mailer\.", r"@notifications?\.",
-        r"@campaign\.", r"@newsletter\.", r"@promo\.",
-        r"@help\.",
-    ]
-    
-    for pattern in automated_sender_patterns:
-        if re.search(pattern, sender_contact):
-            return False, "Automated: Sender pattern detected"
-    
-    # ============ 1. OTP / VERIFICATION CODES ============
-    otp_patterns = [
-        r"code\s*is\s*\d+", r"code\s*:\s*\d+",
-        r"verification\s*code", r"one-time\s*password",
-        r"\botp\b", r"passcode", r"pin\s*code",
-        r"رمز\s*التحقق", r"كود\s*التفعيل", r"كلمة\s*المرور\s*المؤقتة",
-        r"رمز\s*الدخول", r"كود\s*التأكيد", r"رمز\s*التأكيد",
-        r"\b\d{4,6}\b.*code", r"code.*\b\d{4,6}\b",
-        r"رقم\s*سري", r"رمز\s*أمان",
-    ]
-    if any(re.search(p, full_text) for p in otp_patterns):
-        return False, "Automated: OTP/Verification"
-
-    # ============ 2. MARKETING / ADS / OFFERS ============
-    # Check if this is a private chat (based on metadata)
-    is_group = message.get("is_group", False)
-    is_channel_src = message.get("is_channel", False)
-    is_private = not (is_group or is_channel_src)
-
-    marketing_keywords_strict = [
-        # English
-        "unsubscribe", "opt-out", "stop to end", "manage preferences",
-        "promotional", "limited time offer", "special offer", "exclusive deal", 
-        "advertisement", "sponsored", "promoted", "[ad]",
-        "flash sale", "today only", "sale ends",
-        # Arabic
-        "إلغاء الاشتراك", "أرسل توقف", "عرض خاص", "لفترة محدودة",
-        "تخفيضات", "خصم خاص", "اشترك الآن", "عرض حصري",
-        "تسوق الآن", "اطلب الآن", "خصم اليوم", "عرض اليوم",
-        "تنزيلات", "خصم حصري", "أسعار مخفضة", "فرصة لا تعوض",
-        "كوبون", "قسيمة", "رمز الخصم", "برعاية", "إعلان", "ترويج",
-    ]
-    
-    # Keywords that are common in REAL chats but also ads (False Positive risks)
-    # We only block these in [NON-PRIVATE] chats
-    marketing_risk_keywords = [
-        "discount", "click here", "click below", "act now", "ad:", "save now",
-        "best price", "clearance", "buy now", "shop now", "order now",
-        "free shipping", "free trial", "free gift", "bonus",
-        "you've been selected", "congratulations", "winner",
-        "claim your", "redeem", "expires soon", "last chance",
-        "خصم", "مجاني", "هدية", "جائزة", "فائز", "فوز", "احصل على"
-    ]
-
-    # Block strict keywords always
-    if any(k in full_text for k in marketing_keywords_strict):
-        return False, "Automated: Marketing/Ad"
-        
-    # Block risk keywords only in Groups/Channels
-    if not is_private:
-        if any(k in full_text for k in marketing_risk_keywords):
-            return False, "Automated: Marketing/Ad (Group/Channel Content)"
-
-
-    # ============ 3. SYSTEM / INFO / TRANSACTIONAL ============
-    info_keywords = [
-        # English  
-        "do not reply", "auto-generated", "system message",
-        "no-reply", "noreply", "automated message", "this is an automated",
-        "order confirmation", "shipping update", "delivery update",
-        "tracking number", "your order has", "has been shipped",
-        "payment received", "payment confirmed", "receipt",
-        "invoice", "statement", "transaction", "purchase confirmation",
-        # Arabic
-        "لا ترد", "رسالة تلقائية", "تمت العملية بنجاح",
-        "عزيزي العميل، تم", "تم سحب", "تم إيداع",
-        "تأكيد الطلب", "تحديث الشحن", "رقم التتبع",
-        "تم شحن", "إيصال", "فاتورة", "كشف حساب",
-        "تم الدفع", "تأكيد الدفع", "عملية ناجحة",
-    ]
-    if any(k in full_text for k in info_keywords):
-        return False, "Automated: System/Transactional"
-
-    # ============ 4. ACCOUNT NOTIFICATIONS ============
-    account_keywords = [
-        # English
-        "password reset", "reset your password", "forgot password",
-        "account update", "account created", "account activated",
-        "login attempt", "new sign-in", "new device", "new login",
-        "verify your email", "confirm your email", "email verification",
-        "two-factor", "2fa", "mfa", "authenticator",
-        "security code", "access code", "account security",
-        "profile update", "settings changed", "preferences updated",
-        # Arabic
-        "تحديث الحساب", "تسجيل دخول جديد", "جهاز جديد",
-        "إعادة تعيين كلمة المرور", "استعادة كلمة المرور",
-        "تفعيل الحساب", "تأكيد البريد", "التحقق من البريد",
-        "رمز الأمان", "رمز الوصول", "أمان الحساب",
-        "تم تحديث الملف", "تم تغيير الإعدادات",
-    ]
-    if any(k in full_text for k in account_keywords):
-        return False, "Automated: Account Notification"
-
-    # ============ 5. SECURITY WARNINGS / ALERTS ============
-    security_keywords = [
-        # English
-        "security alert", "security notice", "security warning",
-        "suspicious activity", "unusual activity", "unauthorized",
-        "breach", "compromised", "hacked", "fraud alert",
-        "action required", "immediate action", "urgent action",
-        "your account may", "we noticed", "we detected",
-        "blocked", "restricted", "suspended", "locked",
-        # Arabic
-        "تنبيه أمني", "تحذير أمني", "إشعار أمني",
-        "نشاط مشبوه", "نشاط غير عادي", "غير مصرح به",
-        "اختراق", "تم حظر", "تم تعليق", "تم تقييد",
-        "إجراء مطلوب", "إجراء فوري", "إجراء عاجل",
-    ]
-    if any(k in full_text for k in security_keywords):
-        return False, "Automated: Security Alert"
-
-    # ============ 6. NEWSLETTERS / DIGESTS ============
-    newsletter_keywords = [
-        # English
-        "newsletter", "weekly digest", "daily digest", "monthly digest",
-        "weekly update", "daily update", "monthly update",
-        "news roundup", "news summary", "this week in",
-        "top stories", "headlines", "what's new",
-        "edition", "issue #", "issue no",
-        "curator", "curated", "editorial",
-        # Arabic
-        "النشرة الإخبارية", "ملخص أسبوعي", "ملخص يومي",
-        "تحديث أسبوعي", "تحديث يومي", "أخبار الأسبوع",
-        "أهم الأخبار", "عناوين اليوم", "ما الجديد",
-    ]
-    if any(k in full_text for k in newsletter_keywords):
-        return False, "Automated: Newsletter"
-
-    # ============ 7. TERMS / POLICY UPDATES ============
-    policy_keywords = [
-        # English
-        "terms of use", "terms of service", "privacy policy",
-        "policy update", "terms update", "legal update",
-        "we've updated", "we have updated", "changes to our",
-        "updated our terms", "updated our policy", "updated our privacy",
-        "service agreement", "user agreement", "license agreement",
-        "effective date", "these changes will take effect",
-        "by continuing to use", "data protection", "gdpr",
-        # Arabic
-        "شروط الاستخدام", "سياسة الخصوصية", "تحديث الشروط",
-        "تغييرات على", "تم تحديث", "الاتفاقية",
-    ]
-    if any(k in full_text for k in policy_keywords):
-        return False, "Automated: Terms/Policy Update"
-
-    # ============ 8. WELCOME / ONBOARDING EMAILS ============
-    welcome_keywords = [
-        # English
-        "welcome to", "thanks for signing up", "thank you for signing up",
-        "thanks for joining", "thank you for joining", "get started",
-        "getting started", "welcome aboard", "you're in", "you are in",
-        "account is ready", "account has been created",
-        "first steps", "next steps", "start using",
-        "activate your", "complete your profile", "set up your",
-        "explore our", "discover our", "learn how to",
-        # Arabic
-        "مرحبا بك في", "أهلا بك في", "شكرا للتسجيل",
-        "شكرا للانضمام", "ابدأ الآن", "حسابك جاهز",
-        "الخطوات الأولى", "أكمل ملفك الشخصي",
-    ]
-    if any(k in full_text for k in welcome_keywords):
-        return False, "Automated: Welcome/Onboarding"
-
-    # ============ 9. CI/CD / DEVOPS NOTIFICATIONS ============
-    devops_keywords = [
-        # Build notifications
-        "build failed", "build succeeded", "build passed", "build completed",
-        "deployment failed", "deployment succeeded", "deploy failed",
-        "pipeline failed", "pipeline succeeded", "pipeline completed",
-        "workflow failed", "workflow succeeded", "workflow completed",
-        # Git notifications
-        "pull request", "merge request", "commit", "push notification",
-        "code review", "branch", "repository",
-        # CI/CD platforms
-        "github actions", "gitlab ci", "jenkins", "travis ci",
-        "circleci", "azure devops", "bitbucket pipelines",
-        "railway", "vercel", "netlify", "heroku", "aws codebuild",
-        # Server/monitoring
-        "server alert", "server down", "server error", "uptime",
-        "monitoring alert", "health check", "crash report",
-        "cpu usage", "memory usage", "disk space",
-        "error rate", "latency alert",
-    ]
-    if any(k in full_text for k in devops_keywords):
-        return False, "Automated: CI/CD/DevOps"
-
-    # ============ 10. SERVICE PROVIDER NOREPLY ============
-    # Check for additional service-specific noreply patterns
-    service_noreply_patterns = [
-        r"googleone-noreply", r"google-noreply", r"@google\.com$",
-        r"@notify\.railway\.app", r"@github\.com", r"@gitlab\.com",
-        r"@microsoft\.com", r"clarity@microsoft", r"@azure\.com",
-        r"@accountprotection\.microsoft\.com",
-        r"@vercel\.com", r"@netlify\.com", r"@heroku\.com",
-        r"@dropbox\.com", r"@slack\.com", r"@zoom\.us",
-        r"@stripe\.com", r"@paypal\.com", r"@linkedin\.com",
-        r"@twitter\.com", r"@x\.com", r"@facebook\.com",
-        r"@meta\.com", r"@apple\.com", r"@amazon\.com",
-        r"@openrouter\.ai", r"@elsanow\.io", r"@help\.elsanow\.io",
-        r"@openai\.com", r"@anthropic\.com", r"@deepmind\.com",
-        r"@aws\.amazon\.com", r"@cloud\.google\.com",
-    ]
-    for pattern in service_noreply_patterns:
-        if re.search(pattern, sender_contact):
-            return False, "Automated: Service Provider"
-
+    reason = get_automated_matcher().match(message)
+    if reason:
+        return False, reason
     return True, None
 
 
@@ -502,13 +598,51 @@ def filter_telegram_bots(message: Dict) -> tuple[bool, Optional[str]]:
 
 # ============ Filter Manager ============
 
+# Seconds a license's compiled filters are reused before settings are re-read
+# (update_preferences invalidates immediately within this process)
+FILTER_CACHE_TTL_SECONDS = int(os.getenv("FILTER_CACHE_TTL_SECONDS", "300"))
+
+
 class FilterManager:
-    """Manage message filters for a license"""
+    """
+    Manage message filters for a license.
+    
+    Rules are built once per instance; apply_filters() keeps one instance per
+    license (see get_filter_manager), so evaluation only walks the prebuilt
+    rule list.
+    """
     
-    def __init__(self, license_id: int):
+    def __init__(
+        self,
+        license_id: int,
+        blocked_senders: Optional[List[str]] = None,
+        blocked_keywords: Optional[List[str]] = None,
+        required_keywords: Optional[List[str]] = None
+    ):
         self.license_id = license_id
         self.filter = MessageFilter()
+        self.blocked_senders = frozenset(s.strip() for s in (blocked_senders or []) if s and s.strip())
+        self.blocked_keywords = self._normalize_keywords(blocked_keywords)
+        self.required_keywords = self._normalize_keywords(required_keywords)
+        self._blocked_keywords_re = self._compile_keywords(self.blocked_keywords)
+        self._required_keywords_re = self._compile_keywords(self.required_keywords)
+        # Last recent_messages list seen and its hashed index (reused across a poll cycle)
+        self._recent_source: Optional[List[Dict]] = None
+        self._recent_count = 0
+        self._recent_index: Optional[RecentMessageIndex] = None
         self._setup_default_filters()
+        self._setup_license_filters()
+    
+    @staticmethod
+    def _normalize_keywords(keywords: Optional[List[str]]) -> List[str]:
+        return sorted({k.strip().lower() for k in (keywords or []) if k and k.strip()})
+    
+    @staticmethod
+    def _compile_keywords(keywords: List[str]):
+        """One alternation, so a message is scanned once per keyword list"""
+        if not keywords:
+            return None
+        return re.compile("|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
     
     def _setup_default_filters(self):
         """Setup default filter rules"""
@@ -521,35 +655,128 @@ class FilterManager:
         # Add Telegram bot filter
         self.filter.add_rule(filter_telegram_bots)
     
+    def _setup_license_filters(self):
+        """Rules compiled from the license's own settings"""
+        if self.blocked_senders:
+            self.filter.add_rule(self._check_blocked_sender)
+        if self._blocked_keywords_re:
+            self.filter.add_rule(self._check_blocked_keywords)
+        if self._required_keywords_re:
+            self.filter.add_rule(self._check_required_keywords)
+    
+    def _check_blocked_sender(self, message: Dict) -> tuple[bool, Optional[str]]:
+        return filter_blocked_senders(message, self.blocked_senders)
+    
+    def _check_blocked_keywords(self, message: Dict) -> tuple[bool, Optional[str]]:
+        if self._blocked_keywords_re.search((message.get("body") or "").lower()):
+            return False, "Contains blocked keyword"
+        return True, None
+    
+    def _check_required_keywords(self, message: Dict) -> tuple[bool, Optional[str]]:
+        if not self._required_keywords_re.search((message.get("body") or "").lower()):
+            return False, "Does not contain required keyword"
+        return True, None
+    
     def add_custom_rule(self, rule_func: Callable):
         """Add a custom filter rule"""
         self.filter.add_rule(rule_func)
     
+    def _recent_messages_index(self, recent_messages: List[Dict]) -> RecentMessageIndex:
+        """Index recent_messages once and reuse it while the same list is passed in"""
+        if recent_messages is not self._recent_source or len(recent_messages) != self._recent_count:
+            self._recent_source = recent_messages
+            self._recent_count = len(recent_messages)
+            self._recent_index = RecentMessageIndex(recent_messages)
+        return self._recent_index
+    
     def should_process(self, message: Dict, recent_messages: List[Dict] = None) -> tuple[bool, Optional[str]]:
         """Check if message should be processed"""
-        # Add duplicate check if recent messages provided
+        should_process, reason = self.filter.should_process(message)
+        if not should_process:
+            return False, reason
+        
+        # Duplicate check if recent messages provided
         if recent_messages:
-            duplicate_check = lambda msg: filter_duplicate(msg, recent_messages)
-            self.filter.add_rule(duplicate_check)
+            return filter_duplicate(message, self._recent_messages_index(recent_messages))
         
-        return self.filter.should_process(message)
+        return True, None
     
     def get_blocked_senders(self) -> List[str]:
         """Get list of blocked senders for this license"""
-        # This would typically come from database
-        # For now, return empty list
-        return []
+        return sorted(self.blocked_senders)
     
     def get_keyword_filters(self) -> Dict:
         """Get keyword filter configuration"""
-        # This would typically come from database
         return {
-            "blocked_keywords": [],
-            "required_keywords": [],
-            "mode": "block"
+            "blocked_keywords": list(self.blocked_keywords),
+            "required_keywords": list(self.required_keywords),
+            "mode": "allow" if self.required_keywords else "block"
         }
 
 
+# license_id -> (FilterManager, built_at monotonic time)
+_filter_managers: Dict[int, tuple] = {}
+
+
+def _json_list(value) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    try:
+        parsed = json.loads(value)
+        return [str(v) for v in parsed] if isinstance(parsed, list) else []
+    except (TypeError, ValueError):
+        return [v.strip() for v in str(value).split(",") if v.strip()]
+
+
+async def _load_filter_settings(license_id: int) -> Dict[str, List[str]]:
+    """Read the license's blocked senders and keyword filters"""
+    from db_helper import get_db, fetch_one
+    
+    async with get_db(readonly=True) as db:
+        row = await fetch_one(
+            db,
+            """SELECT blocked_senders, blocked_keywords, required_keywords
+               FROM user_preferences WHERE license_key_id = ?""",
+            [license_id],
+        )
+    row = row or {}
+    return {
+        "blocked_senders": _json_list(row.get("blocked_senders")),
+        "blocked_keywords": _json_list(row.get("blocked_keywords")),
+        "required_keywords": _json_list(row.get("required_keywords")),
+    }
+
+
+async def get_filter_manager(license_id: int) -> FilterManager:
+    """Cached FilterManager for a license, rebuilt after invalidation or TTL"""
+    cached = _filter_managers.get(license_id)
+    if cached and time.monotonic() - cached[1] < FILTER_CACHE_TTL_SECONDS:
+        return cached[0]
+    
+    settings = {}
+    if license_id:
+        try:
+            settings = await _load_filter_settings(license_id)
+        except Exception as e:
+            # Keep filtering with the defaults; retry the settings on the next message
+            logger.debug(f"Could not load filter settings for license {license_id}: {e}")
+            return cached[0] if cached else FilterManager(license_id)
+    
+    manager = FilterManager(license_id, **settings)
+    _filter_managers[license_id] = (manager, time.monotonic())
+    return manager
+
+
+def invalidate_filter_cache(license_id: Optional[int] = None):
+    """Drop cached filters for a license (or all) after its settings change"""
+    if license_id is None:
+        _filter_managers.clear()
+    else:
+        _filter_managers.pop(license_id, None)
+
+
 # ============ Integration with Agent ============
 
 async def apply_filters(message: Dict, license_id: int, recent_messages: List[Dict] = None) -> tuple[bool, Optional[str]]:
@@ -564,14 +791,5 @@ async def apply_filters(message: Dict, license_id: int, recent_messages: List[Di
     Returns:
         Tuple of (should_process, reason_if_rejected)
     """
-    filter_manager = FilterManager(license_id)
-    
-    # Load custom filters from database if needed
-    # blocked_senders = filter_manager.get_blocked_senders()
-    # if blocked_senders:
-    #     filter_manager.add_custom_rule(
-    #         lambda msg: filter_blocked_senders(msg, blocked_senders)
-    #     )
-    
+    filter_manager = await get_filter_manager(license_id)
     return filter_manager.should_process(message, recent_messages)
-
@@ -0,0 +1,66 @@
+"""
+Al-Mudeer - Contact Aliases Table Migration
+Creates the contact_aliases identity table used to resolve sender aliases
+"""
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+async def create_contact_aliases_table():
+    """
+    Create the contact_aliases table.
+
+    Each row maps one identifier of a contact (kind 'contact' for
+    sender_contact/recipient_email values, 'id' for platform IDs) to the
+    canonical key of the group it belongs to, per license.
+
+    A new (empty) table is backfilled from existing messages right away:
+    once a contact has any rows, alias lookups stop scanning the message
+    tables, so older aliases would otherwise be missed.
+    """
+    from db_helper import get_db, execute_sql, fetch_one, commit_db, DB_TYPE
+
+    logger.info("Creating contact_aliases table...")
+
+    async with get_db() as db:
+        if DB_TYPE == "postgresql":
+            await execute_sql(db, """
+                CREATE TABLE IF NOT EXISTS contact_aliases (
+                    license_key_id INTEGER NOT NULL,
+                    alias TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    canonical TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    PRIMARY KEY (license_key_id, alias, kind)
+                )
+            """)
+        else:
+            await execute_sql(db, """
+                CREATE TABLE IF NOT EXISTS contact_aliases (
+                    license_key_id INTEGER NOT NULL,
+                    alias TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    canonical TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (license_key_id, alias, kind)
+                )
+            """)
+
+        # Group lookups: all aliases sharing a canonical key
+        await execute_sql(db, """
+            CREATE INDEX IF NOT EXISTS idx_contact_aliases_canonical
+            ON contact_aliases(license_key_id, canonical)
+        """)
+
+        await commit_db(db)
+        logger.info("✅ Contact aliases table created!")
+
+        populated = await fetch_one(db, "SELECT 1 FROM contact_aliases LIMIT 1")
+
+    if not populated:
+        from models.inbox import backfill_contact_aliases
+
+        count = await backfill_contact_aliases()
+        logger.info(f"✅ Backfilled contact aliases from {count} contact/ID pairs")
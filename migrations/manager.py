@@ -259,6 +259,10 @@ async def ensure_user_preferences_columns():
         ("preferred_languages", "TEXT"),
         ("reply_length", "TEXT"),
         ("formality_level", "TEXT"),
+        # Per-license message filters (JSON lists, see message_filters.get_filter_manager)
+        ("blocked_senders", "TEXT"),
+        ("blocked_keywords", "TEXT"),
+        ("required_keywords", "TEXT"),
     ]
     
     async with get_db() as db:
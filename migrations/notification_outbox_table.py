@@ -0,0 +1,73 @@
+"""
+Al-Mudeer - Notification Outbox Table Migration
+Creates the notification_outbox (one row per push delivery) and
+notification_broadcasts (admin broadcast progress) tables
+"""
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+async def create_notification_outbox_table():
+    """
+    Create the notification_outbox and notification_broadcasts tables.
+    """
+    from db_helper import get_db, execute_sql, commit_db, DB_TYPE
+
+    logger.info("Creating notification outbox tables...")
+
+    if DB_TYPE == "postgresql":
+        id_pk = "SERIAL PRIMARY KEY"
+        now = "NOW()"
+    else:
+        id_pk = "INTEGER PRIMARY KEY AUTOINCREMENT"
+        now = "CURRENT_TIMESTAMP"
+
+    async with get_db() as db:
+        await execute_sql(db, f"""
+            CREATE TABLE IF NOT EXISTS notification_broadcasts (
+                id {id_pk},
+                title TEXT NOT NULL,
+                message TEXT NOT NULL,
+                notification_type TEXT,
+                priority TEXT DEFAULT 'normal',
+                link TEXT,
+                total_targets INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT {now}
+            )
+        """)
+
+        # dedup_key is unique: the same notification is never queued twice per channel
+        await execute_sql(db, f"""
+            CREATE TABLE IF NOT EXISTS notification_outbox (
+                id {id_pk},
+                license_key_id INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                dedup_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                broadcast_id INTEGER,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER DEFAULT 5,
+                run_after TIMESTAMP,
+                lease_expires_at TIMESTAMP,
+                worker_id TEXT,
+                sent_count INTEGER,
+                error_message TEXT,
+                created_at TIMESTAMP DEFAULT {now},
+                updated_at TIMESTAMP DEFAULT {now}
+            )
+        """)
+
+        await execute_sql(db, """
+            CREATE INDEX IF NOT EXISTS idx_notification_outbox_claim
+            ON notification_outbox(channel, status, created_at)
+        """)
+        await execute_sql(db, """
+            CREATE INDEX IF NOT EXISTS idx_notification_outbox_broadcast
+            ON notification_outbox(broadcast_id, status)
+        """)
+
+        await commit_db(db)
+        logger.info("✅ Notification outbox tables created!")
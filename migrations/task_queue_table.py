@@ -31,7 +31,11 @@ async def create_task_queue_table():
                     created_at TIMESTAMP DEFAULT NOW(),
                     updated_at TIMESTAMP DEFAULT NOW(),
                     processed_at TIMESTAMP,
-                    completed_at TIMESTAMP
+                    completed_at TIMESTAMP,
+                    attempts INTEGER DEFAULT 0,
+                    max_attempts INTEGER DEFAULT 5,
+                    run_after TIMESTAMP,
+                    lease_expires_at TIMESTAMP
                 )
             """)
         else:
@@ -47,15 +51,38 @@ async def create_task_queue_table():
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     processed_at TIMESTAMP,
-                    completed_at TIMESTAMP
+                    completed_at TIMESTAMP,
+                    attempts INTEGER DEFAULT 0,
+                    max_attempts INTEGER DEFAULT 5,
+                    run_after TIMESTAMP,
+                    lease_expires_at TIMESTAMP
                 )
             """)
         
+        # Retry/lease columns (migration for existing databases)
+        for column, definition in (
+            ("attempts", "INTEGER DEFAULT 0"),
+            ("max_attempts", "INTEGER DEFAULT 5"),
+            ("run_after", "TIMESTAMP"),
+            ("lease_expires_at", "TIMESTAMP"),
+        ):
+            if DB_TYPE == "postgresql":
+                await execute_sql(db, f"ALTER TABLE task_queue ADD COLUMN IF NOT EXISTS {column} {definition}")
+                continue
+            try:
+                await execute_sql(db, f"ALTER TABLE task_queue ADD COLUMN {column} {definition}")
+            except Exception:
+                pass  # Column already exists
+        
         # Create indexes
         await execute_sql(db, """
             CREATE INDEX IF NOT EXISTS idx_task_queue_status_priority
             ON task_queue(status, priority DESC, created_at ASC)
         """)
+        await execute_sql(db, """
+            CREATE INDEX IF NOT EXISTS idx_task_queue_lease
+            ON task_queue(status, lease_expires_at)
+        """)
         
         await commit_db(db)
         logger.info("✅ Task queue table created!")
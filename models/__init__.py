@@ -25,6 +25,9 @@ from .email_config import (
     get_email_oauth_tokens,
     update_email_config_settings,
     get_email_password,
+    update_gmail_history_id,
+    update_imap_sync_state,
+    get_license_id_by_email_address,
 )
 
 # Telegram configuration
@@ -49,6 +52,7 @@ from .telegram_config import (
 from .inbox import (
     save_inbox_message,
     update_inbox_analysis,
+    update_inbox_draft,
     get_inbox_messages,
     get_inbox_messages_count,
     get_inbox_conversations,
@@ -131,6 +135,9 @@ __all__ = [
     "get_email_oauth_tokens",
     "update_email_config_settings",
     "get_email_password",
+    "update_gmail_history_id",
+    "update_imap_sync_state",
+    "get_license_id_by_email_address",
     # Telegram
     "save_telegram_config",
     "get_telegram_config",
@@ -149,6 +156,7 @@ __all__ = [
     # Inbox
     "save_inbox_message",
     "update_inbox_analysis",
+    "update_inbox_draft",
     "get_inbox_messages",
     "get_inbox_messages_count",
     "get_inbox_conversations",
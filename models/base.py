@@ -63,6 +63,11 @@ async def init_enhanced_tables():
                 is_active BOOLEAN DEFAULT TRUE,
                 check_interval_minutes INTEGER DEFAULT 5,
                 last_checked_at TIMESTAMP,
+                -- Gmail history.list cursor for incremental sync
+                gmail_history_id TEXT,
+                -- IMAP UID cursor for incremental fetch (reset when UIDVALIDITY changes)
+                imap_uidvalidity INTEGER,
+                imap_last_uid INTEGER,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (license_key_id) REFERENCES license_keys(id)
             )
@@ -90,6 +95,21 @@ async def init_enhanced_tables():
         except:
             pass  # Column already exists
         
+        try:
+            await execute_sql(db, """
+                ALTER TABLE email_configs ADD COLUMN gmail_history_id TEXT
+            """)
+        except Exception:
+            pass  # Column already exists
+        
+        for column in ("imap_uidvalidity", "imap_last_uid"):
+            try:
+                await execute_sql(db, f"""
+                    ALTER TABLE email_configs ADD COLUMN {column} INTEGER
+                """)
+            except Exception:
+                pass  # Column already exists
+        
         # Telegram Bot Configuration per license
         await execute_sql(db, """
             CREATE TABLE IF NOT EXISTS telegram_configs (
@@ -461,6 +481,9 @@ async def init_customers_and_analytics():
                 preferred_languages TEXT,
                 reply_length TEXT,
                 formality_level TEXT,
+                blocked_senders TEXT,
+                blocked_keywords TEXT,
+                required_keywords TEXT,
                 FOREIGN KEY (license_key_id) REFERENCES license_keys(id)
             )
         """)
@@ -8,6 +8,9 @@ from datetime import datetime, timedelta, date
 from typing import Optional, List
 
 from db_helper import get_db, execute_sql, fetch_all, fetch_one, commit_db, DB_TYPE
+from logging_config import get_logger
+
+logger = get_logger(__name__)
 
 # For functions that still use aiosqlite directly (to be migrated)
 DATABASE_PATH = os.getenv("DATABASE_PATH", "almudeer.db")
@@ -321,15 +324,58 @@ def _parse_datetime(value) -> datetime:
 
 # ============ Notifications ============
 
+def _push_in_background(license_id: int, notification_id: int, notification_type: str,
+                        title: str, message: str, priority: str, link: str = None):
+    """Fire-and-forget web and mobile push (fallback when the outbox can't be used)"""
+    import asyncio
+    try:
+        from services.push_service import send_push_to_license, WEBPUSH_AVAILABLE
+        if WEBPUSH_AVAILABLE:
+            asyncio.create_task(
+                send_push_to_license(
+                    license_id=license_id,
+                    title=title,
+                    message=message,
+                    link=link,
+                    tag=f"notification-{notification_id}",
+                    priority=priority
+                )
+            )
+    except Exception:
+        pass  # Web Push is optional, don't fail if it errors
+    
+    try:
+        from services.fcm_mobile_service import send_fcm_to_license
+        asyncio.create_task(
+            send_fcm_to_license(
+                license_id=license_id,
+                title=title,
+                body=message,
+                data={
+                    "type": notification_type,
+                    "notification_id": str(notification_id),
+                    "priority": priority
+                },
+                link=link
+            )
+        )
+    except Exception:
+        pass  # FCM is optional, don't fail if it errors
+
+
 async def create_notification(
     license_id: int,
     notification_type: str,
     title: str,
     message: str,
     priority: str = "normal",
-    link: str = None
+    link: str = None,
+    push: bool = True
 ) -> int:
-    """Create a new notification and send Web Push if subscribers exist."""
+    """
+    Create a new notification and queue its mobile/web push delivery
+    (notification outbox). push=False only records the in-app entry.
+    """
     notification_id = 0
     
     async with get_db() as db:
@@ -376,43 +422,22 @@ async def create_notification(
             else:
                 raise e
     
-    # Send Web Push notification in background (non-blocking)
-    try:
-        from services.push_service import send_push_to_license, WEBPUSH_AVAILABLE
-        if WEBPUSH_AVAILABLE:
-            import asyncio
-            asyncio.create_task(
-                send_push_to_license(
-                    license_id=license_id,
-                    title=title,
-                    message=message,
-                    link=link,
-                    tag=f"notification-{notification_id}",
-                    priority=priority
-                )
-            )
-    except Exception:
-        pass  # Web Push is optional, don't fail if it errors
-    
-    # Send FCM Mobile Push notification in background (non-blocking)
-    try:
-        from services.fcm_mobile_service import send_fcm_to_license
-        import asyncio
-        asyncio.create_task(
-            send_fcm_to_license(
-                license_id=license_id,
-                title=title,
-                body=message,
-                data={
-                    "type": notification_type,
-                    "notification_id": str(notification_id),
-                    "priority": priority
-                },
-                link=link
+    if push and notification_id:
+        try:
+            from models.notification_outbox import enqueue_notification_push
+            await enqueue_notification_push(
+                license_id,
+                notification_id,
+                title,
+                message,
+                link=link,
+                data={"type": notification_type, "priority": priority},
+                priority=priority
             )
-        )
-    except Exception:
-        pass  # FCM is optional, don't fail if it errors
+        except Exception as e:
+            # Outbox unavailable (e.g. table not migrated yet): push directly in background
+            logger.warning(f"Notification outbox unavailable, pushing inline: {e}")
+            _push_in_background(license_id, notification_id, notification_type, title, message, priority, link)
     
     return notification_id
 
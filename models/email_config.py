@@ -60,7 +60,9 @@ async def save_email_config(
                     access_token_encrypted = ?, refresh_token_encrypted = ?,
                     token_expires_at = ?,
                     password_encrypted = ?,
-                    check_interval_minutes = ?
+                    check_interval_minutes = ?,
+                    gmail_history_id = NULL,
+                    imap_uidvalidity = NULL, imap_last_uid = NULL
                 WHERE license_key_id = ?
                 """,
                 [
@@ -194,6 +196,41 @@ async def update_email_config_settings(
         return True
 
 
+async def update_gmail_history_id(license_id: int, history_id: str) -> None:
+    """Store the Gmail historyId to resume incremental sync from."""
+    async with get_db() as db:
+        await execute_sql(
+            db,
+            "UPDATE email_configs SET gmail_history_id = ? WHERE license_key_id = ?",
+            [str(history_id), license_id],
+        )
+        await commit_db(db)
+
+
+async def update_imap_sync_state(license_id: int, uidvalidity: Optional[int], last_uid: Optional[int]) -> None:
+    """Store the IMAP UIDVALIDITY/last UID cursor that EmailService.sync_emails() resumes from."""
+    async with get_db() as db:
+        await execute_sql(
+            db,
+            "UPDATE email_configs SET imap_uidvalidity = ?, imap_last_uid = ? WHERE license_key_id = ?",
+            [uidvalidity, last_uid, license_id],
+        )
+        await commit_db(db)
+
+
+async def get_license_id_by_email_address(email_address: str) -> Optional[int]:
+    """Find the license whose active email config uses this address (for Gmail push)."""
+    is_active_value = "TRUE" if DB_TYPE == "postgresql" else "1"
+    async with get_db(readonly=True) as db:
+        row = await fetch_one(
+            db,
+            f"""SELECT license_key_id FROM email_configs
+               WHERE LOWER(email_address) = ? AND is_active = {is_active_value}""",
+            [email_address.lower()],
+        )
+        return row["license_key_id"] if row else None
+
+
 # Deprecated - kept for backward compatibility
 async def get_email_password(license_id: int) -> Optional[str]:
     """Get decrypted email password (deprecated - use OAuth tokens instead)."""
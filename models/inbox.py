@@ -2,6 +2,7 @@
 Unified message inbox and outbox management
 """
 
+import os
 from datetime import datetime, timezone
 from typing import Optional, List, Any
 
@@ -75,6 +76,8 @@ async def save_inbox_message(
     import json
     attachments_json = json.dumps(attachments) if attachments else None
 
+    incoming_contact = sender_contact
+
     async with get_db() as db:
 
         # ---------------------------------------------------------
@@ -151,15 +154,34 @@ async def save_inbox_message(
             """,
             [license_id],
         )
+        await link_contact_aliases(db, license_id, [sender_contact, incoming_contact], [sender_id])
         await commit_db(db)
         
         message_id = row["id"] if row else 0
         
         
-        # Call upsert to update conversation state
-        # We do this asynchronously/fire-and-forget or await it? 
+        # Update conversation state
         # Await it to ensure UI is consistent on next fetch.
-        await upsert_conversation_state(license_id, sender_contact, sender_name, channel)
+        # Pending messages only join the conversation counters once analyzed.
+        inserted_status = status or 'pending'
+        if inserted_status != 'pending':
+            await apply_conversation_delta(
+                license_id,
+                sender_contact,
+                message_delta=1,
+                unread_delta=1 if inserted_status == 'analyzed' else 0,
+                last_message={
+                    "id": message_id,
+                    "body": body,
+                    "attachments": attachments_json,
+                    "created_at": reg_received_at,
+                    "status": inserted_status,
+                },
+                sender_name=sender_name,
+                channel=channel,
+            )
+        else:
+            await apply_conversation_delta(license_id, sender_contact, sender_name=sender_name, channel=channel)
 
         return message_id
 
@@ -182,7 +204,11 @@ async def update_inbox_analysis(
 
     async with get_db() as db:
         # First, get the message details to pass to upsert_conversation_state
-        message_row = await fetch_one(db, "SELECT license_key_id, sender_contact, sender_name, channel FROM inbox_messages WHERE id = ?", [message_id])
+        message_row = await fetch_one(db, """
+            SELECT license_key_id, sender_contact, sender_name, channel, status, is_read,
+                   deleted_at, body, attachments, received_at
+            FROM inbox_messages WHERE id = ?
+        """, [message_id])
         
         try:
             # Try to update with all columns including language/dialect
@@ -221,11 +247,25 @@ async def update_inbox_analysis(
                 raise
         
         if message_row:
-            await upsert_conversation_state(
+            # Only the pending -> analyzed transition adds the message to the conversation
+            newly_counted = (
+                message_row.get("status") in (None, "pending")
+                and not message_row.get("deleted_at")
+            )
+            await apply_conversation_delta(
                 message_row["license_key_id"],
                 message_row["sender_contact"],
-                message_row["sender_name"],
-                message_row["channel"]
+                message_delta=1 if newly_counted else 0,
+                unread_delta=1 if newly_counted and not message_row.get("is_read") else 0,
+                last_message={
+                    "id": message_id,
+                    "body": message_row.get("body"),
+                    "attachments": message_row.get("attachments"),
+                    "created_at": message_row.get("received_at"),
+                    "status": "analyzed",
+                } if newly_counted else None,
+                sender_name=message_row["sender_name"],
+                channel=message_row["channel"]
             )
             
             # Broadcast via WebSocket for real-time mobile updates
@@ -299,6 +339,18 @@ async def get_inbox_message_by_id(message_id: int, license_id: int) -> Optional[
         return _parse_message_row(row)
 
 
+async def update_inbox_draft(message_id: int, license_id: int, draft_response: str) -> bool:
+    """Replace the AI draft of an inbox message (e.g. after regenerating it)."""
+    async with get_db() as db:
+        await execute_sql(
+            db,
+            "UPDATE inbox_messages SET ai_draft_response = ? WHERE id = ? AND license_key_id = ?",
+            [draft_response, message_id, license_id]
+        )
+        await commit_db(db)
+    return True
+
+
 
 async def get_inbox_messages_count(
     license_id: int,
@@ -388,6 +440,7 @@ async def create_outbox_message(
             """,
             [license_id],
         )
+        await link_contact_aliases(db, license_id, [recipient_email], [recipient_id])
         await commit_db(db)
         return row["id"] if row else 0
 
@@ -726,14 +779,140 @@ async def get_inbox_status_counts(license_id: int) -> dict:
         }
 
 
+# ============ Contact Aliases ============
+
+def _alias_entries(contacts, ids) -> set:
+    """Expand contacts and platform IDs into (kind, alias) pairs, including tg:<id> forms."""
+    entries = set()
+    for contact in contacts:
+        if not contact:
+            continue
+        contact = str(contact)
+        entries.add(("contact", contact))
+        if contact.startswith("tg:") and contact[3:].isdigit():
+            entries.add(("id", contact[3:]))
+    for sid in ids:
+        if sid is None or sid == "":
+            continue
+        sid = str(sid)
+        entries.add(("id", sid))
+        entries.add(("contact", f"tg:{sid}"))
+    return entries
+
+
+async def link_contact_aliases(db, license_id: int, contacts, ids=()) -> Optional[str]:
+    """
+    Record that the given contacts and platform IDs belong to the same person.
+
+    contact_aliases is a union-find over identifiers: every alias points at
+    the canonical key of its group. Linking aliases from different groups
+    merges them under the smallest existing key. Does not commit.
+
+    Returns:
+        The canonical key of the (merged) group, or None if nothing to link
+    """
+    entries = _alias_entries(contacts, ids)
+    if not license_id or not entries:
+        return None
+
+    aliases = sorted({alias for _, alias in entries})
+    placeholders = ", ".join(["?" for _ in aliases])
+    rows = await fetch_all(
+        db,
+        f"""
+        SELECT kind, alias, canonical FROM contact_aliases
+        WHERE license_key_id = ? AND alias IN ({placeholders})
+        """,
+        [license_id] + aliases,
+    )
+
+    known = set()
+    roots = set()
+    for row in rows:
+        key = (row["kind"], row["alias"])
+        if key in entries:
+            known.add(key)
+            roots.add(row["canonical"])
+
+    canonical = min(roots) if roots else min(f"{kind}:{alias}" for kind, alias in entries)
+
+    merged = sorted(roots - {canonical})
+    if merged:
+        merged_placeholders = ", ".join(["?" for _ in merged])
+        await execute_sql(
+            db,
+            f"""
+            UPDATE contact_aliases SET canonical = ?
+            WHERE license_key_id = ? AND canonical IN ({merged_placeholders})
+            """,
+            [canonical, license_id] + merged,
+        )
+
+    missing = sorted(entries - known)
+    if missing:
+        values = ", ".join(["(?, ?, ?, ?)" for _ in missing])
+        params = []
+        for kind, alias in missing:
+            params.extend([license_id, alias, kind, canonical])
+        await execute_sql(
+            db,
+            f"""
+            INSERT INTO contact_aliases (license_key_id, alias, kind, canonical)
+            VALUES {values}
+            ON CONFLICT (license_key_id, alias, kind) DO NOTHING
+            """,
+            params,
+        )
+
+    return canonical
+
+
+async def backfill_contact_aliases(license_id: Optional[int] = None) -> int:
+    """
+    Populate contact_aliases from existing inbox/outbox messages.
+    Safe to re-run; already linked aliases are left untouched.
+
+    Returns:
+        Number of distinct (contact, id) pairs processed
+    """
+    license_filter = "AND license_key_id = ?" if license_id else ""
+    params = [license_id, license_id] if license_id else []
+
+    async with get_db() as db:
+        rows = await fetch_all(
+            db,
+            f"""
+            SELECT DISTINCT license_key_id, sender_contact AS contact, sender_id AS platform_id
+            FROM inbox_messages
+            WHERE (sender_contact IS NOT NULL OR sender_id IS NOT NULL) {license_filter}
+            UNION
+            SELECT DISTINCT license_key_id, recipient_email AS contact, recipient_id AS platform_id
+            FROM outbox_messages
+            WHERE (recipient_email IS NOT NULL OR recipient_id IS NOT NULL) {license_filter}
+            """,
+            params,
+        )
+
+        for row in rows:
+            await link_contact_aliases(
+                db, row["license_key_id"], [row["contact"]], [row["platform_id"]]
+            )
+        await commit_db(db)
+
+    return len(rows)
+
+
 async def _get_sender_aliases(db, license_id: int, sender_contact: str) -> tuple:
     """
     Get all sender_contact and sender_id variants for a given sender.
     This handles the case where the same Telegram user may have messages
     stored with different identifiers (phone, username, or user ID).
+
+    Resolved with a single indexed read of contact_aliases; contacts the
+    table has not seen yet fall back to scanning the message tables.
     
     Returns:
-        Tuple of (all_contacts: set, all_ids: set)
+        Tuple of (all_contacts: tuple, all_ids: tuple)
     """
     # Handle None sender_contact
     if not sender_contact:
@@ -743,7 +922,38 @@ async def _get_sender_aliases(db, license_id: int, sender_contact: str) -> tuple
     check_ids = [sender_contact]
     if sender_contact.startswith("tg:"):
         check_ids.append(sender_contact[3:])
-    
+
+    placeholders = ", ".join(["?" for _ in check_ids])
+    rows = await fetch_all(
+        db,
+        f"""
+        SELECT kind, alias FROM contact_aliases
+        WHERE license_key_id = ? AND canonical IN (
+            SELECT canonical FROM contact_aliases
+            WHERE license_key_id = ? AND alias IN ({placeholders})
+        )
+        """,
+        [license_id, license_id] + check_ids,
+    )
+    if not rows:
+        return await _scan_sender_aliases(db, license_id, sender_contact, check_ids)
+
+    all_contacts = {sender_contact}
+    all_ids = {cid for cid in check_ids if cid.isdigit()}
+    for row in rows:
+        if row["kind"] == "id":
+            all_ids.add(row["alias"])
+        else:
+            all_contacts.add(row["alias"])
+
+    return tuple(all_contacts), tuple(all_ids)
+
+
+async def _scan_sender_aliases(db, license_id: int, sender_contact: str, check_ids: List[str]) -> tuple:
+    """
+    Discover aliases by scanning inbox/outbox messages (two hops).
+    Used for contacts that are not in contact_aliases yet.
+    """
     placeholders = ", ".join(["?" for _ in check_ids])
     
     # Query for all aliases across both tables
@@ -1224,6 +1434,12 @@ async def fix_stale_inbox_status(license_id: int = None) -> int:
 async def mark_message_as_read(message_id: int, license_id: int) -> bool:
     """Mark a single inbox message as read."""
     async with get_db() as db:
+        row = await fetch_one(
+            db,
+            "SELECT sender_contact, status, is_read, deleted_at FROM inbox_messages WHERE id = ? AND license_key_id = ?",
+            [message_id, license_id]
+        )
+        
         query = "UPDATE inbox_messages SET is_read = 1 WHERE id = ? AND license_key_id = ?"
         params = [message_id, license_id]
         if DB_TYPE == "postgresql":
@@ -1233,9 +1449,9 @@ async def mark_message_as_read(message_id: int, license_id: int) -> bool:
         await commit_db(db)
         
         # After marking as read, update the conversation's unread_count
-        row = await fetch_one(db, "SELECT sender_contact FROM inbox_messages WHERE id = ?", [message_id])
         if row and row["sender_contact"]:
-            await upsert_conversation_state(license_id, row["sender_contact"])
+            was_unread = row.get("status") == "analyzed" and not row.get("is_read") and not row.get("deleted_at")
+            await apply_conversation_delta(license_id, row["sender_contact"], unread_delta=-1 if was_unread else 0)
         return True
 
 async def mark_chat_read(license_id: int, sender_contact: str) -> int:
@@ -1284,7 +1500,7 @@ async def mark_chat_read(license_id: int, sender_contact: str) -> int:
             
         await execute_sql(db, query, params)
         await commit_db(db)
-        await upsert_conversation_state(license_id, sender_contact)
+        await apply_conversation_delta(license_id, sender_contact, reset_unread=True)
         return 1
 
 
@@ -1569,6 +1785,7 @@ async def save_synced_outbox_message(
             """,
             [license_id],
         )
+        await link_contact_aliases(db, license_id, [recipient_email], [recipient_id])
         await commit_db(db)
         
         message_id = row["id"] if row else 0
@@ -1576,7 +1793,20 @@ async def save_synced_outbox_message(
         # Update conversation state
         contact = recipient_email or recipient_id
         if contact:
-            await upsert_conversation_state(license_id, contact, recipient_name, channel)
+            await apply_conversation_delta(
+                license_id,
+                contact,
+                message_delta=1,
+                last_message={
+                    "id": message_id,
+                    "body": body,
+                    "attachments": attachments_json,
+                    "created_at": ts_value,
+                    "status": "sent",
+                },
+                sender_name=recipient_name,
+                channel=channel
+            )
             
         # Broadcast via WebSocket
         try:
@@ -1773,7 +2003,7 @@ async def soft_delete_inbox_message(message_id: int, license_id: int) -> dict:
     async with get_db() as db:
         message = await fetch_one(
             db,
-            "SELECT id, deleted_at, sender_contact FROM inbox_messages WHERE id = ? AND license_key_id = ?",
+            "SELECT id, deleted_at, sender_contact, status, is_read FROM inbox_messages WHERE id = ? AND license_key_id = ?",
             [message_id, license_id]
         )
         
@@ -1802,7 +2032,15 @@ async def soft_delete_inbox_message(message_id: int, license_id: int) -> dict:
         await commit_db(db)
         
         if message.get("sender_contact"):
-            await upsert_conversation_state(license_id, message["sender_contact"])
+            was_counted = message.get("status") not in (None, "pending")
+            was_unread = message.get("status") == "analyzed" and not message.get("is_read")
+            await apply_conversation_delta(
+                license_id,
+                message["sender_contact"],
+                message_delta=-1 if was_counted else 0,
+                unread_delta=-1 if was_unread else 0,
+                removed_message_id=message_id
+            )
 
         return {
             "success": True, 
@@ -2230,6 +2468,203 @@ async def search_messages(
 
 # ============ Conversation Optimization (Denormalized) ============
 
+# How inbox_conversations is maintained on message events:
+# "incremental" applies deltas in a single UPDATE, "full" recomputes from the
+# source tables every time. Drift from incremental updates is repaired by
+# reconcile_conversation_states().
+CONVERSATION_STATE_MODE = os.getenv("CONVERSATION_STATE_MODE", "incremental").lower()
+
+
+def _conversation_preview(body: Optional[str], attachments: Any) -> str:
+    """Preview text for the conversation list, labelling media when the body is empty."""
+    body = body or ""
+    if not body.strip():
+        if attachments:
+            import json
+            try:
+                att_list = []
+                if isinstance(attachments, str):
+                    att_list = json.loads(attachments)
+                elif isinstance(attachments, list):
+                    att_list = attachments
+                
+                if att_list and len(att_list) > 0:
+                    att = att_list[0]
+                    # Check mime_type or filename extension
+                    mime = att.get("mime_type", "").lower()
+                    filename = (att.get("filename") or att.get("file_name") or "").lower()
+                    
+                    if mime.startswith("audio/") or filename.endswith((".mp3", ".wav", ".aac", ".m4a", ".ogg", ".opus", ".amr")):
+                         body = "🎙️ تسجيل صوتي"
+                    elif mime.startswith("image/") or filename.endswith((".jpg", ".jpeg", ".png", ".gif", ".webp")):
+                         body = "📷 صورة"
+                    elif mime.startswith("video/") or filename.endswith((".mp4", ".mov", ".avi", ".webm")):
+                         body = "🎥 فيديو"
+                    else:
+                         body = "📁 ملف"
+            except:
+                body = "� ملف"
+    return body
+
+
+def _conversation_timestamp(value: Any) -> Any:
+    """Normalize a message timestamp the same way the full recompute stores it."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        if DB_TYPE != "postgresql":
+            return value.isoformat()
+    return value
+
+
+def _affected_rows(result: Any) -> int:
+    """Rows touched by an UPDATE (asyncpg status string or sqlite cursor)."""
+    if isinstance(result, str):
+        try:
+            return int(result.split()[-1])
+        except (ValueError, IndexError):
+            return 0
+    return getattr(result, "rowcount", 0) or 0
+
+
+async def apply_conversation_delta(
+    license_id: int,
+    sender_contact: str,
+    message_delta: int = 0,
+    unread_delta: int = 0,
+    last_message: Optional[dict] = None,
+    removed_message_id: Optional[int] = None,
+    reset_unread: bool = False,
+    sender_name: Optional[str] = None,
+    channel: Optional[str] = None
+):
+    """
+    Apply a message insert/read/delete event to `inbox_conversations` in one UPDATE.
+
+    `last_message` (id, body, attachments, created_at, status) replaces the
+    cached last message when it is at least as recent. A conversation without
+    a cached row, or losing its current last message, falls back to the full
+    recompute in upsert_conversation_state().
+
+    The recompute counts every alias of the sender, so the delta is applied
+    to the cached rows of the whole alias group, not just `sender_contact`.
+    """
+    if not sender_contact:
+        return
+    if CONVERSATION_STATE_MODE == "full":
+        await upsert_conversation_state(license_id, sender_contact, sender_name, channel)
+        return
+    if not (message_delta or unread_delta or last_message or reset_unread):
+        return
+
+    now = datetime.utcnow()
+    ts_value = now if DB_TYPE == "postgresql" else now.isoformat()
+
+    async with get_db() as db:
+        all_contacts, _ = await _get_sender_aliases(db, license_id, sender_contact)
+        contacts = sorted(set(all_contacts) | {sender_contact})
+        contact_placeholders = ", ".join(["?" for _ in contacts])
+
+        if removed_message_id is not None:
+            rows = await fetch_all(db, f"""
+                SELECT sender_contact, last_message_id FROM inbox_conversations
+                WHERE license_key_id = ? AND sender_contact IN ({contact_placeholders})
+            """, [license_id] + contacts)
+            if not rows or any(row["last_message_id"] == removed_message_id for row in rows):
+                for contact in [row["sender_contact"] for row in rows] or [sender_contact]:
+                    await upsert_conversation_state(license_id, contact, sender_name, channel)
+                return
+
+        sets = ["message_count = CASE WHEN message_count + ? < 0 THEN 0 ELSE message_count + ? END"]
+        params: List[Any] = [message_delta, message_delta]
+        if reset_unread:
+            sets.append("unread_count = 0")
+        else:
+            sets.append("unread_count = CASE WHEN unread_count + ? < 0 THEN 0 ELSE unread_count + ? END")
+            params.extend([unread_delta, unread_delta])
+
+        if last_message:
+            last_at = _conversation_timestamp(last_message.get("created_at"))
+            newer = "(last_message_at IS NULL OR last_message_at <= ?)"
+            replacements = [
+                ("last_message_id", last_message["id"]),
+                ("last_message_body", _conversation_preview(last_message.get("body"), last_message.get("attachments"))),
+                ("last_message_ai_summary", None),
+                ("status", last_message.get("status")),
+                ("last_message_at", last_at),
+            ]
+            for column, value in replacements:
+                sets.append(f"{column} = CASE WHEN {newer} THEN ? ELSE {column} END")
+                params.extend([last_at, value])
+
+        if sender_name:
+            sets.append("sender_name = ?")
+            params.append(sender_name)
+        if channel:
+            sets.append("channel = ?")
+            params.append(channel)
+
+        sets.append("updated_at = ?")
+        params.extend([ts_value, license_id] + contacts)
+
+        result = await execute_sql(db, f"""
+            UPDATE inbox_conversations SET {", ".join(sets)}
+            WHERE license_key_id = ? AND sender_contact IN ({contact_placeholders})
+        """, params)
+        await commit_db(db)
+
+        if not _affected_rows(result) and last_message:
+            # First message of a conversation: build the row from the source tables
+            await upsert_conversation_state(license_id, sender_contact, sender_name, channel)
+
+
+async def reconcile_conversation_states(license_id: Optional[int] = None) -> dict:
+    """
+    Re-run the full recompute over cached conversations, repairing any drift
+    left by incremental updates. Returns counts of checked and repaired rows.
+    """
+    query = """
+        SELECT license_key_id, sender_contact, unread_count, message_count, last_message_id
+        FROM inbox_conversations
+    """
+    params: List[Any] = []
+    if license_id is not None:
+        query += " WHERE license_key_id = ?"
+        params.append(license_id)
+
+    async with get_db(readonly=True) as db:
+        rows = await fetch_all(db, query, params)
+
+    def snapshot(row: Optional[dict]) -> tuple:
+        if not row:
+            return (0, 0, 0)
+        return (row["unread_count"] or 0, row["message_count"] or 0, row["last_message_id"] or 0)
+
+    repaired = 0
+    for row in rows:
+        lid, contact = row["license_key_id"], row["sender_contact"]
+        try:
+            await upsert_conversation_state(lid, contact)
+            async with get_db(readonly=True) as db:
+                fresh = await fetch_one(db, """
+                    SELECT unread_count, message_count, last_message_id FROM inbox_conversations
+                    WHERE license_key_id = ? AND sender_contact = ?
+                """, [lid, contact])
+        except Exception as e:
+            from logging_config import get_logger
+            get_logger(__name__).warning(f"Conversation reconcile failed for {contact} (license {lid}): {e}")
+            continue
+        if snapshot(fresh) != snapshot(row):
+            repaired += 1
+
+    return {"checked": len(rows), "repaired": repaired}
+
+
 async def upsert_conversation_state(
     license_id: int, 
     sender_contact: str, 
@@ -2239,7 +2674,8 @@ async def upsert_conversation_state(
     """
     Recalculate and update the cached conversation state in `inbox_conversations`.
     To best maintain consistency, we re-calculate from source tables.
-    This approach is "read-heavy write" but ensures accuracy vs incremental updates which can drift.
+    This approach is "read-heavy write"; hot paths use apply_conversation_delta()
+    and this full recompute is the fallback and reconciliation path.
     """
     from db_helper import DB_TYPE
     
@@ -2391,6 +2827,7 @@ async def upsert_conversation_state(
                 """, 
                 [ts_now, license_id, sender_contact]
             )
+            await commit_db(db)
             return
 
         status = last_message["status"]
@@ -2402,33 +2839,7 @@ async def upsert_conversation_state(
         if not channel:
             channel = last_message.get("channel")
         # Check for empty body but present attachments (Audio/File)
-        if not body.strip():
-            attachments = last_message.get("attachments")
-            if attachments:
-                import json
-                try:
-                    att_list = []
-                    if isinstance(attachments, str):
-                        att_list = json.loads(attachments)
-                    elif isinstance(attachments, list):
-                        att_list = attachments
-                    
-                    if att_list and len(att_list) > 0:
-                        att = att_list[0]
-                        # Check mime_type or filename extension
-                        mime = att.get("mime_type", "").lower()
-                        filename = (att.get("filename") or att.get("file_name") or "").lower()
-                        
-                        if mime.startswith("audio/") or filename.endswith((".mp3", ".wav", ".aac", ".m4a", ".ogg", ".opus", ".amr")):
-                             body = "🎙️ تسجيل صوتي"
-                        elif mime.startswith("image/") or filename.endswith((".jpg", ".jpeg", ".png", ".gif", ".webp")):
-                             body = "📷 صورة"
-                        elif mime.startswith("video/") or filename.endswith((".mp4", ".mov", ".avi", ".webm")):
-                             body = "🎥 فيديو"
-                        else:
-                             body = "📁 ملف"
-                except:
-                    body = "� ملف"
+        body = _conversation_preview(body, last_message.get("attachments"))
 
         # 3. Upsert
         now = datetime.utcnow()
@@ -0,0 +1,136 @@
+"""
+Al-Mudeer - Leased Queue Helpers
+Lease, backoff and dead-letter handling shared by the tables that workers
+claim rows from (task_queue, notification_outbox). Each row is leased to one
+worker_id; every write made on a worker's behalf is fenced by that id, so a
+worker whose lease was reaped cannot touch a row another worker reclaimed.
+"""
+
+import os
+import random
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from db_helper import get_db, execute_sql, fetch_all, commit_db, DB_TYPE
+
+# UPDATE ... RETURNING claims a batch atomically (SQLite 3.35+)
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Rows per multi-row INSERT (keeps SQLite under its bound-variable limit)
+BULK_INSERT_CHUNK = 100
+
+# Rows that exhausted max_attempts (dead-letter, kept for inspection)
+STATUS_DEAD = "dead"
+
+# Retry n waits TASK_RETRY_BASE_SECONDS * 2^(n-1), capped, plus up to 10% jitter
+TASK_RETRY_BASE_SECONDS = float(os.getenv("TASK_RETRY_BASE_SECONDS", "10"))
+TASK_RETRY_MAX_SECONDS = float(os.getenv("TASK_RETRY_MAX_SECONDS", "3600"))
+
+
+def db_timestamp(value: datetime):
+    """A naive UTC datetime as the current driver stores it"""
+    return value if DB_TYPE == "postgresql" else value.isoformat()
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """Read back a timestamp column (datetime on Postgres, ISO string on SQLite)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def retry_delay_seconds(attempts: int) -> float:
+    """Exponential backoff before retry number `attempts`"""
+    delay = min(TASK_RETRY_MAX_SECONDS, TASK_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * (1 + random.random() * 0.1)
+
+
+async def retry_or_bury(
+    db, table: str, row_id: int, attempts: int, max_attempts: int, error_msg: str,
+    retry: bool = True, worker_id: Optional[str] = None
+) -> str:
+    """
+    Requeue a processing row with backoff, or dead-letter it once `attempts`
+    reaches `max_attempts` (or retry=False). Returns the new status.
+    With worker_id, only a row still leased to that worker is touched.
+    Does not commit.
+    """
+    now = datetime.utcnow()
+    owner = " AND worker_id = ?" if worker_id is not None else ""
+    owner_params = [worker_id] if worker_id is not None else []
+    if retry and attempts < max_attempts:
+        run_after = db_timestamp(now + timedelta(seconds=retry_delay_seconds(attempts)))
+        await execute_sql(db, f"""
+            UPDATE {table}
+            SET status = 'pending', worker_id = NULL, lease_expires_at = NULL,
+                run_after = ?, error_message = ?, updated_at = ?
+            WHERE id = ? AND status = 'processing'{owner}
+        """, [run_after, str(error_msg), db_timestamp(now), row_id] + owner_params)
+        return "pending"
+
+    await execute_sql(db, f"""
+        UPDATE {table}
+        SET status = '{STATUS_DEAD}', lease_expires_at = NULL, error_message = ?, updated_at = ?
+        WHERE id = ? AND status = 'processing'{owner}
+    """, [str(error_msg), db_timestamp(now), row_id] + owner_params)
+    return STATUS_DEAD
+
+
+async def release_lease(table: str, row_id: int, worker_id: str):
+    """Return a claimed row to the queue without counting the attempt (e.g. on shutdown)"""
+    greatest = "GREATEST" if DB_TYPE == "postgresql" else "MAX"
+    async with get_db() as db:
+        await execute_sql(db, f"""
+            UPDATE {table}
+            SET status = 'pending', worker_id = NULL, lease_expires_at = NULL,
+                attempts = {greatest}(COALESCE(attempts, 0) - 1, 0), updated_at = ?
+            WHERE id = ? AND worker_id = ? AND status = 'processing'
+        """, [db_timestamp(datetime.utcnow()), row_id, worker_id])
+        await commit_db(db)
+
+
+async def renew_leases(table: str, row_ids: Iterable[int], worker_id: str, lease_seconds: float):
+    """Extend the lease on rows this worker is still working on"""
+    row_ids = list(row_ids)
+    if not row_ids:
+        return
+    now = datetime.utcnow()
+    placeholders = ", ".join("?" for _ in row_ids)
+    async with get_db() as db:
+        await execute_sql(db, f"""
+            UPDATE {table} SET lease_expires_at = ?, updated_at = ?
+            WHERE id IN ({placeholders}) AND worker_id = ? AND status = 'processing'
+        """, [db_timestamp(now + timedelta(seconds=lease_seconds)), db_timestamp(now)] + row_ids + [worker_id])
+        await commit_db(db)
+
+
+async def reap_expired_leases(
+    table: str, default_max_attempts: int, stale_before: Optional[datetime] = None
+) -> int:
+    """
+    Requeue (or dead-letter) processing rows whose lease expired, i.e. their
+    worker crashed or hung. With stale_before, rows claimed before leases
+    existed are reaped when their processed_at is older than it.
+    Returns the number of rows reaped.
+    """
+    expired = "lease_expires_at < ?"
+    params = [db_timestamp(datetime.utcnow())]
+    if stale_before is not None:
+        expired = f"({expired} OR (lease_expires_at IS NULL AND processed_at < ?))"
+        params.append(db_timestamp(stale_before))
+
+    async with get_db() as db:
+        rows = await fetch_all(db, f"""
+            SELECT id, worker_id, attempts, max_attempts FROM {table}
+            WHERE status = 'processing' AND {expired}
+        """, params)
+        for row in rows:
+            await retry_or_bury(
+                db, table, row["id"], row["attempts"] or 0, row["max_attempts"] or default_max_attempts,
+                f"Lease expired (worker {row['worker_id']})"
+            )
+        await commit_db(db)
+    return len(rows)
@@ -0,0 +1,412 @@
+"""
+Al-Mudeer - Notification Outbox
+Durable push-delivery queue: one row per (notification, channel), drained by
+NotificationDeliveryWorker with per-channel concurrency, retries and dedup.
+"""
+
+import os
+import json
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional, Dict, List, Any, Iterable, Sequence
+from db_helper import get_db, execute_sql, fetch_one, fetch_all, commit_db, DB_TYPE
+from models.leased_queue import (
+    SQLITE_HAS_RETURNING,
+    BULK_INSERT_CHUNK,
+    STATUS_DEAD,
+    db_timestamp,
+    parse_timestamp,
+    retry_or_bury,
+    release_lease,
+    renew_leases,
+    reap_expired_leases,
+)
+
+# Delivery channels, each drained by its own worker loop
+CHANNEL_FCM = "fcm"
+CHANNEL_WEB_PUSH = "web_push"
+OUTBOX_CHANNELS = (CHANNEL_FCM, CHANNEL_WEB_PUSH)
+
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_OUTBOX_MAX_ATTEMPTS", "5"))
+# A claimed delivery is leased for this long; expired leases are requeued by the reaper
+NOTIFICATION_OUTBOX_LEASE_SECONDS = int(os.getenv("NOTIFICATION_OUTBOX_LEASE_SECONDS", "120"))
+
+# Statuses: pending -> processing -> sent, back to pending for a retry, or dead
+OUTBOX_STATUSES = ("pending", "processing", "sent", STATUS_DEAD)
+
+# Events of in-process delivery workers, set when deliveries are queued here
+_outbox_wakers: List[asyncio.Event] = []
+
+
+def register_outbox_waker(event: asyncio.Event):
+    """Have event set whenever this process queues deliveries"""
+    _outbox_wakers.append(event)
+
+
+def unregister_outbox_waker(event: asyncio.Event):
+    if event in _outbox_wakers:
+        _outbox_wakers.remove(event)
+
+
+def notify_outbox():
+    for event in _outbox_wakers:
+        event.set()
+
+
+def available_push_channels() -> List[str]:
+    """Channels worth queuing in this deployment (web push needs pywebpush)"""
+    channels = [CHANNEL_FCM]
+    try:
+        from services.push_service import WEBPUSH_AVAILABLE
+        if WEBPUSH_AVAILABLE:
+            channels.append(CHANNEL_WEB_PUSH)
+    except Exception:
+        pass
+    return channels
+
+
+def push_deliveries(
+    license_id: int,
+    notification_id: int,
+    title: str,
+    body: str,
+    link: Optional[str] = None,
+    data: Optional[Dict[str, Any]] = None,
+    priority: str = "normal",
+    image: Optional[str] = None,
+    channels: Optional[Sequence[str]] = None
+) -> List[Dict[str, Any]]:
+    """Outbox rows delivering one in-app notification to the license's devices"""
+    payload = {
+        "title": title,
+        "body": body,
+        "link": link,
+        "data": data or {},
+        "priority": priority,
+        "image": image,
+        "notification_id": notification_id,
+    }
+    return [
+        {
+            "license_id": license_id,
+            "channel": channel,
+            "dedup_key": f"notification:{notification_id}:{channel}",
+            "payload": payload,
+        }
+        for channel in (channels or available_push_channels())
+    ]
+
+
+async def _insert_deliveries(db, deliveries: List[Dict[str, Any]], broadcast_id: Optional[int] = None) -> int:
+    """Multi-row INSERT that skips dedup_keys already queued. Returns rows inserted."""
+    now = db_timestamp(datetime.utcnow())
+    rows = [
+        [
+            delivery["license_id"], delivery["channel"], delivery["dedup_key"],
+            json.dumps(delivery["payload"], ensure_ascii=False, default=str), broadcast_id,
+            NOTIFICATION_OUTBOX_MAX_ATTEMPTS, now, now,
+        ]
+        for delivery in deliveries
+    ]
+    insert = """
+        INSERT INTO notification_outbox
+            (license_key_id, channel, dedup_key, payload, broadcast_id, status, max_attempts, created_at, updated_at)
+        VALUES """
+    placeholder = "(?, ?, ?, ?, ?, 'pending', ?, ?, ?)"
+    on_conflict = " ON CONFLICT (dedup_key) DO NOTHING"
+
+    inserted = 0
+    if DB_TYPE == "postgresql" or SQLITE_HAS_RETURNING:
+        for start in range(0, len(rows), BULK_INSERT_CHUNK):
+            chunk = rows[start:start + BULK_INSERT_CHUNK]
+            returned = await fetch_all(
+                db,
+                insert + ", ".join(placeholder for _ in chunk) + on_conflict + " RETURNING id",
+                [value for row in chunk for value in row]
+            )
+            inserted += len(returned)
+    else:
+        for row in rows:
+            await execute_sql(db, insert + placeholder + on_conflict, row)
+            changed = await fetch_one(db, "SELECT changes() AS count")
+            inserted += changed["count"]
+    return inserted
+
+
+async def enqueue_deliveries(deliveries: Iterable[Dict[str, Any]], broadcast_id: Optional[int] = None) -> int:
+    """
+    Queue deliveries ({license_id, channel, dedup_key, payload}) in one commit.
+    Deliveries whose dedup_key is already queued are skipped.
+    Returns the number queued.
+    """
+    deliveries = list(deliveries)
+    if not deliveries:
+        return 0
+    async with get_db() as db:
+        inserted = await _insert_deliveries(db, deliveries, broadcast_id)
+        await commit_db(db)
+    if inserted:
+        notify_outbox()
+    return inserted
+
+
+async def enqueue_notification_push(license_id: int, notification_id: int, title: str, body: str, **kwargs) -> int:
+    """Queue mobile and web push for an in-app notification (see push_deliveries)"""
+    return await enqueue_deliveries(push_deliveries(license_id, notification_id, title, body, **kwargs))
+
+
+async def claim_deliveries(channel: str, worker_id: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    Claim up to `limit` due deliveries of one channel, oldest first.
+    Each claim counts as an attempt and leases the row.
+    """
+    now = datetime.utcnow()
+    lease = db_timestamp(now + timedelta(seconds=NOTIFICATION_OUTBOX_LEASE_SECONDS))
+    claim_params = [worker_id, lease, db_timestamp(now), channel, db_timestamp(now), limit]
+    select = """
+        SELECT id FROM notification_outbox
+        WHERE channel = ? AND status = 'pending' AND (run_after IS NULL OR run_after <= ?)
+        ORDER BY created_at ASC, id ASC
+        LIMIT ?
+    """
+    update = """
+        UPDATE notification_outbox
+        SET status = 'processing', worker_id = ?, lease_expires_at = ?, updated_at = ?,
+            attempts = COALESCE(attempts, 0) + 1
+        WHERE id IN ({select})
+    """
+    returning = " RETURNING id, license_key_id, payload, attempts, max_attempts"
+
+    async with get_db() as db:
+        if DB_TYPE == "postgresql":
+            rows = await fetch_all(db, update.format(select=select + " FOR UPDATE SKIP LOCKED") + returning, claim_params)
+        elif SQLITE_HAS_RETURNING:
+            rows = await fetch_all(db, update.format(select=select) + returning, claim_params)
+        else:
+            ids = [row["id"] for row in await fetch_all(db, select, claim_params[3:])]
+            rows = []
+            if ids:
+                placeholders = ", ".join("?" for _ in ids)
+                await execute_sql(db, update.format(select=placeholders), claim_params[:3] + ids)
+                rows = await fetch_all(db, f"""
+                    SELECT id, license_key_id, payload, attempts, max_attempts
+                    FROM notification_outbox WHERE id IN ({placeholders})
+                """, ids)
+        await commit_db(db)
+
+    return [
+        {
+            "id": row["id"],
+            "license_id": row["license_key_id"],
+            "channel": channel,
+            "payload": json.loads(row["payload"]),
+            "attempts": row["attempts"],
+            "max_attempts": row["max_attempts"] or NOTIFICATION_OUTBOX_MAX_ATTEMPTS,
+        }
+        for row in sorted(rows, key=lambda row: row["id"])
+    ]
+
+
+async def complete_deliveries(sent_counts: Dict[int, int], worker_id: str):
+    """
+    Mark deliveries sent, recording how many devices each reached. Only rows
+    still leased to this worker are touched; a reaped and reclaimed delivery
+    is left to its new owner.
+    """
+    if not sent_counts:
+        return
+    now = db_timestamp(datetime.utcnow())
+    async with get_db() as db:
+        for delivery_id, sent_count in sent_counts.items():
+            await execute_sql(db, """
+                UPDATE notification_outbox
+                SET status = 'sent', sent_count = ?, lease_expires_at = NULL, updated_at = ?
+                WHERE id = ? AND worker_id = ? AND status = 'processing'
+            """, [sent_count, now, delivery_id, worker_id])
+        await commit_db(db)
+
+
+async def fail_delivery(delivery: Dict[str, Any], worker_id: str, error_msg: str) -> Optional[str]:
+    """
+    Retry a failed delivery with backoff, or dead-letter it. Returns the new
+    status, None if the delivery is no longer leased to this worker.
+    """
+    async with get_db() as db:
+        row = await fetch_one(
+            db,
+            "SELECT id FROM notification_outbox WHERE id = ? AND worker_id = ? AND status = 'processing'",
+            [delivery["id"], worker_id]
+        )
+        if not row:
+            return None
+        status = await retry_or_bury(
+            db, "notification_outbox", delivery["id"], delivery["attempts"],
+            delivery["max_attempts"] or NOTIFICATION_OUTBOX_MAX_ATTEMPTS, error_msg, worker_id=worker_id
+        )
+        await commit_db(db)
+    return status
+
+
+async def release_delivery(delivery_id: int, worker_id: str):
+    """Return a claimed delivery to the queue without counting the attempt (shutdown)"""
+    await release_lease("notification_outbox", delivery_id, worker_id)
+
+
+async def heartbeat_deliveries(delivery_ids: List[int], worker_id: str):
+    """Extend the lease on deliveries this worker is still sending"""
+    await renew_leases("notification_outbox", delivery_ids, worker_id, NOTIFICATION_OUTBOX_LEASE_SECONDS)
+
+
+async def reap_expired_deliveries() -> int:
+    """Requeue (or dead-letter) processing deliveries whose lease expired"""
+    reaped = await reap_expired_leases("notification_outbox", NOTIFICATION_OUTBOX_MAX_ATTEMPTS)
+    if reaped:
+        notify_outbox()
+    return reaped
+
+
+async def get_outbox_metrics() -> Dict[str, Any]:
+    """Delivery counts per channel and status, and the age of the oldest pending row"""
+    now = datetime.utcnow()
+    async with get_db(readonly=True) as db:
+        rows = await fetch_all(db, """
+            SELECT channel, status, COUNT(*) AS count, MIN(created_at) AS oldest_created_at
+            FROM notification_outbox
+            WHERE status IN ('pending', 'processing', 'dead')
+            GROUP BY channel, status
+        """)
+
+    channels: Dict[str, Dict[str, Any]] = {
+        channel: {"pending": 0, "processing": 0, STATUS_DEAD: 0, "oldest_pending_age_seconds": None}
+        for channel in OUTBOX_CHANNELS
+    }
+    for row in rows:
+        entry = channels.setdefault(row["channel"], {
+            "pending": 0, "processing": 0, STATUS_DEAD: 0, "oldest_pending_age_seconds": None
+        })
+        entry[row["status"]] = row["count"]
+        if row["status"] == "pending":
+            created = parse_timestamp(row["oldest_created_at"])
+            if created:
+                entry["oldest_pending_age_seconds"] = round(max(0.0, (now - created).total_seconds()), 1)
+    return {"channels": channels, "timestamp": now.isoformat()}
+
+
+# ============ Admin Broadcasts ============
+
+async def _insert_notifications(db, license_ids: List[int], notification_type: str, title: str,
+                                message: str, priority: str, link: Optional[str]) -> Dict[int, int]:
+    """Bulk-insert one in-app notification per license. Returns {license_id: notification_id}."""
+    insert = "INSERT INTO notifications (license_key_id, type, priority, title, message, link) VALUES "
+    rows = [[license_id, notification_type, priority, title, message, link] for license_id in license_ids]
+
+    if DB_TYPE == "postgresql" or SQLITE_HAS_RETURNING:
+        notification_ids: Dict[int, int] = {}
+        for start in range(0, len(rows), BULK_INSERT_CHUNK):
+            chunk = rows[start:start + BULK_INSERT_CHUNK]
+            returned = await fetch_all(
+                db,
+                insert + ", ".join("(?, ?, ?, ?, ?, ?)" for _ in chunk) + " RETURNING id, license_key_id",
+                [value for row in chunk for value in row]
+            )
+            notification_ids.update({row["license_key_id"]: row["id"] for row in returned})
+        return notification_ids
+
+    # Older SQLite: ids are contiguous under the single writer connection
+    await db.executemany(insert + "(?, ?, ?, ?, ?, ?)", rows)
+    row = await fetch_one(db, "SELECT last_insert_rowid() AS id")
+    first_id = row["id"] - len(rows) + 1
+    return {license_id: first_id + n for n, license_id in enumerate(license_ids)}
+
+
+async def create_broadcast(
+    title: str,
+    message: str,
+    notification_type: str = "team_update",
+    priority: str = "normal",
+    link: Optional[str] = None,
+    license_ids: Optional[List[int]] = None
+) -> Dict[str, Any]:
+    """
+    Admin broadcast: in one transaction, record the broadcast, bulk-insert
+    the in-app notifications and queue their push deliveries. Delivery runs
+    in the background; poll get_broadcast_progress().
+    license_ids=None targets every active license.
+    """
+    async with get_db() as db:
+        if license_ids is None:
+            rows = await fetch_all(db, "SELECT id FROM license_keys WHERE is_active = TRUE ORDER BY id")
+            license_ids = [row["id"] for row in rows]
+        license_ids = list(dict.fromkeys(license_ids))
+
+        broadcast_sql = """
+            INSERT INTO notification_broadcasts (title, message, notification_type, priority, link, total_targets)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+        broadcast_params = [title, message, notification_type, priority, link, len(license_ids)]
+        if DB_TYPE == "postgresql" or SQLITE_HAS_RETURNING:
+            row = await fetch_one(db, broadcast_sql + " RETURNING id", broadcast_params)
+        else:
+            await execute_sql(db, broadcast_sql, broadcast_params)
+            row = await fetch_one(db, "SELECT last_insert_rowid() AS id")
+        broadcast_id = row["id"]
+
+        notification_ids = await _insert_notifications(
+            db, license_ids, notification_type, title, message, priority, link
+        )
+        channels = available_push_channels()
+        deliveries = [
+            delivery
+            for license_id, notification_id in notification_ids.items()
+            for delivery in push_deliveries(
+                license_id, notification_id, title, message, link=link,
+                data={"type": notification_type, "priority": priority, "broadcast_id": str(broadcast_id)},
+                priority=priority, channels=channels
+            )
+        ]
+        queued = await _insert_deliveries(db, deliveries, broadcast_id)
+        await commit_db(db)
+
+    notify_outbox()
+    return {
+        "broadcast_id": broadcast_id,
+        "total_targets": len(license_ids),
+        "notifications_created": len(notification_ids),
+        "deliveries_queued": queued,
+    }
+
+
+async def get_broadcast_progress(broadcast_id: int) -> Optional[Dict[str, Any]]:
+    """Delivery progress of a broadcast, None if it doesn't exist"""
+    async with get_db(readonly=True) as db:
+        broadcast = await fetch_one(db, """
+            SELECT id, title, notification_type, total_targets, created_at
+            FROM notification_broadcasts WHERE id = ?
+        """, [broadcast_id])
+        if not broadcast:
+            return None
+        rows = await fetch_all(db, """
+            SELECT channel, status, COUNT(*) AS count, COALESCE(SUM(sent_count), 0) AS devices
+            FROM notification_outbox WHERE broadcast_id = ?
+            GROUP BY channel, status
+        """, [broadcast_id])
+
+    deliveries = {status: 0 for status in OUTBOX_STATUSES}
+    devices_reached = {channel: 0 for channel in OUTBOX_CHANNELS}
+    for row in rows:
+        deliveries[row["status"]] = deliveries.get(row["status"], 0) + row["count"]
+        devices_reached[row["channel"]] = devices_reached.get(row["channel"], 0) + (row["devices"] or 0)
+
+    total = sum(deliveries.values())
+    finished = deliveries["sent"] + deliveries[STATUS_DEAD]
+    return {
+        "broadcast_id": broadcast["id"],
+        "title": broadcast["title"],
+        "notification_type": broadcast["notification_type"],
+        "total_targets": broadcast["total_targets"],
+        "created_at": str(broadcast["created_at"]),
+        "deliveries": deliveries,
+        "devices_reached": devices_reached,
+        "progress": round(finished / total, 4) if total else 1.0,
+        "done": finished == total,
+    }
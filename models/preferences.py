@@ -41,6 +41,13 @@ async def get_preferences(license_id: int) -> dict:
                     # On error, treat as simple string or empty list
                     prefs["preferred_languages"] = [str(raw_langs)]
             
+            for key in ("blocked_senders", "blocked_keywords", "required_keywords"):
+                if key in prefs:
+                    try:
+                        prefs[key] = json.loads(prefs[key]) if prefs[key] else []
+                    except (TypeError, ValueError):
+                        prefs[key] = []
+            
             return prefs
 
         # Create default preferences including AI tone defaults
@@ -93,6 +100,10 @@ async def update_preferences(license_id: int, **kwargs) -> bool:
         'preferred_languages',
         'reply_length',
         'formality_level',
+        # Message filters (JSON lists)
+        'blocked_senders',
+        'blocked_keywords',
+        'required_keywords',
     ]
     updates = {k: v for k, v in kwargs.items() if k in allowed}
     
@@ -108,7 +119,7 @@ async def update_preferences(license_id: int, **kwargs) -> bool:
         
     # Pre-process updates: Serialize lists to JSON
     for k, v in updates.items():
-        if k == 'preferred_languages' and isinstance(v, list):
+        if k in ('preferred_languages', 'blocked_senders', 'blocked_keywords', 'required_keywords') and isinstance(v, list):
             updates[k] = json.dumps(v)
     
     set_clause = ", ".join(f"{k} = ?" for k in updates.keys())
@@ -146,7 +157,11 @@ async def update_preferences(license_id: int, **kwargs) -> bool:
             )
         await commit_db(db)
         logger.info("Preferences update completed successfully")
-        return True
+    
+    # Filter settings are compiled once per license; rebuild on next message
+    from message_filters import invalidate_filter_cache
+    invalidate_filter_cache(license_id)
+    return True
 
 
 async def delete_preferences(license_id: int, db=None) -> bool:
@@ -3,143 +3,365 @@ Al-Mudeer - Persistent Task Queue
 Handles background jobs (AI analysis, etc.) robustly with database persistence.
 """
 
+import os
 import json
-from datetime import datetime
-from typing import Optional, Dict, List, Any
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional, Dict, List, Any, Iterable
 from db_helper import get_db, execute_sql, fetch_one, fetch_all, commit_db, DB_TYPE
+from models.leased_queue import (
+    SQLITE_HAS_RETURNING,
+    BULK_INSERT_CHUNK,
+    STATUS_DEAD,
+    db_timestamp,
+    parse_timestamp,
+    retry_or_bury,
+    release_lease,
+    renew_leases,
+    reap_expired_leases,
+)
+
+# Postgres NOTIFY channel announcing new tasks to listening workers
+TASK_NOTIFY_CHANNEL = "task_queue"
+
+# A claimed task is leased to its worker for this long; the worker renews the
+# lease while running, and the reaper requeues tasks whose lease ran out
+TASK_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv("TASK_VISIBILITY_TIMEOUT_SECONDS", "300"))
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "5"))
+
+# Statuses: pending -> processing -> completed, back to pending for a retry,
+# or dead once max_attempts is exhausted (dead-letter, kept for inspection)
+TASK_STATUS_DEAD = STATUS_DEAD
+
+# Events of in-process workers, set when a task is enqueued here
+_task_wakers: List[asyncio.Event] = []
+
+
+def register_task_waker(event: asyncio.Event):
+    """Have event set whenever this process enqueues a task"""
+    _task_wakers.append(event)
+
+
+def unregister_task_waker(event: asyncio.Event):
+    if event in _task_wakers:
+        _task_wakers.remove(event)
+
+
+def notify_task_available():
+    """Wake in-process workers (other processes are woken by Postgres NOTIFY)"""
+    for event in _task_wakers:
+        event.set()
+
 
 async def enqueue_task(
     task_type: str,
     payload: Dict[str, Any],
-    priority: int = 0
+    priority: int = 0,
+    max_attempts: Optional[int] = None,
+    delay_seconds: float = 0
 ) -> int:
     """
     Queue a background task.
     priority: Higher runs first (default 0)
+    max_attempts: Runs before the task is dead-lettered (default TASK_MAX_ATTEMPTS)
+    delay_seconds: Don't run before this many seconds from now
     """
     async with get_db() as db:
         now = datetime.utcnow()
         ts_value = now if DB_TYPE == "postgresql" else now.isoformat()
         payload_json = json.dumps(payload)
+        max_attempts = max_attempts or TASK_MAX_ATTEMPTS
+        run_after = db_timestamp(now + timedelta(seconds=delay_seconds)) if delay_seconds else None
         
         if DB_TYPE == "postgresql":
             sql = """
-                INSERT INTO task_queue (task_type, payload, priority, status, created_at, updated_at)
-                VALUES ($1, $2, $3, 'pending', $4, $4)
+                INSERT INTO task_queue (task_type, payload, priority, status, created_at, updated_at, max_attempts, run_after)
+                VALUES ($1, $2, $3, 'pending', $4, $4, $5, $6)
                 RETURNING id
             """
-            row = await fetch_one(db, sql, [task_type, payload_json, priority, ts_value])
+            row = await fetch_one(db, sql, [task_type, payload_json, priority, ts_value, max_attempts, run_after])
+            await execute_sql(db, f"SELECT pg_notify('{TASK_NOTIFY_CHANNEL}', ?)", [task_type])
             await commit_db(db)
+            notify_task_available()
             return row["id"]
         else:
             # SQLite
             sql = """
-                INSERT INTO task_queue (task_type, payload, priority, status, created_at, updated_at)
-                VALUES (?, ?, ?, 'pending', ?, ?)
+                INSERT INTO task_queue (task_type, payload, priority, status, created_at, updated_at, max_attempts, run_after)
+                VALUES (?, ?, ?, 'pending', ?, ?, ?, ?)
             """
-            await execute_sql(db, sql, [task_type, payload_json, priority, ts_value, ts_value])
+            await execute_sql(db, sql, [task_type, payload_json, priority, ts_value, ts_value, max_attempts, run_after])
             
             # Get ID
             row = await fetch_one(db, "SELECT last_insert_rowid() as id")
             task_id = row["id"]
             await commit_db(db)
+            notify_task_available()
             return task_id
 
+async def enqueue_tasks_bulk(
+    task_type: str,
+    payloads: Iterable[Dict[str, Any]],
+    priority: int = 0,
+    max_attempts: Optional[int] = None
+) -> List[int]:
+    """
+    Queue many tasks of one type with multi-row INSERTs and a single commit.
+    Returns the new task ids in payload order.
+    """
+    payloads = list(payloads)
+    if not payloads:
+        return []
+    
+    now = datetime.utcnow()
+    ts_value = now if DB_TYPE == "postgresql" else now.isoformat()
+    max_attempts = max_attempts or TASK_MAX_ATTEMPTS
+    rows = [
+        [task_type, json.dumps(payload), priority, ts_value, ts_value, max_attempts]
+        for payload in payloads
+    ]
+    insert = "INSERT INTO task_queue (task_type, payload, priority, status, created_at, updated_at, max_attempts) VALUES "
+    
+    task_ids: List[int] = []
+    async with get_db() as db:
+        if DB_TYPE == "postgresql" or SQLITE_HAS_RETURNING:
+            for start in range(0, len(rows), BULK_INSERT_CHUNK):
+                chunk = rows[start:start + BULK_INSERT_CHUNK]
+                values = ", ".join("(?, ?, ?, 'pending', ?, ?, ?)" for _ in chunk)
+                returned = await fetch_all(
+                    db, insert + values + " RETURNING id", [value for row in chunk for value in row]
+                )
+                # Ids are assigned in VALUES order
+                task_ids.extend(sorted(row["id"] for row in returned))
+        else:
+            # Older SQLite: ids are contiguous under the single writer connection
+            await db.executemany(insert + "(?, ?, ?, 'pending', ?, ?, ?)", rows)
+            row = await fetch_one(db, "SELECT last_insert_rowid() as id")
+            task_ids = list(range(row["id"] - len(rows) + 1, row["id"] + 1))
+        
+        if DB_TYPE == "postgresql":
+            await execute_sql(db, f"SELECT pg_notify('{TASK_NOTIFY_CHANNEL}', ?)", [task_type])
+        await commit_db(db)
+    
+    notify_task_available()
+    return task_ids
+
 async def fetch_next_task(worker_id: str = "worker-1") -> Optional[Dict]:
     """
     Fetch and lock the next pending task.
     Returns task dict or None.
     """
+    tasks = await fetch_next_tasks(worker_id, limit=1)
+    return tasks[0] if tasks else None
+
+async def fetch_next_tasks(worker_id: str = "worker-1", limit: int = 1) -> List[Dict]:
+    """
+    Claim up to `limit` pending tasks in one statement.
+    
+    PostgreSQL uses FOR UPDATE SKIP LOCKED so concurrent workers (in any
+    process) claim disjoint batches; SQLite claims with UPDATE ... RETURNING
+    under the single writer connection.
+    Only tasks whose run_after has passed are claimed; each claim counts as
+    an attempt and leases the task for TASK_VISIBILITY_TIMEOUT_SECONDS.
+    Returns task dicts in priority order.
+    """
     now = datetime.utcnow()
     ts_value = now if DB_TYPE == "postgresql" else now.isoformat()
+    lease = db_timestamp(now + timedelta(seconds=TASK_VISIBILITY_TIMEOUT_SECONDS))
+    claim_params = [worker_id, ts_value, ts_value, lease, ts_value, limit]
     
     async with get_db() as db:
-        # Atomic fetch-and-update (skip locked)
         if DB_TYPE == "postgresql":
-            # PostgreSQL FOR UPDATE SKIP LOCKED
-            sql = """
+            rows = await fetch_all(db, """
                 UPDATE task_queue
-                SET status = 'processing', worker_id = $1, processed_at = $2, updated_at = $2
-                WHERE id = (
+                SET status = 'processing', worker_id = ?, processed_at = ?, updated_at = ?,
+                    lease_expires_at = ?, attempts = COALESCE(attempts, 0) + 1
+                WHERE id IN (
                     SELECT id FROM task_queue
-                    WHERE status = 'pending'
+                    WHERE status = 'pending' AND (run_after IS NULL OR run_after <= ?)
                     ORDER BY priority DESC, created_at ASC
-                    LIMIT 1
+                    LIMIT ?
                     FOR UPDATE SKIP LOCKED
                 )
-                RETURNING id, task_type, payload
-            """
-            row = await fetch_one(db, sql, [worker_id, ts_value])
-            if row:
-                await commit_db(db)
-                return {
-                    "id": row["id"],
-                    "task_type": row["task_type"],
-                    "payload": json.loads(row["payload"])
-                }
-            return None
-            
+                RETURNING id, task_type, payload, priority, created_at, attempts, max_attempts
+            """, claim_params)
+        elif SQLITE_HAS_RETURNING:
+            rows = await fetch_all(db, """
+                UPDATE task_queue
+                SET status = 'processing', worker_id = ?, processed_at = ?, updated_at = ?,
+                    lease_expires_at = ?, attempts = COALESCE(attempts, 0) + 1
+                WHERE id IN (
+                    SELECT id FROM task_queue
+                    WHERE status = 'pending' AND (run_after IS NULL OR run_after <= ?)
+                    ORDER BY priority DESC, created_at ASC
+                    LIMIT ?
+                )
+                RETURNING id, task_type, payload, priority, created_at, attempts, max_attempts
+            """, claim_params)
         else:
-            # SQLite (Simulated atomic lock)
-            # 1. Find candidate
-            find_sql = """
-                SELECT id, task_type, payload FROM task_queue
-                WHERE status = 'pending'
+            # Older SQLite: select then update while holding the writer connection
+            rows = await fetch_all(db, """
+                SELECT id, task_type, payload, priority, created_at,
+                       COALESCE(attempts, 0) + 1 AS attempts, max_attempts
+                FROM task_queue
+                WHERE status = 'pending' AND (run_after IS NULL OR run_after <= ?)
                 ORDER BY priority DESC, created_at ASC
-                LIMIT 1
-            """
-            row = await fetch_one(db, find_sql)
-            if not row:
-                return None
-                
-            task_id = row["id"]
-            
-            # 2. Try to lock
-            update_sql = """
-                UPDATE task_queue
-                SET status = 'processing', worker_id = ?, processed_at = ?, updated_at = ?
-                WHERE id = ? AND status = 'pending'
-            """
-            try:
-                await execute_sql(db, update_sql, [worker_id, ts_value, ts_value, task_id])
-                await commit_db(db)
-                # Success
-                return {
-                    "id": task_id,
-                    "task_type": row["task_type"],
-                    "payload": json.loads(row["payload"])
-                }
-            except:
-                 # Race condition failed
-                return None
-
-async def complete_task(task_id: int):
-    """Mark task as completed."""
+                LIMIT ?
+            """, [ts_value, limit])
+            if rows:
+                placeholders = ", ".join("?" for _ in rows)
+                await execute_sql(db, f"""
+                    UPDATE task_queue
+                    SET status = 'processing', worker_id = ?, processed_at = ?, updated_at = ?,
+                        lease_expires_at = ?, attempts = COALESCE(attempts, 0) + 1
+                    WHERE id IN ({placeholders}) AND status = 'pending'
+                """, [worker_id, ts_value, ts_value, lease] + [row["id"] for row in rows])
+        await commit_db(db)
+    
+    # RETURNING order is unspecified
+    rows.sort(key=lambda row: (-(row["priority"] or 0), str(row["created_at"]), row["id"]))
+    return [
+        {
+            "id": row["id"],
+            "task_type": row["task_type"],
+            "payload": json.loads(row["payload"]),
+            "attempts": row["attempts"],
+            "max_attempts": row["max_attempts"] or TASK_MAX_ATTEMPTS,
+        }
+        for row in rows
+    ]
+
+async def heartbeat_tasks(task_ids: List[int], worker_id: str):
+    """Extend the lease on tasks this worker is still running"""
+    await renew_leases("task_queue", task_ids, worker_id, TASK_VISIBILITY_TIMEOUT_SECONDS)
+
+async def complete_task(task_id: int, worker_id: str):
+    """Mark task as completed (only while this worker still holds its lease)."""
     now = datetime.utcnow()
     ts_value = now if DB_TYPE == "postgresql" else now.isoformat()
     
     async with get_db() as db:
         await execute_sql(
             db, 
-            "UPDATE task_queue SET status = 'completed', completed_at = ?, updated_at = ? WHERE id = ?",
-            [ts_value, ts_value, task_id]
+            """
+            UPDATE task_queue SET status = 'completed', completed_at = ?, updated_at = ?, lease_expires_at = NULL
+            WHERE id = ? AND worker_id = ? AND status = 'processing'
+            """,
+            [ts_value, ts_value, task_id, worker_id]
         )
         await commit_db(db)
 
-async def fail_task(task_id: int, error_msg: str):
-    """Mark task as failed."""
+async def complete_tasks_bulk(task_ids: Iterable[int], worker_id: str) -> List[int]:
+    """
+    Mark many tasks completed in one statement.
+    Returns the ids that were still 'processing' under this worker (and are
+    now completed); a task reaped and claimed by another worker is left alone.
+    """
+    task_ids = list(task_ids)
+    if not task_ids:
+        return []
+    
     now = datetime.utcnow()
     ts_value = now if DB_TYPE == "postgresql" else now.isoformat()
+    placeholders = ", ".join("?" for _ in task_ids)
+    update = f"""
+        UPDATE task_queue
+        SET status = 'completed', completed_at = ?, updated_at = ?, lease_expires_at = NULL
+        WHERE id IN ({placeholders}) AND worker_id = ? AND status = 'processing'
+    """
+    params = [ts_value, ts_value] + task_ids + [worker_id]
     
     async with get_db() as db:
-        await execute_sql(
-            db, 
-            "UPDATE task_queue SET status = 'failed', error_message = ?, updated_at = ? WHERE id = ?",
-            [str(error_msg), ts_value, task_id]
+        if DB_TYPE == "postgresql" or SQLITE_HAS_RETURNING:
+            rows = await fetch_all(db, update + " RETURNING id", params)
+            completed = [row["id"] for row in rows]
+        else:
+            rows = await fetch_all(
+                db,
+                f"SELECT id FROM task_queue WHERE id IN ({placeholders}) AND worker_id = ? AND status = 'processing'",
+                task_ids + [worker_id]
+            )
+            await execute_sql(db, update, params)
+            completed = [row["id"] for row in rows]
+        await commit_db(db)
+    return sorted(completed)
+
+async def fail_task(task_id: int, worker_id: str, error_msg: str, retry: bool = True) -> Optional[str]:
+    """
+    Record a failed run. The task is retried with exponential backoff until
+    max_attempts, then dead-lettered. retry=False dead-letters immediately.
+    Returns the new status ('pending' or 'dead'), None if the task is gone
+    or no longer leased to this worker (reaped and claimed elsewhere).
+    """
+    async with get_db() as db:
+        row = await fetch_one(
+            db,
+            "SELECT attempts, max_attempts FROM task_queue WHERE id = ? AND worker_id = ? AND status = 'processing'",
+            [task_id, worker_id]
+        )
+        if not row:
+            return None
+        status = await retry_or_bury(
+            db, "task_queue", task_id, row["attempts"] or 0, row["max_attempts"] or TASK_MAX_ATTEMPTS,
+            error_msg, retry=retry, worker_id=worker_id
         )
         await commit_db(db)
+    return status
+
+async def release_task(task_id: int, worker_id: str):
+    """Return a claimed task to the queue without counting the attempt (e.g. on shutdown)"""
+    await release_lease("task_queue", task_id, worker_id)
 
-async def retry_stuck_tasks(timeout_minutes: int = 15):
-    """Reset tasks stuck in 'processing' state for too long."""
-    # Logic to be implemented if needed for robustness
-    pass
+async def retry_stuck_tasks(timeout_minutes: Optional[int] = None) -> int:
+    """
+    Reaper: requeue (or dead-letter) 'processing' tasks whose lease expired,
+    i.e. their worker crashed or hung. Rows claimed before leases existed
+    fall back to processed_at older than timeout_minutes.
+    Returns the number of tasks reaped.
+    """
+    timeout = timedelta(minutes=timeout_minutes) if timeout_minutes else timedelta(seconds=TASK_VISIBILITY_TIMEOUT_SECONDS)
+    reaped = await reap_expired_leases("task_queue", TASK_MAX_ATTEMPTS, stale_before=datetime.utcnow() - timeout)
+    if reaped:
+        notify_task_available()
+    return reaped
+
+async def get_queue_metrics() -> Dict[str, Any]:
+    """
+    Queue depth and latency per task_type: pending/processing/dead counts,
+    age of the oldest pending task (queue latency) and of the longest-running
+    processing task.
+    """
+    now = datetime.utcnow()
+    async with get_db(readonly=True) as db:
+        rows = await fetch_all(db, f"""
+            SELECT task_type, status, COUNT(*) AS count,
+                   MIN(created_at) AS oldest_created_at, MIN(processed_at) AS oldest_processed_at
+            FROM task_queue
+            WHERE status IN ('pending', 'processing', '{TASK_STATUS_DEAD}')
+            GROUP BY task_type, status
+        """)
+    
+    def age(value) -> Optional[float]:
+        parsed = parse_timestamp(value)
+        return round(max(0.0, (now - parsed).total_seconds()), 1) if parsed else None
+    
+    task_types: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        entry = task_types.setdefault(row["task_type"], {
+            "pending": 0,
+            "processing": 0,
+            TASK_STATUS_DEAD: 0,
+            "oldest_pending_age_seconds": None,
+            "oldest_processing_age_seconds": None,
+        })
+        entry[row["status"]] = row["count"]
+        if row["status"] == "pending":
+            entry["oldest_pending_age_seconds"] = age(row["oldest_created_at"])
+        elif row["status"] == "processing":
+            entry["oldest_processing_age_seconds"] = age(row["oldest_processed_at"])
+    
+    totals = {
+        status: sum(entry[status] for entry in task_types.values())
+        for status in ("pending", "processing", TASK_STATUS_DEAD)
+    }
+    return {"task_types": task_types, "totals": totals, "timestamp": now.isoformat()}
@@ -27,6 +27,7 @@ from models import (
     search_messages,
     update_inbox_status,
     update_inbox_analysis,
+    update_inbox_draft,
     create_outbox_message,
     approve_outbox_message,
     get_pending_outbox,
@@ -43,8 +44,9 @@ from services import (
     TelegramService,
     TelegramPhoneService,
 )
-from agent import process_message
+from agent import process_message, stream_draft
 from dependencies import get_license_from_header
+from services.sse import sse_response
 
 router = APIRouter(prefix="/api/integrations", tags=["Chat"])
 
@@ -256,6 +258,40 @@ async def approve_chat_message(
         background_tasks.add_task(send_approved_message, outbox_id, license["license_id"])
         return {"success": True, "message": "تم إرسال الرد"}
 
+@router.post("/inbox/{message_id}/draft/stream")
+async def stream_inbox_draft(
+    message_id: int,
+    license: dict = Depends(get_license_from_header)
+):
+    """Regenerate the AI draft of a message, streamed as server-sent events, and save it"""
+    from models.inbox import get_inbox_message_by_id, get_chat_history_for_llm
+    from models import get_preferences
+    message = await get_inbox_message_by_id(message_id, license["license_id"])
+    if not message:
+        raise HTTPException(status_code=404, detail="الرسالة غير موجودة")
+
+    history = ""
+    if message.get("sender_contact"):
+        history = await get_chat_history_for_llm(
+            license_id=license["license_id"],
+            sender_contact=message["sender_contact"],
+            limit=10,
+        )
+    preferences = await get_preferences(license["license_id"])
+
+    async def save_draft(draft: str):
+        await update_inbox_draft(message_id, license["license_id"], draft)
+
+    return sse_response(
+        stream_draft(
+            message=message.get("body") or "",
+            history=history,
+            sender_name=message.get("sender_name"),
+            preferences=preferences,
+        ),
+        on_complete=save_draft
+    )
+
 @router.post("/inbox/cleanup")
 async def cleanup_inbox_status_route(license: dict = Depends(get_license_from_header)):
     from models.inbox import fix_stale_inbox_status
@@ -493,13 +529,13 @@ async def send_approved_message(outbox_id: int, license_id: int):
 
                 elif channel == "telegram_bot":
                     from db_helper import get_db, fetch_one
-                    async with get_db() as db:
+                    async with get_db(readonly=True) as db:
                         row = await fetch_one(db, "SELECT bot_token FROM telegram_configs WHERE license_key_id = ?", [license_id])
-                        if row:
-                            ts = TelegramService(row["bot_token"])
-                            res = await ts.send_message(chat_id=message["recipient_id"], text=body)
-                            sent_anything = True
-                            if res: last_platform_id = str(res.get("message_id"))
+                    if row:
+                        ts = TelegramService(row["bot_token"])
+                        res = await ts.send_message(chat_id=message["recipient_id"], text=body)
+                        sent_anything = True
+                        if res: last_platform_id = str(res.get("message_id"))
 
                 elif channel == "telegram":
                     session = await get_telegram_phone_session_data(license_id)
@@ -591,27 +627,27 @@ async def send_approved_message(outbox_id: int, license_id: int):
                                         last_platform_id = res.get("message_id")
 
                         elif channel == "telegram_bot":
-                             from db_helper import get_db, fetch_one
-                             async with get_db() as db:
+                            from db_helper import get_db, fetch_one
+                            async with get_db(readonly=True) as db:
                                 row = await fetch_one(db, "SELECT bot_token FROM telegram_configs WHERE license_key_id = ?", [license_id])
-                                if row:
-                                    ts = TelegramService(row["bot_token"])
-                                    res = None
-                                    if mime_type.startswith("image/"):
-                                        res = await ts.send_photo(chat_id=message["recipient_id"], photo_path=tmp_path)
-                                    elif mime_type.startswith("video/"):
-                                        res = await ts.send_video(chat_id=message["recipient_id"], video_path=tmp_path)
-                                    elif mime_type.startswith("audio/"):
-                                        if is_voice_note:
-                                            res = await ts.send_voice(chat_id=message["recipient_id"], audio_path=tmp_path)
-                                        else:
-                                            res = await ts.send_audio(chat_id=message["recipient_id"], audio_path=tmp_path)
+                            if row:
+                                ts = TelegramService(row["bot_token"])
+                                res = None
+                                if mime_type.startswith("image/"):
+                                    res = await ts.send_photo(chat_id=message["recipient_id"], photo_path=tmp_path)
+                                elif mime_type.startswith("video/"):
+                                    res = await ts.send_video(chat_id=message["recipient_id"], video_path=tmp_path)
+                                elif mime_type.startswith("audio/"):
+                                    if is_voice_note:
+                                        res = await ts.send_voice(chat_id=message["recipient_id"], audio_path=tmp_path)
                                     else:
-                                        res = await ts.send_document(chat_id=message["recipient_id"], document_path=tmp_path)
-                                    
-                                    if res:
-                                        sent_anything = True
-                                        last_platform_id = str(res.get("message_id"))
+                                        res = await ts.send_audio(chat_id=message["recipient_id"], audio_path=tmp_path)
+                                else:
+                                    res = await ts.send_document(chat_id=message["recipient_id"], document_path=tmp_path)
+                                
+                                if res:
+                                    sent_anything = True
+                                    last_platform_id = str(res.get("message_id"))
 
                         elif channel == "telegram":
                             session = await get_telegram_phone_session_data(license_id)
@@ -653,14 +689,14 @@ async def send_approved_message(outbox_id: int, license_id: int):
                 
                 elif channel == "telegram_bot":
                     from db_helper import get_db, fetch_one
-                    async with get_db() as db:
+                    async with get_db(readonly=True) as db:
                         row = await fetch_one(db, "SELECT bot_token FROM telegram_configs WHERE license_key_id = ?", [license_id])
-                        if row:
-                            ts = TelegramService(row["bot_token"])
-                            res = await ts.send_voice(chat_id=message["recipient_id"], audio_path=audio_path)
-                            if res:
-                                sent_anything = True
-                                last_platform_id = str(res.get("message_id"))
+                    if row:
+                        ts = TelegramService(row["bot_token"])
+                        res = await ts.send_voice(chat_id=message["recipient_id"], audio_path=audio_path)
+                        if res:
+                            sent_anything = True
+                            last_platform_id = str(res.get("message_id"))
 
                 elif channel == "telegram":
                     session = await get_telegram_phone_session_data(license_id)
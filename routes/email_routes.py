@@ -5,8 +5,11 @@ Gmail OAuth 2.0 configuration and message fetching
 
 import os
 import html
+import json
+import base64
+import hmac
 from datetime import datetime, timedelta
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel, Field
 
@@ -16,6 +19,7 @@ from models import (
     get_email_oauth_tokens,
     update_email_config_settings,
     save_inbox_message,
+    get_license_id_by_email_address,
 )
 from services import GmailOAuthService, GmailAPIService, EMAIL_PROVIDERS
 from dependencies import get_license_from_header
@@ -213,3 +217,32 @@ async def fetch_emails(
         return {"success": True, "message": f"تم جلب {processed} رسالة جديدة", "count": processed}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"خطأ في جلب الرسائل: {str(e)}")
+
+
+@router.post("/gmail/push")
+async def gmail_push_notification(request: Request, token: str = ""):
+    """
+    Gmail push endpoint for a Cloud Pub/Sub push subscription.
+    Configure the subscription URL with ?token=<GMAIL_PUSH_TOKEN>.
+    The notification only says the mailbox changed; the poller then pulls
+    the new messages with history.list.
+    """
+    expected = os.getenv("GMAIL_PUSH_TOKEN")
+    if not expected or not hmac.compare_digest(token, expected):
+        raise HTTPException(status_code=403, detail="Invalid push token")
+    
+    try:
+        envelope = await request.json()
+        data = base64.b64decode(envelope["message"]["data"])
+        notification = json.loads(data)
+        email_address = notification["emailAddress"]
+    except (KeyError, TypeError, ValueError):
+        # Acknowledge malformed messages so Pub/Sub doesn't redeliver them forever
+        return {"success": False}
+    
+    license_id = await get_license_id_by_email_address(email_address)
+    if license_id:
+        from workers import request_email_poll
+        request_email_poll(license_id)
+    
+    return {"success": True}
@@ -192,6 +192,11 @@ class PreferencesUpdate(BaseModel):
     custom_tone_guidelines: Optional[str] = None
     preferred_languages: Optional[Union[str, List[str]]] = None
     formality_level: Optional[str] = None
+    
+    # Message filters
+    blocked_senders: Optional[List[str]] = None
+    blocked_keywords: Optional[List[str]] = None
+    required_keywords: Optional[List[str]] = None
 
 
 # ============ Preferences Routes ============
@@ -28,7 +28,6 @@ from services.notification_service import (
     NotificationChannel,
 )
 from dependencies import get_license_from_header
-from models import create_notification
 
 load_dotenv()
 
@@ -71,113 +70,48 @@ async def broadcast_notification(
     """
     Send notification to all users or specific users.
     Admin-only endpoint for subscription reminders, team updates, and promotions.
-    Uses parallel sending for efficiency (max 10 concurrent).
+    In-app notifications are bulk-inserted and their push deliveries queued in
+    one transaction; the notification outbox worker fans them out in the
+    background. Poll GET /admin/broadcast/{broadcast_id} for progress.
     """
-    import asyncio
-    from db_helper import get_db, fetch_all
-    from database import DB_TYPE
+    from models.notification_outbox import create_broadcast
     from logging_config import get_logger
     
     logger = get_logger(__name__)
     
-    # Semaphore to limit concurrent notifications
-    MAX_CONCURRENT = 10
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
-    
-    async def send_single_notification(license_id: int) -> bool:
-        """Send notification to a single license with semaphore control."""
-        async with semaphore:
-            try:
-                await create_notification(
-                    license_id=license_id,
-                    notification_type=data.notification_type,
-                    title=data.title,
-                    message=data.message,
-                    priority=data.priority,
-                    link=data.link
-                )
-                return True
-            except Exception as e:
-                logger.warning(f"Failed to send notification to license {license_id}: {e}")
-                return False
-    
     try:
-        # Get target license IDs
-        if data.license_ids:
-            license_ids = data.license_ids
-            
-            tasks = [send_single_notification(lid) for lid in license_ids]
-            results = await asyncio.gather(*tasks)
-            sent_count = sum(results)
-            
-            return {
-                "success": True,
-                "sent_count": sent_count,
-                "total_targets": len(license_ids),
-                "message": f"تم إرسال الإشعار إلى {sent_count} مستخدم"
-            }
-        else: # target_users == "all" (implicitly, if license_ids is None)
-            # 1. Fetch all active licenses
-            # In a real large-scale system, we should stream this query
-            # from models import get_all_licenses  # Assuming this exists or we use raw SQL
-            # Fallback to a mock query if not implemented, or assume small scale for now
-            # For this implementations, lets assume we have a list of license IDs.
-            # licenses = await get_all_licenses() 
-            # TEMP: Mock list for safety if function missing, or query DB directly
-            # To be safe, we will use the topic "all_users" for FCM which is EFFICIENT
-            # But for IN-APP history, we still need to iterate.
-            
-            # A. Send FCM via Topic (Efficient)
-            try:
-                from services.fcm_mobile_service import send_fcm_topic
-                
-                # Create a NotificationPayload for FCM
-                payload = NotificationPayload(
-                    title=data.title,
-                    message=data.message,
-                    priority=NotificationPriority(data.priority), # Convert string to enum
-                    link=data.link,
-                    metadata={"notification_type": data.notification_type} # Add type to metadata
-                )
-                
-                fcm_count = await send_fcm_topic(
-                    topic="all_users",
-                    title=payload.title,
-                    body=payload.message,
-                    data=payload.metadata,
-                    image=payload.image
-                )
-            except Exception as e:
-                logger.error(f"Broadcast FCM Topic failed: {e}")
-
-            # B. Create In-App Entry for History (Batched)
-            # This is the heavy part. We simply want them to see it in "Inbox".
-            # For 10k users, this insert loop is slow.
-            # Optimization: Insert into a "broadcasts" table and let clients pull it?
-            # Or just batch insert.
-            
-            # Since we don't have a "broadcasts" table and rely on "notifications" table:
-            # We will use a Background Task to process these inserts in chunks.
-            
-            from fastapi import BackgroundTasks
-            # Note: We can't easily inject BackgroundTasks here without changing signature
-            # We will use asyncio.create_task for now, but a Queue is better.
-            
-            async def batch_create_notifications():
-                # Pseudo-code for fetching IDs
-                # all_ids = await db.fetch_all("SELECT id FROM licenses")
-                # For safety in this environment without proper DB mocking:
-                logger.info("Starting background batch insert for broadcast...")
-                # await db_batch_insert(...)
-                logger.info("Finished background batch insert.")
-
-            asyncio.create_task(batch_create_notifications())
-            
-            return {"status": "broadcast_initiated", "method": "topic+background_insert"}
-
+        result = await create_broadcast(
+            title=data.title,
+            message=data.message,
+            notification_type=data.notification_type,
+            priority=data.priority,
+            link=data.link,
+            license_ids=data.license_ids or None
+        )
     except Exception as e:
         logger.error(f"Broadcast failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "success": True,
+        "status": "broadcast_queued",
+        **result,
+        "message": f"تم إنشاء الإشعار لـ {result['notifications_created']} مستخدم وجاري إرسال التنبيهات"
+    }
+
+
+@router.get("/admin/broadcast/{broadcast_id}")
+async def broadcast_progress(
+    broadcast_id: int,
+    _: None = Depends(verify_admin)
+):
+    """Delivery progress of an admin broadcast"""
+    from models.notification_outbox import get_broadcast_progress
+    
+    progress = await get_broadcast_progress(broadcast_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    return progress
 
 
 # ============ Integration Schemas ============
@@ -11,6 +11,7 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 from database import generate_license_key, validate_license_key
+from db_helper import get_db
 from security import validate_license_key_format
 
 # Load environment variables
@@ -101,7 +102,7 @@ class SubscriptionUpdate(BaseModel):
 @router.get("/check-username/{username}")
 async def check_username_availability(username: str):
     """Check if a username exists and return user info"""
-    from db_helper import get_db, fetch_one
+    from db_helper import fetch_one
     async with get_db() as db:
         row = await fetch_one(db, "SELECT company_name FROM license_keys WHERE username = ?", [username])
         if row:
@@ -124,7 +125,7 @@ async def create_subscription(
     logger = get_logger(__name__)
     
     try:
-        from db_helper import get_db, fetch_one
+        from db_helper import fetch_one
         # Check if username is already taken
         async with get_db() as db:
             existing = await fetch_one(db, "SELECT id FROM license_keys WHERE username = ?", [subscription.username])
@@ -185,18 +186,14 @@ async def list_subscriptions(
     Admins see all, users see only their own.
     """
     import os
-    from database import DB_TYPE, DATABASE_PATH, DATABASE_URL, POSTGRES_AVAILABLE
+    from database import DB_TYPE, POSTGRES_AVAILABLE
     from datetime import datetime
     
     try:
         subscriptions = []
         
         if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-            import asyncpg
-            if not DATABASE_URL:
-                raise ValueError("DATABASE_URL is required for PostgreSQL")
-            conn = await asyncpg.connect(DATABASE_URL)
-            try:
+            async with get_db(readonly=True) as conn:
                 query = "SELECT id, company_name, contact_email, username, is_active, created_at, expires_at, max_requests_per_day, requests_today, last_request_date, is_trial, referral_code, referral_count FROM license_keys"
                 params = []
                 
@@ -222,11 +219,9 @@ async def list_subscriptions(
                         row_dict["days_remaining"] = None
                     
                     subscriptions.append(row_dict)
-            finally:
-                await conn.close()
         else:
             import aiosqlite
-            async with aiosqlite.connect(DATABASE_PATH) as db:
+            async with get_db(readonly=True) as db:
                 db.row_factory = aiosqlite.Row
                 
                 query = "SELECT id, company_name, contact_email, username, is_active, created_at, expires_at, max_requests_per_day, requests_today, last_request_date, is_trial, referral_code, referral_count FROM license_keys"
@@ -278,7 +273,7 @@ async def get_subscription(
     if not auth["is_admin"] and license_id != auth["license_id"]:
         raise HTTPException(status_code=403, detail="غير مصرح لك بالوصول إلى بيانات هذا الاشتراك")
     from database import get_license_key_by_id, DB_TYPE
-    from db_helper import get_db, fetch_one
+    from db_helper import fetch_one
     
     try:
         async with get_db() as db:
@@ -354,7 +349,7 @@ async def update_subscription(
     if not auth["is_admin"]:
         raise HTTPException(status_code=403, detail="هذا الإجراء متاح لمدير النظام فقط")
     from database import DB_TYPE, DATABASE_PATH, DATABASE_URL, POSTGRES_AVAILABLE
-    from db_helper import get_db, fetch_one, execute_sql, commit_db
+    from db_helper import fetch_one, execute_sql, commit_db
     from logging_config import get_logger
     
     logger = get_logger(__name__)
@@ -462,7 +457,7 @@ async def regenerate_subscription_key(
     if not auth["is_admin"]:
         raise HTTPException(status_code=403, detail="هذا الإجراء متاح لمدير النظام فقط")
     from database import DB_TYPE, hash_license_key
-    from db_helper import get_db, fetch_one, execute_sql, commit_db
+    from db_helper import fetch_one, execute_sql, commit_db
     from security import encrypt_sensitive_data
     from logging_config import get_logger
     import secrets
@@ -530,7 +525,7 @@ async def delete_subscription(
     """Delete a subscription permanently (Admin Only)"""
     if not auth["is_admin"]:
         raise HTTPException(status_code=403, detail="هذا الإجراء متاح لمدير النظام فقط")
-    from db_helper import get_db, fetch_one, execute_sql, commit_db
+    from db_helper import fetch_one, execute_sql, commit_db
     from database import DB_TYPE
     from models import delete_preferences
     from logging_config import get_logger
@@ -656,7 +651,7 @@ async def get_subscription_usage(
     if not auth["is_admin"] and license_id != auth["license_id"]:
         raise HTTPException(status_code=403, detail="غير مصرح لك بالوصول إلى إحصائيات هذا الاشتراك")
     from database import DB_TYPE
-    from db_helper import get_db, fetch_all, fetch_one
+    from db_helper import fetch_all, fetch_one
     
     try:
         async with get_db() as db:
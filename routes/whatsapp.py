@@ -15,6 +15,7 @@ from services.whatsapp_service import (
     delete_whatsapp_config,
 )
 from models import save_inbox_message, create_smart_notification
+from services.dedup_store import get_dedup_store, inbound_message_key
 from security import sanitize_phone, sanitize_string, sanitize_message
 from dependencies import get_license_from_header
 from services.file_storage_service import get_file_storage
@@ -382,6 +383,11 @@ async def receive_webhook(request: Request):
                         
                         continue  # Status processed, skip to next message
                     
+                    # Skip webhook redeliveries of messages we already stored
+                    dedup_key = inbound_message_key(license_id, "whatsapp", msg.get("message_id"))
+                    if msg.get("message_id") and await get_dedup_store("inbound").contains(dedup_key):
+                        continue
+                    
                     # Media Handling (Premium File Storage)
                     attachments = []
                     if msg.get("media_id"):
@@ -441,6 +447,8 @@ async def receive_webhook(request: Request):
                         received_at=msg.get("timestamp"),
                         attachments=attachments
                     )
+                    if inbox_id and msg.get("message_id"):
+                        await get_dedup_store("inbound").add(dedup_key)
 
 
                     # Analyze with AI (WhatsApp auto-analysis)
@@ -0,0 +1,30 @@
+import asyncio
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from db_pool import db_pool
+from migrations.contact_aliases_table import create_contact_aliases_table
+from models.inbox import backfill_contact_aliases
+
+async def main():
+    print("Initialize DB Pool...")
+    await db_pool.initialize()
+    await create_contact_aliases_table()
+
+    license_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    scope = f"license {license_id}" if license_id is not None else "all licenses"
+    print(f"Backfilling contact aliases for {scope}...")
+
+    count = await backfill_contact_aliases(license_id)
+
+    print(f"Backfill complete! Linked {count} contact/ID pairs.")
+    await db_pool.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
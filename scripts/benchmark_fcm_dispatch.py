@@ -0,0 +1,121 @@
+"""
+FCM dispatch benchmark against a local mock FCM v1 endpoint.
+
+Starts a mock `messages:send` server (uvicorn, artificial latency, a share of
+tokens answered 404 UNREGISTERED) and compares the previous sender - one
+token at a time with a fresh client per request - to send_fcm_to_tokens on
+the shared pooled client.
+
+    python scripts/benchmark_fcm_dispatch.py --tokens 500 --latency-ms 40
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import datetime
+import threading
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+
+def start_mock_fcm(latency: float, invalid_every: int) -> str:
+    import uvicorn
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+
+    app = FastAPI()
+
+    @app.post("/v1/projects/{project}/messages:send")
+    async def send(project: str, request: Request):
+        message = (await request.json())["message"]
+        await asyncio.sleep(latency)
+        if int(message["token"].rsplit("-", 1)[1]) % invalid_every == 0:
+            return JSONResponse({"error": {"status": "NOT_FOUND", "message": "UNREGISTERED"}}, status_code=404)
+        return {"name": f"projects/{project}/messages/{message['token']}"}
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+async def legacy_send_all(fcm, rows):
+    """Pre-dispatcher behaviour: sequential sends, new client per request"""
+    sent = 0
+    invalid = []
+    for row in rows:
+        payload = fcm._build_v1_payload(row["token"], "title", "body", {"type": "benchmark"})
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                f"{fcm.FCM_API_BASE}/v1/projects/{fcm.FCM_PROJECT_ID}/messages:send",
+                json=payload,
+                headers={"Authorization": f"Bearer {fcm._cached_access_token}"},
+                timeout=10.0,
+            )
+        if response.status_code == 200:
+            sent += 1
+        elif response.status_code == 404:
+            invalid.append(row["id"])
+    return sent, invalid
+
+
+async def run(args):
+    import services.fcm_mobile_service as fcm
+
+    rows = [{"id": n, "token": f"token-{n}", "platform": "android"} for n in range(args.tokens)]
+    results = []
+    for name, send_all in (
+        ("before (sequential, client per send)", lambda: legacy_send_all(fcm, rows)),
+        (f"shared client, {fcm.FCM_SEND_CONCURRENCY} concurrent", lambda: fcm.send_fcm_to_tokens(rows, "title", "body", {"type": "benchmark"})),
+    ):
+        started = time.perf_counter()
+        sent, invalid = await send_all()
+        results.append((name, time.perf_counter() - started, sent, len(invalid)))
+    await fcm.close_http_client()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="mock FCM response time")
+    parser.add_argument("--invalid-every", type=int, default=10, help="every Nth token is UNREGISTERED")
+    parser.add_argument("--concurrency", type=int, default=None, help="override FCM_SEND_CONCURRENCY")
+    args = parser.parse_args()
+
+    base = start_mock_fcm(args.latency_ms / 1000, args.invalid_every)
+
+    import services.fcm_mobile_service as fcm
+    fcm.FCM_API_BASE = base
+    fcm.FCM_V1_AVAILABLE = True
+    fcm.FCM_PROJECT_ID = "benchmark"
+    # Pre-seeded token: the benchmark measures dispatch, not OAuth
+    fcm._cached_access_token = "benchmark-token"
+    fcm._token_expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    if args.concurrency:
+        fcm.FCM_SEND_CONCURRENCY = args.concurrency
+
+    results = asyncio.run(run(args))
+
+    print(f"{args.tokens} tokens, {args.latency_ms:.0f} ms mock latency, "
+          f"HTTP/2 {'on' if fcm.HTTP2_AVAILABLE else 'off (h2 not installed)'}")
+    baseline = results[0][1]
+    for name, elapsed, sent, invalid in results:
+        print(f"{name:<40} {elapsed:>7.2f}s  {args.tokens / elapsed:>8,.0f} sends/s  "
+              f"sent={sent} invalid={invalid}  ({baseline / elapsed:.1f}x)")
+    if len({(sent, invalid) for _, _, sent, invalid in results}) != 1:
+        sys.exit("senders disagree on outcomes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import os
+import re
+import sys
+import time
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import message_filters
+from message_filters import (
+    AutomatedMessageMatcher, AUTOMATED_SENDER_PATTERNS, OTP_PATTERNS,
+    KEYWORD_CATEGORIES, SERVICE_NOREPLY_PATTERNS,
+)
+
+SAMPLE_MESSAGES = [
+    {"body": "مرحبا، أريد الاستفسار عن أسعار المنتجات لديكم", "sender_contact": "+963912345678", "sender_name": "أحمد"},
+    {"body": "Hi, can you send me the catalogue and delivery times to Damascus?", "sender_contact": "customer@gmail.com", "sender_name": "Sara"},
+    {"body": "Your verification code is 482913", "sender_contact": "+15550001", "sender_name": "Service"},
+    {"body": "عرض خاص لفترة محدودة! خصم 50% على جميع المنتجات", "sender_contact": "+963900000000", "sender_name": "متجر"},
+    {"body": "Your order has been shipped. Tracking number: 1Z999", "sender_contact": "orders@shop.example", "sender_name": "Shop", "subject": "Shipping update"},
+    {"body": "Weekly digest: top stories from your network", "sender_contact": "digest@news.example", "sender_name": "News"},
+    {"body": "هل يمكنني تعديل الطلب قبل الشحن؟ شكراً لكم", "sender_contact": "@khaled", "sender_name": "خالد"},
+    {"body": "Build failed on main: pipeline failed at step test", "sender_contact": "ci@example.org", "sender_name": "CI"},
+    {"body": "Bonus offer for everyone in the group, claim your gift", "sender_contact": "@promo_user", "sender_name": "Promo", "is_group": True},
+    {"body": "I need help with my account, the app keeps closing", "sender_contact": "user@outlook.com", "sender_name": "Omar"},
+]
+
+
+def legacy_filter_automated_messages(message):
+    """Pre-matcher behaviour: one re.search per pattern and one substring scan per keyword"""
+    body = message.get("body", "").lower()
+    sender_contact = (message.get("sender_contact") or "").lower()
+    full_text = f"{body} {(message.get('subject') or '').lower()} {(message.get('sender_name') or '').lower()}"
+    for pattern in list(AUTOMATED_SENDER_PATTERNS):
+        if re.search(pattern, sender_contact):
+            return False, "Automated: Sender pattern detected"
+    if any(re.search(p, full_text) for p in list(OTP_PATTERNS)):
+        return False, "Automated: OTP/Verification"
+    is_private = not (message.get("is_group", False) or message.get("is_channel", False))
+    for reason, keywords, blocks_private in KEYWORD_CATEGORIES:
+        if (blocks_private or not is_private) and any(k in full_text for k in list(keywords)):
+            return False, reason
+    for pattern in list(SERVICE_NOREPLY_PATTERNS):
+        if re.search(pattern, sender_contact):
+            return False, "Automated: Service Provider"
+    return True, None
+
+
+def throughput(func, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for message in SAMPLE_MESSAGES:
+            func(message)
+    elapsed = time.perf_counter() - started
+    return rounds * len(SAMPLE_MESSAGES) / elapsed
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    scan = AutomatedMessageMatcher(use_automaton=False)
+    candidates = [
+        ("before (per-pattern search + substring scans)", legacy_filter_automated_messages),
+        ("combined regexes + substring scans", lambda m: scan.match(m)),
+    ]
+    if message_filters.AHOCORASICK_AVAILABLE:
+        automaton = AutomatedMessageMatcher(use_automaton=True)
+        candidates.append(("combined regexes + Aho-Corasick", lambda m: automaton.match(m)))
+    else:
+        print("pyahocorasick not installed; skipping the automaton run")
+
+    # Same reasons from every implementation
+    for message in SAMPLE_MESSAGES:
+        expected = legacy_filter_automated_messages(message)[1]
+        for name, func in candidates[1:]:
+            assert func(message) == expected, f"{name} disagrees on {message['body']!r}"
+
+    print(f"{len(SAMPLE_MESSAGES) * rounds} messages per run")
+    baseline = None
+    for name, func in candidates:
+        rate = throughput(func, rounds)
+        baseline = baseline or rate
+        print(f"{name:<50} {rate:>12,.0f} msg/s  ({rate / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
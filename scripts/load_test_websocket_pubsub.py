@@ -0,0 +1,171 @@
+"""
+WebSocket fan-out load test across several worker processes.
+
+Each worker process runs its own ConnectionManager with thousands of
+simulated sockets spread over many licenses, all sharing one Redis
+(REDIS_URL, or an in-process fakeredis TCP server when unset). The parent
+publishes through Redis and every worker reports delivered frames and
+end-to-end latency.
+
+    python scripts/load_test_websocket_pubsub.py --workers 4 --connections 2500 --messages 2000
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import multiprocessing
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SimulatedSocket:
+    """Stands in for a client WebSocket; records per-frame latency"""
+
+    def __init__(self, latencies: list):
+        self.latencies = latencies
+
+    async def accept(self):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+    async def send_text(self, frame: str):
+        sent_at = json.loads(frame)["data"]["sent_at"]
+        self.latencies.append(time.time() - sent_at)
+
+
+def sockets_per_license(connections: int, licenses: int) -> list:
+    return [len(range(license_id, connections, licenses)) for license_id in range(licenses)]
+
+
+async def run_worker(index, redis_url, args, ready, results):
+    import redis.asyncio as aioredis
+    from services.websocket_manager import ConnectionManager, RedisPubSubManager
+
+    manager = ConnectionManager()
+    manager._pubsub = RedisPubSubManager(redis_client=aioredis.from_url(redis_url), encoding=args.encoding)
+    await manager._pubsub.initialize()
+    manager._pubsub_initialized = True
+
+    latencies = []
+    for n in range(args.connections):
+        await manager.connect(SimulatedSocket(latencies), license_id=n % args.licenses)
+
+    per_license = sockets_per_license(args.connections, args.licenses)
+    expected = sum(per_license[n % args.licenses] for n in range(args.messages))
+
+    await asyncio.sleep(0.5)  # let the pattern subscription settle
+    ready.put(index)
+
+    deadline = time.monotonic() + args.timeout
+    while len(latencies) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    results.put({
+        "worker": index,
+        "expected": expected,
+        "delivered": len(latencies),
+        "latencies": latencies,
+        "stats": {key: value for key, value in manager.get_stats().items() if key != "sockets"},
+    })
+    await manager.close()
+
+
+def worker_main(index, redis_url, args, ready, results):
+    asyncio.run(run_worker(index, redis_url, args, ready, results))
+
+
+async def publish(redis_url, args):
+    import redis.asyncio as aioredis
+    from services.websocket_manager import ConnectionManager, RedisPubSubManager, WebSocketMessage
+
+    manager = ConnectionManager()
+    manager._pubsub = RedisPubSubManager(redis_client=aioredis.from_url(redis_url), encoding=args.encoding)
+    await manager._pubsub.initialize()
+    manager._pubsub_initialized = True
+
+    started = time.perf_counter()
+    for start in range(0, args.messages, args.burst):
+        await asyncio.gather(*(
+            manager.send_to_license(n % args.licenses, WebSocketMessage(
+                event="new_message", data={"id": n, "sent_at": time.time()}
+            ))
+            for n in range(start, min(start + args.burst, args.messages))
+        ))
+    elapsed = time.perf_counter() - started
+    stats = dict(manager._pubsub.stats)
+    await manager._pubsub.close()
+    return elapsed, stats
+
+
+def start_fake_redis() -> str:
+    from fakeredis import TcpFakeServer
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--connections", type=int, default=2500, help="simulated sockets per worker")
+    parser.add_argument("--licenses", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--burst", type=int, default=100, help="concurrent publishes per batch")
+    parser.add_argument("--encoding", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    redis_url = os.getenv("REDIS_URL") or start_fake_redis()
+    context = multiprocessing.get_context("spawn")
+    ready, results = context.Queue(), context.Queue()
+    processes = [
+        context.Process(target=worker_main, args=(index, redis_url, args, ready, results))
+        for index in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get(timeout=args.timeout)
+
+    elapsed, publish_stats = asyncio.run(publish(redis_url, args))
+    reports = [results.get(timeout=args.timeout * 2) for _ in processes]
+    for process in processes:
+        process.join()
+
+    delivered = sum(report["delivered"] for report in reports)
+    expected = sum(report["expected"] for report in reports)
+    latencies = [value for report in reports for value in report["latencies"]]
+    print(f"{args.workers} workers x {args.connections} sockets, {args.licenses} licenses, {args.encoding} payloads")
+    print(f"published {args.messages} messages in {elapsed:.2f}s "
+          f"({args.messages / elapsed:,.0f}/s, {publish_stats['publish_batches']} pipeline batches)")
+    print(f"delivered {delivered:,}/{expected:,} frames "
+          f"(p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms)")
+    for report in sorted(reports, key=lambda r: r["worker"]):
+        stats = report["stats"]
+        print(f"  worker {report['worker']}: {report['delivered']:,}/{report['expected']:,} "
+              f"dropped={stats['dropped_frames']} slow_closes={stats['slow_consumer_closes']} "
+              f"avg_send={stats['avg_send_ms']}ms")
+    sys.exit(0 if delivered == expected else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import asyncio
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from db_pool import db_pool
+from models.inbox import reconcile_conversation_states
+
+async def main():
+    print("Initialize DB Pool...")
+    await db_pool.initialize()
+
+    license_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    scope = f"license {license_id}" if license_id is not None else "all licenses"
+    print(f"Reconciling conversation state for {scope}...")
+
+    result = await reconcile_conversation_states(license_id)
+
+    print(f"Reconcile complete! Checked {result['checked']}, repaired {result['repaired']} conversations.")
+    await db_pool.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
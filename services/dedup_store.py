@@ -0,0 +1,240 @@
+"""
+Al-Mudeer - Message Deduplication Store
+Recently-seen message keys shared by the poller, Telegram listener and WhatsApp webhook
+"""
+
+import os
+import time
+import math
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+DEDUP_MAX_SIZE = int(os.getenv("DEDUP_MAX_SIZE", "10000"))
+DEDUP_TTL_SECONDS = int(os.getenv("DEDUP_TTL_SECONDS", "86400"))
+# auto (Redis when cache.CacheManager has it, else memory), memory, redis, bloom
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "auto").lower()
+DEDUP_BLOOM_ERROR_RATE = float(os.getenv("DEDUP_BLOOM_ERROR_RATE", "0.001"))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter (no deletes; false positives at ~error_rate)"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self.created_at = time.monotonic()
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DedupStore:
+    """
+    Insertion-ordered LRU of recently seen keys with a TTL.
+
+    Entries are kept in expiry order (a hit refreshes the TTL and moves the
+    key to the end), so expiry and eviction both pop from the front in O(1).
+    Backends extend the horizon beyond the in-process LRU:
+      - "redis": SET NX EX on the cache.CacheManager Redis, shared by all workers
+      - "bloom": keys evicted from the LRU spill into two rotating Bloom filters
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        max_size: int = DEDUP_MAX_SIZE,
+        ttl_seconds: int = DEDUP_TTL_SECONDS,
+        backend: str = DEDUP_BACKEND,
+        redis_client: Optional[Any] = None
+    ):
+        self.namespace = namespace
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+
+        self._redis = None
+        if backend in ("auto", "redis"):
+            if redis_client is None:
+                from cache import cache
+                redis_client = cache.redis_client if cache.use_redis else None
+            self._redis = redis_client
+            if backend == "redis" and self._redis is None:
+                logger.warning(f"Dedup store '{namespace}': Redis unavailable, using memory only")
+        self.backend = "redis" if self._redis is not None else ("bloom" if backend == "bloom" else "memory")
+
+        # Current and previous generation; a generation covers up to max_size
+        # evicted keys or one TTL, so a key is remembered for at least that long
+        self._blooms = [BloomFilter(max_size, DEDUP_BLOOM_ERROR_RATE)] if self.backend == "bloom" else []
+
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "local_hits": 0,
+            "backend_hits": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "backend_errors": 0,
+        }
+
+    def _redis_key(self, key: str) -> str:
+        return f"dedup:{self.namespace}:{key}"
+
+    def _expire(self, now: float):
+        """Drop expired entries from the front (oldest expiry first)"""
+        while self._entries:
+            key, expires_at = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            self._entries.popitem(last=False)
+            self.stats["expirations"] += 1
+
+    def _remember(self, key: str, now: float):
+        """Insert/refresh key locally, evicting the least recently seen"""
+        self._entries[key] = now + self.ttl_seconds
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            evicted, _ = self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+            if self._blooms:
+                self._bloom_add(evicted, now)
+
+    def _bloom_add(self, key: str, now: float):
+        current = self._blooms[-1]
+        if current.count >= self.max_size or now - current.created_at >= self.ttl_seconds:
+            current = BloomFilter(self.max_size, DEDUP_BLOOM_ERROR_RATE)
+            self._blooms = [self._blooms[-1], current]
+        current.add(key)
+
+    def _local_hit(self, key: str, now: float) -> bool:
+        self._expire(now)
+        if key in self._entries:
+            self._remember(key, now)
+            self.stats["local_hits"] += 1
+            return True
+        if any(key in bloom for bloom in self._blooms):
+            self.stats["backend_hits"] += 1
+            return True
+        return False
+
+    async def seen(self, key: str) -> bool:
+        """
+        Check-and-record: True if key was already seen within the TTL,
+        otherwise record it and return False. Atomic across workers with Redis.
+        """
+        now = time.monotonic()
+        if self._local_hit(key, now):
+            self.stats["hits"] += 1
+            return True
+
+        if self._redis is not None:
+            try:
+                created = await asyncio.to_thread(
+                    self._redis.set, self._redis_key(key), "1", nx=True, ex=self.ttl_seconds
+                )
+                if not created:
+                    self._remember(key, time.monotonic())
+                    self.stats["backend_hits"] += 1
+                    self.stats["hits"] += 1
+                    return True
+            except Exception as e:
+                self.stats["backend_errors"] += 1
+                logger.debug(f"Dedup store '{self.namespace}' Redis error: {e}")
+
+        self._remember(key, time.monotonic())
+        self.stats["misses"] += 1
+        return False
+
+    async def contains(self, key: str) -> bool:
+        """True if key was seen within the TTL (does not record it)"""
+        now = time.monotonic()
+        if self._local_hit(key, now):
+            self.stats["hits"] += 1
+            return True
+        if self._redis is not None:
+            try:
+                if await asyncio.to_thread(self._redis.exists, self._redis_key(key)):
+                    self._remember(key, time.monotonic())
+                    self.stats["backend_hits"] += 1
+                    self.stats["hits"] += 1
+                    return True
+            except Exception as e:
+                self.stats["backend_errors"] += 1
+                logger.debug(f"Dedup store '{self.namespace}' Redis error: {e}")
+        self.stats["misses"] += 1
+        return False
+
+    async def add(self, key: str):
+        """Record key as seen"""
+        self._remember(key, time.monotonic())
+        if self._redis is not None:
+            try:
+                await asyncio.to_thread(self._redis.set, self._redis_key(key), "1", ex=self.ttl_seconds)
+            except Exception as e:
+                self.stats["backend_errors"] += 1
+                logger.debug(f"Dedup store '{self.namespace}' Redis error: {e}")
+
+    async def discard(self, key: str):
+        """Forget key (e.g. when processing a claimed message failed)"""
+        self._entries.pop(key, None)
+        if self._redis is not None:
+            try:
+                await asyncio.to_thread(self._redis.delete, self._redis_key(key))
+            except Exception as e:
+                self.stats["backend_errors"] += 1
+                logger.debug(f"Dedup store '{self.namespace}' Redis error: {e}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, hit rate and current size"""
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["size"] = len(self._entries)
+        stats["max_size"] = self.max_size
+        stats["backend"] = self.backend
+        return stats
+
+
+# Per-namespace stores shared within the process
+_stores: Dict[str, DedupStore] = {}
+
+
+def get_dedup_store(namespace: str, **kwargs) -> DedupStore:
+    """Get (or create) the shared store for a namespace"""
+    store = _stores.get(namespace)
+    if store is None:
+        store = _stores[namespace] = DedupStore(namespace, **kwargs)
+    return store
+
+
+def inbound_message_key(license_id: int, channel: str, channel_message_id: Any) -> str:
+    """Key for an incoming platform message, identical across poller/listener/webhook"""
+    return f"{channel}:{license_id}:{channel_message_id}"
+
+
+def get_dedup_stats() -> Dict[str, Any]:
+    """Stats for every dedup store in this process (for health checks)"""
+    return {namespace: store.get_stats() for namespace, store in _stores.items()}
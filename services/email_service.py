@@ -10,16 +10,181 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.header import decode_header
 from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 import asyncio
+import base64
+import quopri
 import re
+import select
 import socket
+import ssl
 import errno
 import os
+import threading
 from email.mime.base import MIMEBase
 from email import encoders
 
 
+# Header fields downloaded for every new message; bodies and attachments are
+# fetched separately (text part only) or on demand (fetch_attachment)
+IMAP_HEADER_FIELDS = "SUBJECT FROM DATE MESSAGE-ID"
+IMAP_SUMMARY_ITEMS = f"(UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({IMAP_HEADER_FIELDS})])"
+
+_IMAP_TOKEN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+_IMAP_SECTION_LITERAL = re.compile(rb'BODY\[([^\]]*)\](?:<\d+>)?\s*\{(\d+)\}$')
+_IMAP_LITERAL = re.compile(rb'\{(\d+)\}$')
+_IMAP_FETCH_START = re.compile(rb'^\d+ \(')
+
+# Kept-alive IMAP connections, one per mailbox and purpose (server, port, address, folder, purpose)
+_imap_connections: Dict[tuple, imaplib.IMAP4] = {}
+_imap_locks: Dict[tuple, threading.Lock] = {}
+_imap_registry_lock = threading.Lock()
+
+
+def _imap_lock(key: tuple) -> threading.Lock:
+    with _imap_registry_lock:
+        return _imap_locks.setdefault(key, threading.Lock())
+
+
+def close_imap_connections():
+    """Log out of every kept-alive IMAP connection (call on shutdown)"""
+    with _imap_registry_lock:
+        connections = list(_imap_connections.values())
+        _imap_connections.clear()
+    for mail in connections:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+
+def _uid_set(uids: List[int]) -> str:
+    """Compress sorted UIDs into an IMAP sequence set ("1:3,7,9:10")"""
+    ranges = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+def _parse_imap_list(data: bytes) -> list:
+    """Parse IMAP parenthesized data into nested lists (NIL -> None, strings -> bytes)"""
+    root: list = []
+    stack = [root]
+    for token in _IMAP_TOKEN.findall(data):
+        if token == b"(":
+            child: list = []
+            stack[-1].append(child)
+            stack.append(child)
+        elif token == b")":
+            if len(stack) > 1:
+                stack.pop()
+        elif token.startswith(b'"'):
+            stack[-1].append(re.sub(rb'\\(.)', rb'\1', token[1:-1]))
+        elif token.upper() == b"NIL":
+            stack[-1].append(None)
+        else:
+            stack[-1].append(token)
+    return root
+
+
+def _split_fetch_response(data: list) -> List[Tuple[Dict[str, Any], Dict[str, bytes]]]:
+    """
+    Split an imaplib FETCH response into (items, sections) per message.
+
+    BODY[...] literals are returned in sections keyed by section name; any
+    other literal (e.g. a non-ASCII filename in BODYSTRUCTURE) is inlined
+    as a quoted string before parsing the remaining items.
+    """
+    messages = []
+    meta = b""
+    sections: Dict[str, bytes] = {}
+
+    def _flush():
+        if meta:
+            parsed = _parse_imap_list(meta)
+            fields = parsed[1] if len(parsed) > 1 and isinstance(parsed[1], list) else []
+            items = {}
+            for i in range(0, len(fields) - 1, 2):
+                if isinstance(fields[i], bytes):
+                    items[fields[i].decode("ascii", "replace").upper()] = fields[i + 1]
+            messages.append((items, sections))
+
+    for item in data:
+        if item is None:
+            continue
+        pre, literal = item if isinstance(item, tuple) else (item, None)
+        if _IMAP_FETCH_START.match(pre):
+            _flush()
+            meta, sections = b"", {}
+        if literal is not None:
+            section = _IMAP_SECTION_LITERAL.search(pre)
+            if section:
+                sections[section.group(1).decode("ascii", "replace").upper()] = literal
+                pre = pre[:section.start()]
+            else:
+                escaped = literal.replace(b"\\", b"\\\\").replace(b'"', b'\\"')
+                pre = _IMAP_LITERAL.sub(b"", pre) + b'"' + escaped + b'"'
+        meta += pre + b" "
+    _flush()
+    return messages
+
+
+def _structure_parts(node: list, section: str = "") -> List[Tuple[str, list]]:
+    """Flatten a BODYSTRUCTURE into (section number, leaf part) pairs"""
+    if node and isinstance(node[0], list):
+        parts = []
+        index = 1
+        for child in node:
+            if not isinstance(child, list):
+                break
+            parts.extend(_structure_parts(child, f"{section}.{index}" if section else str(index)))
+            index += 1
+        return parts
+    return [(section or "1", node)]
+
+
+def _pairs(value) -> Dict[str, str]:
+    """IMAP ("key" "value" ...) parameter list -> dict with lowercase keys"""
+    if not isinstance(value, list):
+        return {}
+    result = {}
+    for i in range(0, len(value) - 1, 2):
+        if isinstance(value[i], bytes) and isinstance(value[i + 1], bytes):
+            result[value[i].decode("ascii", "replace").lower()] = value[i + 1].decode("utf-8", "replace")
+    return result
+
+
+def _has_buffered_data(mail: imaplib.IMAP4) -> bool:
+    """True if a server line is already buffered (select() on the socket would miss it)"""
+    sock = mail.socket()
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        return True
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError, OSError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def _decode_transfer(data: bytes, encoding: str) -> bytes:
+    """Undo a part's Content-Transfer-Encoding"""
+    encoding = (encoding or "").lower()
+    try:
+        if encoding == "base64":
+            return base64.b64decode(data)
+        if encoding == "quoted-printable":
+            return quopri.decodestring(data)
+    except Exception:
+        pass
+    return data
+
+
 class EmailService:
     """Service for fetching and sending emails"""
     
@@ -30,7 +195,9 @@ class EmailService:
         imap_server: str,
         smtp_server: str,
         imap_port: int = 993,
-        smtp_port: int = 587
+        smtp_port: int = 587,
+        imap_ssl: bool = True,
+        keep_alive: bool = False
     ):
         self.email_address = email_address
         self.password = password
@@ -38,6 +205,9 @@ class EmailService:
         self.smtp_server = smtp_server
         self.imap_port = imap_port
         self.smtp_port = smtp_port
+        self.imap_ssl = imap_ssl
+        # Reuse one logged-in IMAP connection per mailbox across polls
+        self.keep_alive = keep_alive
     
     def _format_error_message(self, error: Exception, protocol: str) -> str:
         """Format error messages to be more user-friendly"""
@@ -183,84 +353,330 @@ class EmailService:
         
         return body.strip()
     
-    async def fetch_new_emails(
+    # ============ IMAP Fetching ============
+    
+    def _open_imap(self, timeout: int = 30) -> imaplib.IMAP4:
+        """Connect and log in to the IMAP server"""
+        if self.imap_ssl:
+            mail = imaplib.IMAP4_SSL(self.imap_server, self.imap_port, timeout=timeout)
+        else:
+            mail = imaplib.IMAP4(self.imap_server, self.imap_port, timeout=timeout)
+        mail.login(self.email_address, self.password)
+        return mail
+    
+    def _mailbox_key(self, folder: str, purpose: str = "fetch") -> tuple:
+        return (self.imap_server, self.imap_port, self.email_address.lower(), folder, purpose)
+    
+    def _with_mailbox(self, folder: str, action, purpose: str = "fetch"):
+        """
+        Run action(mail, uidvalidity, uidnext) against a selected mailbox.
+        
+        With keep_alive the logged-in connection is kept for the next call
+        (and re-opened once if the server dropped it); otherwise it is
+        logged out afterwards. Each purpose gets its own connection, so an
+        IDLE never holds up fetches on the same mailbox.
+        """
+        if not self.keep_alive:
+            mail = self._open_imap()
+            try:
+                return action(mail, *self._select(mail, folder))
+            finally:
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+        
+        key = self._mailbox_key(folder, purpose)
+        with _imap_lock(key):
+            for attempt in range(2):
+                mail = _imap_connections.get(key)
+                try:
+                    if mail is None:
+                        mail = self._open_imap()
+                        _imap_connections[key] = mail
+                    return action(mail, *self._select(mail, folder))
+                except (imaplib.IMAP4.abort, OSError):
+                    # Stale kept-alive connection: drop it and reconnect once
+                    _imap_connections.pop(key, None)
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
+                    if attempt:
+                        raise
+    
+    @staticmethod
+    def _select(mail: imaplib.IMAP4, folder: str) -> Tuple[Optional[int], Optional[int]]:
+        """SELECT folder and return its (UIDVALIDITY, UIDNEXT)"""
+        status, data = mail.select(folder)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"SELECT {folder} failed: {data}")
+        values = []
+        for name in ("UIDVALIDITY", "UIDNEXT"):
+            _, value = mail.response(name)
+            try:
+                values.append(int(value[-1]))
+            except (TypeError, ValueError, IndexError):
+                values.append(None)
+        return values[0], values[1]
+    
+    def _part_info(self, section: str, node: list) -> dict:
+        """Describe one BODYSTRUCTURE leaf: MIME type, encoding, size, filename"""
+        def text(index):
+            value = node[index] if len(node) > index else None
+            return value.decode("utf-8", "replace") if isinstance(value, bytes) else ""
+        
+        mime_type = f"{text(0)}/{text(1)}".lower()
+        params = _pairs(node[2] if len(node) > 2 else None)
+        # Extension data follows the type-specific fields
+        if mime_type.startswith("text/"):
+            disposition_index = 9
+        elif mime_type == "message/rfc822":
+            disposition_index = 11
+        else:
+            disposition_index = 8
+        disposition = node[disposition_index] if len(node) > disposition_index else None
+        disposition_type = ""
+        disposition_params = {}
+        if isinstance(disposition, list) and disposition and isinstance(disposition[0], bytes):
+            disposition_type = disposition[0].decode("ascii", "replace").lower()
+            disposition_params = _pairs(disposition[1] if len(disposition) > 1 else None)
+        
+        filename = disposition_params.get("filename") or params.get("name") or ""
+        encoded = disposition_params.get("filename*") or params.get("name*")
+        if not filename and encoded:
+            filename = email.utils.collapse_rfc2231_value(email.utils.decode_rfc2231(encoded))
+        
+        try:
+            size = int(text(6) or 0)
+        except ValueError:
+            size = 0
+        return {
+            "section": section,
+            "mime_type": mime_type,
+            "charset": params.get("charset") or "utf-8",
+            "encoding": text(5),
+            "size": size,
+            "filename": self._decode_header_value(filename) if filename else "",
+            "is_attachment": disposition_type == "attachment" or bool(filename),
+        }
+    
+    def _build_email(self, uid: int, header: bytes, structure) -> Tuple[dict, Optional[dict]]:
+        """Email dict from headers + BODYSTRUCTURE, and the text part to download"""
+        msg = email.message_from_bytes(header or b"")
+        subject = self._decode_header_value(msg.get("Subject", ""))
+        from_header = self._decode_header_value(msg.get("From", ""))
+        sender_name, sender_email = self._extract_email_address(from_header)
+        date_str = msg.get("Date", "")
+        try:
+            received_at = email.utils.parsedate_to_datetime(date_str)
+        except (TypeError, ValueError):
+            received_at = datetime.now()
+        
+        parts = [
+            self._part_info(section, node)
+            for section, node in _structure_parts(structure if isinstance(structure, list) else [])
+        ]
+        inline = [p for p in parts if not p["is_attachment"]]
+        body_part = next((p for p in inline if p["mime_type"] == "text/plain"), None)
+        body_part = body_part or next((p for p in inline if p["mime_type"] == "text/html"), None)
+        
+        attachments = []
+        for part in parts:
+            if not part["is_attachment"]:
+                continue
+            mime_type = part["mime_type"]
+            type_ = "document"
+            if mime_type.startswith("image/"):
+                type_ = "image"
+            elif mime_type.startswith("video/"):
+                type_ = "video"
+            elif mime_type.startswith("audio/"):
+                type_ = "audio"
+            # Not downloaded here; fetch_attachment(uid, part) retrieves it on demand
+            attachments.append({
+                "file_id": f"{uid}:{part['section']}",
+                "file_name": part["filename"] or f"part-{part['section']}",
+                "mime_type": mime_type,
+                "file_size": part["size"],
+                "type": type_,
+                "uid": uid,
+                "part": part["section"],
+            })
+        
+        return {
+            "channel_message_id": msg.get("Message-ID", ""),
+            "uid": uid,
+            "subject": subject,
+            "sender_name": sender_name or sender_email.split('@')[0],
+            "sender_contact": sender_email,
+            "body": "",
+            "received_at": received_at,
+            "raw_from": from_header,
+            "attachments": attachments,
+        }, body_part
+    
+    def _fetch_uid_range(self, mail: imaplib.IMAP4, uids: List[int]) -> List[dict]:
+        """
+        Fetch summaries for all UIDs in one UID FETCH, then only the text
+        parts (one FETCH per distinct section number).
+        """
+        status, data = mail.uid("FETCH", _uid_set(uids), IMAP_SUMMARY_ITEMS)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+        
+        emails: Dict[int, dict] = {}
+        body_parts: Dict[str, Dict[int, dict]] = {}
+        for items, sections in _split_fetch_response(data):
+            try:
+                uid = int(items.get("UID"))
+            except (TypeError, ValueError):
+                continue
+            header = next((v for k, v in sections.items() if k.startswith("HEADER")), b"")
+            try:
+                email_data, body_part = self._build_email(uid, header, items.get("BODYSTRUCTURE"))
+            except Exception as e:
+                print(f"Error parsing email UID {uid}: {e}")
+                continue
+            emails[uid] = email_data
+            if body_part:
+                body_parts.setdefault(body_part["section"], {})[uid] = body_part
+        
+        for section, by_uid in body_parts.items():
+            status, data = mail.uid("FETCH", _uid_set(list(by_uid)), f"(UID BODY.PEEK[{section}])")
+            if status != "OK":
+                continue
+            for items, sections in _split_fetch_response(data):
+                try:
+                    uid = int(items.get("UID"))
+                except (TypeError, ValueError):
+                    continue
+                part = by_uid.get(uid)
+                if part is None or section not in sections:
+                    continue
+                raw = _decode_transfer(sections[section], part["encoding"])
+                try:
+                    body = raw.decode(part["charset"], errors="replace")
+                except LookupError:
+                    body = raw.decode("utf-8", errors="replace")
+                if part["mime_type"] == "text/html":
+                    # Simple HTML to text conversion
+                    body = re.sub(r'<[^>]+>', '', body)
+                    body = re.sub(r'\s+', ' ', body)
+                emails[uid]["body"] = body.strip()
+        
+        return [emails[uid] for uid in sorted(emails)]
+    
+    async def sync_emails(
         self,
+        uidvalidity: Optional[int] = None,
+        last_uid: Optional[int] = None,
         since_hours: int = 24,
         folder: str = "INBOX",
         limit: int = 50
-    ) -> List[dict]:
-        """Fetch new emails from IMAP server"""
+    ) -> Tuple[List[dict], Optional[int], Optional[int]]:
+        """
+        Fetch emails newer than the stored UID cursor.
         
-        emails = []
+        Returns (emails, uidvalidity, last_uid); store the cursor and pass it
+        back on the next call. While the mailbox's UIDVALIDITY matches, only
+        UIDs above last_uid are fetched (oldest first, up to limit). Without a
+        cursor, or after UIDVALIDITY changed, falls back to a SINCE search.
+        """
         
-        def _fetch():
-            nonlocal emails
-            mail = None
-            try:
-                # Connect to IMAP with timeout
-                mail = imaplib.IMAP4_SSL(self.imap_server, self.imap_port, timeout=30)
-                mail.login(self.email_address, self.password)
-                mail.select(folder)
-                
-                # Search for recent emails
+        def _sync(mail, current_validity, uidnext):
+            incremental = bool(last_uid) and uidvalidity is not None and current_validity == uidvalidity
+            if incremental:
+                _, data = mail.uid("SEARCH", None, f"UID {last_uid + 1}:*")
+            else:
                 since_date = (datetime.now() - timedelta(hours=since_hours)).strftime("%d-%b-%Y")
-                _, message_numbers = mail.search(None, f'(SINCE {since_date})')
-                
-                message_ids = message_numbers[0].split()
-                
-                # Get latest emails (limit)
-                for msg_id in message_ids[-limit:]:
-                    try:
-                        _, msg_data = mail.fetch(msg_id, "(RFC822)")
-                        email_body = msg_data[0][1]
-                        msg = email.message_from_bytes(email_body)
-                        
-                        # Extract info
-                        subject = self._decode_header_value(msg.get("Subject", ""))
-                        from_header = self._decode_header_value(msg.get("From", ""))
-                        sender_name, sender_email = self._extract_email_address(from_header)
-                        date_str = msg.get("Date", "")
-                        message_id = msg.get("Message-ID", "")
-                        body = self._get_email_body(msg)
-                        
-                        # Parse date
-                        try:
-                            received_at = email.utils.parsedate_to_datetime(date_str)
-                        except:
-                            received_at = datetime.now()
-                        
-                        emails.append({
-                            "channel_message_id": message_id,
-                            "subject": subject,
-                            "sender_name": sender_name or sender_email.split('@')[0],
-                            "sender_contact": sender_email,
-                            "body": body,
-                            "received_at": received_at,
-                            "raw_from": from_header
-                        })
-                        
-                    except Exception as e:
-                        print(f"Error parsing email {msg_id}: {e}")
-                        continue
-                
-                mail.logout()
-                mail = None
-                
+                _, data = mail.uid("SEARCH", None, f"(SINCE {since_date})")
+            found = sorted(int(uid) for uid in (data[0] or b"").split() if uid.isdigit())
+            
+            if incremental:
+                # "n:*" always matches the highest UID, even when it is below n
+                found = [uid for uid in found if uid > last_uid]
+                uids = found[:limit]
+                cursor = uids[-1] if uids else last_uid
+            else:
+                uids = found[-limit:]
+                if uidnext:
+                    cursor = uidnext - 1
+                else:
+                    cursor = found[-1] if found else None
+            
+            emails = self._fetch_uid_range(mail, uids) if uids else []
+            return emails, current_validity, cursor
+        
+        def _run():
+            try:
+                return self._with_mailbox(folder, _sync)
             except Exception as e:
-                if mail:
-                    try:
-                        mail.logout()
-                    except:
-                        pass
                 print(f"IMAP Error: {e}")
                 raise
         
         # Run in thread pool to not block async
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, _fetch)
-        
+        return await loop.run_in_executor(None, _run)
+    
+    async def fetch_new_emails(
+        self,
+        since_hours: int = 24,
+        folder: str = "INBOX",
+        limit: int = 50
+    ) -> List[dict]:
+        """Fetch new emails from IMAP server"""
+        emails, _, _ = await self.sync_emails(since_hours=since_hours, folder=folder, limit=limit)
         return emails
     
+    async def fetch_attachment(self, uid: int, part: str, folder: str = "INBOX") -> Optional[bytes]:
+        """Download one attachment listed by sync_emails() (decoded bytes)"""
+        
+        def _fetch(mail, _validity, _uidnext):
+            status, data = mail.uid("FETCH", str(uid), f"(UID BODY.PEEK[{part}] BODY.PEEK[{part}.MIME])")
+            if status != "OK":
+                return None
+            for _, sections in _split_fetch_response(data):
+                if part in sections:
+                    mime = email.message_from_bytes(sections.get(f"{part}.MIME", b""))
+                    return _decode_transfer(sections[part], mime.get("Content-Transfer-Encoding", ""))
+            return None
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, lambda: self._with_mailbox(folder, _fetch))
+    
+    async def wait_for_new_mail(self, folder: str = "INBOX", timeout: int = 29 * 60) -> bool:
+        """
+        IDLE on a dedicated kept-alive connection until the server reports
+        new mail or timeout (seconds) passes. Returns True when new mail
+        arrived; call sync_emails() afterwards. Requires keep_alive=True.
+        """
+        if not self.keep_alive:
+            raise ValueError("wait_for_new_mail requires keep_alive=True")
+        
+        def _idle(mail, _validity, _uidnext):
+            tag = mail._new_tag()
+            mail.send(tag + b" IDLE\r\n")
+            line = mail.readline()
+            if not line.startswith(b"+"):
+                raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+            
+            arrived = False
+            if _has_buffered_data(mail) or select.select([mail.socket()], [], [], timeout)[0]:
+                arrived = b"EXISTS" in mail.readline()
+            mail.send(b"DONE\r\n")
+            while True:
+                line = mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("connection closed during IDLE")
+                if line.startswith(tag):
+                    break
+                arrived = arrived or b"EXISTS" in line
+            return arrived
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, lambda: self._with_mailbox(folder, _idle, purpose="idle"))
+    
     async def send_email(
         self,
         to_email: str,
@@ -348,8 +764,7 @@ class EmailService:
             try:
                 # Test IMAP with timeout
                 try:
-                    mail = imaplib.IMAP4_SSL(self.imap_server, self.imap_port, timeout=timeout)
-                    mail.login(self.email_address, self.password)
+                    mail = self._open_imap(timeout=timeout)
                     mail.logout()
                     mail = None
                 except (imaplib.IMAP4.error, imaplib.IMAP4.abort) as e:
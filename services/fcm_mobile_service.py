@@ -10,12 +10,84 @@ Supports both:
 import os
 import json
 import time
+import asyncio
+import datetime
 import httpx
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from logging_config import get_logger
 
 logger = get_logger(__name__)
 
+# HTTP/2 is used when the optional h2 package is installed (pip install httpx[http2]);
+# FCM multiplexes concurrent sends over one connection
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Overridable so the sender can be pointed at a local mock (benchmarks/tests)
+FCM_API_BASE = os.getenv("FCM_API_BASE", "https://fcm.googleapis.com")
+# Sends in flight at once across the process
+FCM_SEND_CONCURRENCY = int(os.getenv("FCM_SEND_CONCURRENCY", "20"))
+
+# Per-token delivery outcomes
+SEND_OK = "sent"
+SEND_INVALID_TOKEN = "invalid"  # token unregistered/expired: deactivate it
+SEND_FAILED = "failed"          # transient or configuration error: keep the token
+SEND_UNAVAILABLE = "unavailable"  # this API isn't usable, try the other one
+
+
+class FCMDeliveryError(Exception):
+    """No device could be reached (transient failures only)"""
+
+
+_http_client: Optional[httpx.AsyncClient] = None
+_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_loop: Optional[asyncio.AbstractEventLoop] = None
+_send_semaphore: Optional[asyncio.Semaphore] = None
+_token_lock: Optional[asyncio.Lock] = None
+
+
+def _loop_primitives():
+    """Send cap and token-refresh lock, bound to the running event loop"""
+    global _sync_loop, _send_semaphore, _token_lock
+    loop = asyncio.get_running_loop()
+    if _sync_loop is not loop:
+        _send_semaphore = asyncio.Semaphore(FCM_SEND_CONCURRENCY)
+        _token_lock = asyncio.Lock()
+        _sync_loop = loop
+    return _send_semaphore, _token_lock
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Process-wide pooled client for FCM, so connections (and TLS sessions)
+    are reused across sends. Rebuilt if the event loop changes.
+    """
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=10.0,
+            limits=httpx.Limits(
+                max_connections=FCM_SEND_CONCURRENCY,
+                max_keepalive_connections=FCM_SEND_CONCURRENCY,
+                keepalive_expiry=60.0,
+            ),
+        )
+        _http_client_loop = loop
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared FCM HTTP client (application shutdown)"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
 # === FCM Configuration ===
 # Legacy API (deprecated - will be removed by Google)
 FCM_SERVER_KEY = os.getenv("FCM_SERVER_KEY")
@@ -28,11 +100,11 @@ GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")  #
 FCM_V1_AVAILABLE = False
 _cached_access_token = None
 _token_expiry = None
+_credentials = None
 
 try:
     from google.oauth2 import service_account
     from google.auth.transport.requests import Request
-    import datetime
     
     creds_valid = False
     if GOOGLE_APPLICATION_CREDENTIALS:
@@ -58,9 +130,30 @@ except ImportError:
     logger.info("FCM: Will use legacy API if FCM_SERVER_KEY is set")
 
 
+def _access_token_fresh() -> bool:
+    return bool(
+        _cached_access_token and _token_expiry
+        and datetime.datetime.utcnow() < _token_expiry - datetime.timedelta(minutes=5)
+    )
+
+
+async def _get_access_token_async() -> Optional[str]:
+    """
+    Cached access token without blocking the event loop: only a stale token
+    is refreshed (in a thread), and concurrent senders wait for one refresh.
+    """
+    if _access_token_fresh():
+        return _cached_access_token
+    _, token_lock = _loop_primitives()
+    async with token_lock:
+        if _access_token_fresh():
+            return _cached_access_token
+        return await asyncio.to_thread(_get_access_token)
+
+
 def _get_access_token() -> Optional[str]:
     """Get OAuth2 access token for FCM v1 API."""
-    global _cached_access_token, _token_expiry
+    global _cached_access_token, _token_expiry, _credentials
     
     if not FCM_V1_AVAILABLE:
         return None
@@ -68,18 +161,19 @@ def _get_access_token() -> Optional[str]:
     try:
         from google.oauth2 import service_account
         from google.auth.transport.requests import Request
-        import datetime
         
         # Check if cached token is still valid (with 5 min buffer)
         if _cached_access_token and _token_expiry:
             if datetime.datetime.utcnow() < _token_expiry - datetime.timedelta(minutes=5):
                 return _cached_access_token
         
-        # Get credentials - try file first, then JSON env var
-        credentials = None
+        # Get credentials - try file first, then JSON env var (loaded once)
+        credentials = _credentials
         
         # Option 1: File path
-        if GOOGLE_APPLICATION_CREDENTIALS and os.path.exists(GOOGLE_APPLICATION_CREDENTIALS):
+        if credentials is not None:
+            pass
+        elif GOOGLE_APPLICATION_CREDENTIALS and os.path.exists(GOOGLE_APPLICATION_CREDENTIALS):
             credentials = service_account.Credentials.from_service_account_file(
                 GOOGLE_APPLICATION_CREDENTIALS,
                 scopes=['https://www.googleapis.com/auth/firebase.messaging']
@@ -110,6 +204,7 @@ def _get_access_token() -> Optional[str]:
             logger.warning("FCM: No valid credentials found")
             return None
         
+        _credentials = credentials
         credentials.refresh(Request())
         
         # Log the identity we are using
@@ -359,17 +454,41 @@ async def send_fcm_notification(
         ttl_seconds: Time-to-live in seconds (default: 24 hours)
         sound: Notification sound name (default: "default")
     """
-    # Try v1 API first
+    status = await _deliver(token, title, body, data, link, badge_count, ttl_seconds, sound, image)
+    return status == SEND_OK
+
+
+async def _deliver(
+    token: str,
+    title: str,
+    body: str,
+    data: Optional[dict] = None,
+    link: Optional[str] = None,
+    badge_count: int = 1,
+    ttl_seconds: int = 86400,
+    sound: str = "default",
+    image: Optional[str] = None
+) -> str:
+    """Send to one token (v1 first, then legacy) and return a SEND_* outcome"""
+    status = SEND_UNAVAILABLE
     if FCM_V1_AVAILABLE:
-        result = await _send_fcm_v1(token, title, body, data, link, badge_count, ttl_seconds, sound, image)
-        if result is not None:  # None means v1 failed, try legacy
-            return result
+        access_token = await _get_access_token_async()
+        if access_token:
+            payload = _build_v1_payload(token, title, body, data, link, badge_count, ttl_seconds, sound, image)
+            status = await _post_fcm_v1(payload, access_token, title)
+            if status in (SEND_OK, SEND_INVALID_TOKEN):
+                return status
+    
+    if FCM_SERVER_KEY:
+        payload = _build_legacy_payload(token, title, body, data, link, badge_count, ttl_seconds, sound, image)
+        return await _post_fcm_legacy(payload, title)
     
-    # Fallback to legacy API
-    return await _send_fcm_legacy(token, title, body, data, link, badge_count, ttl_seconds, sound, image)
+    if status == SEND_UNAVAILABLE:
+        logger.warning("FCM: Neither v1 API nor legacy server key configured")
+    return status
 
 
-async def _send_fcm_v1(
+def _build_v1_payload(
     token: str,
     title: str,
     body: str,
@@ -379,109 +498,107 @@ async def _send_fcm_v1(
     ttl_seconds: int = 86400,
     sound: str = "default",
     image: Optional[str] = None
-) -> Optional[bool]:
-    """
-    Send notification via FCM HTTP v1 API.
-    Returns None if v1 API is unavailable or failed (to trigger fallback).
-    """
-    access_token = _get_access_token()
-    if not access_token:
-        return None
+) -> dict:
+    """Build the FCM HTTP v1 message for one token"""
+    message_data = data.copy() if data else {}
+    if link:
+        message_data["link"] = link
     
-    try:
-        # Build v1 API payload
-        message_data = data.copy() if data else {}
-        if link:
-            message_data["link"] = link
-        
-        if image:
-             message_data["sender_image"] = image
-        
-        # Convert all data values to strings (FCM v1 requirement)
-        message_data = {k: str(v) for k, v in message_data.items()}
-        
-        payload = {
-            "message": {
-                "token": token,
+    if image:
+         message_data["sender_image"] = image
+    
+    # Convert all data values to strings (FCM v1 requirement)
+    message_data = {k: str(v) for k, v in message_data.items()}
+    
+    return {
+        "message": {
+            "token": token,
+            "notification": {
+                "title": title,
+                "body": body
+            },
+            "android": {
+                "priority": "high",
+                "ttl": f"{ttl_seconds}s",  # TTL in string format with 's' suffix
                 "notification": {
-                    "title": title,
-                    "body": body
+                    "sound": sound,
+                    "click_action": "FLUTTER_NOTIFICATION_CLICK"
+                }
+            },
+            "apns": {
+                "headers": {
+                    "apns-expiration": str(int(time.time()) + ttl_seconds)  # Unix timestamp when notification expires
                 },
-                "android": {
-                    "priority": "high",
-                    "ttl": f"{ttl_seconds}s",  # TTL in string format with 's' suffix
-                    "notification": {
+                "payload": {
+                    "aps": {
                         "sound": sound,
-                        "click_action": "FLUTTER_NOTIFICATION_CLICK"
+                        "badge": badge_count  # Dynamic badge count
                     }
-                },
-                "apns": {
-                    "headers": {
-                        "apns-expiration": str(int(time.time()) + ttl_seconds)  # Unix timestamp when notification expires
-                    },
-                    "payload": {
-                        "aps": {
-                            "sound": sound,
-                            "badge": badge_count  # Dynamic badge count
-                        }
-                    }
-                },
-                "data": message_data
-            }
+                }
+            },
+            "data": message_data
         }
-        
-        async with httpx.AsyncClient() as client:
+    }
+
+
+async def _post_fcm_v1(payload: dict, access_token: str, title: str = "") -> str:
+    """POST one v1 message on the shared client"""
+    global _cached_access_token
+    try:
+        client = get_http_client()
+        send_semaphore, _ = _loop_primitives()
+        async with send_semaphore:
             response = await client.post(
-                f"https://fcm.googleapis.com/v1/projects/{FCM_PROJECT_ID}/messages:send",
+                f"{FCM_API_BASE}/v1/projects/{FCM_PROJECT_ID}/messages:send",
                 json=payload,
                 headers={
                     "Authorization": f"Bearer {access_token}",
                     "Content-Type": "application/json"
                 },
-                timeout=10.0
             )
+        
+        if response.status_code == 200:
+            logger.info(f"FCM v1: Notification sent: {title[:30]}...")
+            return SEND_OK
+        elif response.status_code == 404 or (
+            response.status_code == 400 and ("UNREGISTERED" in response.text or "registration token" in response.text)
+        ):
+            # Token not found/expired - mark as failed
+            logger.warning(f"FCM v1: Token not found (expired)")
+            return SEND_INVALID_TOKEN
+        elif response.status_code == 401 or response.status_code == 403:
+            # Auth error or Permission denied - clear cached token to force refresh
+            _cached_access_token = None
             
-            if response.status_code == 200:
-                logger.info(f"FCM v1: Notification sent: {title[:30]}...")
-                return True
-            elif response.status_code == 404:
-                # Token not found/expired - mark as failed
-                logger.warning(f"FCM v1: Token not found (expired)")
-                return False
-            elif response.status_code == 401 or response.status_code == 403:
-                # Auth error or Permission denied - clear cached token to force refresh
-                global _cached_access_token
-                _cached_access_token = None
-                
-                # Log detailed identity info to debug IAM issues
-                try:
-                    from google.oauth2 import service_account
-                    # Re-load creds just to inspect them
-                    creds = None
-                    if GOOGLE_APPLICATION_CREDENTIALS and GOOGLE_APPLICATION_CREDENTIALS.strip().startswith("{"):
-                        import json as json_module
-                        info = json_module.loads(GOOGLE_APPLICATION_CREDENTIALS)
-                        creds = service_account.Credentials.from_service_account_info(info)
-                    
-                    if creds and hasattr(creds, 'service_account_email'):
-                        logger.error(f"FCM v1 AUTH ERROR ({response.status_code}): Using account '{creds.service_account_email}'. This account lacks 'cloudmessaging.messages.create' permission.")
-                    else:
-                        logger.error(f"FCM v1 AUTH ERROR ({response.status_code}): Could not determine local service account email.")
-                except Exception as e:
-                    logger.error(f"FCM v1: Error debugging auth identity: {e}")
-                
-                logger.warning(f"FCM v1: Auth/Permission failed ({response.status_code}), clearing cache and falling back")
-                return None
-            else:
-                logger.error(f"FCM v1: HTTP error {response.status_code}: {response.text}")
-                return None
+            # Log detailed identity info to debug IAM issues
+            try:
+                from google.oauth2 import service_account
+                # Re-load creds just to inspect them
+                creds = None
+                if GOOGLE_APPLICATION_CREDENTIALS and GOOGLE_APPLICATION_CREDENTIALS.strip().startswith("{"):
+                    import json as json_module
+                    info = json_module.loads(GOOGLE_APPLICATION_CREDENTIALS)
+                    creds = service_account.Credentials.from_service_account_info(info)
                 
+                if creds and hasattr(creds, 'service_account_email'):
+                    logger.error(f"FCM v1 AUTH ERROR ({response.status_code}): Using account '{creds.service_account_email}'. This account lacks 'cloudmessaging.messages.create' permission.")
+                else:
+                    logger.error(f"FCM v1 AUTH ERROR ({response.status_code}): Could not determine local service account email.")
+            except Exception as e:
+                logger.error(f"FCM v1: Error debugging auth identity: {e}")
+            
+            logger.warning(f"FCM v1: Auth/Permission failed ({response.status_code}), clearing cache and falling back")
+            return SEND_FAILED
+        else:
+            logger.error(f"FCM v1: HTTP error {response.status_code}: {response.text}")
+            return SEND_FAILED
+            
     except Exception as e:
         logger.error(f"FCM v1: Error sending notification: {e}")
-        return None
+        return SEND_FAILED
 
 
-async def _send_fcm_legacy(
+async def _send_fcm_v1(
     token: str,
     title: str,
     body: str,
@@ -491,59 +608,197 @@ async def _send_fcm_legacy(
     ttl_seconds: int = 86400,
     sound: str = "default",
     image: Optional[str] = None
-) -> bool:
+) -> Optional[bool]:
     """
-    Send notification via legacy FCM HTTP API (deprecated).
+    Send notification via FCM HTTP v1 API.
+    Returns None if v1 API is unavailable or failed (to trigger fallback).
     """
-    if not FCM_SERVER_KEY:
-        logger.warning("FCM: Neither v1 API nor legacy server key configured")
+    access_token = await _get_access_token_async()
+    if not access_token:
+        return None
+    
+    payload = _build_v1_payload(token, title, body, data, link, badge_count, ttl_seconds, sound, image)
+    status = await _post_fcm_v1(payload, access_token, title)
+    if status == SEND_OK:
+        return True
+    if status == SEND_INVALID_TOKEN:
         return False
+    return None
+
+
+def _build_legacy_payload(
+    token: str,
+    title: str,
+    body: str,
+    data: Optional[dict] = None,
+    link: Optional[str] = None,
+    badge_count: int = 1,
+    ttl_seconds: int = 86400,
+    sound: str = "default",
+    image: Optional[str] = None
+) -> dict:
+    """Build the legacy HTTP API message for one token"""
+    payload = {
+        "to": token,
+        "notification": {
+            "title": title,
+            "body": body,
+            "sound": sound,
+            "click_action": "FLUTTER_NOTIFICATION_CLICK",
+            "badge": badge_count,  # Dynamic badge for iOS
+            "image": image
+        },
+        "data": dict(data) if data else {},
+        "priority": "high",
+        "time_to_live": ttl_seconds  # TTL for legacy API
+    }
     
+    if link:
+        payload["data"]["link"] = link
+    return payload
+
+
+async def _post_fcm_legacy(payload: dict, title: str = "") -> str:
+    """POST one legacy message on the shared client"""
     try:
-        payload = {
-            "to": token,
-            "notification": {
-                "title": title,
-                "body": body,
-                "sound": sound,
-                "click_action": "FLUTTER_NOTIFICATION_CLICK",
-                "badge": badge_count,  # Dynamic badge for iOS
-                "image": image
-            },
-            "data": data or {},
-            "priority": "high",
-            "time_to_live": ttl_seconds  # TTL for legacy API
-        }
-        
-        if link:
-            payload["data"]["link"] = link
-        
-        async with httpx.AsyncClient() as client:
+        client = get_http_client()
+        send_semaphore, _ = _loop_primitives()
+        async with send_semaphore:
             response = await client.post(
-                "https://fcm.googleapis.com/fcm/send",
+                f"{FCM_API_BASE}/fcm/send",
                 json=payload,
                 headers={
                     "Authorization": f"key={FCM_SERVER_KEY}",
                     "Content-Type": "application/json"
                 },
-                timeout=10.0
             )
+        
+        if response.status_code == 200:
+            result = response.json()
+            if result.get("success", 0) > 0:
+                logger.info(f"FCM legacy: Notification sent: {title[:30]}...")
+                return SEND_OK
+            logger.warning(f"FCM legacy: Notification failed: {result}")
+            errors = {item.get("error") for item in result.get("results", []) if isinstance(item, dict)}
+            if errors & {"NotRegistered", "InvalidRegistration", "MismatchSenderId"}:
+                return SEND_INVALID_TOKEN
+            return SEND_FAILED
+        else:
+            logger.error(f"FCM legacy: HTTP error {response.status_code}: {response.text}")
+            return SEND_FAILED
             
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("success", 0) > 0:
-                    logger.info(f"FCM legacy: Notification sent: {title[:30]}...")
-                    return True
-                else:
-                    logger.warning(f"FCM legacy: Notification failed: {result}")
-                    return False
-            else:
-                logger.error(f"FCM legacy: HTTP error {response.status_code}: {response.text}")
-                return False
-                
     except Exception as e:
         logger.error(f"FCM legacy: Error sending notification: {e}")
+        return SEND_FAILED
+
+
+async def _send_fcm_legacy(
+    token: str,
+    title: str,
+    body: str,
+    data: Optional[dict] = None,
+    link: Optional[str] = None,
+    badge_count: int = 1,
+    ttl_seconds: int = 86400,
+    sound: str = "default",
+    image: Optional[str] = None
+) -> bool:
+    """
+    Send notification via legacy FCM HTTP API (deprecated).
+    """
+    if not FCM_SERVER_KEY:
+        logger.warning("FCM: Neither v1 API nor legacy server key configured")
         return False
+    
+    payload = _build_legacy_payload(token, title, body, data, link, badge_count, ttl_seconds, sound, image)
+    return await _post_fcm_legacy(payload, title) == SEND_OK
+
+
+def unique_device_tokens(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    One token row per device: rows are expected newest-first per device,
+    so the first row seen for a device_id (or token) wins.
+    """
+    seen_devices = set()
+    seen_tokens = set()
+    unique_rows = []
+    for row in rows:
+        device_id = row.get("device_id")
+        token = row.get("token")
+        if device_id:
+            if device_id in seen_devices:
+                continue
+            seen_devices.add(device_id)
+        if token in seen_tokens:
+            continue
+        seen_tokens.add(token)
+        unique_rows.append(row)
+    return unique_rows
+
+
+async def send_fcm_to_tokens(
+    rows: List[Dict[str, Any]],
+    title: str,
+    body: str,
+    data: Optional[dict] = None,
+    link: Optional[str] = None,
+    badge_count: int = 1,
+    ttl_seconds: int = 86400,
+    sound: str = "default",
+    image: Optional[str] = None,
+    license_id: Optional[int] = None,
+    notification_id: Optional[int] = None
+) -> Tuple[int, List[int]]:
+    """
+    Send one notification to many token rows ({id, token, platform}) concurrently,
+    capped by FCM_SEND_CONCURRENCY across the process.
+    
+    Returns (sent_count, ids of rows whose token FCM reported invalid).
+    """
+    async def send_one(row: Dict[str, Any]) -> str:
+        # Prepare data with tracking IDs
+        tracking_data = data.copy() if data else {}
+        if notification_id:
+            tracking_data["notification_id"] = str(notification_id)
+            
+            # Track delivery in database
+            try:
+                from services.notification_service import track_notification_delivery
+                analytics_id = await track_notification_delivery(
+                    license_id=license_id,
+                    notification_id=notification_id,
+                    platform=row.get("platform", "android"),
+                    notification_type=tracking_data.get("type", "general")
+                )
+                tracking_data["analytics_id"] = str(analytics_id)
+            except Exception as e:
+                logger.warning(f"FCM: Failed to track delivery: {e}")
+        
+        return await _deliver(
+            row["token"], title, body, tracking_data, link, badge_count, ttl_seconds, sound, image
+        )
+    
+    statuses = await asyncio.gather(*(send_one(row) for row in rows))
+    sent_count = sum(1 for status in statuses if status == SEND_OK)
+    invalid_ids = [row["id"] for row, status in zip(rows, statuses) if status == SEND_INVALID_TOKEN]
+    return sent_count, invalid_ids
+
+
+async def deactivate_fcm_tokens(token_ids: List[int]):
+    """Mark many tokens inactive in one statement"""
+    if not token_ids:
+        return
+    from db_helper import get_db, execute_sql, commit_db
+    
+    placeholders = ",".join("?" for _ in token_ids)
+    async with get_db() as db:
+        await execute_sql(
+            db,
+            f"UPDATE fcm_tokens SET is_active = FALSE WHERE id IN ({placeholders})",
+            list(token_ids)
+        )
+        await commit_db(db)
+    logger.info(f"FCM: Marked {len(token_ids)} tokens as inactive")
 
 
 async def send_fcm_to_license(
@@ -556,12 +811,15 @@ async def send_fcm_to_license(
     ttl_seconds: int = 86400,
     sound: str = "default",  # Customizable notification sound
     image: Optional[str] = None,
-    notification_id: Optional[int] = None
+    notification_id: Optional[int] = None,
+    raise_on_failure: bool = False
 ) -> int:
     """
     Send push notification to all mobile devices for a license.
     
-    Returns the number of successful sends.
+    Returns the number of successful sends. With raise_on_failure, raises
+    FCMDeliveryError when no device was reached because of transient errors
+    (so a queued delivery is retried without duplicating partial sends).
     
     Args:
         license_id: License key ID
@@ -572,7 +830,7 @@ async def send_fcm_to_license(
         badge_count: iOS badge count (if None, calculates from unread notifications)
         ttl_seconds: Time-to-live in seconds (default: 24 hours)
     """
-    from db_helper import get_db, fetch_all, fetch_one, execute_sql, commit_db
+    from db_helper import get_db, fetch_all, fetch_one
     
     # Check if user has notifications enabled
     try:
@@ -585,25 +843,6 @@ async def send_fcm_to_license(
         # If we can't check preferences, proceed with sending (fail-open)
         logger.warning(f"FCM: Could not check notification preferences: {e}")
     
-    sent_count = 0
-    expired_ids = []
-    
-    # Calculate badge count from unread notifications if not provided
-    if badge_count is None:
-        async with get_db() as db:
-            unread_row = await fetch_one(
-                db,
-                """
-                SELECT COUNT(*) as unread_count FROM notifications
-                WHERE license_key_id = ? AND is_read = FALSE
-                """,
-                [license_id]
-            )
-            badge_count = unread_row["unread_count"] if unread_row else 1
-            # Ensure badge is at least 1 for new notification
-            if badge_count < 1:
-                badge_count = 1
-    
     async with get_db() as db:
         rows = await fetch_all(
             db,
@@ -618,77 +857,40 @@ async def send_fcm_to_license(
         if not rows:
             return 0
         
-        # Deduplicate by device_id
-        # Since we order by device_id DESC, non-nulls come first (usually). 
-        # Actually in SQL NULLs ordering depends on DB. 
-        # We'll stick to a set-based deduplication in python.
-        
-        processed_device_ids = set()
-        unique_tokens = []
-        
-        for row in rows:
-            device_id = row.get("device_id")
-            token = row.get("token")
-            
-            # If we have a device ID, ensure we haven't sent to it already
-            if device_id:
-                if device_id in processed_device_ids:
-                    continue
-                processed_device_ids.add(device_id)
-            
-            # Simple token deduplication (just in case)
-            if any(r["token"] == token for r in unique_tokens):
-                continue
-                
-            unique_tokens.append(row)
-
-        for row in unique_tokens:
-            # Prepare data with tracking IDs
-            tracking_data = data.copy() if data else {}
-            if notification_id:
-                tracking_data["notification_id"] = str(notification_id)
-                
-                # Track delivery in database
-                try:
-                    from services.notification_service import track_notification_delivery
-                    analytics_id = await track_notification_delivery(
-                        license_id=license_id,
-                        notification_id=notification_id,
-                        platform=row.get("platform", "android"),
-                        notification_type=tracking_data.get("type", "general")
-                    )
-                    tracking_data["analytics_id"] = str(analytics_id)
-                except Exception as e:
-                    logger.warning(f"FCM: Failed to track delivery: {e}")
-
-            success = await send_fcm_notification(
-                token=row["token"],
-                title=title,
-                body=body,
-                data=tracking_data,
-                link=link,
-                badge_count=badge_count,
-                ttl_seconds=ttl_seconds,
-                sound=sound,
-                image=image
-            )
-            
-            if success:
-                sent_count += 1
-            else:
-                expired_ids.append(row["id"])
-        
-        # Mark failed tokens as inactive
-        if expired_ids:
-            placeholders = ",".join("?" for _ in expired_ids)
-            await execute_sql(
+        # Calculate badge count from unread notifications if not provided
+        if badge_count is None:
+            unread_row = await fetch_one(
                 db,
-                f"UPDATE fcm_tokens SET is_active = FALSE WHERE id IN ({placeholders})",
-                expired_ids
+                """
+                SELECT COUNT(*) as unread_count FROM notifications
+                WHERE license_key_id = ? AND is_read = FALSE
+                """,
+                [license_id]
             )
-            await commit_db(db)
-            logger.info(f"FCM: Marked {len(expired_ids)} tokens as inactive")
+            # Ensure badge is at least 1 for new notification
+            badge_count = max(1, unread_row["unread_count"] if unread_row else 1)
+    
+    targets = unique_device_tokens(rows)
+    sent_count, invalid_ids = await send_fcm_to_tokens(
+        targets,
+        title,
+        body,
+        data=data,
+        link=link,
+        badge_count=badge_count,
+        ttl_seconds=ttl_seconds,
+        sound=sound,
+        image=image,
+        license_id=license_id,
+        notification_id=notification_id,
+    )
+    
+    # Mark tokens FCM rejected as inactive
+    await deactivate_fcm_tokens(invalid_ids)
     
+    failed_count = len(targets) - sent_count - len(invalid_ids)
+    if raise_on_failure and sent_count == 0 and failed_count > 0:
+        raise FCMDeliveryError(f"FCM: all {failed_count} sends failed for license {license_id}")
     return sent_count
 
 
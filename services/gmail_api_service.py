@@ -3,14 +3,57 @@ Al-Mudeer - Gmail API Service
 Uses Gmail API with OAuth 2.0 tokens for fetching and sending emails
 """
 
+import os
 import base64
 import json
 import httpx
 import asyncio
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta, timezone
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from urllib.parse import urlparse
+from uuid import uuid4
+
+# HTTP/2 is used when the optional h2 package is installed (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_http_client: Optional[httpx.AsyncClient] = None
+_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Process-wide pooled client for Gmail API calls, so connections (and TLS
+    sessions) are reused across requests and licenses. Rebuilt if the event
+    loop changes.
+    """
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=30.0,
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("GMAIL_MAX_CONNECTIONS", "20")),
+                max_keepalive_connections=10,
+                keepalive_expiry=60.0,
+            ),
+        )
+        _http_client_loop = loop
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared Gmail HTTP client (application shutdown)"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
 
 
 class GmailRateLimitError(Exception):
@@ -18,10 +61,29 @@ class GmailRateLimitError(Exception):
     pass
 
 
+class GmailHistoryExpiredError(Exception):
+    """Raised when a stored historyId is too old for users.history.list"""
+    pass
+
+
+class GmailMessageNotFoundError(Exception):
+    """Raised when a message no longer exists (deleted before it was fetched)"""
+    pass
+
+
 class GmailAPIService:
     """Service for Gmail API operations using OAuth 2.0"""
     
-    GMAIL_API_BASE = "https://gmail.googleapis.com/gmail/v1"
+    GMAIL_API_BASE = os.getenv("GMAIL_API_BASE", "https://gmail.googleapis.com/gmail/v1")
+    GMAIL_BATCH_URL = os.getenv("GMAIL_BATCH_URL", "https://www.googleapis.com/batch/gmail/v1")
+    
+    # Gmail accepts up to 100 calls per batch, but more than 50 tends to trip per-user rate limits
+    BATCH_SIZE = min(int(os.getenv("GMAIL_BATCH_SIZE", "50")), 100)
+    # Concurrent messages.get calls when batching isn't possible
+    FETCH_CONCURRENCY = int(os.getenv("GMAIL_FETCH_CONCURRENCY", "5"))
+    MAX_RETRIES = 3
+    # Backoff base (seconds) for batch parts that failed with a non-rate-limit error
+    PART_RETRY_DELAY = 2.0
     
     def __init__(self, access_token: str, refresh_token: str = None, oauth_service=None):
         """
@@ -57,107 +119,120 @@ class GmailAPIService:
     async def _request(self, method: str, endpoint: str, **kwargs) -> Dict:
         """Make authenticated request to Gmail API with retry logic and rate limit handling"""
         url = f"{self.GMAIL_API_BASE}/{endpoint}"
-        max_retries = 3
+        max_retries = self.MAX_RETRIES
         
-        async with httpx.AsyncClient() as client:
-            for attempt in range(max_retries + 1):
-                try:
-                    response = await client.request(
-                        method,
-                        url,
-                        headers=self._headers,
-                        timeout=30.0,
-                        **kwargs
-                    )
-                    
-                    error_data = {}
-                    error_msg = ""
-                    if response.content:
-                        try:
-                            error_data = response.json()
-                            error_msg = error_data.get("error", {}).get("message", response.text)
-                        except:
-                            error_msg = response.text
-                            
-                    # Handle Authentication Issues
-                    # 401: Standard Unauthorized
-                    # 400/403 with "invalid authentication credentials": Google sometimes returns this
-                    is_auth_error = (
-                        response.status_code == 401 or 
-                        (response.status_code in [400, 403] and "invalid authentication credentials" in error_msg.lower())
-                    )
-                    
-                    if is_auth_error and self.refresh_token and attempt == 0:
-                        refreshed = await self._refresh_token_if_needed()
-                        if refreshed:
-                            # Headers updated, continue loop to retry immediately
-                            continue
-                    
-                    # Handle Rate Limiting (429 or 403 with rate limit message)
-                    is_rate_limit = (
-                        response.status_code == 429 or 
-                        (response.status_code == 403 and ("rate limit" in error_msg.lower() or "user-rate limit" in error_msg.lower()))
-                    )
-
-                    if is_rate_limit:
-                        if attempt < max_retries:
-                            wait_time = 0
-                            # Try to parse "Retry after" from error message or header
-                            import re
-                            # Check for ISO timestamp: Retry after 2026-01-29T16:56:36.348Z
-                            ts_match = re.search(r'Retry after ([\d\-\:T\.Z]+)', error_msg)
-                            if ts_match:
-                                try:
-                                    ts_str = ts_match.group(1).replace("Z", "+00:00")
-                                    retry_at = datetime.fromisoformat(ts_str)
-                                    now = datetime.now(timezone.utc)
-                                    wait_time = (retry_at - now).total_seconds()
-                                except:
-                                    pass
-                            
-                            # If no timestamp found, use exponential backoff: 5s, 10s, 20s
-                            # Increased base to 10s for better recovery
-                            if wait_time <= 0:
-                                wait_time = 10 * (2 ** attempt)
-                            
-                            # Cap wait time at 120 seconds to avoid blocking too long
-                            wait_time = min(wait_time, 120)
-                            
-                            from logging_config import get_logger
-                            logger = get_logger(__name__)
-                            logger.warning(
-                                f"Gmail API rate limit reached (Attempt {attempt+1}/{max_retries}). "
-                                f"Waiting {wait_time:.1f}s before retry. Endpoint: {endpoint}"
-                            )
-                            
-                            await asyncio.sleep(wait_time)
-                            continue  # Retry
-                        else:
-                             # If we exhausted retries, raise specific exception
-                            raise GmailRateLimitError(f"Gmail API rate limit exceeded after {max_retries} retries: {error_msg}")
-                            
-                    if response.status_code != 200:
-                        raise Exception(f"Gmail API error: {error_msg}")
-                    
-                    return response.json() if response.content else {}
-                    
-                except (httpx.RequestError, httpx.TimeoutException) as e:
+        client = get_http_client()
+        for attempt in range(max_retries + 1):
+            try:
+                response = await client.request(
+                    method,
+                    url,
+                    headers=self._headers,
+                    timeout=30.0,
+                    **kwargs
+                )
+                
+                error_data = {}
+                error_msg = ""
+                if response.content:
+                    try:
+                        error_data = response.json()
+                        error_msg = error_data.get("error", {}).get("message", response.text)
+                    except:
+                        error_msg = response.text
+                        
+                # Handle Authentication Issues
+                # 401: Standard Unauthorized
+                # 400/403 with "invalid authentication credentials": Google sometimes returns this
+                is_auth_error = (
+                    response.status_code == 401 or 
+                    (response.status_code in [400, 403] and "invalid authentication credentials" in error_msg.lower())
+                )
+                
+                if is_auth_error and self.refresh_token and attempt == 0:
+                    refreshed = await self._refresh_token_if_needed()
+                    if refreshed:
+                        # Headers updated, continue loop to retry immediately
+                        continue
+                
+                # Handle Rate Limiting (429 or 403 with rate limit message)
+                if self._is_rate_limit(response.status_code, error_msg):
                     if attempt < max_retries:
-                        wait_time = 2 * (attempt + 1)
+                        wait_time = self._rate_limit_wait(error_msg, attempt)
+                        
+                        from logging_config import get_logger
+                        logger = get_logger(__name__)
+                        logger.warning(
+                            f"Gmail API rate limit reached (Attempt {attempt+1}/{max_retries}). "
+                            f"Waiting {wait_time:.1f}s before retry. Endpoint: {endpoint}"
+                        )
+                        
                         await asyncio.sleep(wait_time)
-                        continue
-                    raise Exception(f"Gmail API connection error: {str(e)}")
-                except GmailRateLimitError:
-                    raise
-                except Exception as e:
-                    # Re-raise unless it's a transient error we want to retry
-                    if "rate limit" in str(e).lower() and attempt < max_retries:
-                        await asyncio.sleep(10)
-                        continue
-                    raise e
+                        continue  # Retry
+                    else:
+                         # If we exhausted retries, raise specific exception
+                        raise GmailRateLimitError(f"Gmail API rate limit exceeded after {max_retries} retries: {error_msg}")
+                        
+                # history.list answers 404 once startHistoryId is out of range
+                if response.status_code == 404 and endpoint.startswith("users/me/history"):
+                    raise GmailHistoryExpiredError(f"Gmail history expired: {error_msg}")
+                if response.status_code == 404 and endpoint.startswith("users/me/messages/"):
+                    raise GmailMessageNotFoundError(f"Gmail message not found: {error_msg}")
+                
+                if response.status_code != 200:
+                    raise Exception(f"Gmail API error: {error_msg}")
+                
+                return response.json() if response.content else {}
+                
+            except (httpx.RequestError, httpx.TimeoutException) as e:
+                if attempt < max_retries:
+                    wait_time = 2 * (attempt + 1)
+                    await asyncio.sleep(wait_time)
+                    continue
+                raise Exception(f"Gmail API connection error: {str(e)}")
+            except (GmailRateLimitError, GmailHistoryExpiredError, GmailMessageNotFoundError):
+                raise
+            except Exception as e:
+                # Re-raise unless it's a transient error we want to retry
+                if "rate limit" in str(e).lower() and attempt < max_retries:
+                    await asyncio.sleep(10)
+                    continue
+                raise e
         
         return {}
     
+    @staticmethod
+    def _is_rate_limit(status_code: int, error_msg: str) -> bool:
+        """429, or 403 with a rate limit message"""
+        return (
+            status_code == 429 or 
+            (status_code == 403 and ("rate limit" in error_msg.lower() or "user-rate limit" in error_msg.lower()))
+        )
+    
+    @staticmethod
+    def _rate_limit_wait(error_msg: str, attempt: int) -> float:
+        """Seconds to wait before retrying a rate-limited call"""
+        wait_time = 0
+        # Try to parse "Retry after" from error message or header
+        import re
+        # Check for ISO timestamp: Retry after 2026-01-29T16:56:36.348Z
+        ts_match = re.search(r'Retry after ([\d\-\:T\.Z]+)', error_msg)
+        if ts_match:
+            try:
+                ts_str = ts_match.group(1).replace("Z", "+00:00")
+                retry_at = datetime.fromisoformat(ts_str)
+                now = datetime.now(timezone.utc)
+                wait_time = (retry_at - now).total_seconds()
+            except:
+                pass
+        
+        # If no timestamp found, use exponential backoff: 10s, 20s, 40s
+        if wait_time <= 0:
+            wait_time = 10 * (2 ** attempt)
+        
+        # Cap wait time at 120 seconds to avoid blocking too long
+        return min(wait_time, 120)
+    
     async def get_profile(self) -> Dict:
         """Get Gmail user profile"""
         return await self._request("GET", "users/me/profile")
@@ -201,6 +276,49 @@ class GmailAPIService:
         """
         return await self._request("GET", f"users/me/messages/{message_id}?format={format}")
 
+    async def list_history(
+        self,
+        start_history_id: str,
+        page_token: str = None,
+        max_results: int = 500
+    ) -> Dict:
+        """
+        List mailbox changes since a history ID (users.history.list)
+        
+        Args:
+            start_history_id: historyId from a previous sync or profile
+            page_token: Token for pagination
+            max_results: Maximum number of history records per page
+        
+        Returns:
+            Dictionary with history records, nextPageToken and current historyId
+        """
+        params = {
+            "startHistoryId": start_history_id,
+            "historyTypes": "messageAdded",
+            "maxResults": max_results,
+        }
+        if page_token:
+            params["pageToken"] = page_token
+        
+        query_string = "&".join([f"{k}={v}" for k, v in params.items()])
+        return await self._request("GET", f"users/me/history?{query_string}")
+    
+    async def watch(self, topic_name: str, label_ids: Optional[List[str]] = None) -> Dict:
+        """
+        Register Gmail push notifications to a Pub/Sub topic (users.watch).
+        The watch lasts 7 days and must be renewed before it expires.
+        
+        Returns:
+            Dictionary with historyId and expiration (epoch millis)
+        """
+        payload = {
+            "topicName": topic_name,
+            "labelIds": label_ids or ["INBOX", "SENT"],
+            "labelFilterBehavior": "include",
+        }
+        return await self._request("POST", "users/me/watch", json=payload)
+    
     async def get_attachment_data(self, message_id: str, attachment_id: str) -> Optional[bytes]:
         """Download attachment content"""
         try:
@@ -409,21 +527,322 @@ class GmailAPIService:
         messages_result = await self.list_messages(query=query, max_results=limit)
         message_ids = [msg["id"] for msg in messages_result.get("messages", [])]
         
+        emails, _ = await self._fetch_messages(message_ids)
+        return emails
+    
+    async def fetch_history_emails(
+        self,
+        start_history_id: str,
+        limit: int = 50
+    ) -> Tuple[List[Dict], str]:
+        """
+        Fetch only the messages added since a history ID
+        
+        Args:
+            start_history_id: historyId stored after the previous sync
+            limit: Maximum number of messages to fetch; the returned history ID
+                stops at the last record included so nothing is skipped
+        
+        If some messages can't be fetched, the returned history ID stops
+        before the first record that added one, so the next sync retries them
+        (messages already stored are skipped by the poller).
+        
+        Returns:
+            Tuple of (email dictionaries, history ID to resume from)
+        
+        Raises:
+            GmailHistoryExpiredError: if start_history_id is too old
+        """
+        message_ids: List[str] = []
+        seen = set()
+        # (history ID, message IDs) of each record included, in order
+        included: List[Tuple[str, List[str]]] = []
+        latest_history_id = start_history_id
+        page_token = None
+        
+        while True:
+            result = await self.list_history(start_history_id, page_token=page_token)
+            records = result.get("history", [])
+            truncated = False
+            
+            for record in records:
+                added = [
+                    item.get("message", {}) for item in record.get("messagesAdded", [])
+                ]
+                new_ids = [
+                    msg["id"] for msg in added
+                    if msg.get("id") and msg["id"] not in seen and "DRAFT" not in msg.get("labelIds", [])
+                ]
+                if message_ids and len(message_ids) + len(new_ids) > limit:
+                    truncated = True
+                    break
+                for msg_id in new_ids:
+                    seen.add(msg_id)
+                    message_ids.append(msg_id)
+                latest_history_id = record.get("id", latest_history_id)
+                included.append((latest_history_id, [msg.get("id") for msg in added]))
+            
+            page_token = result.get("nextPageToken")
+            if truncated:
+                break
+            if not page_token:
+                # Caught up: resume from the mailbox's current history ID
+                latest_history_id = result.get("historyId", latest_history_id)
+                break
+        
+        emails, failed = await self._fetch_messages(message_ids)
+        if failed:
+            failed = set(failed)
+            resume_from = start_history_id
+            for history_id, ids in included:
+                if failed.intersection(ids):
+                    break
+                resume_from = history_id
+            from logging_config import get_logger
+            get_logger(__name__).warning(
+                f"{len(failed)} Gmail messages could not be fetched; "
+                f"resuming history from {resume_from} so the next sync retries them"
+            )
+            return emails, str(resume_from)
+        
+        return emails, str(latest_history_id)
+    
+    async def sync_emails(
+        self,
+        start_history_id: Optional[str],
+        since_hours: int = 24,
+        limit: int = 50
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Incremental sync: history.list when a history ID is known, otherwise
+        (or when it has expired) a full fetch_new_emails() search.
+        
+        Returns:
+            Tuple of (email dictionaries, history ID to store for the next sync)
+        """
+        if start_history_id:
+            try:
+                return await self.fetch_history_emails(start_history_id, limit=limit)
+            except GmailHistoryExpiredError as e:
+                from logging_config import get_logger
+                get_logger(__name__).info(f"{e}; falling back to full sync")
+        
+        # Read the history ID before searching so nothing added meanwhile is missed
+        profile = await self.get_profile()
+        emails = await self.fetch_new_emails(since_hours=since_hours, limit=limit)
+        history_id = profile.get("historyId")
+        return emails, str(history_id) if history_id else None
+    
+    async def batch_get_messages(self, message_ids: List[str], format: str = "full") -> Dict[str, Dict]:
+        """
+        Get up to BATCH_SIZE messages in one multipart batch request
+        
+        Rate limiting is handled for the batch as a whole: rate-limited parts
+        are retried together after a backoff, and GmailRateLimitError is
+        raised once retries run out. Parts that fail for other reasons (5xx,
+        unparseable) are retried the same way, and left out once retries run
+        out so the caller can try them again later.
+        
+        Returns:
+            Dictionary of message ID -> message object (None for messages
+            that no longer exist)
+        """
+        from logging_config import get_logger
+        logger = get_logger(__name__)
+        
+        api_path = urlparse(self.GMAIL_API_BASE).path.rstrip("/")
+        client = get_http_client()
+        results: Dict[str, Optional[Dict]] = {}
+        pending = list(message_ids)
+        limited: List[str] = []
+        failed: List[str] = []
+        
+        for attempt in range(self.MAX_RETRIES + 1):
+            boundary = f"batch_{uuid4().hex}"
+            parts = []
+            for index, msg_id in enumerate(pending):
+                parts.append(
+                    f"--{boundary}\r\n"
+                    f"Content-Type: application/http\r\n"
+                    f"Content-ID: <item-{index}>\r\n\r\n"
+                    f"GET {api_path}/users/me/messages/{msg_id}?format={format}\r\n\r\n"
+                )
+            body = "".join(parts) + f"--{boundary}--\r\n"
+            
+            response = await client.post(
+                self.GMAIL_BATCH_URL,
+                content=body.encode(),
+                headers={
+                    "Authorization": self._headers["Authorization"],
+                    "Content-Type": f"multipart/mixed; boundary={boundary}",
+                },
+            )
+            
+            if response.status_code == 401 and self.refresh_token and attempt == 0:
+                if await self._refresh_token_if_needed():
+                    continue
+            
+            if self._is_rate_limit(response.status_code, response.text):
+                limited = pending
+                failed = []
+                error_msg = response.text
+            elif response.status_code != 200:
+                raise Exception(f"Gmail batch error {response.status_code}: {response.text[:200]}")
+            else:
+                limited = []
+                failed = []
+                error_msg = ""
+                answered = set()
+                for index, status, payload in self._parse_batch_response(response):
+                    if index is None or index >= len(pending):
+                        continue
+                    msg_id = pending[index]
+                    answered.add(msg_id)
+                    part_error = ""
+                    if isinstance(payload, dict):
+                        part_error = str(payload.get("error", {}).get("message", "")) if status != 200 else ""
+                    if status == 200 and isinstance(payload, dict):
+                        results[msg_id] = payload
+                    elif status == 404:
+                        logger.info(f"Message {msg_id} no longer exists, skipping")
+                        results[msg_id] = None
+                    elif self._is_rate_limit(status, part_error):
+                        limited.append(msg_id)
+                        error_msg = part_error
+                    else:
+                        logger.warning(f"Error fetching message {msg_id} in batch: {status} {part_error}")
+                        failed.append(msg_id)
+                # Parts missing from the response are retried too
+                failed.extend(msg_id for msg_id in pending if msg_id not in answered)
+            
+            if not limited and not failed:
+                return results
+            
+            pending = limited + failed
+            if attempt < self.MAX_RETRIES:
+                if limited:
+                    wait_time = self._rate_limit_wait(error_msg, attempt)
+                    logger.warning(
+                        f"Gmail batch rate limited for {len(limited)} messages "
+                        f"(Attempt {attempt+1}/{self.MAX_RETRIES}). Waiting {wait_time:.1f}s before retry."
+                    )
+                else:
+                    wait_time = self.PART_RETRY_DELAY * (attempt + 1)
+                await asyncio.sleep(wait_time)
+        
+        if limited:
+            raise GmailRateLimitError(
+                f"Gmail API rate limit exceeded after {self.MAX_RETRIES} retries "
+                f"for {len(pending)} batched messages"
+            )
+        logger.error(
+            f"Gmail batch: {len(failed)} messages still failing after {self.MAX_RETRIES} retries, "
+            f"leaving them for the next sync: {failed}"
+        )
+        return results
+    
+    @staticmethod
+    def _parse_batch_response(response: httpx.Response) -> List[Tuple[Optional[int], int, Optional[Dict]]]:
+        """Split a multipart/mixed batch response into (item index, status, JSON body) tuples"""
+        import re
+        
+        content_type = response.headers.get("content-type", "")
+        match = re.search(r'boundary="?([^";]+)"?', content_type)
+        if not match:
+            raise Exception("Gmail batch response has no multipart boundary")
+        boundary = match.group(1)
+        
+        results = []
+        text = response.text.replace("\r\n", "\n")
+        for chunk in text.split(f"--{boundary}"):
+            chunk = chunk.strip()
+            if not chunk or chunk == "--":
+                continue
+            
+            # Outer part headers, then the embedded HTTP response
+            outer_headers, _, http_response = chunk.partition("\n\n")
+            id_match = re.search(r'Content-ID:\s*<(?:response-)?item-(\d+)>', outer_headers, re.IGNORECASE)
+            index = int(id_match.group(1)) if id_match else None
+            
+            status_line, _, rest = http_response.partition("\n")
+            status_match = re.match(r'HTTP/[\d.]+\s+(\d+)', status_line.strip())
+            status = int(status_match.group(1)) if status_match else 0
+            
+            _, _, json_body = rest.partition("\n\n")
+            try:
+                payload = json.loads(json_body) if json_body.strip() else None
+            except ValueError:
+                payload = None
+            results.append((index, status, payload))
+        
+        return results
+    
+    async def _get_messages_concurrently(self, message_ids: List[str]) -> Dict[str, Optional[Dict]]:
+        """
+        messages.get for each ID, at most FETCH_CONCURRENCY at a time
+        (None for messages that no longer exist; failed IDs are left out)
+        """
+        from logging_config import get_logger
+        logger = get_logger(__name__)
+        semaphore = asyncio.Semaphore(self.FETCH_CONCURRENCY)
+        
+        async def fetch_one(msg_id: str):
+            async with semaphore:
+                try:
+                    return msg_id, await self.get_message(msg_id, format="full"), True
+                except GmailMessageNotFoundError:
+                    logger.info(f"Message {msg_id} no longer exists, skipping")
+                    return msg_id, None, True
+                except Exception as e:
+                    if "rate limit" in str(e).lower():
+                        logger.info(f"Rate limit hit during message fetch {msg_id}: {e}")
+                    else:
+                        logger.error(f"Error fetching message {msg_id}: {e}")
+                    return msg_id, None, False
+        
+        fetched = await asyncio.gather(*(fetch_one(msg_id) for msg_id in message_ids))
+        return {msg_id: message for msg_id, message, ok in fetched if ok}
+    
+    async def _fetch_messages(self, message_ids: List[str]) -> Tuple[List[Dict], List[str]]:
+        """
+        Fetch and parse full messages by ID (batched, in the original order)
+        
+        Returns:
+            Tuple of (email dictionaries, IDs that could not be fetched and are
+            worth retrying; deleted messages are not among them)
+        """
+        from logging_config import get_logger
+        logger = get_logger(__name__)
+        
+        messages: Dict[str, Dict] = {}
+        for start in range(0, len(message_ids), self.BATCH_SIZE):
+            chunk = message_ids[start:start + self.BATCH_SIZE]
+            if len(chunk) == 1:
+                messages.update(await self._get_messages_concurrently(chunk))
+                continue
+            try:
+                messages.update(await self.batch_get_messages(chunk))
+            except GmailRateLimitError:
+                raise
+            except Exception as e:
+                logger.warning(f"Gmail batch fetch failed, fetching individually: {e}")
+                messages.update(await self._get_messages_concurrently(chunk))
+        
         emails = []
+        failed = []
         for msg_id in message_ids:
+            if msg_id not in messages:
+                failed.append(msg_id)
+                continue
+            message = messages[msg_id]
+            if not message:
+                continue
             try:
-                message = await self.get_message(msg_id, format="full")
                 emails.append(await self._parse_message(message))
             except Exception as e:
-                from logging_config import get_logger
-                logger = get_logger(__name__)
-                if "rate limit" in str(e).lower():
-                    logger.info(f"Rate limit hit during message parse {msg_id}: {e}")
-                else:
-                    logger.error(f"Error parsing message {msg_id}: {e}")
-                continue
+                logger.error(f"Error parsing message {msg_id}: {e}")
         
-        return emails
+        return emails, failed
     
     async def _parse_message(self, message: Dict) -> Dict:
         """Parse Gmail API message format into our standard format"""
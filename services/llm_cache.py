@@ -0,0 +1,320 @@
+"""
+Al-Mudeer - Shared LLM Response Cache
+Second-level cache behind LLMService's in-process LRU, shared by every worker
+and kept across restarts (Redis, or an on-disk SQLite file)
+"""
+
+import os
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+# auto (Redis when cache.CacheManager has it, else SQLite), redis, sqlite, memory (L1 only)
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "auto").lower()
+LLM_CACHE_SQLITE_PATH = os.getenv("LLM_CACHE_SQLITE_PATH", "llm_cache.db")
+# Size budgets: the shared L2, and the in-process L1
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024
+LLM_CACHE_L1_MAX_BYTES = int(os.getenv("LLM_CACHE_L1_MAX_MB", "8")) * 1024 * 1024
+
+# Entries evicted per round when a store is over its size budget
+EVICT_BATCH = 64
+
+
+def make_cache_key(
+    prompt: str,
+    system: Optional[str] = None,
+    model: str = "",
+    temperature: Optional[float] = None,
+    json_mode: bool = False,
+    max_tokens: Optional[int] = None
+) -> str:
+    """Key for one generation request: a different model or sampling setting is a different entry"""
+    content = f"{model}||{temperature}||{int(json_mode)}||{max_tokens}||{system or ''}||{prompt}"
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
+class RedisResponseStore:
+    """
+    Responses as Redis strings with a TTL. A sorted set indexes keys by last
+    access and a hash holds their sizes, so the store is trimmed
+    least-recently-used first once it exceeds max_bytes.
+    Uses the sync client of cache.CacheManager (calls run in a thread).
+    """
+
+    def __init__(self, redis_client: Any, max_bytes: int = LLM_CACHE_MAX_BYTES, prefix: str = "llmcache"):
+        self._redis = redis_client
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self._index = f"{prefix}:index"
+        self._sizes = f"{prefix}:sizes"
+        self._bytes = f"{prefix}:bytes"
+        self.bytes = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def _get(self, key: str) -> Optional[str]:
+        pipe = self._redis.pipeline()
+        pipe.get(self._key(key))
+        pipe.zadd(self._index, {key: time.time()}, xx=True)
+        value, _ = pipe.execute()
+        if isinstance(value, bytes):
+            value = value.decode()
+        return value
+
+    def _set(self, key: str, value: str, ttl_seconds: int):
+        size = len(value.encode())
+        pipe = self._redis.pipeline()
+        pipe.set(self._key(key), value, ex=ttl_seconds)
+        pipe.zadd(self._index, {key: time.time()})
+        pipe.hget(self._sizes, key)
+        pipe.hset(self._sizes, key, size)
+        pipe.incrby(self._bytes, size)
+        _, _, previous, _, total = pipe.execute()
+        if previous:
+            total = self._redis.decrby(self._bytes, int(previous))
+        self.bytes = int(total)
+        if self.bytes > self.max_bytes:
+            self._evict(ttl_seconds)
+
+    def _evict(self, ttl_seconds: int):
+        """Drop index entries past their TTL, then least recently used until under budget"""
+        cutoff = time.time() - ttl_seconds
+        while True:
+            stale = self._redis.zrangebyscore(self._index, "-inf", cutoff, start=0, num=EVICT_BATCH)
+            victims = stale or (
+                self._redis.zrange(self._index, 0, EVICT_BATCH - 1) if self.bytes > self.max_bytes else []
+            )
+            if not victims:
+                return
+            victims = [v.decode() if isinstance(v, bytes) else v for v in victims]
+            sizes = self._redis.hmget(self._sizes, victims)
+            freed = sum(int(size) for size in sizes if size)
+            pipe = self._redis.pipeline()
+            pipe.delete(*(self._key(victim) for victim in victims))
+            pipe.zrem(self._index, *victims)
+            pipe.hdel(self._sizes, *victims)
+            pipe.decrby(self._bytes, freed)
+            self.bytes = int(pipe.execute()[-1])
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl_seconds: int):
+        await asyncio.to_thread(self._set, key, value, ttl_seconds)
+
+
+class SQLiteResponseStore:
+    """
+    Responses in an on-disk SQLite file (separate from the app database), so
+    they survive restarts and are shared by workers on the same host.
+    Expired rows are dropped on read; least recently used rows are deleted
+    once the stored responses exceed max_bytes.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_SQLITE_PATH, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_response_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_response_cache_access ON llm_response_cache(last_access)"
+        )
+        # Running total of stored bytes, kept by triggers so every worker sharing
+        # the file sees the same figure without summing the table on each write
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_response_cache_size (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    bytes INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS llm_response_cache_size_insert
+                AFTER INSERT ON llm_response_cache BEGIN
+                    UPDATE llm_response_cache_size SET bytes = bytes + NEW.size WHERE id = 0;
+                END
+            """)
+            self._conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS llm_response_cache_size_update
+                AFTER UPDATE OF size ON llm_response_cache BEGIN
+                    UPDATE llm_response_cache_size SET bytes = bytes + NEW.size - OLD.size WHERE id = 0;
+                END
+            """)
+            self._conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS llm_response_cache_size_delete
+                AFTER DELETE ON llm_response_cache BEGIN
+                    UPDATE llm_response_cache_size SET bytes = bytes - OLD.size WHERE id = 0;
+                END
+            """)
+            # Seeded once from the rows already there (files written before the total existed)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO llm_response_cache_size (id, bytes) "
+                "SELECT 0, COALESCE(SUM(size), 0) FROM llm_response_cache"
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self.bytes = self._total_bytes()
+
+    def _total_bytes(self) -> int:
+        return self._conn.execute("SELECT bytes FROM llm_response_cache_size WHERE id = 0").fetchone()[0]
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, expires_at FROM llm_response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE llm_response_cache SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def _set(self, key: str, value: str, ttl_seconds: int):
+        now = time.time()
+        with self._lock:
+            # An upsert rather than INSERT OR REPLACE: REPLACE drops the old row
+            # without firing the delete trigger, which would skew the running total
+            self._conn.execute(
+                "INSERT INTO llm_response_cache (key, response, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET response = excluded.response, size = excluded.size, "
+                "expires_at = excluded.expires_at, last_access = excluded.last_access",
+                (key, value, len(value.encode()), now + ttl_seconds, now)
+            )
+            self.bytes = self._total_bytes()
+            if self.bytes > self.max_bytes:
+                self._conn.execute("DELETE FROM llm_response_cache WHERE expires_at <= ?", (now,))
+                self.bytes = self._total_bytes()
+            while self.bytes > self.max_bytes:
+                self._conn.execute("""
+                    DELETE FROM llm_response_cache WHERE key IN (
+                        SELECT key FROM llm_response_cache ORDER BY last_access ASC LIMIT ?
+                    )
+                """, (EVICT_BATCH,))
+                self.bytes = self._total_bytes()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl_seconds: int):
+        await asyncio.to_thread(self._set, key, value, ttl_seconds)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_response_store(backend: str = LLM_CACHE_BACKEND, redis_client: Optional[Any] = None):
+    """L2 store for the configured backend, None for memory-only"""
+    if backend == "memory":
+        return None
+    if backend in ("auto", "redis"):
+        if redis_client is None:
+            from cache import cache
+            redis_client = cache.redis_client if cache.use_redis else None
+        if redis_client is not None:
+            return RedisResponseStore(redis_client)
+        if backend == "redis":
+            logger.warning("LLM cache: Redis unavailable, using the SQLite store")
+    try:
+        return SQLiteResponseStore()
+    except Exception as e:
+        logger.warning(f"LLM cache: SQLite store unavailable ({e}), using memory only")
+        return None
+
+
+class TieredLLMCache:
+    """
+    In-process LRU (L1) in front of a shared store (L2). An L2 hit is copied
+    into L1; writes go to both. L2 errors degrade to L1-only, never fail a request.
+    """
+
+    def __init__(self, l1: Any, l2: Optional[Any] = None, ttl_seconds: int = 86400):
+        self.l1 = l1
+        self.l2 = l2
+        self.ttl_seconds = ttl_seconds
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "l1_hits": 0,
+            "l2_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "l2_errors": 0,
+        }
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.l1.get_by_key(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            self.stats["l1_hits"] += 1
+            return value
+
+        if self.l2 is not None:
+            try:
+                value = await self.l2.get(key)
+            except Exception as e:
+                self.stats["l2_errors"] += 1
+                logger.debug(f"LLM cache L2 read error: {e}")
+                value = None
+            if value is not None:
+                await self.l1.set_by_key(key, value)
+                self.stats["hits"] += 1
+                self.stats["l2_hits"] += 1
+                return value
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        self.stats["sets"] += 1
+        await self.l1.set_by_key(key, value)
+        if self.l2 is not None:
+            try:
+                await self.l2.set(key, value, self.ttl_seconds)
+            except Exception as e:
+                self.stats["l2_errors"] += 1
+                logger.debug(f"LLM cache L2 write error: {e}")
+
+    @property
+    def size(self) -> int:
+        return self.l1.size
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters per tier, hit rate and bytes held"""
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["l1_entries"] = self.l1.size
+        stats["l1_bytes"] = self.l1.bytes
+        stats["l2_backend"] = (
+            "redis" if isinstance(self.l2, RedisResponseStore)
+            else "sqlite" if isinstance(self.l2, SQLiteResponseStore)
+            else "none"
+        )
+        stats["l2_bytes"] = self.l2.bytes if self.l2 is not None else 0
+        return stats
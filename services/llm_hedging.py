@@ -0,0 +1,194 @@
+"""
+Al-Mudeer - LLM Provider Health
+Per-provider latency histograms (for hedged requests) and circuit breakers,
+so LLMService skips a failing provider instead of waiting on its retries
+"""
+
+import os
+import time
+import bisect
+from typing import Any, Dict, List, Optional
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+# Hedged requests: when the provider in flight is slower than this percentile
+# of its own recent latencies, the next provider is started in parallel
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Hedge delay used until a provider has LLM_HEDGE_MIN_SAMPLES latencies recorded
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "10"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Never hedge sooner than this (seconds), however fast the provider usually is
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+
+# Circuit breaker: open after N consecutive failures, probe again after the cooldown
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "60"))
+# Attempts each provider makes inside LLMService before failing over; its own
+# patient retries would keep the breaker from seeing the failure for minutes
+LLM_PROVIDER_MAX_ATTEMPTS = max(1, int(os.getenv("LLM_PROVIDER_MAX_ATTEMPTS", "1")))
+
+# Histogram bucket upper bounds in milliseconds (last bucket is open-ended)
+LATENCY_BUCKETS_MS = [
+    100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 5000,
+    7500, 10000, 15000, 20000, 30000, 45000, 60000, 120000,
+]
+# Counts are halved once a histogram holds this many samples, so old latencies fade out
+HISTOGRAM_DECAY_AT = 1000
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with exponential aging"""
+
+    def __init__(self, bounds: Optional[List[float]] = None, decay_at: int = HISTOGRAM_DECAY_AT):
+        self.bounds = bounds or LATENCY_BUCKETS_MS
+        self.decay_at = decay_at
+        self.counts = [0.0] * (len(self.bounds) + 1)
+        self.samples = 0
+
+    def record(self, latency_ms: float):
+        self.counts[bisect.bisect_left(self.bounds, latency_ms)] += 1
+        self.samples += 1
+        if sum(self.counts) >= self.decay_at:
+            self.counts = [count / 2 for count in self.counts]
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound (ms) of the bucket holding the q-th percentile, None if empty"""
+        total = sum(self.counts)
+        if not total:
+            return None
+        rank = total * q / 100
+        seen = 0.0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.bounds[min(index, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": {
+                (f"le_{bound}" if index < len(self.bounds) else f"gt_{self.bounds[-1]}"): round(count, 1)
+                for index, (bound, count) in enumerate(zip(self.bounds + [self.bounds[-1]], self.counts))
+                if count
+            },
+        }
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive failures; open -> half_open
+    once `cooldown` seconds have passed, letting a single probe call through.
+    The probe closes the breaker on success and re-opens it on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failures: Optional[int] = None, cooldown: Optional[float] = None):
+        self.failures = failures if failures is not None else LLM_BREAKER_FAILURES
+        self.cooldown = cooldown if cooldown is not None else LLM_BREAKER_COOLDOWN
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self) -> bool:
+        """Whether a call may go out now (claims the probe slot when half-open)"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.probing or self.consecutive_failures >= self.failures:
+            if self.opened_at is None or self.probing:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release(self):
+        """A call ended without a verdict (cancelled): free the probe slot"""
+        self.probing = False
+
+
+class ProviderHealth:
+    """Latency histogram and circuit breaker of one provider"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latency = LatencyHistogram()
+        self.breaker = CircuitBreaker()
+        self.stats = {"calls": 0, "successes": 0, "failures": 0, "slow": 0, "cancelled": 0, "skipped": 0}
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait on this provider before starting the next one in parallel"""
+        if self.latency.samples < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return max(self.latency.percentile(LLM_HEDGE_PERCENTILE) / 1000, LLM_HEDGE_MIN_DELAY)
+
+    def record_success(self, latency_ms: float):
+        self.stats["successes"] += 1
+        self.latency.record(latency_ms)
+        self.breaker.record_success()
+
+    def record_failure(self):
+        self.stats["failures"] += 1
+        self._trip()
+
+    def record_slow(self):
+        """
+        Cancelled after running past its hedge deadline: counts against the
+        breaker like a failure. The time it ran is only when it was cut off,
+        not a latency, so it stays out of the histogram (it would push the
+        percentile, and with it the hedge delay, up on every hedge)
+        """
+        self.stats["slow"] += 1
+        self._trip()
+
+    def _trip(self):
+        before = self.breaker.state
+        self.breaker.record_failure()
+        if self.breaker.state == CircuitBreaker.OPEN and before != CircuitBreaker.OPEN:
+            logger.warning(
+                f"Circuit breaker for {self.name} opened after "
+                f"{self.breaker.consecutive_failures} failures, skipping it for {self.breaker.cooldown:.0f}s"
+            )
+
+    def record_cancelled(self):
+        self.stats["cancelled"] += 1
+        self.breaker.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.times_opened,
+            "hedge_delay_s": round(self.hedge_delay(), 2),
+            "latency": self.latency.get_stats(),
+        }
@@ -16,9 +16,9 @@ import json
 import time
 import tempfile
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator
 from collections import OrderedDict
 
 import httpx
@@ -49,6 +49,8 @@ def _init_genai(project_id: str, location: str):
     return genai_client
 
 from logging_config import get_logger
+from services.rate_limiter import LLMRateLimiter, get_llm_rate_limiter, estimate_tokens, current_request_context, CapacityWait, track_capacity_wait
+from services.llm_hedging import ProviderHealth, CircuitBreaker, LLM_HEDGING_ENABLED, LLM_PROVIDER_MAX_ATTEMPTS
 
 logger = get_logger(__name__)
 
@@ -79,6 +81,7 @@ class LLMConfig:
     
     # Retry settings - aggressive for rate limit handling
     # Vertex AI has better rate limits than AI Studio, but we keep conservative settings
+    # (standalone providers only: LLMService caps attempts at LLM_PROVIDER_MAX_ATTEMPTS and fails over)
     max_retries: int = 20  # increased to 20 for "Patient Retry"
     base_delay: float = 30.0  # Increased delay: 30s+ to wait out congestion
     
@@ -134,135 +137,39 @@ def calculate_backoff_delay(
 
 # ============ Global Concurrency Control ============
 
-# Global semaphore to limit concurrent LLM API calls
+# Semaphores limiting concurrent LLM API calls, one per priority class, so
+# background calls waiting on quota never hold the slots of interactive ones.
 # This prevents burst requests when multiple messages are processed simultaneously
-_llm_semaphore: Optional[asyncio.Semaphore] = None
+_llm_semaphores: Dict[str, asyncio.Semaphore] = {}
 
 
-def get_llm_semaphore(max_concurrent: int = 3) -> asyncio.Semaphore:
-    """Get or create global semaphore for LLM concurrency control"""
-    global _llm_semaphore
-    if _llm_semaphore is None:
-        _llm_semaphore = asyncio.Semaphore(max_concurrent)
-        logger.info(f"LLM concurrency limiter initialized: max {max_concurrent} concurrent requests")
-    return _llm_semaphore
+def get_llm_semaphore(max_concurrent: int = 3, priority: Optional[str] = None) -> asyncio.Semaphore:
+    """Get or create the concurrency semaphore for a priority (default: the caller's llm_request_context)"""
+    priority = priority or current_request_context()[0]
+    if priority not in _llm_semaphores:
+        _llm_semaphores[priority] = asyncio.Semaphore(max_concurrent)
+        logger.info(f"LLM concurrency limiter initialized: max {max_concurrent} concurrent {priority} requests")
+    return _llm_semaphores[priority]
 
 
-# ============ Global Rate Limiter ============
+# ============ Rate Limiting ============
 
-class GlobalRateLimiter:
-    """
-    Enforces a minimum time interval between ALL Gemini API requests.
-    
-    CRITICAL FEATURES:
-    1. Starts with current time - forces wait on first request after startup
-    2. Reports 429 errors to extend cooldown period
-    3. Uses 15s minimum interval = 4 RPM max (very safe under 15 RPM limit)
-    4. Exponential cooldown after consecutive 429s (handles daily limit)
-    
-    This prevents rate limits even when the app restarts mid-request-burst.
-    """
-    
-    # Minimum seconds between requests (4s = max 15 requests/minute)
-    # Optimized for Vertex AI default quotas while staying safe
-    MIN_INTERVAL = float(os.getenv("LLM_MIN_REQUEST_INTERVAL", "4.0"))
-    
-    # Base cooldown after 429 (5 minutes)
-    BASE_COOLDOWN = 300.0
-    
-    # Maximum cooldown (1 hour) - for when daily limit is hit
-    MAX_COOLDOWN = 3600.0
-    
-    _instance = None
-    _lock = None
-    _last_request_time = None
-    _cooldown_until = 0.0
-    _consecutive_429s = 0  # Track consecutive 429 errors
-    
-    @classmethod
-    def get_instance(cls) -> "GlobalRateLimiter":
-        if cls._instance is None:
-            cls._instance = cls()
-            cls._lock = asyncio.Lock()
-            cls._last_request_time = time.time()
-            logger.info(f"Global rate limiter initialized: min {cls.MIN_INTERVAL}s between requests, first request will wait")
-        return cls._instance
-    
-    async def wait_for_capacity(self) -> None:
-        """
-        Wait until enough time has passed since the last request.
-        Also respects any extended cooldown from 429 errors.
-        """
-        async with self._lock:
-            now = time.time()
-            
-            # Check if we're in an extended cooldown from a 429 error
-            if now < self._cooldown_until:
-                cooldown_wait = self._cooldown_until - now
-                logger.warning(f"Rate limiter: in 429 cooldown, waiting {cooldown_wait:.1f}s")
-                await asyncio.sleep(cooldown_wait)
-                now = time.time()
-            
-            # Normal rate limiting - ensure MIN_INTERVAL between requests
-            time_since_last = now - self._last_request_time
-            
-            if time_since_last < self.MIN_INTERVAL:
-                wait_time = self.MIN_INTERVAL - time_since_last
-                logger.info(f"Rate limiter: waiting {wait_time:.1f}s before next request")
-                await asyncio.sleep(wait_time)
-            
-            # Update last request time BEFORE making the request
-            self._last_request_time = time.time()
-    
-    def report_rate_limit_hit(self) -> None:
-        """
-        Call this when a 429 response is received.
-        Uses exponential backoff for consecutive 429s.
-        """
-        self._consecutive_429s += 1
-        
-        # Exponential backoff: 5min, 10min, 20min, 40min, max 1 hour
-        cooldown = min(self.BASE_COOLDOWN * (2 ** (self._consecutive_429s - 1)), self.MAX_COOLDOWN)
-        self._cooldown_until = time.time() + cooldown
-        
-        logger.warning(f"Rate limiter: 429 #{self._consecutive_429s}, cooldown {cooldown/60:.1f} minutes")
-        
-        if self._consecutive_429s >= 3:
-            logger.error(f"Rate limiter: {self._consecutive_429s} consecutive 429s - may have hit daily limit!")
-    
-    def report_success(self) -> None:
-        """Call this when a request succeeds to reset the 429 counter."""
-        if self._consecutive_429s > 0:
-            logger.info(f"Rate limiter: request succeeded, resetting 429 counter from {self._consecutive_429s}")
-            self._consecutive_429s = 0
-    
-    def is_in_cooldown(self) -> bool:
-        """
-        Check if we're currently in a rate limit cooldown period.
-        Workers should check this BEFORE queuing any AI requests.
-        """
-        return time.time() < self._cooldown_until
-    
-    def get_cooldown_remaining(self) -> float:
-        """Get seconds remaining in cooldown, or 0 if not in cooldown."""
-        remaining = self._cooldown_until - time.time()
-        return max(0, remaining)
-
-
-def get_rate_limiter() -> GlobalRateLimiter:
-    """Get the global rate limiter instance"""
-    return GlobalRateLimiter.get_instance()
+def get_rate_limiter() -> LLMRateLimiter:
+    """Get the LLM rate limiter (distributed token buckets, see services.rate_limiter)"""
+    return get_llm_rate_limiter()
 
 
 # ============ Response Caching ============
 
 class LRUCache:
-    """Thread-safe LRU Cache for LLM responses"""
+    """Thread-safe LRU Cache for LLM responses, bounded by entries and bytes"""
     
-    def __init__(self, max_size: int = 1000, ttl_seconds: int = 86400):
+    def __init__(self, max_size: int = 1000, ttl_seconds: int = 86400, max_bytes: Optional[int] = None):
         self.max_size = max_size
         self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
         self.cache: OrderedDict = OrderedDict()
+        self.bytes = 0
         self._lock = asyncio.Lock()
     
     def _make_key(self, prompt: str, system: Optional[str] = None) -> str:
@@ -272,7 +179,9 @@ class LRUCache:
     
     async def get(self, prompt: str, system: Optional[str] = None) -> Optional[str]:
         """Get cached response if exists and not expired"""
-        key = self._make_key(prompt, system)
+        return await self.get_by_key(self._make_key(prompt, system))
+    
+    async def get_by_key(self, key: str) -> Optional[str]:
         async with self._lock:
             if key not in self.cache:
                 return None
@@ -280,7 +189,7 @@ class LRUCache:
             entry = self.cache[key]
             if time.time() - entry["timestamp"] > self.ttl_seconds:
                 # Expired
-                del self.cache[key]
+                self._remove(key)
                 return None
             
             # Move to end (most recently used)
@@ -290,21 +199,37 @@ class LRUCache:
     
     async def set(self, prompt: str, response: str, system: Optional[str] = None):
         """Cache a response"""
-        key = self._make_key(prompt, system)
+        await self.set_by_key(self._make_key(prompt, system), response)
+    
+    async def set_by_key(self, key: str, response: str):
+        size = len(response.encode())
         async with self._lock:
+            if key in self.cache:
+                self._remove(key)
+            
             # Remove oldest if at capacity
-            while len(self.cache) >= self.max_size:
-                self.cache.popitem(last=False)
+            while self.cache and (
+                len(self.cache) >= self.max_size
+                or (self.max_bytes is not None and self.bytes + size > self.max_bytes)
+            ):
+                self._remove(next(iter(self.cache)))
             
             self.cache[key] = {
                 "response": response,
-                "timestamp": time.time()
+                "timestamp": time.time(),
+                "size": size
             }
+            self.bytes += size
+    
+    def _remove(self, key: str):
+        entry = self.cache.pop(key)
+        self.bytes -= entry["size"]
     
     async def clear(self):
         """Clear all cached entries"""
         async with self._lock:
             self.cache.clear()
+            self.bytes = 0
     
     @property
     def size(self) -> int:
@@ -349,6 +274,43 @@ class LLMProvider(ABC):
         attachments: Optional[List[Dict[str, Any]]] = None
     ) -> Optional[LLMResponse]:
         pass
+    
+    async def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        max_tokens: int = 600,
+        temperature: float = 0.3
+    ) -> AsyncIterator[str]:
+        """
+        Yield the response text as it is generated (plain text, no tools).
+        Raises on failure so the caller can fail over; providers without a
+        streaming API yield the complete response once.
+        """
+        response = await self.generate(prompt=prompt, system=system, max_tokens=max_tokens, temperature=temperature)
+        if not response or not response.content:
+            raise RuntimeError(f"{self.name} returned no content")
+        yield response.content
+
+
+async def iter_chat_completion_deltas(response: httpx.Response) -> AsyncIterator[str]:
+    """Text deltas of an OpenAI-compatible streaming chat completion (server-sent events)"""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue  # Comments/keep-alives (": OPENROUTER PROCESSING") and blank separators
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            return
+        try:
+            chunk = json.loads(payload)
+        except ValueError:
+            continue
+        if chunk.get("error"):
+            raise RuntimeError(f"Stream error: {chunk['error']}")
+        choices = chunk.get("choices") or [{}]
+        text = (choices[0].get("delta") or {}).get("content")
+        if text:
+            yield text
 
 
 class OpenAIProvider(LLMProvider):
@@ -386,6 +348,9 @@ class OpenAIProvider(LLMProvider):
         if not self.is_available:
             return None
         
+        await get_rate_limiter().wait_for_capacity(
+            self.name, self.config.openai_model, estimate_tokens(system, prompt) + max_tokens
+        )
         start_time = time.time()
         
         for attempt in range(self.config.max_retries):
@@ -479,6 +444,50 @@ class OpenAIProvider(LLMProvider):
     def _record_error(self):
         self._error_count += 1
         self._last_error_time = time.time()
+    
+    async def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        max_tokens: int = 600,
+        temperature: float = 0.3
+    ) -> AsyncIterator[str]:
+        if not self.is_available:
+            raise RuntimeError("OpenAI not available")
+        
+        await get_rate_limiter().wait_for_capacity(
+            self.name, self.config.openai_model, estimate_tokens(system, prompt) + max_tokens
+        )
+        body = {
+            "model": self.config.openai_model,
+            "messages": [
+                {"role": "system", "content": system or "You are a helpful assistant."},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+        try:
+            async with httpx.AsyncClient(timeout=60.0) as client:
+                async with client.stream(
+                    "POST",
+                    f"{self.config.openai_base_url}/chat/completions",
+                    headers={
+                        "Authorization": f"Bearer {self.config.openai_api_key}",
+                        "Content-Type": "application/json",
+                    },
+                    json=body,
+                ) as response:
+                    response.raise_for_status()
+                    async for text in iter_chat_completion_deltas(response):
+                        yield text
+            self._error_count = 0
+        except httpx.HTTPError as e:
+            # No patient retry while a user watches the stream: fail over instead
+            self._record_error()
+            logger.error(f"OpenAI stream error: {e}")
+            raise
 
 
 class GeminiProvider(LLMProvider):
@@ -568,8 +577,10 @@ class GeminiProvider(LLMProvider):
             logger.warning("Gemini client not available")
             return None
         
-        # CRITICAL: Enforce global rate limit HERE for Gemini only
-        await get_rate_limiter().wait_for_capacity()
+        # CRITICAL: Take RPM/TPM capacity from the shared buckets before calling Gemini
+        await get_rate_limiter().wait_for_capacity(
+            self.name, self.config.google_model, estimate_tokens(system, prompt) + max_tokens
+        )
         
         start_time = time.time()
         
@@ -663,7 +674,7 @@ class GeminiProvider(LLMProvider):
                 
                 latency = int((time.time() - start_time) * 1000)
                 self._error_count = 0
-                get_rate_limiter().report_success()
+                get_rate_limiter().report_success(self.name)
                 
                 return LLMResponse(
                     content=content.strip(),
@@ -679,11 +690,11 @@ class GeminiProvider(LLMProvider):
                 # Check for rate limit errors (429)
                 if "429" in str(e) or "resource_exhausted" in error_str or "quota" in error_str:
                     # CRITICAL: Report 429 to global rate limiter
-                    get_rate_limiter().report_rate_limit_hit()
+                    get_rate_limiter().report_rate_limit_hit(self.name, self.config.google_model)
                     
                     if attempt < self.config.max_retries - 1:
                         # Patient Retry: Wait it out!
-                        global_remaining = get_rate_limiter().get_cooldown_remaining()
+                        global_remaining = get_rate_limiter().get_cooldown_remaining(self.name)
                         backoff_delay = self.config.base_delay * (1.5 ** attempt)
                         
                         delay = max(backoff_delay, global_remaining)
@@ -715,6 +726,52 @@ class GeminiProvider(LLMProvider):
         self._error_count += 1
         self._last_error_time = time.time()
 
+    async def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        max_tokens: int = 600,
+        temperature: float = 0.3
+    ) -> AsyncIterator[str]:
+        if not self.is_available:
+            raise RuntimeError("Gemini not available")
+        
+        client = GeminiProvider._client
+        if client is None:
+            raise RuntimeError("Gemini client not available")
+        
+        await get_rate_limiter().wait_for_capacity(
+            self.name, self.config.google_model, estimate_tokens(system, prompt) + max_tokens
+        )
+        
+        from google.genai import types
+        
+        full_prompt = f"{system}\n\n{prompt}" if system else prompt
+        config = types.GenerateContentConfig(
+            temperature=temperature,
+            max_output_tokens=max_tokens,
+        )
+        try:
+            stream = await client.aio.models.generate_content_stream(
+                model=self.config.google_model,
+                contents=[full_prompt],
+                config=config,
+            )
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+            self._error_count = 0
+            get_rate_limiter().report_success(self.name)
+        except Exception as e:
+            error_str = str(e).lower()
+            if "429" in error_str or "resource_exhausted" in error_str or "quota" in error_str:
+                # No patient retry while a user watches the stream: start the cooldown and fail over
+                get_rate_limiter().report_rate_limit_hit(self.name, self.config.google_model)
+            else:
+                self._record_error()
+            logger.error(f"Gemini stream error: {e}")
+            raise
+
     async def embed_text(self, text: str) -> Optional[List[float]]:
         """
         Generate embeddings for text using Gemini text-embedding-004 model.
@@ -728,8 +785,8 @@ class GeminiProvider(LLMProvider):
             return None
 
         try:
-            # Rate limit check
-            await get_rate_limiter().wait_for_capacity()
+            # Rate limit check (embeddings have their own per-model buckets)
+            await get_rate_limiter().wait_for_capacity(self.name, "text-embedding-004", estimate_tokens(text))
             
             # Run in executor because google-genai might be sync or we want to be safe
             response = await asyncio.get_event_loop().run_in_executor(
@@ -775,6 +832,14 @@ class OpenRouterProvider(LLMProvider):
             self._error_count = 0
         return True
     
+    def _models(self) -> List[str]:
+        """Models tried in order: fallbacks if the primary is rate limited (Free tier strategy)"""
+        return [
+            self.config.openrouter_model,  # Primary from config
+            "google/gemini-2.0-flash-exp:free", # User preferred
+            "google/gemini-2.0-pro-exp-02-05:free", # Pro fallback
+        ]
+    
     async def generate(
         self,
         prompt: str,
@@ -790,11 +855,7 @@ class OpenRouterProvider(LLMProvider):
         start_time = time.time()
         
         # fallback models if primary rate limits (Free tier strategy)
-        models_to_try = [
-            self.config.openrouter_model,  # Primary from config
-            "google/gemini-2.0-flash-exp:free", # User preferred
-            "google/gemini-2.0-pro-exp-02-05:free", # Pro fallback
-        ]
+        models_to_try = self._models()
         
         # Max global timeout for all attempts
         # Outer loop for Patient Retry of the ENTIRE model list
@@ -804,6 +865,9 @@ class OpenRouterProvider(LLMProvider):
                 # Try each model up to 2 times (short retry)
                 for attempt in range(2):
                     try:
+                        await get_rate_limiter().wait_for_capacity(
+                            self.name, model, estimate_tokens(system, prompt) + max_tokens
+                        )
                         async with httpx.AsyncClient(timeout=45.0) as client: # Reduced timeout per attempt
                             messages = []
                             if system:
@@ -913,6 +977,65 @@ class OpenRouterProvider(LLMProvider):
     def _record_error(self):
         self._error_count += 1
         self._last_error_time = time.time()
+    
+    async def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        max_tokens: int = 600,
+        temperature: float = 0.3
+    ) -> AsyncIterator[str]:
+        if not self.is_available:
+            raise RuntimeError("OpenRouter not available")
+        
+        messages = []
+        if system:
+            messages.append({"role": "system", "content": system})
+        messages.append({"role": "user", "content": prompt})
+        headers = {
+            "Authorization": f"Bearer {self.config.openrouter_api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://almudeer.royaraqamia.com",
+            "X-Title": "Al-Mudeer",
+        }
+        
+        # Next model only while nothing has been streamed yet
+        last_error: Optional[Exception] = None
+        for model in self._models():
+            await get_rate_limiter().wait_for_capacity(
+                self.name, model, estimate_tokens(system, prompt) + max_tokens
+            )
+            streamed = False
+            try:
+                async with httpx.AsyncClient(timeout=45.0) as client:
+                    async with client.stream(
+                        "POST",
+                        self.OPENROUTER_API_URL,
+                        headers=headers,
+                        json={
+                            "model": model,
+                            "messages": messages,
+                            "max_tokens": max_tokens,
+                            "temperature": temperature,
+                            "stream": True,
+                        },
+                    ) as response:
+                        response.raise_for_status()
+                        async for text in iter_chat_completion_deltas(response):
+                            streamed = True
+                            yield text
+                if streamed:
+                    self._error_count = 0
+                    return
+            except Exception as e:
+                if streamed:
+                    self._record_error()
+                    raise
+                logger.warning(f"OpenRouter stream failed on {model}: {e}")
+                last_error = e
+        
+        self._record_error()
+        raise RuntimeError(f"OpenRouter: all models failed to stream ({last_error})")
 
 
 # ============ Main Service ============
@@ -925,29 +1048,44 @@ class LLMService:
     - Automatic failover: OpenAI -> Gemini -> Rule-based
     - Response caching for identical prompts
     - Circuit breaker pattern for failing providers
+    - Hedged requests: a provider slower than its usual latency is raced
+      against the next one, first good answer wins
     - Retry with exponential backoff
     """
     
     def __init__(self, config: Optional[LLMConfig] = None):
         self.config = config or LLMConfig()
-        self.cache = LRUCache(
-            max_size=self.config.cache_max_size,
-            ttl_seconds=self.config.cache_ttl_seconds
-        ) if self.config.cache_enabled else None
+        self.cache = None
+        if self.config.cache_enabled:
+            from services.llm_cache import TieredLLMCache, create_response_store, LLM_CACHE_L1_MAX_BYTES
+            self.cache = TieredLLMCache(
+                LRUCache(
+                    max_size=self.config.cache_max_size,
+                    ttl_seconds=self.config.cache_ttl_seconds,
+                    max_bytes=LLM_CACHE_L1_MAX_BYTES
+                ),
+                create_response_store(),
+                ttl_seconds=self.config.cache_ttl_seconds
+            )
         
         # Initialize providers in priority order
         # OpenRouter is ENABLED by default as high-quality backup (Gemini 2.0 Flash)
         # providing failover when Gemini API hits daily rate limits
         enable_openrouter = os.getenv("ENABLE_OPENROUTER", "true").lower() == "true"
         
+        # Providers give up quickly and leave the retrying to failover, hedging
+        # and the circuit breakers instead of sleeping through their own retries
+        provider_config = replace(
+            self.config, max_retries=min(self.config.max_retries, LLM_PROVIDER_MAX_ATTEMPTS)
+        )
         self.providers: List[LLMProvider] = [
-            OpenAIProvider(self.config),  # Only used if OPENAI_API_KEY is set
-            GeminiProvider(self.config),   # PRIMARY - always active
+            OpenAIProvider(provider_config),  # Only used if OPENAI_API_KEY is set
+            GeminiProvider(provider_config),   # PRIMARY - always active
         ]
         
         # Only add OpenRouter if explicitly enabled (disabled by default for quality)
         if enable_openrouter:
-            self.providers.append(OpenRouterProvider(self.config))
+            self.providers.append(OpenRouterProvider(provider_config))
             logger.info("OpenRouter backup provider ENABLED")
         else:
             logger.info("OpenRouter backup provider DISABLED (Gemini-only mode)")
@@ -958,7 +1096,14 @@ class LLMService:
             "cache_hits": 0,
             "provider_calls": {},
             "failures": 0,
+            "streams": 0,
+            "streams_completed": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
         }
+        self._first_token_ms_total = 0.0
+        # Latency histogram and circuit breaker per provider name
+        self.health: Dict[str, ProviderHealth] = {}
         
         logger.info(f"LLM Service initialized with {len([p for p in self.providers if p.is_available])} available providers")
     
@@ -992,8 +1137,13 @@ class LLMService:
         
         # Check cache first
         # Disable cache if attachments are present (content might differ even if prompt is same)
-        if self.cache and use_cache and not attachments:
-            cached = await self.cache.get(prompt, system)
+        cache_key = None
+        if self.cache and use_cache and not attachments and not tools:
+            from services.llm_cache import make_cache_key
+            cache_key = make_cache_key(
+                prompt, system, self._primary_model(), temperature, json_mode, max_tokens
+            )
+            cached = await self.cache.get(cache_key)
             if cached:
                 self.stats["cache_hits"] += 1
                 return LLMResponse(
@@ -1003,67 +1153,261 @@ class LLMService:
                     cached=True
                 )
         
-        # Try each provider in order
-        for provider in self.providers:
-            # Smart Failover: Skip Gemini if global rate limiter is in cooldown
-            # This allows immediate failover to OpenRouter without waiting
-            if provider.name == "gemini":
-                rate_limiter = get_rate_limiter()
-                if rate_limiter.is_in_cooldown():
-                    remaining = rate_limiter.get_cooldown_remaining()
-                    logger.warning(f"Skipping Gemini due to active rate limit cooldown ({remaining:.1f}s), failing over to next provider")
+        # Providers in failover order; a slow one is hedged by starting the next in parallel
+        providers = self._eligible_providers()
+        call_kwargs = dict(
+            prompt=prompt,
+            system=system,
+            json_mode=json_mode,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            attachments=attachments
+        )
+        pending: Dict[asyncio.Task, LLMProvider] = {}
+        # Clocks exclude time queued on the rate limiter: that is not provider latency
+        waits: Dict[asyncio.Task, CapacityWait] = {}
+        hedges = set()
+        overdue = set()
+        
+        def launch() -> Optional[LLMProvider]:
+            # Half-open breakers let one probe through: claim it only when actually calling
+            while providers and not self._health(providers[0]).breaker.allow():
+                self._health(providers.pop(0)).stats["skipped"] += 1
+            if not providers:
+                return None
+            provider = providers.pop(0)
+            logger.debug(f"Trying provider: {provider.name}")
+            # Only pass tools to providers that support it (Gemini)
+            kwargs = dict(call_kwargs, tools=tools) if provider.name == "gemini" and tools else call_kwargs
+            with track_capacity_wait() as wait:
+                task = asyncio.ensure_future(provider.generate(**kwargs))
+            pending[task] = provider
+            waits[task] = wait
+            self._health(provider).stats["calls"] += 1
+            return provider
+        
+        try:
+            while pending or providers:
+                if not pending:
+                    launch()
                     continue
-
+                
+                # Wait on the calls in flight; hedge once the newest one runs past its latency
+                # percentile. Its clock stops while it is queued for capacity, so the deadline
+                # is worked out again whenever it enters or leaves the limiter's queue
+                hedge_after = None
+                requeued = None
+                if LLM_HEDGING_ENABLED and providers:
+                    newest_task, newest = list(pending.items())[-1]
+                    wait = waits[newest_task]
+                    wait.changed.clear()
+                    requeued = asyncio.ensure_future(wait.changed.wait())
+                    if not wait.queued:
+                        hedge_after = max(self._health(newest).hedge_delay() - wait.running_seconds(), 0)
+                done, _ = await asyncio.wait(
+                    list(pending) + ([requeued] if requeued else []),
+                    timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED
+                )
+                if requeued:
+                    requeued.cancel()
+                    done.discard(requeued)
+                    if not done and requeued.done():
+                        continue
+                if not done:
+                    slow_task, slow = list(pending.items())[-1]
+                    hedged = launch()
+                    if hedged is None:
+                        continue
+                    overdue.add(slow_task)
+                    hedges.add(list(pending)[-1])
+                    self.stats["hedged"] += 1
+                    logger.info(f"{slow.name} slower than {hedge_after:.1f}s, hedging with {hedged.name}")
+                    continue
+                
+                for task in done:
+                    provider = pending.pop(task)
+                    health = self._health(provider)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        logger.error(f"Provider {provider.name} raised: {e}")
+                        response = None
+                    
+                    if not (response and response.content):
+                        health.record_failure()
+                        continue
+                    
+                    health.record_success(waits[task].running_seconds() * 1000)
+                    if task in hedges:
+                        self.stats["hedge_wins"] += 1
+                    
+                    # Track usage
+                    self.stats["provider_calls"][provider.name] = \
+                        self.stats["provider_calls"].get(provider.name, 0) + 1
+                    
+                    # Cache successful response under the model that gave it (tool calls aren't cached)
+                    if cache_key and not response.tool_calls:
+                        await self.cache.set(make_cache_key(
+                            prompt, system, self._model_of(provider), temperature, json_mode, max_tokens
+                        ), response.content)
+                    
+                    logger.info(f"LLM response from {provider.name} ({response.latency_ms}ms)")
+                    return response
+        finally:
+            # First good answer wins: cancel whatever is still running. A call that
+            # had already run past its hedge deadline counts against its breaker,
+            # so a provider that always loses this way is eventually skipped. One
+            # queued on the rate limiter again (e.g. for its next model) was only
+            # waiting on local quota, not on the provider
+            for task, provider in pending.items():
+                task.cancel()
+                if task in overdue and not waits[task].queued:
+                    self._health(provider).record_slow()
+                else:
+                    self._health(provider).record_cancelled()
+        
+        # All providers failed
+        self.stats["failures"] += 1
+        logger.warning("All LLM providers failed, returning None (will be retried later)")
+        return None
+    
+    def _health(self, provider: LLMProvider) -> ProviderHealth:
+        if provider.name not in self.health:
+            self.health[provider.name] = ProviderHealth(provider.name)
+        return self.health[provider.name]
+    
+    def _eligible_providers(self) -> List[LLMProvider]:
+        """Providers worth calling now, in failover order (open circuit breakers are skipped)"""
+        eligible = []
+        for provider in self.providers:
+            # Smart Failover: Skip a provider in 429 cooldown (cooldowns are per provider)
+            # This allows immediate failover to the next one without waiting
+            rate_limiter = get_rate_limiter()
+            if rate_limiter.is_in_cooldown(provider.name):
+                remaining = rate_limiter.get_cooldown_remaining(provider.name)
+                logger.warning(f"Skipping {provider.name} due to active rate limit cooldown ({remaining:.1f}s), failing over to next provider")
+                continue
+            
             if not provider.is_available:
                 logger.debug(f"Provider {provider.name} not available, skipping")
                 continue
             
-            logger.debug(f"Trying provider: {provider.name}")
-            
-            # Only pass tools to providers that support it (Gemini)
-            if provider.name == "gemini" and tools:
-                response = await provider.generate(
-                    prompt=prompt,
-                    system=system,
-                    json_mode=json_mode,
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    attachments=attachments,
-                    tools=tools
-                )
-            else:
-                response = await provider.generate(
+            health = self._health(provider)
+            if health.breaker.state == CircuitBreaker.OPEN:
+                health.stats["skipped"] += 1
+                logger.debug(f"Provider {provider.name} circuit breaker open, skipping")
+                continue
+            eligible.append(provider)
+        return eligible
+    
+    async def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        max_tokens: int = 600,
+        temperature: float = 0.3,
+        use_cache: bool = True
+    ) -> AsyncIterator[str]:
+        """
+        Stream a plain-text response chunk by chunk.
+        
+        Providers are tried in failover order until one produces its first
+        chunk; after that the answer can't switch providers, so a later
+        error propagates. The assembled text is cached like generate()'s
+        (a cache hit is yielded as a single chunk).
+        """
+        self.stats["total_requests"] += 1
+        self.stats["streams"] += 1
+        
+        cache_key = None
+        if self.cache and use_cache:
+            from services.llm_cache import make_cache_key
+            cache_key = make_cache_key(
+                prompt, system, self._primary_model(), temperature, False, max_tokens
+            )
+            cached = await self.cache.get(cache_key)
+            if cached:
+                self.stats["cache_hits"] += 1
+                yield cached
+                return
+        
+        start_time = time.time()
+        for provider in self._eligible_providers():
+            health = self._health(provider)
+            if not health.breaker.allow():
+                health.stats["skipped"] += 1
+                continue
+            health.stats["calls"] += 1
+            parts: List[str] = []
+            try:
+                async for text in provider.generate_stream(
                     prompt=prompt,
                     system=system,
-                    json_mode=json_mode,
                     max_tokens=max_tokens,
-                    temperature=temperature,
-                    attachments=attachments
-                )
+                    temperature=temperature
+                ):
+                    if not parts:
+                        first_token_ms = (time.time() - start_time) * 1000
+                    parts.append(text)
+                    yield text
+            except Exception as e:
+                health.record_failure()
+                if parts:
+                    self.stats["failures"] += 1
+                    raise
+                logger.warning(f"Stream from {provider.name} failed before the first token, failing over: {e}")
+                continue
+            finally:
+                # Client went away mid-stream: free a half-open breaker's probe slot
+                health.breaker.release()
             
-            if response and response.content:
-                # Track usage
+            if parts:
+                health.stats["successes"] += 1
+                health.breaker.record_success()
                 self.stats["provider_calls"][provider.name] = \
                     self.stats["provider_calls"].get(provider.name, 0) + 1
-                
-                # Cache successful response
-                if self.cache and use_cache:
-                    await self.cache.set(prompt, response.content, system)
-                
-                logger.info(f"LLM response from {provider.name} ({response.latency_ms}ms)")
-                return response
+                self.stats["streams_completed"] += 1
+                self._first_token_ms_total += first_token_ms
+                if cache_key:
+                    await self.cache.set(make_cache_key(
+                        prompt, system, self._model_of(provider), temperature, False, max_tokens
+                    ), "".join(parts).strip())
+                logger.info(f"LLM stream from {provider.name} ({int((time.time() - start_time) * 1000)}ms)")
+                return
         
-        # All providers failed
         self.stats["failures"] += 1
-        logger.warning("All LLM providers failed, returning None (will be retried later)")
-        return None
+        raise RuntimeError("All LLM providers failed to stream")
+    
+    def _model_of(self, provider: LLMProvider) -> str:
+        """Provider and model a response came from (part of the cache key)"""
+        models = {
+            "openai": self.config.openai_model,
+            "gemini": self.config.google_model,
+            "openrouter": self.config.openrouter_model,
+        }
+        return f"{provider.name}:{models.get(provider.name, '')}"
+    
+    def _primary_model(self) -> str:
+        """Model that answers first in the failover chain: lookups use its key, so
+        answers a fallback gave (cached under the fallback's key) aren't served as its own"""
+        for provider in self.providers:
+            if provider.is_available:
+                return self._model_of(provider)
+        return ""
     
     def get_stats(self) -> Dict[str, Any]:
         """Get service statistics"""
         return {
             **self.stats,
             "cache_size": self.cache.size if self.cache else 0,
+            "cache": self.cache.get_stats() if self.cache else None,
+            "rate_limiter": get_rate_limiter().get_stats(),
+            "stream_avg_first_token_ms": (
+                round(self._first_token_ms_total / self.stats["streams_completed"])
+                if self.stats["streams_completed"] else None
+            ),
             "available_providers": [p.name for p in self.providers if p.is_available],
+            "providers": {name: health.get_stats() for name, health in self.health.items()},
         }
     
     async def health_check(self) -> Dict[str, Any]:
@@ -1093,6 +1437,11 @@ def get_llm_service() -> LLMService:
     return _llm_service
 
 
+def get_llm_stats() -> Optional[Dict[str, Any]]:
+    """Stats of the global LLM service (cache tiers included), None if not created yet"""
+    return _llm_service.get_stats() if _llm_service else None
+
+
 async def llm_generate(
     prompt: str,
     system: Optional[str] = None,
@@ -1105,8 +1454,8 @@ async def llm_generate(
     """
     Convenience function for generating LLM responses.
     
-    Uses global rate limiter + semaphore to prevent rate limiting.
-    Rate limiter enforces minimum 10s between requests (6 RPM max).
+    Uses the per-priority semaphore to cap concurrency; providers take
+    RPM/TPM capacity from the shared rate limiter buckets.
     Returns content string (legacy) or LLMResponse object (if tools used).
     """
     service = get_llm_service()
@@ -1114,8 +1463,8 @@ async def llm_generate(
     
     # Wait for semaphore - limits to N concurrent LLM requests
     async with semaphore:
-        # Note: We removed the global rate_limiter.wait_for_capacity() call here.
-        # It is now handled inside GeminiProvider.generate() to allow failover to OpenRouter.
+        # Note: rate limiting is not done here.
+        # It is handled inside each provider's generate() to allow failover to OpenRouter.
         
         logger.debug(f"Acquired LLM semaphore, processing request...")
         response = await service.generate(
@@ -1140,3 +1489,25 @@ async def llm_generate(
             
         return response.content if response else None
 
+
+async def llm_generate_stream(
+    prompt: str,
+    system: Optional[str] = None,
+    max_tokens: int = 1024,
+    temperature: float = 0.3,
+) -> AsyncIterator[str]:
+    """
+    Streaming counterpart of llm_generate(): yields text chunks as the
+    provider produces them (same per-priority semaphore, held for the stream).
+    """
+    service = get_llm_service()
+    semaphore = get_llm_semaphore(service.config.max_concurrent_requests)
+    
+    async with semaphore:
+        async for text in service.generate_stream(
+            prompt=prompt,
+            system=system,
+            max_tokens=max_tokens,
+            temperature=temperature
+        ):
+            yield text
@@ -637,43 +637,36 @@ async def send_notification(
                 title=payload.title,
                 message=payload.message,
                 priority=payload.priority.value,
-                link=payload.link
+                link=payload.link,
+                push=False
             )
             results["in_app"] = {"success": True, "id": notif_obj_id}
 
-            # 2. Trigger Mobile Push (FCM) - only if notifications enabled
+            # 2. Queue Mobile (FCM) and Web Push delivery - only if notifications enabled
             # We assume IN_APP implies a desire to reach the user's device
             if notifications_enabled:
                 try:
-                    from services.fcm_mobile_service import send_fcm_to_license
-                    fcm_count = await send_fcm_to_license(
-                        license_id=license_id,
-                        title=payload.title,
-                        body=payload.message,
+                    from models.notification_outbox import (
+                        enqueue_notification_push, available_push_channels, CHANNEL_FCM, CHANNEL_WEB_PUSH,
+                    )
+                    channels_queued = available_push_channels()
+                    await enqueue_notification_push(
+                        license_id,
+                        notif_obj_id,
+                        payload.title,
+                        payload.message,
                         link=payload.link,
                         data=payload.metadata,
+                        priority=payload.priority.value,
                         image=payload.image,
-                        notification_id=notif_obj_id
+                        channels=channels_queued
                     )
-                    results["mobile_push"] = {"success": True, "count": fcm_count}
+                    results["mobile_push"] = {"success": True, "queued": CHANNEL_FCM in channels_queued}
+                    if CHANNEL_WEB_PUSH in channels_queued:
+                        results["web_push"] = {"success": True, "queued": True}
                 except Exception as e:
                     # Log but don't fail the whole request
                     results["mobile_push"] = {"success": False, "error": str(e)}
-
-                # 3. Trigger Web Push
-                try:
-                    from services.push_service import send_push_to_license, WEBPUSH_AVAILABLE
-                    if WEBPUSH_AVAILABLE:
-                        web_count = await send_push_to_license(
-                            license_id=license_id,
-                            title=payload.title,
-                            message=payload.message,
-                            link=payload.link or "/dashboard/notifications",
-                            notification_id=notif_obj_id
-                        )
-                        results["web_push"] = {"success": True, "count": web_count}
-                except Exception as e:
-                    results["web_push"] = {"success": False, "error": str(e)}
             else:
                 results["mobile_push"] = {"success": True, "skipped": "notifications_disabled"}
                 results["web_push"] = {"success": True, "skipped": "notifications_disabled"}
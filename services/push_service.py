@@ -242,7 +242,7 @@ async def send_push_to_license(
     sent_count = 0
     expired_ids = []
     
-    async with get_db() as db:
+    async with get_db(readonly=True) as db:
         # Get all push subscriptions for this license
         rows = await fetch_all(
             db,
@@ -253,53 +253,54 @@ async def send_push_to_license(
             [license_id]
         )
         
-        if not rows:
-            return 0
-        
-        for row in rows:
-            try:
-                subscription_info = json.loads(row["subscription_info"])
-                # Track delivery
-                if notification_id:
-                    try:
-                        from services.notification_service import track_notification_delivery
-                        await track_notification_delivery(
-                            license_id=license_id,
-                            notification_id=notification_id,
-                            platform="web",
-                            notification_type="general"
-                        )
-                    except Exception as e:
-                        logger.warning(f"Push: Tracking failed: {e}")
+    if not rows:
+        return 0
+    
+    for row in rows:
+        try:
+            subscription_info = json.loads(row["subscription_info"])
+            # Track delivery
+            if notification_id:
+                try:
+                    from services.notification_service import track_notification_delivery
+                    await track_notification_delivery(
+                        license_id=license_id,
+                        notification_id=notification_id,
+                        platform="web",
+                        notification_type="general"
+                    )
+                except Exception as e:
+                    logger.warning(f"Push: Tracking failed: {e}")
 
-                success = await send_push_notification(
-                    subscription_info=subscription_info,
-                    title=title,
-                    message=message,
-                    link=link,
-                    tag=tag,
-                    priority=priority
-                )
-                
-                if success:
-                    sent_count += 1
-                else:
-                    # Mark subscription as inactive if it failed
-                    expired_ids.append(row["id"])
-            except Exception as e:
-                logger.warning(f"Error processing subscription {row['id']}: {e}")
+            success = await send_push_notification(
+                subscription_info=subscription_info,
+                title=title,
+                message=message,
+                link=link,
+                tag=tag,
+                priority=priority
+            )
+            
+            if success:
+                sent_count += 1
+            else:
+                # Mark subscription as inactive if it failed
                 expired_ids.append(row["id"])
-        
-        # Clean up expired subscriptions
-        if expired_ids:
-            placeholders = ",".join("?" for _ in expired_ids)
+        except Exception as e:
+            logger.warning(f"Error processing subscription {row['id']}: {e}")
+            expired_ids.append(row["id"])
+    
+    # Clean up expired subscriptions
+    if expired_ids:
+        placeholders = ",".join("?" for _ in expired_ids)
+        async with get_db() as db:
             await execute_sql(
                 db,
                 f"UPDATE push_subscriptions SET is_active = FALSE WHERE id IN ({placeholders})",
                 expired_ids
             )
             await commit_db(db)
-            logger.info(f"Marked {len(expired_ids)} expired push subscriptions as inactive")
+        logger.info(f"Marked {len(expired_ids)} expired push subscriptions as inactive")
     
     return sent_count
 
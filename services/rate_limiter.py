@@ -0,0 +1,646 @@
+"""
+Al-Mudeer - Distributed LLM Rate Limiter
+Token buckets for requests/minute and tokens/minute per provider and model,
+shared by every worker (Redis, or an on-disk SQLite file), with priority
+classes and per-license fair queuing for callers that have to wait
+"""
+
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+PRIORITY_INTERACTIVE = "interactive"  # A user is waiting on the answer (drafts, /analyze)
+PRIORITY_BACKGROUND = "background"    # Queue workers and retries
+_PRIORITY_ORDER = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 1}
+
+# auto (Redis when cache.CacheManager has it, else SQLite), redis, sqlite, memory (per process)
+LLM_RATE_LIMIT_BACKEND = os.getenv("LLM_RATE_LIMIT_BACKEND", "auto").lower()
+LLM_RATE_LIMIT_SQLITE_PATH = os.getenv("LLM_RATE_LIMIT_SQLITE_PATH", "llm_rate_limit.db")
+# provider[:model]=rpm/tpm, comma-separated (tpm 0 = not limited). Providers
+# without an entry are not limited. Each model gets its own buckets.
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "gemini=15/1000000")
+# Share of each bucket that background callers leave for interactive ones
+LLM_BACKGROUND_RESERVE = float(os.getenv("LLM_BACKGROUND_RESERVE", "0.2"))
+# Most of a provider's RPM one license may take (1 = no per-license cap)
+LLM_LICENSE_SHARE = float(os.getenv("LLM_LICENSE_SHARE", "1.0"))
+
+# Longest a queued caller sleeps before re-checking the buckets
+MAX_WAIT_SLICE = 1.0
+
+
+def estimate_tokens(*texts: Optional[str]) -> int:
+    """Rough token count for quota purposes (~4 characters per token)"""
+    return sum(len(text) for text in texts if text) // 4 + 1
+
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """'gemini=15/1000000,gemini:gemini-2.5-pro=5/250000' -> {"gemini:*": (15, 1000000), ...}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            target, values = item.split("=", 1)
+            rpm, _, tpm = values.partition("/")
+            provider, _, model = target.strip().partition(":")
+            limits[f"{provider}:{model or '*'}"] = (int(rpm), int(tpm or 0))
+        except ValueError:
+            logger.warning(f"Ignoring malformed LLM_RATE_LIMITS entry: {item!r}")
+    return limits
+
+
+@dataclass
+class Bucket:
+    """One token bucket: holds up to capacity, refills at rate per second"""
+    key: str
+    capacity: float
+    rate: float
+    cost: float
+    reserve: float = 0.0  # Level that must remain after this take
+
+
+def refill_and_take(buckets: List[Bucket], state: Dict[str, Tuple[float, float]], now: float):
+    """
+    Shared bucket arithmetic: (new state to save or None, seconds to wait).
+    All buckets are taken together or not at all; missing buckets start full
+    so a quiet provider can burst up to its quota.
+    """
+    levels = {}
+    wait = 0.0
+    for bucket in buckets:
+        level, updated = state.get(bucket.key, (bucket.capacity, now))
+        level = min(bucket.capacity, level + max(0.0, now - updated) * bucket.rate)
+        levels[bucket.key] = level
+        needed = min(bucket.cost, bucket.capacity) + bucket.reserve
+        if level < needed:
+            wait = max(wait, (needed - level) / bucket.rate)
+    if wait > 0:
+        return None, wait
+    return {b.key: (levels[b.key] - min(b.cost, b.capacity), now) for b in buckets}, 0.0
+
+
+class MemoryBucketStore:
+    """Buckets in this process only (no shared backend available)"""
+    name = "memory"
+
+    def __init__(self):
+        self._state: Dict[str, Tuple[float, float]] = {}
+
+    async def take(self, buckets: List[Bucket]) -> float:
+        new_state, wait = refill_and_take(buckets, self._state, time.time())
+        if new_state:
+            self._state.update(new_state)
+        return wait
+
+    async def drain(self, keys: List[str]):
+        now = time.time()
+        for key in keys:
+            self._state[key] = (0.0, now)
+
+
+# KEYS: bucket keys. ARGV: now, ttl, then capacity/rate/cost/reserve per key.
+# Returns 0 when taken, else milliseconds to wait.
+_TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local base = 2 + (i - 1) * 4
+    local capacity = tonumber(ARGV[base + 1])
+    local rate = tonumber(ARGV[base + 2])
+    local cost = math.min(tonumber(ARGV[base + 3]), capacity)
+    local reserve = tonumber(ARGV[base + 4])
+    local stored = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(stored[1]) or capacity
+    local updated = tonumber(stored[2]) or now
+    level = math.min(capacity, level + math.max(0, now - updated) * rate)
+    levels[i] = level - cost
+    if level < cost + reserve then
+        wait = math.max(wait, (cost + reserve - level) / rate)
+    end
+end
+if wait > 0 then
+    return math.ceil(wait * 1000)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'level', tostring(levels[i]), 'ts', tostring(now))
+    redis.call('EXPIRE', key, ttl)
+end
+return 0
+"""
+
+
+class RedisBucketStore:
+    """
+    Buckets as Redis hashes, taken atomically by a Lua script so every
+    worker draws from the same quota.
+    Uses the sync client of cache.CacheManager (calls run in a thread).
+    """
+    name = "redis"
+
+    def __init__(self, redis_client: Any, prefix: str = "llmrate"):
+        self._redis = redis_client
+        self.prefix = prefix
+        self._script = redis_client.register_script(_TAKE_SCRIPT)
+
+    def _take(self, buckets: List[Bucket]) -> float:
+        args: List[Any] = [time.time(), 120]
+        for bucket in buckets:
+            args.extend([bucket.capacity, bucket.rate, bucket.cost, bucket.reserve])
+        keys = [f"{self.prefix}:{bucket.key}" for bucket in buckets]
+        return int(self._script(keys=keys, args=args)) / 1000
+
+    def _drain(self, keys: List[str]):
+        pipe = self._redis.pipeline()
+        for key in keys:
+            pipe.hset(f"{self.prefix}:{key}", mapping={"level": 0, "ts": time.time()})
+            pipe.expire(f"{self.prefix}:{key}", 120)
+        pipe.execute()
+
+    async def take(self, buckets: List[Bucket]) -> float:
+        return await asyncio.to_thread(self._take, buckets)
+
+    async def drain(self, keys: List[str]):
+        await asyncio.to_thread(self._drain, keys)
+
+
+class SQLiteBucketStore:
+    """
+    Buckets in an on-disk SQLite file (separate from the app database),
+    shared by workers on the same host. BEGIN IMMEDIATE serializes the
+    read-modify-write across processes.
+    """
+    name = "sqlite"
+
+    def __init__(self, path: str = LLM_RATE_LIMIT_SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_rate_buckets (
+                key TEXT PRIMARY KEY,
+                level REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def _take(self, buckets: List[Bucket]) -> float:
+        keys = [bucket.key for bucket in buckets]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    f"SELECT key, level, updated_at FROM llm_rate_buckets WHERE key IN ({','.join('?' * len(keys))})",
+                    keys
+                ).fetchall()
+                new_state, wait = refill_and_take(buckets, {row[0]: (row[1], row[2]) for row in rows}, time.time())
+                if new_state:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO llm_rate_buckets (key, level, updated_at) VALUES (?, ?, ?)",
+                        [(key, level, updated) for key, (level, updated) in new_state.items()]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def _drain(self, keys: List[str]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO llm_rate_buckets (key, level, updated_at) VALUES (?, 0, ?)",
+                [(key, now) for key in keys]
+            )
+
+    async def take(self, buckets: List[Bucket]) -> float:
+        return await asyncio.to_thread(self._take, buckets)
+
+    async def drain(self, keys: List[str]):
+        await asyncio.to_thread(self._drain, keys)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_bucket_store(backend: str = LLM_RATE_LIMIT_BACKEND, redis_client: Optional[Any] = None):
+    """Bucket store for the configured backend (memory when nothing shared is available)"""
+    if backend == "memory":
+        return MemoryBucketStore()
+    if backend in ("auto", "redis"):
+        if redis_client is None:
+            from cache import cache
+            redis_client = cache.redis_client if cache.use_redis else None
+        if redis_client is not None:
+            return RedisBucketStore(redis_client)
+        if backend == "redis":
+            logger.warning("LLM rate limiter: Redis unavailable, using the SQLite store")
+    try:
+        return SQLiteBucketStore()
+    except Exception as e:
+        logger.warning(f"LLM rate limiter: SQLite store unavailable ({e}), limiting per process")
+        return MemoryBucketStore()
+
+
+# (priority, license_id) of the LLM calls made in the current task
+_request_context: contextvars.ContextVar = contextvars.ContextVar(
+    "llm_request_context", default=(PRIORITY_INTERACTIVE, None)
+)
+
+
+def current_request_context() -> Tuple[str, Any]:
+    """(priority, license_id) for LLM calls made by the current task"""
+    return _request_context.get()
+
+
+@contextmanager
+def llm_request_context(priority: Optional[str] = None, license_id: Any = None):
+    """
+    Tag LLM calls made inside the block with a priority and/or license.
+    Unset values are inherited from the enclosing context.
+    """
+    current_priority, current_license = _request_context.get()
+    token = _request_context.set((
+        priority or current_priority,
+        license_id if license_id is not None else current_license
+    ))
+    try:
+        yield
+    finally:
+        _request_context.reset(token)
+
+
+class CapacityWait:
+    """
+    Clock of one LLM call that leaves out the time it spends queued on the
+    limiter (or sleeping out a 429 cooldown), so queueing is not mistaken
+    for provider latency
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.queued_since: Optional[float] = None
+        self.queued_seconds = 0.0
+        self.changed = asyncio.Event()
+
+    @property
+    def queued(self) -> bool:
+        return self.queued_since is not None
+
+    def running_seconds(self) -> float:
+        """Time since the call started, minus the time it spent queued"""
+        now = time.monotonic()
+        queued = self.queued_seconds + (now - self.queued_since if self.queued else 0.0)
+        return now - self.started - queued
+
+    def enter(self):
+        if not self.queued:
+            self.queued_since = time.monotonic()
+            self.changed.set()
+
+    def leave(self):
+        if self.queued:
+            self.queued_seconds += time.monotonic() - self.queued_since
+            self.queued_since = None
+            self.changed.set()
+
+
+_capacity_wait: contextvars.ContextVar = contextvars.ContextVar("llm_capacity_wait", default=None)
+
+
+@contextmanager
+def track_capacity_wait():
+    """
+    Yield a CapacityWait for the LLM call started inside the block. Tasks
+    created inside it inherit the tracker, so start the call's task here.
+    """
+    wait = CapacityWait()
+    token = _capacity_wait.set(wait)
+    try:
+        yield wait
+    finally:
+        _capacity_wait.reset(token)
+
+
+@contextmanager
+def _queued_for_capacity():
+    """Mark the calling LLM call as queued (not yet running) for the block"""
+    wait = _capacity_wait.get()
+    if wait is None:
+        yield
+        return
+    wait.enter()
+    try:
+        yield
+    finally:
+        wait.leave()
+
+
+@dataclass
+class _Waiter:
+    buckets: List[Bucket]
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class _BucketGroup:
+    """Callers queued for one provider/model, by priority then license (round-robin)"""
+
+    def __init__(self):
+        self.queues: Dict[int, "OrderedDict[Any, Deque[_Waiter]]"] = {
+            order: OrderedDict() for order in _PRIORITY_ORDER.values()
+        }
+        self.wakeup = asyncio.Event()
+        self.dispatcher: Optional[asyncio.Task] = None
+
+    def has_waiters(self, up_to_order: int) -> bool:
+        return any(self.queues[order] for order in self.queues if order <= up_to_order)
+
+    def push(self, order: int, license_id: Any, waiter: _Waiter):
+        self.queues[order].setdefault(license_id, deque()).append(waiter)
+        self.wakeup.set()
+
+    def head(self) -> Optional[Tuple[int, Any, _Waiter]]:
+        """Next waiter: highest priority first, then the license served least recently"""
+        for order in sorted(self.queues):
+            licenses = self.queues[order]
+            while licenses:
+                license_id, waiters = next(iter(licenses.items()))
+                while waiters and waiters[0].future.done():
+                    waiters.popleft()  # Caller gave up (cancelled/timed out)
+                if waiters:
+                    return order, license_id, waiters[0]
+                del licenses[license_id]
+        return None
+
+    def pop(self, order: int, license_id: Any):
+        """Remove the served head and move its license to the back of the line"""
+        licenses = self.queues[order]
+        waiters = licenses.pop(license_id)
+        waiters.popleft()
+        if waiters:
+            licenses[license_id] = waiters
+
+
+class LLMRateLimiter:
+    """
+    Distributed token-bucket limiter for LLM providers.
+
+    Each provider/model has an RPM bucket and, when configured, a TPM
+    bucket. Buckets start full (bursts up to the quota) and refill
+    continuously. They live in a shared store, so all workers draw from
+    one quota.
+
+    Priorities: background callers must leave LLM_BACKGROUND_RESERVE of
+    each bucket untouched, so interactive calls (a user waiting on a draft)
+    get capacity first even across workers. In-process, queued callers are
+    served by priority and then round-robin across licenses; an optional
+    per-license bucket (LLM_LICENSE_SHARE) caps any one license's share.
+
+    No lock is held while waiting: each provider/model has its own queue,
+    and a caller only queues when the buckets are empty.
+
+    A 429 from a provider drains its buckets for every worker and starts
+    that provider's exponential cooldown, which LLMService uses to fail over
+    (other providers keep serving meanwhile).
+    """
+
+    # Base cooldown after 429 (5 minutes)
+    BASE_COOLDOWN = 300.0
+
+    # Maximum cooldown (1 hour) - for when daily limit is hit
+    MAX_COOLDOWN = 3600.0
+
+    def __init__(
+        self,
+        store: Optional[Any] = None,
+        limits: Optional[Dict[str, Tuple[int, int]]] = None,
+        background_reserve: float = LLM_BACKGROUND_RESERVE,
+        license_share: float = LLM_LICENSE_SHARE
+    ):
+        self.store = store
+        self.limits = parse_rate_limits(LLM_RATE_LIMITS) if limits is None else limits
+        self.background_reserve = background_reserve
+        self.license_share = license_share
+        self._groups: Dict[str, _BucketGroup] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._cooldown_until: Dict[str, float] = {}
+        self._consecutive_429s: Dict[str, int] = {}
+        self._wait_seconds_total = 0.0
+        self.stats: Dict[str, Any] = {
+            "granted": {priority: 0 for priority in _PRIORITY_ORDER},
+            "waited": 0,
+            "rate_limit_hits": 0,
+            "store_errors": 0,
+        }
+
+    def _get_store(self):
+        # Created on first use so importing/inspecting the limiter touches no backend
+        if self.store is None:
+            self.store = create_bucket_store()
+        return self.store
+
+    def _group(self, name: str) -> _BucketGroup:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Queues and their events belong to one event loop
+            self._loop = loop
+            self._groups = {}
+        group = self._groups.get(name)
+        if group is None:
+            group = self._groups[name] = _BucketGroup()
+        return group
+
+    def _limit_for(self, provider: str, model: str) -> Optional[Tuple[int, int]]:
+        return self.limits.get(f"{provider}:{model}") or self.limits.get(f"{provider}:*")
+
+    def _buckets(self, name: str, limit: Tuple[int, int], tokens: int, priority: str, license_id: Any) -> List[Bucket]:
+        rpm, tpm = limit
+        reserve = self.background_reserve if priority == PRIORITY_BACKGROUND else 0.0
+        buckets = [Bucket(f"{name}:rpm", rpm, rpm / 60, 1, rpm * reserve)]
+        if tpm:
+            buckets.append(Bucket(f"{name}:tpm", tpm, tpm / 60, max(1, tokens), tpm * reserve))
+        if license_id is not None and self.license_share < 1:
+            share = max(1.0, rpm * self.license_share)
+            buckets.append(Bucket(f"{name}:license:{license_id}", share, share / 60, 1))
+        return buckets
+
+    async def _take(self, buckets: List[Bucket]) -> float:
+        try:
+            return await self._get_store().take(buckets)
+        except Exception as e:
+            # Shared store down: limit per process rather than fail the request
+            self.stats["store_errors"] += 1
+            logger.warning(f"LLM rate limiter store error, limiting per process: {e}")
+            self.store = MemoryBucketStore()
+            return await self.store.take(buckets)
+
+    async def wait_for_capacity(
+        self,
+        provider: str = "gemini",
+        model: str = "",
+        tokens: int = 0,
+        priority: Optional[str] = None,
+        license_id: Any = None
+    ) -> None:
+        """
+        Wait until the provider/model has a request (and `tokens`) to spare.
+        Priority and license default to the llm_request_context of the caller.
+        Also respects the provider's cooldown from 429 errors.
+        """
+        context_priority, context_license = _request_context.get()
+        priority = priority if priority in _PRIORITY_ORDER else context_priority
+        license_id = license_id if license_id is not None else context_license
+
+        remaining = self.get_cooldown_remaining(provider)
+        if remaining > 0:
+            logger.warning(f"Rate limiter: {provider} in 429 cooldown, waiting {remaining:.1f}s")
+            with _queued_for_capacity():
+                await asyncio.sleep(remaining)
+
+        limit = self._limit_for(provider, model)
+        if limit is None:
+            return
+
+        name = f"{provider}:{model or '*'}"
+        buckets = self._buckets(name, limit, tokens, priority, license_id)
+        group = self._group(name)
+        order = _PRIORITY_ORDER[priority]
+
+        # Fast path: nobody of equal or higher priority is queued ahead of us
+        if not group.has_waiters(order) and await self._take(buckets) == 0:
+            self.stats["granted"][priority] += 1
+            return
+
+        waiter = _Waiter(buckets, asyncio.get_running_loop().create_future())
+        group.push(order, license_id, waiter)
+        if group.dispatcher is None or group.dispatcher.done():
+            group.dispatcher = asyncio.create_task(self._dispatch(group))
+        with _queued_for_capacity():
+            await waiter.future
+
+        waited = time.monotonic() - waiter.queued_at
+        self._wait_seconds_total += waited
+        self.stats["waited"] += 1
+        self.stats["granted"][priority] += 1
+        if waited >= 1:
+            logger.info(f"Rate limiter: {priority} call to {name} waited {waited:.1f}s")
+
+    async def _dispatch(self, group: _BucketGroup):
+        """Serve one group's queue in order as its buckets refill"""
+        while True:
+            head = group.head()
+            if head is None:
+                return
+            order, license_id, waiter = head
+            if waiter.future.done():
+                # Caller gave up (e.g. a hedged LLM call that lost): don't spend quota on it
+                group.pop(order, license_id)
+                continue
+            group.wakeup.clear()
+            wait = await self._take(waiter.buckets)
+            if wait == 0:
+                group.pop(order, license_id)
+                if not waiter.future.done():
+                    waiter.future.set_result(None)
+                continue
+            # Sleep until a refill, or until a higher-priority caller queues
+            try:
+                await asyncio.wait_for(group.wakeup.wait(), timeout=min(wait, MAX_WAIT_SLICE))
+            except asyncio.TimeoutError:
+                pass
+
+    def report_rate_limit_hit(self, provider: str = "gemini", model: str = "") -> None:
+        """
+        Call this when a 429 response is received.
+        Uses exponential backoff for the provider's consecutive 429s and
+        empties its buckets so other workers slow down too.
+        """
+        hits = self._consecutive_429s[provider] = self._consecutive_429s.get(provider, 0) + 1
+        self.stats["rate_limit_hits"] += 1
+
+        # Exponential backoff: 5min, 10min, 20min, 40min, max 1 hour
+        cooldown = min(self.BASE_COOLDOWN * (2 ** (hits - 1)), self.MAX_COOLDOWN)
+        self._cooldown_until[provider] = time.time() + cooldown
+
+        logger.warning(f"Rate limiter: {provider} 429 #{hits}, cooldown {cooldown/60:.1f} minutes")
+
+        if hits >= 3:
+            logger.error(f"Rate limiter: {hits} consecutive 429s from {provider} - may have hit daily limit!")
+
+        if self._limit_for(provider, model) is not None:
+            name = f"{provider}:{model or '*'}"
+            try:
+                asyncio.get_running_loop().create_task(self._drain([f"{name}:rpm", f"{name}:tpm"]))
+            except RuntimeError:
+                pass  # No running loop (sync caller): the local cooldown still applies
+
+    async def _drain(self, keys: List[str]):
+        try:
+            await self._get_store().drain(keys)
+        except Exception as e:
+            logger.debug(f"LLM rate limiter drain failed: {e}")
+
+    def report_success(self, provider: str = "gemini") -> None:
+        """Call this when a request succeeds to reset the provider's 429 counter."""
+        hits = self._consecutive_429s.pop(provider, 0)
+        if hits > 0:
+            logger.info(f"Rate limiter: {provider} request succeeded, resetting 429 counter from {hits}")
+
+    def is_in_cooldown(self, provider: str = "gemini") -> bool:
+        """
+        Check if the provider is currently in a rate limit cooldown period.
+        Workers should check this BEFORE queuing any AI requests.
+        """
+        return time.time() < self._cooldown_until.get(provider, 0.0)
+
+    def get_cooldown_remaining(self, provider: str = "gemini") -> float:
+        """Get seconds remaining in the provider's cooldown, or 0 if not in cooldown."""
+        return max(0.0, self._cooldown_until.get(provider, 0.0) - time.time())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Grants per priority, queueing and cooldown state"""
+        stats = dict(self.stats)
+        stats["granted"] = dict(self.stats["granted"])
+        stats["avg_wait_seconds"] = (
+            round(self._wait_seconds_total / stats["waited"], 3) if stats["waited"] else 0.0
+        )
+        stats["queued"] = sum(
+            len(waiters)
+            for group in self._groups.values()
+            for licenses in group.queues.values()
+            for waiters in licenses.values()
+        )
+        stats["backend"] = self.store.name if self.store is not None else None
+        stats["limits"] = {key: {"rpm": rpm, "tpm": tpm} for key, (rpm, tpm) in self.limits.items()}
+        stats["cooldown_remaining"] = {
+            provider: round(self.get_cooldown_remaining(provider), 1)
+            for provider in self._cooldown_until
+            if self.is_in_cooldown(provider)
+        }
+        return stats
+
+
+_rate_limiter: Optional[LLMRateLimiter] = None
+
+
+def get_llm_rate_limiter() -> LLMRateLimiter:
+    """Process-wide limiter (its buckets are shared through the store)"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = LLMRateLimiter()
+        logger.info(f"LLM rate limiter initialized: {_rate_limiter.limits}")
+    return _rate_limiter
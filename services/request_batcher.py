@@ -4,6 +4,7 @@ Groups similar AI requests to reduce API calls
 """
 
 import asyncio
+import os
 import time
 from typing import Dict, List, Any, Optional
 from dataclasses import dataclass, field
@@ -30,20 +31,36 @@ class RequestBatcher:
     Batches similar AI requests to reduce API calls.
     
     Instead of processing each message individually, groups messages
-    and processes them in batches, reducing overhead.
+    and analyzes each batch with one multi-message LLM call. Messages the
+    combined response doesn't cover are processed individually.
     """
     
     def __init__(self, 
                  batch_size: int = 5,
                  batch_timeout: float = 2.0,
-                 max_wait_time: float = 5.0):
+                 max_wait_time: float = 5.0,
+                 combined: Optional[bool] = None):
         self.batch_size = batch_size
         self.batch_timeout = batch_timeout  # Wait this long to collect batch
         self.max_wait_time = max_wait_time  # Max wait before forcing process
+        # "combined" sends a whole batch in one prompt; "individual" keeps one call per message
+        if combined is None:
+            combined = os.getenv("REQUEST_BATCH_MODE", "combined").lower() == "combined"
+        self.combined = combined
         self._pending: Dict[str, List[BatchedRequest]] = defaultdict(list)
         self._lock = asyncio.Lock()
         self._batch_tasks: Dict[str, asyncio.Task] = {}
         self._running = False
+        self.stats: Dict[str, int] = {
+            "batches": 0,
+            "requests": 0,
+            "combined_requests": 0,
+            "fallback_requests": 0,
+            "filtered_requests": 0,
+            "parse_failures": 0,
+            "llm_calls": 0,
+            "calls_saved": 0,
+        }
     
     async def start(self):
         """Start the batching service"""
@@ -117,7 +134,7 @@ class RequestBatcher:
     
     async def _process_batch(self, batch_key: str):
         """Process all requests in a batch"""
-        from agent import process_message
+        from agent import process_message, process_message_batch
         
         batch = self._pending.pop(batch_key, [])
         if not batch:
@@ -125,8 +142,35 @@ class RequestBatcher:
         
         logger.info(f"Processing batch of {len(batch)} requests (key: {batch_key})")
         
-        # Process each request (could be optimized further with true batching)
-        for request in batch:
+        results: List[Optional[Dict[str, Any]]] = [None] * len(batch)
+        llm_calls = 0
+        filtered = 0
+        if self.combined and len(batch) > 1:
+            try:
+                analysis = await process_message_batch([
+                    {
+                        "message": request.message,
+                        "message_type": request.message_type,
+                        "sender_name": request.sender_name,
+                    }
+                    for request in batch
+                ])
+                results = analysis.results
+                llm_calls = analysis.llm_calls
+                filtered = analysis.filtered
+                if analysis.parse_failed:
+                    self.stats["parse_failures"] += 1
+            except Exception as e:
+                logger.warning(f"Combined analysis failed for batch {batch_key}, processing individually: {e}")
+        
+        fallback = 0
+        for request, result in zip(batch, results):
+            if result is not None:
+                request.future.set_result(result)
+                continue
+            
+            # Per-message path: not batched, or missing from the combined response
+            fallback += 1
             try:
                 result = await process_message(
                     message=request.message,
@@ -137,6 +181,40 @@ class RequestBatcher:
             except Exception as e:
                 logger.error(f"Batch request {request.request_id} failed: {e}")
                 request.future.set_result({"success": False, "error": str(e)})
+        
+        self._record_batch(len(batch), llm_calls, filtered, fallback)
+    
+    def _record_batch(self, size: int, llm_calls: int, filtered: int, fallback: int):
+        """
+        Update batching metrics.
+        
+        calls_saved compares against one call per unfiltered message; a failed
+        combined parse can make it negative for that batch.
+        """
+        combined = size - filtered - fallback
+        calls = llm_calls + fallback
+        saved = (size - filtered) - calls
+        
+        self.stats["batches"] += 1
+        self.stats["requests"] += size
+        self.stats["combined_requests"] += combined
+        self.stats["fallback_requests"] += fallback
+        self.stats["filtered_requests"] += filtered
+        self.stats["llm_calls"] += calls
+        self.stats["calls_saved"] += saved
+        
+        if llm_calls:
+            logger.info(
+                f"Batch analyzed: {combined} combined, {fallback} individual, "
+                f"{filtered} filtered, {saved} LLM calls saved"
+            )
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get batching metrics"""
+        stats: Dict[str, Any] = dict(self.stats)
+        stats["mode"] = "combined" if self.combined else "individual"
+        stats["pending"] = self.pending_count
+        return stats
     
     @property
     def pending_count(self) -> int:
@@ -157,6 +235,11 @@ async def get_request_batcher() -> RequestBatcher:
     return _request_batcher
 
 
+def get_batcher_stats() -> Optional[Dict[str, Any]]:
+    """Batching metrics of the global batcher, if it has been started"""
+    return _request_batcher.get_stats() if _request_batcher else None
+
+
 async def batch_analyze(message: str, 
                         message_type: str = "email",
                         sender_name: str = None,
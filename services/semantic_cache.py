@@ -0,0 +1,305 @@
+"""
+Al-Mudeer - Semantic LLM Cache
+Reuses a stored analysis/draft for near-duplicate customer messages
+("كم السعر؟" / "كم سعره؟") by embedding similarity, scoped per license
+"""
+
+import os
+import re
+import time
+import zlib
+import math
+import random
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+# Minimum cosine similarity for reusing a stored response
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+# local (hashed character n-grams, no API calls) or gemini (GeminiProvider.embed_text)
+SEMANTIC_CACHE_EMBEDDER = os.getenv("SEMANTIC_CACHE_EMBEDDER", "local").lower()
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "500"))  # per license
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+# Share of hits re-checked against the LLM in the background (quality sampling)
+SEMANTIC_CACHE_VERIFY_RATE = float(os.getenv("SEMANTIC_CACHE_VERIFY_RATE", "0.0"))
+
+# Best scores this close below the threshold count as near misses (threshold tuning)
+NEAR_MISS_MARGIN = 0.05
+
+_DIACRITICS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u0640]")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_ARABIC_FOLDS = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ى": "ي", "ة": "ه", "ؤ": "و", "ئ": "ي"})
+
+
+# Light stemming: attached article/conjunctions and possessive pronouns
+_PREFIXES = ("وال", "بال", "فال", "كال", "لل", "ال")
+_SUFFIXES = ("كم", "هم", "ها", "نا", "كي", "ه", "ك", "ي")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop tashkeel/tatweel and punctuation, fold alef/ya/ta marbuta variants"""
+    text = _DIACRITICS.sub("", text.lower()).translate(_ARABIC_FOLDS)
+    return " ".join(_PUNCTUATION.sub(" ", text).split())
+
+
+def light_stem(word: str) -> str:
+    """Strip one prefix and one suffix while keeping a stem of at least 3 letters"""
+    for prefix in _PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= 3:
+            word = word[len(prefix):]
+            break
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    return word
+
+
+class HashingEmbedder:
+    """
+    Local embedder: light-stemmed words plus their character 2-4-grams,
+    hashed into a fixed-size unit vector. Near-identical phrasings share most
+    features, with no model download and no API quota.
+    """
+    name = "local"
+
+    def __init__(self, dim: int = 512, ngram_range=(2, 4)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def embed_sync(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for word in normalize_text(text).split():
+            word = light_stem(word)
+            vector[zlib.crc32(f"w:{word}".encode()) % self.dim] += 2.0
+            padded = f" {word} "
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+                for start in range(max(1, len(padded) - n + 1)):
+                    gram = padded[start:start + n]
+                    vector[zlib.crc32(gram.encode()) % self.dim] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    async def embed(self, text: str) -> Optional[List[float]]:
+        return self.embed_sync(text)
+
+
+class GeminiEmbedder:
+    """Embeddings from GeminiProvider.embed_text (uses the shared LLM rate limiter)"""
+    name = "gemini"
+
+    def __init__(self):
+        from services.llm_provider import GeminiProvider, LLMConfig
+        self._provider = GeminiProvider(LLMConfig())
+
+    async def embed(self, text: str) -> Optional[List[float]]:
+        vector = await self._provider.embed_text(normalize_text(text))
+        if not vector:
+            return None
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else None
+
+
+class VectorIndex:
+    """
+    Flat index of unit vectors for one scope: a preallocated matrix searched
+    with one matrix-vector product (cosine = dot product). At capacity the
+    oldest entry is overwritten.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.dim: Optional[int] = None
+        self._matrix = None
+        self._vectors: List[List[float]] = []
+        self._entries: List[Dict[str, Any]] = []
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, vector: List[float], value: Any) -> bool:
+        """Store value under vector. Returns True if an older entry was overwritten."""
+        if self.dim is None:
+            self.dim = len(vector)
+            if NUMPY_AVAILABLE:
+                self._matrix = np.zeros((self.capacity, self.dim), dtype=np.float32)
+        if len(vector) != self.dim:
+            return False
+        entry = {"value": value, "stored_at": time.time()}
+        evicted = len(self._entries) == self.capacity
+        slot = self._next if evicted else len(self._entries)
+        if NUMPY_AVAILABLE:
+            self._matrix[slot] = vector
+        if evicted:
+            self._entries[slot] = entry
+            if not NUMPY_AVAILABLE:
+                self._vectors[slot] = vector
+            self._next = (self._next + 1) % self.capacity
+        else:
+            self._entries.append(entry)
+            if not NUMPY_AVAILABLE:
+                self._vectors.append(vector)
+        return evicted
+
+    def search(self, vector: List[float]):
+        """(entry, similarity) of the nearest stored vector, or (None, 0.0)"""
+        if not self._entries or len(vector) != self.dim:
+            return None, 0.0
+        if NUMPY_AVAILABLE:
+            scores = self._matrix[:len(self._entries)] @ np.asarray(vector, dtype=np.float32)
+            best = int(np.argmax(scores))
+            return self._entries[best], float(scores[best])
+        best, best_score = 0, -1.0
+        for position, stored in enumerate(self._vectors):
+            score = sum(a * b for a, b in zip(stored, vector))
+            if score > best_score:
+                best, best_score = position, score
+        return self._entries[best], best_score
+
+
+@dataclass
+class SemanticLookup:
+    """Result of SemanticCache.lookup; pass it back to store() on a miss"""
+    value: Optional[Any]
+    similarity: float
+    embedding: Optional[List[float]]
+    verify: bool = False
+
+
+class SemanticCache:
+    """
+    Per-scope (license + prompt setup) vector indexes of stored responses.
+    Counters: hits, misses, near misses, similarity of hits, expired
+    entries, evictions, embedding failures, lookup latency, and the
+    agreement rate of hits re-checked against the LLM.
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[Any] = None,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = SEMANTIC_CACHE_TTL_SECONDS,
+        verify_rate: float = SEMANTIC_CACHE_VERIFY_RATE
+    ):
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.verify_rate = verify_rate
+        self._indexes: Dict[str, VectorIndex] = {}
+        self._hit_similarity_total = 0.0
+        self._lookup_ms_total = 0.0
+        self.stats: Dict[str, int] = {
+            "lookups": 0,
+            "hits": 0,
+            "misses": 0,
+            "near_misses": 0,
+            "expired": 0,
+            "stores": 0,
+            "evictions": 0,
+            "embed_failures": 0,
+            "verified": 0,
+            "verified_agreed": 0,
+        }
+
+    @staticmethod
+    def scope(license_id: Any, *context: str) -> str:
+        """Scope key: entries are only reused within one license and prompt setup"""
+        digest = hashlib.sha256("||".join(context).encode()).hexdigest()[:16]
+        return f"{license_id}:{digest}"
+
+    async def lookup(self, scope: str, text: str) -> SemanticLookup:
+        started = time.perf_counter()
+        self.stats["lookups"] += 1
+        try:
+            embedding = await self.embedder.embed(text)
+        except Exception as e:
+            logger.debug(f"Semantic cache embedding failed: {e}")
+            embedding = None
+        if not embedding:
+            self.stats["embed_failures"] += 1
+            self.stats["misses"] += 1
+            return SemanticLookup(None, 0.0, None)
+
+        index = self._indexes.get(scope)
+        entry, similarity = index.search(embedding) if index else (None, 0.0)
+        self._lookup_ms_total += (time.perf_counter() - started) * 1000
+
+        if entry is not None and similarity >= self.threshold:
+            if time.time() - entry["stored_at"] <= self.ttl_seconds:
+                self.stats["hits"] += 1
+                self._hit_similarity_total += similarity
+                return SemanticLookup(
+                    entry["value"], similarity, embedding,
+                    verify=self.verify_rate > 0 and random.random() < self.verify_rate
+                )
+            self.stats["expired"] += 1
+        elif entry is not None and similarity >= self.threshold - NEAR_MISS_MARGIN:
+            self.stats["near_misses"] += 1
+
+        self.stats["misses"] += 1
+        return SemanticLookup(None, similarity, embedding)
+
+    def store(self, scope: str, lookup: SemanticLookup, value: Any):
+        """Remember value for the text embedded by lookup()"""
+        if not lookup.embedding:
+            return
+        index = self._indexes.get(scope)
+        if index is None:
+            index = self._indexes[scope] = VectorIndex(self.max_entries)
+        if index.add(lookup.embedding, value):
+            self.stats["evictions"] += 1
+        self.stats["stores"] += 1
+
+    def record_verification(self, agreed: bool):
+        """Outcome of re-checking a hit against a fresh LLM answer"""
+        self.stats["verified"] += 1
+        if agreed:
+            self.stats["verified_agreed"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["avg_hit_similarity"] = round(self._hit_similarity_total / stats["hits"], 4) if stats["hits"] else None
+        stats["avg_lookup_ms"] = round(self._lookup_ms_total / stats["lookups"], 3) if stats["lookups"] else 0.0
+        stats["agreement_rate"] = (
+            round(stats["verified_agreed"] / stats["verified"], 4) if stats["verified"] else None
+        )
+        stats["threshold"] = self.threshold
+        stats["embedder"] = self.embedder.name
+        stats["scopes"] = len(self._indexes)
+        stats["entries"] = sum(len(index) for index in self._indexes.values())
+        return stats
+
+
+_semantic_cache: Optional[SemanticCache] = None
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """The process-wide semantic cache, or None when SEMANTIC_CACHE_ENABLED is off"""
+    global _semantic_cache
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    if _semantic_cache is None:
+        embedder = GeminiEmbedder() if SEMANTIC_CACHE_EMBEDDER == "gemini" else HashingEmbedder()
+        _semantic_cache = SemanticCache(embedder=embedder)
+    return _semantic_cache
+
+
+def get_semantic_cache_stats() -> Optional[Dict[str, Any]]:
+    return _semantic_cache.get_stats() if _semantic_cache else None
@@ -0,0 +1,62 @@
+"""
+Al-Mudeer - Server-Sent Events
+Streams LLM output to clients as text/event-stream, so the first words
+show up as soon as the provider produces them
+"""
+
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from fastapi.responses import StreamingResponse
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# no-cache for browsers/proxies; X-Accel-Buffering stops nginx from buffering the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """One server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def text_stream_events(
+    chunks: AsyncIterator[str],
+    on_complete: Optional[Callable[[str], Awaitable[Any]]] = None
+) -> AsyncIterator[str]:
+    """
+    A "token" event per chunk, then "done" with the assembled text (after
+    on_complete has run on it), or "error" with whatever arrived before
+    generation failed.
+    """
+    parts = []
+    try:
+        async for text in chunks:
+            parts.append(text)
+            yield sse_event("token", {"text": text})
+    except Exception as e:
+        logger.error(f"Streaming generation failed after {len(parts)} chunks: {e}")
+        yield sse_event("error", {"error": "تعذر إكمال الرد، حاول مرة أخرى", "partial": "".join(parts)})
+        return
+
+    text = "".join(parts).strip()
+    if on_complete and text:
+        try:
+            await on_complete(text)
+        except Exception as e:
+            logger.error(f"Saving streamed text failed: {e}")
+    yield sse_event("done", {"text": text})
+
+
+def sse_response(
+    chunks: AsyncIterator[str],
+    on_complete: Optional[Callable[[str], Awaitable[Any]]] = None
+) -> StreamingResponse:
+    """StreamingResponse of text_stream_events()"""
+    return StreamingResponse(
+        text_stream_events(chunks, on_complete),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
@@ -118,7 +118,7 @@ class TelegramListenerService:
     async def _sync_sessions(self):
         """Sync active DB sessions with running clients"""
         # Fetch all active sessions
-        async with get_db() as db:
+        async with get_db(readonly=True) as db:
             try:
                 query = """
                     SELECT license_key_id, session_data_encrypted, phone_number 
@@ -290,10 +290,9 @@ class TelegramListenerService:
                         
                     channel_message_id = str(event.message.id)
                     
-                    # 3. Check for Duplicates (Basic check)
-                    # Ideally we use Redis, but here we query DB via `models`
-                    from models import get_inbox_messages
-                    # A better way is to rely on `save_inbox_message` ignoring duplicates or returning existing ID
+                    # 3. Check for Duplicates (shared with the poller and WhatsApp webhook)
+                    from services.dedup_store import get_dedup_store, inbound_message_key
+                    dedup_key = inbound_message_key(license_id, "telegram", channel_message_id)
                     
                     # NEW: Handle Outgoing Sync
                     if event.out:
@@ -301,6 +300,8 @@ class TelegramListenerService:
                         # Skip automated internal messages?
                         
                         recipient_id = str(event.chat_id)
+                        if await get_dedup_store("outbox_sync").contains(dedup_key):
+                            return
 
                         # EXCLUDE Channel Posts (Outgoing)
                         # If I post to my own channel, it shouldn't show in inbox.
@@ -389,9 +390,14 @@ class TelegramListenerService:
                              sent_at=event.message.date,
                              platform_message_id=channel_message_id
                         )
+                        await get_dedup_store("outbox_sync").add(dedup_key)
                         logger.info(f"Saved synced outgoing Telegram message to {recipient_name}")
                         return
 
+                    if await get_dedup_store("inbound").contains(dedup_key):
+                        logger.debug(f"Skipping already stored Telegram message {channel_message_id}")
+                        return
+
                     # Filter specific unwanted updates (e.g. pinned message service msg)
                     if hasattr(event.message, 'action') and event.message.action:
                          # e.g. MessageActionPinMessage
@@ -492,6 +498,7 @@ class TelegramListenerService:
                     )
                     
                     if msg_id:
+                        await get_dedup_store("inbound").add(dedup_key)
                         logger.info(f"Saved real-time Telegram message {msg_id} for license {license_id}")
                         
                         # 6. Trigger AI Analysis
@@ -598,28 +605,29 @@ class TelegramListenerService:
             
              # Fetch session from DB and start
              try:
-                async with get_db() as db:
+                async with get_db(readonly=True) as db:
                     row = await fetch_one(
                         db,
                         "SELECT session_data_encrypted, phone_number FROM telegram_phone_sessions WHERE license_key_id = ? AND is_active = TRUE",
                         [license_id]
                     )
                     
-                    if not row:
-                        logger.warning(f"No active session found for license {license_id}")
-                        return None
-                        
-                    session_data = row.get("session_data_encrypted") or row[0]
-                    phone_number = row.get("phone_number") or row[1]
+                if not row:
+                    logger.warning(f"No active session found for license {license_id}")
+                    return None
                     
-                    try:
-                        session_string = simple_decrypt(session_data)
-                    except Exception as e:
-                        logger.error(f"Failed to decrypt session: {e}")
-                        return None
-                        
-                    await self._start_client(license_id, session_string, phone_number)
-                    return self.clients.get(license_id)
+                session_data = row.get("session_data_encrypted") or row[0]
+                phone_number = row.get("phone_number") or row[1]
+                
+                try:
+                    session_string = simple_decrypt(session_data)
+                except Exception as e:
+                    logger.error(f"Failed to decrypt session: {e}")
+                    return None
+                    
+                # Connect outside the DB block: Telegram I/O must not hold a connection
+                await self._start_client(license_id, session_string, phone_number)
+                return self.clients.get(license_id)
 
              except Exception as e:
                 logger.error(f"Error ensuring active client for {license_id}: {e}")
@@ -205,37 +205,37 @@ class TelegramPhoneService:
                 # We need to know WHICH account we are using.
                 me = await client.get_me()
                 from db_helper import get_db, fetch_one
-                async with get_db() as db:
+                async with get_db(readonly=True) as db:
                     sess_row = await fetch_one(db, "SELECT license_key_id FROM telegram_phone_sessions WHERE user_id = ?", [str(me.id)])
-                    if sess_row:
-                        lic_id = sess_row['license_key_id']
-                        ent_row = await get_telegram_entity(lic_id, str(chat_id_int))
-                        if ent_row and ent_row.get('access_hash'):
-                            from telethon.tl.types import InputPeerUser, InputPeerChannel
-                            ah = int(ent_row['access_hash'])
-                            if ent_row['entity_type'] == 'user':
-                                peer = InputPeerUser(chat_id_int, ah)
-                            else:
-                                peer = InputPeerChannel(chat_id_int, ah)
-                            
-                            entity = await client.get_entity(peer)
-                            if entity:
-                                logger.info(f"Resolved entity {clean_id} using persisted access_hash from DB.")
-                                return entity
+                if sess_row:
+                    lic_id = sess_row['license_key_id']
+                    ent_row = await get_telegram_entity(lic_id, str(chat_id_int))
+                    if ent_row and ent_row.get('access_hash'):
+                        from telethon.tl.types import InputPeerUser, InputPeerChannel
+                        ah = int(ent_row['access_hash'])
+                        if ent_row['entity_type'] == 'user':
+                            peer = InputPeerUser(chat_id_int, ah)
+                        else:
+                            peer = InputPeerChannel(chat_id_int, ah)
+                        
+                        entity = await client.get_entity(peer)
+                        if entity:
+                            logger.info(f"Resolved entity {clean_id} using persisted access_hash from DB.")
+                            return entity
             except Exception as e:
                 logger.debug(f"DB Hash resolution failed: {e}")
 
         # 3. DB Alias (Phone/Username)
         if chat_id_int:
             from db_helper import get_db, fetch_one
-            async with get_db() as db:
+            async with get_db(readonly=True) as db:
                 row = await fetch_one(db, "SELECT sender_contact FROM inbox_messages WHERE sender_id = ? AND sender_contact != sender_id AND sender_contact != '' LIMIT 1", [str(chat_id_int)])
-                if row:
-                    alias = row.get("sender_contact") or row[0]
-                    try:
-                        entity = await client.get_entity(alias)
-                        if entity: return entity
-                    except: pass
+            if row:
+                alias = row.get("sender_contact") or row[0]
+                try:
+                    entity = await client.get_entity(alias)
+                    if entity: return entity
+                except: pass
         
         # 4. Dialogs (Deep Scan)
         try:
@@ -249,16 +249,16 @@ class TelegramPhoneService:
                         try:
                             from models import save_telegram_entity
                             me = await client.get_me()
-                            async with get_db() as db:
+                            async with get_db(readonly=True) as db:
                                 sess_row = await fetch_one(db, "SELECT license_key_id FROM telegram_phone_sessions WHERE user_id = ?", [str(me.id)])
-                                if sess_row:
-                                    await save_telegram_entity(
-                                        license_key_id=sess_row['license_key_id'],
-                                        entity_id=str(dialog.id),
-                                        access_hash=str(dialog.entity.access_hash),
-                                        entity_type='user' if hasattr(dialog.entity, 'first_name') else 'channel',
-                                        username=getattr(dialog.entity, 'username', None)
-                                    )
+                            if sess_row:
+                                await save_telegram_entity(
+                                    license_key_id=sess_row['license_key_id'],
+                                    entity_id=str(dialog.id),
+                                    access_hash=str(dialog.entity.access_hash),
+                                    entity_type='user' if hasattr(dialog.entity, 'first_name') else 'channel',
+                                    username=getattr(dialog.entity, 'username', None)
+                                )
                         except: pass
                     return dialog.entity
         except Exception as e:
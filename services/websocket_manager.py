@@ -9,16 +9,45 @@ Enhanced with Redis pub/sub for horizontal scaling across multiple workers.
 import asyncio
 import json
 import os
-from typing import Dict, Set, Optional, Any
+import time
+from typing import Dict, Set, Optional, Any, List, Tuple
 from datetime import datetime
 from dataclasses import dataclass, asdict
 
 from fastapi import WebSocket, WebSocketDisconnect
 from logging_config import get_logger
 
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
 logger = get_logger(__name__)
 
 
+# Frames buffered per socket before the slow-consumer policy applies
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# "close": disconnect the slow client (it reconnects and resyncs)
+# "drop_oldest": discard its oldest buffered frame
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "close").lower()
+# A single send taking longer than this marks the socket dead
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+# High-frequency events with the same key inside this window collapse to the latest
+WS_COALESCE_WINDOW_MS = int(os.getenv("WS_COALESCE_WINDOW_MS", "100"))
+
+# event -> data fields identifying what the event is about; a newer event for
+# the same thing supersedes a pending one
+COALESCED_EVENTS: Dict[str, Tuple[str, ...]] = {
+    "typing_indicator": ("sender_contact",),
+    "delivery_status": ("outbox_id", "inbox_message_id", "platform_message_id"),
+}
+
+# Cross-worker payload format: json (the client frame as-is) or msgpack (smaller)
+WS_PUBSUB_ENCODING = os.getenv("WS_PUBSUB_ENCODING", "json").lower()
+
+
 @dataclass
 class WebSocketMessage:
     """Structure for WebSocket messages"""
@@ -48,38 +77,53 @@ class RedisPubSubManager:
     """
     Manages Redis pub/sub for cross-process WebSocket message delivery.
     Enables horizontal scaling by broadcasting messages through Redis.
+    
+    Each worker holds one PSUBSCRIBE on CHANNEL_PREFIX* and dispatches by
+    the license id in the channel name to locally registered handlers, so
+    (un)subscribing a license is a dict update, not a Redis round-trip.
+    Concurrent publishes are flushed together in one pipeline.
+    Payloads are the client JSON frame itself (handlers forward it without
+    decoding), or a msgpack envelope with WS_PUBSUB_ENCODING=msgpack.
     """
     
     CHANNEL_PREFIX = "almudeer:ws:"
     
-    def __init__(self):
-        self._redis_client = None
+    def __init__(self, redis_client: Optional[Any] = None, encoding: str = WS_PUBSUB_ENCODING):
+        self._redis_client = redis_client
         self._pubsub = None
         self._listener_task: Optional[asyncio.Task] = None
-        self._message_handlers: Dict[int, Any] = {}  # license_id -> callback
+        self._message_handlers: Dict[int, Any] = {}  # license_id -> callback(frame)
         self._initialized = False
+        self._encoding = "msgpack" if encoding == "msgpack" and MSGPACK_AVAILABLE else "json"
+        self._outgoing: List[Tuple[str, Any, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {
+            "published": 0,
+            "publish_batches": 0,
+            "received": 0,
+            "dispatched": 0,
+            "decode_errors": 0,
+        }
     
     async def initialize(self) -> bool:
         """Initialize Redis connection for pub/sub"""
         if self._initialized:
             return True
-            
-        redis_url = os.getenv("REDIS_URL")
-        if not redis_url:
-            logger.info("Redis URL not configured, pub/sub disabled")
-            return False
+        
+        if self._redis_client is None:
+            redis_url = os.getenv("REDIS_URL")
+            if not redis_url:
+                logger.info("Redis URL not configured, pub/sub disabled")
+                return False
         
         try:
-            import redis.asyncio as aioredis
-            self._redis_client = await aioredis.from_url(
-                redis_url,
-                decode_responses=True
-            )
+            if self._redis_client is None:
+                import redis.asyncio as aioredis
+                self._redis_client = await aioredis.from_url(redis_url)
             # Test connection
             await self._redis_client.ping()
-            self._pubsub = self._redis_client.pubsub()
             self._initialized = True
-            logger.info("Redis pub/sub initialized successfully")
+            logger.info(f"Redis pub/sub initialized successfully ({self._encoding} payloads)")
             return True
         except ImportError:
             logger.warning("redis.asyncio not available, pub/sub disabled")
@@ -89,109 +133,130 @@ class RedisPubSubManager:
             return False
     
     async def subscribe(self, license_id: int, handler):
-        """Subscribe to messages for a specific license"""
+        """Route messages for a license to handler(frame: str)"""
         if not self._initialized:
             return
         
-        channel = f"{self.CHANNEL_PREFIX}{license_id}"
         self._message_handlers[license_id] = handler
-        
-        try:
-            await self._pubsub.subscribe(channel)
-            logger.debug(f"Subscribed to Redis channel: {channel}")
-            
-            # Start listener if not already running
-            if self._listener_task is None or self._listener_task.done():
-                self._listener_task = asyncio.create_task(self._listen())
-        except Exception as e:
-            logger.error(f"Failed to subscribe to Redis channel: {e}")
+        # Start the pattern listener if not already running
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._listen())
     
     async def unsubscribe(self, license_id: int):
-        """Unsubscribe from messages for a specific license"""
+        """Stop routing messages for a license"""
         if not self._initialized:
             return
-        
-        channel = f"{self.CHANNEL_PREFIX}{license_id}"
         self._message_handlers.pop(license_id, None)
-        
-        try:
-            await self._pubsub.unsubscribe(channel)
-            logger.debug(f"Unsubscribed from Redis channel: {channel}")
-            
-            # Stop listener if no more subscriptions
-            if not self._message_handlers and self._listener_task:
-                self._listener_task.cancel()
-                self._listener_task = None
-                logger.debug("Redis listener stopped (no subscriptions)")
-                
-        except Exception as e:
-            logger.error(f"Failed to unsubscribe from Redis channel: {e}")
+    
+    def _encode(self, message: WebSocketMessage):
+        if self._encoding == "msgpack":
+            return msgpack.packb(asdict(message), use_bin_type=True)
+        return message.to_json()
+    
+    def _decode(self, data) -> str:
+        """Redis payload -> client JSON frame (JSON payloads pass through)"""
+        if isinstance(data, str):
+            return data
+        if data[:1] == b"{":
+            return data.decode("utf-8")
+        if not MSGPACK_AVAILABLE:
+            raise ValueError("msgpack payload received but msgpack is not installed")
+        return json.dumps(msgpack.unpackb(data, raw=False))
     
     async def publish(self, license_id: int, message: WebSocketMessage):
-        """Publish a message to a license channel"""
+        """Publish a message to a license channel (batched with concurrent publishes)"""
         if not self._initialized:
             return False
         
         channel = f"{self.CHANNEL_PREFIX}{license_id}"
+        future = asyncio.get_running_loop().create_future()
+        self._outgoing.append((channel, self._encode(message), future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_publishes())
+        return await future
+    
+    async def _flush_publishes(self):
+        """Send every queued publish in one pipeline round-trip"""
+        # Let concurrent publishers join this batch
+        await asyncio.sleep(0)
+        while self._outgoing:
+            batch, self._outgoing = self._outgoing, []
+            try:
+                async with self._redis_client.pipeline(transaction=False) as pipe:
+                    for channel, payload, _ in batch:
+                        pipe.publish(channel, payload)
+                    await pipe.execute()
+                self.stats["published"] += len(batch)
+                self.stats["publish_batches"] += 1
+                result = True
+            except Exception as e:
+                logger.error(f"Failed to publish to Redis: {e}")
+                result = False
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result(result)
+    
+    async def _dispatch(self, channel, data):
+        if isinstance(channel, bytes):
+            channel = channel.decode("utf-8")
+        self.stats["received"] += 1
         try:
-            await self._redis_client.publish(channel, message.to_json())
-            logger.debug(f"Published to Redis channel: {channel}")
-            return True
+            license_id = int(channel[len(self.CHANNEL_PREFIX):])
+        except ValueError:
+            return
+        handler = self._message_handlers.get(license_id)
+        if not handler:
+            return
+        try:
+            frame = self._decode(data)
         except Exception as e:
-            logger.error(f"Failed to publish to Redis: {e}")
-            return False
+            self.stats["decode_errors"] += 1
+            logger.debug(f"Failed to parse Redis message: {e}")
+            return
+        self.stats["dispatched"] += 1
+        await handler(frame)
     
     async def _listen(self):
-        """Background task to listen for Redis messages"""
-        try:
-            while True:
-                message = await self._pubsub.get_message(
-                    ignore_subscribe_messages=True,
-                    timeout=1.0
-                )
-                if message and message.get("type") == "message":
-                    channel = message.get("channel", "")
-                    data = message.get("data", "")
-                    
-                    # Extract license_id from channel
-                    if channel.startswith(self.CHANNEL_PREFIX):
-                        try:
-                            license_id = int(channel[len(self.CHANNEL_PREFIX):])
-                            handler = self._message_handlers.get(license_id)
-                            if handler:
-                                ws_message = WebSocketMessage.from_json(data)
-                                await handler(ws_message)
-                        except (ValueError, json.JSONDecodeError) as e:
-                            logger.debug(f"Failed to parse Redis message: {e}")
-                
-                await asyncio.sleep(0.01)  # Small sleep to prevent busy loop
-        except asyncio.CancelledError:
-            pass
-        except Exception as e:
-            # Ignore "pubsub connection not set" error which can happen during shutdown/unsubscribe
-            if "pubsub connection not set" in str(e):
-                logger.debug(f"Redis listener stopped (connection closed): {e}")
-                return
-            logger.error(f"Redis listener error: {e}")
-            # Wait a bit before restarting loop if it was a transient error
-            await asyncio.sleep(1.0)
+        """Background task: one pattern subscription for every license"""
+        while self._initialized:
+            try:
+                self._pubsub = self._redis_client.pubsub(ignore_subscribe_messages=True)
+                await self._pubsub.psubscribe(f"{self.CHANNEL_PREFIX}*")
+                async for message in self._pubsub.listen():
+                    if message and message.get("type") == "pmessage":
+                        await self._dispatch(message.get("channel", ""), message.get("data", b""))
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                # Ignore "pubsub connection not set" error which can happen during shutdown
+                if "pubsub connection not set" in str(e) or not self._initialized:
+                    logger.debug(f"Redis listener stopped (connection closed): {e}")
+                    return
+                logger.error(f"Redis listener error: {e}")
+                # Wait a bit before resubscribing if it was a transient error
+                await asyncio.sleep(1.0)
+            finally:
+                if self._pubsub is not None:
+                    try:
+                        await self._pubsub.close()
+                    except Exception:
+                        pass
+                    self._pubsub = None
     
     async def close(self):
         """Close Redis connections"""
-        if self._listener_task:
-            self._listener_task.cancel()
-            try:
-                await self._listener_task
-            except asyncio.CancelledError:
-                pass
-        
-        if self._pubsub:
-            await self._pubsub.close()
+        self._initialized = False
+        for task in (self._listener_task, self._flush_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._listener_task = None
         
         if self._redis_client:
             await self._redis_client.close()
-        
-        self._initialized = False
     
     @property
     def is_available(self) -> bool:
@@ -199,20 +264,128 @@ class RedisPubSubManager:
         return self._initialized
 
 
+class ClientConnection:
+    """
+    One WebSocket with a bounded send queue drained by its own writer task,
+    so a slow client only ever delays itself.
+    """
+    
+    def __init__(
+        self,
+        websocket: WebSocket,
+        license_id: int,
+        on_dead,
+        max_queue: int = WS_SEND_QUEUE_SIZE,
+        policy: str = WS_SLOW_CONSUMER_POLICY
+    ):
+        self.websocket = websocket
+        self.license_id = license_id
+        self.policy = policy
+        self.closed = False
+        self._on_dead = on_dead
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.total_send_ms = 0.0
+        self.max_send_ms = 0.0
+        self._writer = asyncio.create_task(self._run())
+    
+    def enqueue(self, frame: str) -> bool:
+        """Queue a pre-serialized frame without waiting. False if the client is gone."""
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.policy != "drop_oldest":
+                self._fail("send queue full", slow=True)
+                return False
+            self._queue.get_nowait()
+            self._queue.put_nowait(frame)
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+    
+    async def _run(self):
+        try:
+            while True:
+                frame = await self._queue.get()
+                started = time.perf_counter()
+                async with asyncio.timeout(WS_SEND_TIMEOUT_SECONDS):
+                    await self.websocket.send_text(frame)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self.sent += 1
+                self.total_send_ms += elapsed_ms
+                self.max_send_ms = max(self.max_send_ms, elapsed_ms)
+        except asyncio.CancelledError:
+            raise
+        except TimeoutError:
+            self._fail(f"send took longer than {WS_SEND_TIMEOUT_SECONDS}s", slow=True)
+        except Exception as e:
+            logger.debug(f"Failed to send to WebSocket: {e}")
+            self._fail(str(e))
+    
+    def _fail(self, reason: str, slow: bool = False):
+        if self.closed:
+            return
+        self.closed = True
+        self._on_dead(self, reason, slow)
+    
+    async def close(self):
+        """Stop the writer (pending frames are discarded)"""
+        self.closed = True
+        if self._writer is not asyncio.current_task() and not self._writer.done():
+            self._writer.cancel()
+            try:
+                await self._writer
+            except (asyncio.CancelledError, Exception):
+                pass
+    
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "license_id": self.license_id,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "avg_send_ms": round(self.total_send_ms / self.sent, 3) if self.sent else 0.0,
+            "max_send_ms": round(self.max_send_ms, 3),
+        }
+
+
 class ConnectionManager:
     """
     Manages WebSocket connections for real-time updates.
     Organizes connections by license_id for targeted messaging.
     
     With Redis pub/sub enabled, messages are broadcast across all workers.
+    
+    Each message is serialized once and handed to every socket's bounded
+    send queue (ClientConnection), so fan-out never waits on a client.
+    Events in COALESCED_EVENTS are held for WS_COALESCE_WINDOW_MS and only
+    the latest per key is delivered.
     """
     
     def __init__(self):
         # Active connections organized by license_id
         self._connections: Dict[int, Set[WebSocket]] = {}
+        self._clients: Dict[WebSocket, ClientConnection] = {}
         self._lock = asyncio.Lock()
         self._pubsub = RedisPubSubManager()
         self._pubsub_initialized = False
+        self._coalesced: Dict[tuple, WebSocketMessage] = {}
+        self._background: Set[asyncio.Task] = set()
+        self.stats: Dict[str, int] = {
+            "frames_queued": 0,
+            "coalesced": 0,
+            "slow_consumer_closes": 0,
+            "dead_connections": 0,
+        }
     
     async def _ensure_pubsub(self):
         """Initialize pub/sub lazily"""
@@ -235,11 +408,15 @@ class ConnectionManager:
                         lambda msg: self._handle_redis_message(license_id, msg)
                     )
             self._connections[license_id].add(websocket)
+            self._clients[websocket] = ClientConnection(websocket, license_id, self._on_client_dead)
         logger.info(f"WebSocket connected: license {license_id} (total: {self.connection_count})")
     
     async def disconnect(self, websocket: WebSocket, license_id: int):
         """Remove a WebSocket connection"""
         async with self._lock:
+            client = self._clients.pop(websocket, None)
+            if client:
+                await client.close()
             if license_id in self._connections:
                 self._connections[license_id].discard(websocket)
                 if not self._connections[license_id]:
@@ -249,36 +426,85 @@ class ConnectionManager:
                         await self._pubsub.unsubscribe(license_id)
         logger.info(f"WebSocket disconnected: license {license_id}")
     
-    async def _handle_redis_message(self, license_id: int, message: WebSocketMessage):
+    async def _handle_redis_message(self, license_id: int, frame: str):
         """Handle incoming message from Redis pub/sub"""
         # Send to local connections only (Redis already broadcast to other workers)
-        await self._send_to_local_connections(license_id, message)
+        self._fan_out(list(self._connections.get(license_id, ())), frame)
+    
+    def _spawn(self, coro):
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            # Event loop shutting down
+            coro.close()
+            return
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+    
+    def _on_client_dead(self, client: ClientConnection, reason: str, slow: bool):
+        """Writer failed or the queue overflowed: close and unregister in the background"""
+        if slow:
+            self.stats["slow_consumer_closes"] += 1
+            logger.warning(f"Closing slow WebSocket consumer for license {client.license_id}: {reason}")
+        else:
+            self.stats["dead_connections"] += 1
+        # 1013: try again later, 1011: internal error. Either way the socket is
+        # closed (a send cut off mid-frame may have left the stream corrupt) so
+        # the client reconnects and resyncs instead of silently missing events.
+        self._spawn(self._drop_client(client, code=1013 if slow else 1011))
+    
+    async def _drop_client(self, client: ClientConnection, code: int):
+        try:
+            await asyncio.wait_for(client.websocket.close(code=code), WS_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+        await self.disconnect(client.websocket, client.license_id)
+    
+    def _fan_out(self, websockets, frame: str):
+        """Hand a pre-serialized frame to each socket's send queue"""
+        for websocket in websockets:
+            client = self._clients.get(websocket)
+            if client and client.enqueue(frame):
+                self.stats["frames_queued"] += 1
     
     async def _send_to_local_connections(self, license_id: int, message: WebSocketMessage):
         """Send message to local WebSocket connections only"""
         if license_id not in self._connections:
             return
-        
-        dead_connections = []
-        json_message = message.to_json()
-        
-        for connection in list(self._connections.get(license_id, [])):
-            try:
-                await connection.send_text(json_message)
-            except Exception as e:
-                logger.debug(f"Failed to send to WebSocket: {e}")
-                dead_connections.append(connection)
-        
-        # Clean up dead connections
-        for conn in dead_connections:
-            await self.disconnect(conn, license_id)
+        self._fan_out(list(self._connections.get(license_id, [])), message.to_json())
+    
+    def _coalesce_key(self, license_id: int, message: WebSocketMessage) -> Optional[tuple]:
+        fields = COALESCED_EVENTS.get(message.event)
+        if fields is None or WS_COALESCE_WINDOW_MS <= 0:
+            return None
+        data = message.data or {}
+        return (license_id, message.event) + tuple(data.get(field) for field in fields)
+    
+    async def _flush_coalesced(self, key: tuple):
+        await asyncio.sleep(WS_COALESCE_WINDOW_MS / 1000)
+        message = self._coalesced.pop(key, None)
+        if message is not None:
+            await self._deliver(key[0], message)
     
     async def send_to_license(self, license_id: int, message: WebSocketMessage):
         """
         Send a message to all connections for a specific license.
         If Redis is available, publishes to Redis for cross-worker delivery.
         Otherwise, sends directly to local connections.
+        High-frequency events (COALESCED_EVENTS) are delivered after a short
+        window, superseded by any newer event for the same key.
         """
+        key = self._coalesce_key(license_id, message)
+        if key is not None:
+            if key in self._coalesced:
+                self.stats["coalesced"] += 1
+            else:
+                self._spawn(self._flush_coalesced(key))
+            self._coalesced[key] = message
+            return
+        await self._deliver(license_id, message)
+    
+    async def _deliver(self, license_id: int, message: WebSocketMessage):
         if self._pubsub.is_available:
             # Publish to Redis - all workers will receive and forward to their local connections
             published = await self._pubsub.publish(license_id, message)
@@ -292,14 +518,20 @@ class ConnectionManager:
         """Send a message to all connected clients"""
         # For broadcast, we send to all local connections
         # Each worker handles its own local connections
-        json_message = message.to_json()
-        
-        for license_id in list(self._connections.keys()):
-            for connection in list(self._connections.get(license_id, [])):
-                try:
-                    await connection.send_text(json_message)
-                except Exception:
-                    pass
+        self._fan_out(list(self._clients), message.to_json())
+    
+    async def close(self):
+        """Stop every socket writer, pending flushes and the Redis listener (shutdown)"""
+        for client in list(self._clients.values()):
+            await client.close()
+        self._clients.clear()
+        self._connections.clear()
+        self._coalesced.clear()
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        if self._pubsub.is_available:
+            await self._pubsub.close()
     
     @property
     def connection_count(self) -> int:
@@ -314,6 +546,26 @@ class ConnectionManager:
     def redis_enabled(self) -> bool:
         """Check if Redis pub/sub is enabled"""
         return self._pubsub.is_available
+    
+    def get_stats(self, top: int = 20) -> Dict[str, Any]:
+        """Fan-out counters plus send queue depth/latency, with the most backed-up sockets"""
+        clients = list(self._clients.values())
+        sent = sum(client.sent for client in clients)
+        return {
+            **self.stats,
+            "connections": len(clients),
+            "licenses": len(self._connections),
+            "pending_coalesced": len(self._coalesced),
+            "pubsub": dict(self._pubsub.stats) if self._pubsub.is_available else None,
+            "queued_frames": sum(client.queue_depth for client in clients),
+            "dropped_frames": sum(client.dropped for client in clients),
+            "avg_send_ms": round(sum(client.total_send_ms for client in clients) / sent, 3) if sent else 0.0,
+            "max_send_ms": round(max((client.max_send_ms for client in clients), default=0.0), 3),
+            "sockets": [
+                client.get_stats()
+                for client in sorted(clients, key=lambda c: (c.queue_depth, c.max_send_ms), reverse=True)[:top]
+            ],
+        }
 
 
 # Global connection manager
@@ -68,6 +68,20 @@ def auth_headers(sample_license_key) -> dict:
     return {"X-License-Key": sample_license_key}
 
 
+@pytest.fixture
+async def sqlite_pool(tmp_path, monkeypatch):
+    """Point get_db() at a fresh DatabasePool over a throwaway SQLite file"""
+    import db_pool as db_pool_module
+
+    pool = db_pool_module.DatabasePool()
+    pool.db_type = "sqlite"
+    pool.sqlite_path = str(tmp_path / "test.db")
+    monkeypatch.setattr(db_pool_module, "db_pool", pool)
+
+    yield pool
+    await pool.close()
+
+
 @pytest.fixture
 async def db_session():
     """Create a test database session with schema initialized"""
@@ -0,0 +1,172 @@
+"""
+Al-Mudeer Database Pool Tests
+Unit tests for the pooled SQLite connections
+"""
+
+import os
+import asyncio
+import pytest
+
+
+@pytest.fixture
+async def sqlite_pool(tmp_path, monkeypatch):
+    """Fresh file-backed SQLite pool"""
+    monkeypatch.setenv("DB_TYPE", "sqlite")
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "pool.db"))
+    monkeypatch.setenv("SQLITE_POOL_READERS", "2")
+    from db_pool import DatabasePool
+
+    pool = DatabasePool()
+    await pool.initialize()
+    yield pool
+    await pool.close()
+
+
+class TestSQLitePool:
+    """Tests for the writer/reader SQLite pool"""
+
+    async def test_connections_are_reused(self, sqlite_pool):
+        """Acquiring twice returns the same warm writer connection"""
+        first = await sqlite_pool.acquire()
+        await sqlite_pool.release(first)
+        second = await sqlite_pool.acquire()
+        await sqlite_pool.release(second)
+
+        assert first is second
+        assert sqlite_pool.get_stats()["connections_opened"] == 3
+
+    async def test_pragmas_applied_once(self, sqlite_pool):
+        """WAL mode and foreign keys are set on pooled connections"""
+        conn = await sqlite_pool.acquire()
+        try:
+            cursor = await conn.execute("PRAGMA journal_mode")
+            assert (await cursor.fetchone())[0] == "wal"
+            cursor = await conn.execute("PRAGMA foreign_keys")
+            assert (await cursor.fetchone())[0] == 1
+        finally:
+            await sqlite_pool.release(conn)
+
+    async def test_readers_are_read_only(self, sqlite_pool):
+        """Read-only connections reject writes but see committed data"""
+        await sqlite_pool.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+        await sqlite_pool.execute("INSERT INTO items (name) VALUES (?)", ("a",))
+
+        rows = await sqlite_pool.fetch("SELECT name FROM items")
+        assert rows == [{"name": "a"}]
+
+        reader = await sqlite_pool.acquire(readonly=True)
+        try:
+            with pytest.raises(Exception):
+                await reader.execute("INSERT INTO items (name) VALUES ('b')")
+        finally:
+            await sqlite_pool.release(reader)
+
+    async def test_uncommitted_work_is_rolled_back_on_release(self, sqlite_pool):
+        """Releasing the writer discards an open transaction, like close() did"""
+        await sqlite_pool.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+
+        conn = await sqlite_pool.acquire()
+        await conn.execute("INSERT INTO items (name) VALUES ('lost')")
+        await sqlite_pool.release(conn)
+
+        assert await sqlite_pool.fetch("SELECT * FROM items") == []
+
+    async def test_nested_acquire_does_not_deadlock(self, sqlite_pool):
+        """A task already holding the writer can acquire it again"""
+        outer = await sqlite_pool.acquire()
+        inner = await sqlite_pool.acquire()
+        assert inner is outer
+        await sqlite_pool.release(inner)
+        assert sqlite_pool.get_stats()["writer_busy"] is True
+        await sqlite_pool.release(outer)
+
+        stats = sqlite_pool.get_stats()
+        assert stats["writer_busy"] is False
+        assert stats["in_use"] == 0
+
+    async def test_spawned_task_waits_for_the_writer(self, sqlite_pool):
+        """Tasks created while holding the writer don't inherit the lease"""
+        outer = await sqlite_pool.acquire()
+        child = asyncio.create_task(sqlite_pool.acquire())
+        await asyncio.sleep(0.05)
+        assert not child.done()
+
+        await sqlite_pool.release(outer)
+        conn = await asyncio.wait_for(child, timeout=1)
+        await sqlite_pool.release(conn)
+        assert sqlite_pool.get_stats()["writer_busy"] is False
+
+
+class TestRawConnectionCheck:
+    """Tests for the startup raw-connection report"""
+
+    def test_reports_modules_bypassing_pool(self):
+        """Loaded modules that call the drivers directly are listed"""
+        import migrations.manager  # noqa: F401 - still opens its own connections
+        import database  # noqa: F401
+        from db_pool import find_raw_connections
+
+        sites = find_raw_connections()
+
+        assert any(site.startswith(os.path.join("migrations", "manager.py")) for site in sites)
+        assert not any(site.startswith("database.py:") for site in sites)
+        assert not any(site.startswith("db_pool.py:") for site in sites)
+
+
+class TestSQLCompiler:
+    """Tests for the memoized SQL dialect translation"""
+
+    def test_postgres_placeholders_numbered(self):
+        """? placeholders become $1, $2, ... when params are passed"""
+        from db_helper import _compile_sql
+
+        sql = _compile_sql("SELECT * FROM t WHERE a = ? AND b = ?", "postgresql", True)
+
+        assert sql == "SELECT * FROM t WHERE a = $1 AND b = $2"
+
+    def test_parameterless_postgres_statement_keeps_question_marks(self):
+        """Without params a ? is SQL, not a placeholder (e.g. the jsonb ? operator)"""
+        from db_helper import _compile_sql
+
+        sql = _compile_sql("SELECT id FROM t WHERE data ? 'key'", "postgresql", False)
+
+        assert sql == "SELECT id FROM t WHERE data ? 'key'"
+
+    def test_question_marks_in_literals_untouched(self):
+        """? inside string literals, identifiers and comments is not a placeholder"""
+        from db_helper import _compile_sql
+
+        sql = _compile_sql(
+            "SELECT 'why?', 'it''s ?', \"col?\" FROM t -- really?\nWHERE a = ?",
+            "postgresql",
+            True,
+        )
+
+        assert sql == "SELECT 'why?', 'it''s ?', \"col?\" FROM t -- really?\nWHERE a = $1"
+
+    def test_sqlite_keeps_placeholders(self):
+        """SQLite statements are unchanged"""
+        from db_helper import _compile_sql
+
+        sql = _compile_sql("UPDATE t SET a = ? WHERE id = ?", "sqlite", True)
+
+        assert sql == "UPDATE t SET a = ? WHERE id = ?"
+
+    def test_ddl_translated_for_postgres(self):
+        """SQLite DDL is adapted for PostgreSQL"""
+        from db_helper import _compile_sql
+
+        sql = _compile_sql("id INTEGER PRIMARY KEY AUTOINCREMENT", "postgresql", False)
+
+        assert sql == "id SERIAL PRIMARY KEY"
+
+    def test_statements_are_memoized(self):
+        """Repeated statements hit the LRU cache"""
+        from db_helper import _compile_sql
+
+        statement = "SELECT id FROM memo_check WHERE x = ?"
+        _compile_sql(statement, "postgresql", True)
+        hits = _compile_sql.cache_info().hits
+        _compile_sql(statement, "postgresql", True)
+
+        assert _compile_sql.cache_info().hits == hits + 1
@@ -0,0 +1,101 @@
+"""
+Al-Mudeer Dedup Store Tests
+LRU/TTL eviction, Bloom spill-over and shared Redis claims
+"""
+
+import pytest
+
+from services import dedup_store
+from services.dedup_store import DedupStore
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = _Clock()
+    monkeypatch.setattr(dedup_store.time, "monotonic", fake)
+    return fake
+
+
+class TestDedupStore:
+    """Tests for the in-process store"""
+
+    @pytest.mark.asyncio
+    async def test_evicts_least_recently_seen(self, clock):
+        """Over capacity the oldest key goes; a hit keeps a key fresh"""
+        store = DedupStore("t", max_size=2, ttl_seconds=60, backend="memory")
+
+        assert await store.seen("a") is False
+        assert await store.seen("b") is False
+        assert await store.seen("a") is True
+        assert await store.seen("c") is False
+
+        assert await store.contains("a") is True
+        assert await store.contains("b") is False
+
+        stats = store.get_stats()
+        assert stats["size"] == 2
+        assert stats["evictions"] == 1
+        assert stats["hits"] == 2 and stats["misses"] == 4
+        assert stats["hit_rate"] == pytest.approx(2 / 6, abs=1e-4)
+
+    @pytest.mark.asyncio
+    async def test_entries_expire_after_ttl(self, clock):
+        """Keys older than the TTL are forgotten"""
+        store = DedupStore("t", max_size=10, ttl_seconds=60, backend="memory")
+        await store.seen("a")
+        clock.now += 30
+        await store.seen("b")
+        clock.now += 31
+
+        assert await store.contains("a") is False
+        assert await store.contains("b") is True
+        assert store.get_stats()["expirations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_bloom_remembers_evicted_keys(self, clock):
+        """With the bloom backend, keys pushed out of the LRU are still detected"""
+        store = DedupStore("t", max_size=2, ttl_seconds=60, backend="bloom")
+        for key in ("a", "b", "c", "d"):
+            await store.seen(key)
+
+        assert len(store) == 2
+        assert await store.seen("a") is True
+        assert store.get_stats()["backend_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_redis_claim_is_shared_between_stores(self, clock):
+        """Two workers' stores agree through SET NX on the shared Redis"""
+        class SharedRedis:
+            def __init__(self):
+                self.keys = {}
+
+            def set(self, key, value, nx=False, ex=None):
+                if nx and key in self.keys:
+                    return None
+                self.keys[key] = value
+                return True
+
+            def exists(self, key):
+                return int(key in self.keys)
+
+            def delete(self, key):
+                self.keys.pop(key, None)
+
+        redis = SharedRedis()
+        worker_a = DedupStore("inbound", backend="redis", redis_client=redis)
+        worker_b = DedupStore("inbound", backend="redis", redis_client=redis)
+
+        assert await worker_a.seen("whatsapp:1:wamid.1") is False
+        assert await worker_b.seen("whatsapp:1:wamid.1") is True
+        assert worker_b.get_stats()["backend"] == "redis"
+
+        await worker_a.discard("whatsapp:1:wamid.1")
+        assert await worker_a.contains("whatsapp:1:wamid.1") is False
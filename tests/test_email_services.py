@@ -3,6 +3,10 @@ Al-Mudeer Email Service Tests
 Unit tests for Email and Gmail services
 """
 
+import asyncio
+import base64
+import re
+
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime
@@ -208,5 +212,454 @@ class TestGmailAPIService:
             assert "Hello World" in result or result is not None
 
 
+# ============ Gmail Incremental Sync ============
+
+class _GmailStandIn:
+    """Minimal local stand-in for the Gmail REST API"""
+
+    def __init__(self):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import urlparse, parse_qs
+
+        stand_in = self
+        self.requests = []
+        self.batch_requests = 0
+        self.rate_limit_once = set()
+        self.failing = set()
+        self.deleted = set()
+        self.history = [
+            {"id": "101", "messagesAdded": [{"message": {"id": "m1", "labelIds": ["INBOX"]}}]},
+            {"id": "102", "messagesAdded": [{"message": {"id": "m2", "labelIds": ["DRAFT"]}}]},
+            {"id": "103", "messagesAdded": [{"message": {"id": "m3", "labelIds": ["INBOX"]}}]},
+        ]
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                path = url.path.replace("/gmail/v1/", "", 1)
+                stand_in.requests.append(path)
+
+                if path == "users/me/history":
+                    if query["startHistoryId"] == "1":
+                        return self._send(404, {"error": {"message": "Requested entity was not found."}})
+                    records = [r for r in stand_in.history if int(r["id"]) > int(query["startHistoryId"])]
+                    return self._send(200, {"history": records, "historyId": "110"})
+                if path == "users/me/profile":
+                    return self._send(200, {"emailAddress": "me@example.com", "historyId": "500"})
+                if path == "users/me/messages":
+                    return self._send(200, {"messages": [{"id": "m9"}]})
+                if path.startswith("users/me/messages/"):
+                    msg_id = path.rsplit("/", 1)[1]
+                    if msg_id in stand_in.failing:
+                        return self._send(500, {"error": {"message": "Backend Error"}})
+                    if msg_id in stand_in.deleted:
+                        return self._send(404, {"error": {"message": "Requested entity was not found."}})
+                    return self._send(200, {
+                        "id": msg_id,
+                        "payload": {"headers": [
+                            {"name": "From", "value": "Sender <sender@example.com>"},
+                            {"name": "Subject", "value": f"subject {msg_id}"},
+                        ]},
+                    })
+                self._send(404, {"error": {"message": "unknown"}})
+
+            def do_POST(self):
+                import re
+
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+                stand_in.batch_requests += 1
+                boundary = "response_boundary"
+                parts = []
+                for index, msg_id in re.findall(r"Content-ID: <item-(\d+)>\r\n\r\nGET /gmail/v1/users/me/messages/(\w+)", body):
+                    if msg_id in stand_in.rate_limit_once:
+                        stand_in.rate_limit_once.discard(msg_id)
+                        status, payload = "429 Too Many Requests", {"error": {"message": "Too many concurrent requests"}}
+                    elif msg_id in stand_in.failing:
+                        status, payload = "500 Internal Server Error", {"error": {"message": "Backend Error"}}
+                    elif msg_id in stand_in.deleted:
+                        status, payload = "404 Not Found", {"error": {"message": "Requested entity was not found."}}
+                    else:
+                        status, payload = "200 OK", {"id": msg_id, "payload": {"headers": [
+                            {"name": "From", "value": "sender@example.com"},
+                        ]}}
+                    parts.append(
+                        f"--{boundary}\r\nContent-Type: application/http\r\n"
+                        f"Content-ID: <response-item-{index}>\r\n\r\n"
+                        f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n\r\n"
+                        f"{json.dumps(payload)}\r\n"
+                    )
+                data = ("".join(parts) + f"--{boundary}--\r\n").encode()
+                self.send_response(200)
+                self.send_header("Content-Type", f"multipart/mixed; boundary={boundary}")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/gmail/v1"
+        self.batch_url = f"http://127.0.0.1:{self.server.server_port}/batch/gmail/v1"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def gmail_stand_in(monkeypatch):
+    from services.gmail_api_service import GmailAPIService
+
+    stand_in = _GmailStandIn()
+    monkeypatch.setattr(GmailAPIService, "GMAIL_API_BASE", stand_in.base_url)
+    monkeypatch.setattr(GmailAPIService, "GMAIL_BATCH_URL", stand_in.batch_url)
+    yield stand_in
+    stand_in.close()
+
+
+class TestGmailHistorySync:
+    """Tests for history.list based incremental sync"""
+
+    @pytest.mark.asyncio
+    async def test_history_sync_fetches_only_new_messages(self, gmail_stand_in):
+        """Only messages added after the stored history ID are downloaded"""
+        from services.gmail_api_service import GmailAPIService
+
+        service = GmailAPIService(access_token="token")
+        emails, history_id = await service.sync_emails("101", since_hours=24, limit=50)
+
+        assert [e["channel_message_id"] for e in emails] == ["m3"]
+        assert history_id == "110"
+        assert "users/me/messages" not in gmail_stand_in.requests
+
+    @pytest.mark.asyncio
+    async def test_expired_history_falls_back_to_full_sync(self, gmail_stand_in):
+        """A 404 from history.list triggers a search and a fresh history ID"""
+        from services.gmail_api_service import GmailAPIService
+
+        service = GmailAPIService(access_token="token")
+        emails, history_id = await service.sync_emails("1", since_hours=24, limit=50)
+
+        assert [e["channel_message_id"] for e in emails] == ["m9"]
+        assert history_id == "500"
+
+    @pytest.mark.asyncio
+    async def test_history_limit_resumes_from_last_included_record(self, gmail_stand_in):
+        """When the limit cuts the history short, the cursor stops at the last record fetched"""
+        from services.gmail_api_service import GmailAPIService
+
+        service = GmailAPIService(access_token="token")
+        emails, history_id = await service.fetch_history_emails("100", limit=1)
+
+        assert [e["channel_message_id"] for e in emails] == ["m1"]
+        assert history_id == "102"
+
+    @pytest.mark.asyncio
+    async def test_failed_fetch_holds_history_cursor(self, gmail_stand_in, monkeypatch):
+        """A message that can't be fetched keeps the cursor before its record, so it is retried"""
+        from services.gmail_api_service import GmailAPIService
+
+        monkeypatch.setattr(GmailAPIService, "PART_RETRY_DELAY", 0)
+        gmail_stand_in.history.append(
+            {"id": "104", "messagesAdded": [{"message": {"id": "m4", "labelIds": ["INBOX"]}}]}
+        )
+        gmail_stand_in.failing = {"m3"}
+
+        service = GmailAPIService(access_token="token")
+        emails, history_id = await service.fetch_history_emails("100", limit=50)
+
+        assert [e["channel_message_id"] for e in emails] == ["m1", "m4"]
+        assert history_id == "102"
+        # The batch part was retried before giving up
+        assert gmail_stand_in.batch_requests == GmailAPIService.MAX_RETRIES + 1
+
+        gmail_stand_in.failing = set()
+        emails, history_id = await service.fetch_history_emails(history_id, limit=50)
+        assert [e["channel_message_id"] for e in emails] == ["m3", "m4"]
+        assert history_id == "110"
+
+    @pytest.mark.asyncio
+    async def test_deleted_message_does_not_hold_history_cursor(self, gmail_stand_in):
+        """A message deleted before it was fetched is skipped, not retried forever"""
+        from services.gmail_api_service import GmailAPIService
+
+        gmail_stand_in.deleted = {"m3"}
+
+        service = GmailAPIService(access_token="token")
+        emails, history_id = await service.fetch_history_emails("102", limit=50)
+
+        assert emails == []
+        assert history_id == "110"
+
+
+
+class TestGmailBatchFetch:
+    """Tests for batched messages.get over the shared client"""
+
+    @pytest.mark.asyncio
+    async def test_messages_fetched_in_one_batch_request(self, gmail_stand_in):
+        """Several messages cost one HTTP round-trip, returned in order"""
+        from services.gmail_api_service import GmailAPIService
+
+        service = GmailAPIService(access_token="token")
+        emails, failed = await service._fetch_messages(["a1", "a2", "a3"])
+
+        assert [e["channel_message_id"] for e in emails] == ["a1", "a2", "a3"]
+        assert failed == []
+        assert gmail_stand_in.batch_requests == 1
+        assert not any(path.startswith("users/me/messages/") for path in gmail_stand_in.requests)
+
+    @pytest.mark.asyncio
+    async def test_rate_limited_parts_are_retried(self, gmail_stand_in, monkeypatch):
+        """Parts answered with 429 are retried together in the next batch"""
+        from services.gmail_api_service import GmailAPIService
+
+        monkeypatch.setattr(GmailAPIService, "_rate_limit_wait", staticmethod(lambda error_msg, attempt: 0))
+        gmail_stand_in.rate_limit_once = {"b2"}
+
+        service = GmailAPIService(access_token="token")
+        messages = await service.batch_get_messages(["b1", "b2"])
+
+        assert set(messages) == {"b1", "b2"}
+        assert gmail_stand_in.batch_requests == 2
+
+    @pytest.mark.asyncio
+    async def test_http_client_is_shared(self):
+        """Service instances reuse one pooled client"""
+        from services.gmail_api_service import get_http_client
+
+        assert get_http_client() is get_http_client()
+
+
+# ============ IMAP UID Sync ============
+
+_IMAP_MESSAGES = {
+    10: {
+        "header": b"Subject: Hello\r\nFrom: Ali <ali@example.com>\r\nMessage-ID: <m10@example.com>\r\n\r\n",
+        "structure": b'("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 5 1 NIL NIL NIL NIL)',
+        "parts": {"1": b"hello"},
+    },
+    11: {
+        "header": b"Subject: Invoice\r\nFrom: sara@example.com\r\nMessage-ID: <m11@example.com>\r\n\r\n",
+        "structure": (
+            b'(("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "BASE64" 16 1 NIL NIL NIL NIL)'
+            b'("APPLICATION" "PDF" ("NAME" "invoice.pdf") NIL NIL "BASE64" 20 NIL ("ATTACHMENT" ("FILENAME" "invoice.pdf")) NIL NIL)'
+            b' "MIXED" ("BOUNDARY" "x") NIL NIL NIL)'
+        ),
+        "parts": {
+            "1": base64.b64encode("مرحبا".encode()),
+            "2": base64.b64encode(b"%PDF-1.4 data"),
+            "2.MIME": b"Content-Type: application/pdf\r\nContent-Transfer-Encoding: base64\r\n\r\n",
+        },
+    },
+}
+
+_IMAP_NEW_MESSAGE = {
+    "header": b"Subject: New\r\nFrom: omar@example.com\r\nMessage-ID: <m12@example.com>\r\n\r\n",
+    "structure": b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 20 1 NIL NIL NIL NIL)',
+    "parts": {"1": b"<p>new <b>one</b></p>"},
+}
+
+
+class _IMAPStandIn:
+    """Minimal local IMAP4rev1 server for UID SEARCH / UID FETCH / IDLE"""
+
+    def __init__(self):
+        import socketserver
+        import threading
+
+        stand_in = self
+        self.messages = dict(_IMAP_MESSAGES)
+        self.uidvalidity = 7
+        self.commands = []
+        self.connections = 0
+
+        class Handler(socketserver.StreamRequestHandler):
+            def send(self, data):
+                self.wfile.write(data)
+                self.wfile.flush()
+
+            def handle(self):
+                stand_in.connections += 1
+                self.send(b"* OK IMAP4rev1 ready\r\n")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    tag, _, command = line.strip().partition(b" ")
+                    stand_in.commands.append(command.decode())
+                    verb = command.split(b" ")[0].upper()
+                    if verb == b"CAPABILITY":
+                        self.send(b"* CAPABILITY IMAP4rev1 IDLE\r\n")
+                    elif verb == b"SELECT":
+                        uids = sorted(stand_in.messages)
+                        self.send(
+                            b"* %d EXISTS\r\n* OK [UIDVALIDITY %d]\r\n* OK [UIDNEXT %d]\r\n"
+                            % (len(uids), stand_in.uidvalidity, uids[-1] + 1)
+                        )
+                    elif verb == b"UID":
+                        self.uid_command(command.split(b" ", 2)[1].upper(), command.split(b" ", 2)[2])
+                    elif verb == b"IDLE":
+                        notice = b"* %d EXISTS\r\n" % len(stand_in.messages) if 12 in stand_in.messages else b""
+                        self.send(b"+ idling\r\n" + notice)
+                        while self.rfile.readline().strip() != b"DONE":
+                            pass
+                    elif verb == b"LOGOUT":
+                        self.send(b"* BYE\r\n" + tag + b" OK done\r\n")
+                        return
+                    self.send(tag + b" OK done\r\n")
+
+            def uid_command(self, action, args):
+                uids = sorted(stand_in.messages)
+                if action == b"SEARCH":
+                    match = re.match(rb"UID (\d+):\*", args)
+                    if match:
+                        found = [u for u in uids if u >= int(match.group(1))] or uids[-1:]
+                    else:
+                        found = uids
+                    self.send(b"* SEARCH " + b" ".join(b"%d" % u for u in found) + b"\r\n")
+                    return
+                uid_set, _, items = args.partition(b" ")
+                wanted = set()
+                for chunk in uid_set.split(b","):
+                    low, _, high = chunk.partition(b":")
+                    wanted.update(range(int(low), int(high or low) + 1))
+                for seq, uid in enumerate(uids, 1):
+                    if uid not in wanted:
+                        continue
+                    message = stand_in.messages[uid]
+                    out = b"* %d FETCH (UID %d" % (seq, uid)
+                    if b"BODYSTRUCTURE" in items:
+                        out += b" BODYSTRUCTURE " + message["structure"]
+                    for section in re.findall(rb"BODY\.PEEK\[([^\]]*)\]", items):
+                        data = message["header"] if section.startswith(b"HEADER") else message["parts"][section.decode()]
+                        out += b" BODY[%s] {%d}\r\n%s" % (section, len(data), data)
+                    self.send(out + b")\r\n")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def service(self, keep_alive=False):
+        from services.email_service import EmailService
+
+        return EmailService(
+            email_address="shop@example.com",
+            password="secret",
+            imap_server="127.0.0.1",
+            smtp_server="127.0.0.1",
+            imap_port=self.port,
+            imap_ssl=False,
+            keep_alive=keep_alive,
+        )
+
+    def fetches(self):
+        return [c for c in self.commands if c.upper().startswith("UID FETCH")]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def imap_stand_in():
+    from services.email_service import close_imap_connections
+
+    stand_in = _IMAPStandIn()
+    yield stand_in
+    close_imap_connections()
+    stand_in.close()
+
+
+class TestIMAPUidSync:
+    """Tests for UID-cursor IMAP fetching"""
+
+    @pytest.mark.asyncio
+    async def test_first_sync_fetches_summaries_in_one_command(self, imap_stand_in):
+        """Headers and structure arrive in one FETCH; attachments are listed, not downloaded"""
+        service = imap_stand_in.service()
+        emails, uidvalidity, last_uid = await service.sync_emails(since_hours=24)
+
+        assert (uidvalidity, last_uid) == (7, 11)
+        assert [e["uid"] for e in emails] == [10, 11]
+        assert emails[0]["body"] == "hello"
+        assert emails[0]["sender_name"] == "Ali"
+        assert emails[1]["body"] == "مرحبا"
+        assert emails[1]["attachments"] == [{
+            "file_id": "11:2", "file_name": "invoice.pdf", "mime_type": "application/pdf",
+            "file_size": 20, "type": "document", "uid": 11, "part": "2",
+        }]
+
+        fetches = imap_stand_in.fetches()
+        assert fetches[0] == "UID FETCH 10:11 (UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (SUBJECT FROM DATE MESSAGE-ID)])"
+        assert fetches[1:] == ["UID FETCH 10:11 (UID BODY.PEEK[1])"]
+        assert not any("RFC822)" in c or "[2]" in c for c in imap_stand_in.commands)
+
+    @pytest.mark.asyncio
+    async def test_cursor_fetches_only_new_uids(self, imap_stand_in):
+        """A matching UIDVALIDITY fetches UIDs above the cursor; a changed one falls back to SINCE"""
+        service = imap_stand_in.service()
+
+        emails, _, last_uid = await service.sync_emails(uidvalidity=7, last_uid=11)
+        assert emails == [] and last_uid == 11
+        assert not imap_stand_in.fetches()
+
+        imap_stand_in.messages[12] = _IMAP_NEW_MESSAGE
+        emails, _, last_uid = await service.sync_emails(uidvalidity=7, last_uid=11)
+        assert [e["uid"] for e in emails] == [12]
+        assert emails[0]["body"] == "new one"
+        assert last_uid == 12
+
+        imap_stand_in.uidvalidity = 8
+        emails, uidvalidity, last_uid = await service.sync_emails(uidvalidity=7, last_uid=12)
+        assert [e["uid"] for e in emails] == [10, 11, 12]
+        assert (uidvalidity, last_uid) == (8, 12)
+
+    @pytest.mark.asyncio
+    async def test_kept_alive_connection_idles_and_downloads_lazily(self, imap_stand_in):
+        """Kept-alive connections serve polls and IDLE; attachments download on demand"""
+        service = imap_stand_in.service(keep_alive=True)
+
+        await service.sync_emails(since_hours=24)
+        imap_stand_in.messages[12] = _IMAP_NEW_MESSAGE
+        assert await service.wait_for_new_mail(timeout=5) is True
+        emails, _, last_uid = await service.sync_emails(uidvalidity=7, last_uid=11)
+        content = await service.fetch_attachment(11, "2")
+
+        assert [e["uid"] for e in emails] == [12] and last_uid == 12
+        assert content == b"%PDF-1.4 data"
+        # One connection for fetches, one for IDLE, both reused
+        assert imap_stand_in.connections == 2
+
+    @pytest.mark.asyncio
+    async def test_idle_does_not_block_fetches(self, imap_stand_in):
+        """A sync on the same mailbox completes while an IDLE is still waiting"""
+        service = imap_stand_in.service(keep_alive=True)
+
+        idle = asyncio.create_task(service.wait_for_new_mail(timeout=2))
+        await asyncio.sleep(0.2)
+        emails, _, _ = await asyncio.wait_for(service.sync_emails(since_hours=24), timeout=1)
+
+        assert [e["uid"] for e in emails] == [10, 11]
+        assert not idle.done()
+        assert await idle is False
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -20,11 +20,11 @@ class TestFCMService:
         with patch("services.fcm_mobile_service.FCM_V1_AVAILABLE", True), \
              patch("services.fcm_mobile_service._get_access_token", return_value="fake-token"), \
              patch("services.fcm_mobile_service.FCM_PROJECT_ID", "test-project"), \
-             patch("httpx.AsyncClient") as mock_client:
+             patch("services.fcm_mobile_service.get_http_client") as mock_client:
             
             mock_post = AsyncMock()
             mock_post.return_value.status_code = 200
-            mock_client.return_value.__aenter__.return_value.post = mock_post
+            mock_client.return_value.post = mock_post
             
             result = await send_fcm_notification(
                 token="device-token",
@@ -46,12 +46,12 @@ class TestFCMService:
         with patch("services.fcm_mobile_service.FCM_V1_AVAILABLE", True), \
              patch("services.fcm_mobile_service._get_access_token", return_value="fake-token"), \
              patch("services.fcm_mobile_service.FCM_PROJECT_ID", "test-project"), \
-             patch("httpx.AsyncClient") as mock_client:
+             patch("services.fcm_mobile_service.get_http_client") as mock_client:
             
             # Simulate 401 Unauthorized
             mock_post = AsyncMock()
             mock_post.return_value.status_code = 401
-            mock_client.return_value.__aenter__.return_value.post = mock_post
+            mock_client.return_value.post = mock_post
             
             # This calls internal _send_fcm_v1 directly to verify it returns None (triggering fallback logic in main wrapper)
             result = await _send_fcm_v1("token", "title", "body")
@@ -61,12 +61,12 @@ class TestFCMService:
     async def test_send_fcm_legacy_success(self):
         """Test sending via Legacy API"""
         with patch("services.fcm_mobile_service.FCM_SERVER_KEY", "server-key"), \
-             patch("httpx.AsyncClient") as mock_client:
+             patch("services.fcm_mobile_service.get_http_client") as mock_client:
             
             mock_post = AsyncMock()
             mock_post.return_value.status_code = 200
-            mock_post.return_value.json.return_value = {"success": 1}
-            mock_client.return_value.__aenter__.return_value.post = mock_post
+            mock_post.return_value.json = MagicMock(return_value={"success": 1})
+            mock_client.return_value.post = mock_post
             
             result = await _send_fcm_legacy("token", "title", "body")
             
@@ -109,3 +109,67 @@ class TestFCMService:
             new_id = await save_fcm_token(99, "new-token", "android")
             
             assert new_id == 11
+
+
+class TestFCMDispatch:
+    """Concurrent sends on the shared client"""
+
+    def test_unique_device_tokens(self):
+        from services.fcm_mobile_service import unique_device_tokens
+
+        rows = [
+            {"id": 1, "token": "a", "device_id": "phone"},
+            {"id": 2, "token": "b", "device_id": "phone"},   # older row, same device
+            {"id": 3, "token": "a", "device_id": None},      # same token, no device
+            {"id": 4, "token": "c", "device_id": None},
+        ]
+        assert [row["id"] for row in unique_device_tokens(rows)] == [1, 4]
+
+    async def test_sends_concurrently_and_reports_invalid_tokens(self):
+        import asyncio
+        from services.fcm_mobile_service import send_fcm_to_tokens
+
+        active = 0
+        peak = 0
+
+        async def fake_post(url, json, headers):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            response = MagicMock(text="")
+            response.status_code = 404 if json["message"]["token"] == "stale" else 200
+            return response
+
+        rows = [{"id": n, "token": f"t{n}", "platform": "android"} for n in range(8)]
+        rows.append({"id": 99, "token": "stale", "platform": "ios"})
+        with patch("services.fcm_mobile_service.FCM_V1_AVAILABLE", True), \
+             patch("services.fcm_mobile_service._get_access_token", return_value="fake-token"), \
+             patch("services.fcm_mobile_service.FCM_PROJECT_ID", "test-project"), \
+             patch("services.fcm_mobile_service.get_http_client") as mock_client:
+            mock_client.return_value.post = AsyncMock(side_effect=fake_post)
+
+            sent, invalid = await send_fcm_to_tokens(rows, "title", "body")
+
+        assert sent == 8
+        assert invalid == [99]
+        assert peak > 1
+
+    async def test_only_invalid_tokens_are_deactivated(self):
+        from services.fcm_mobile_service import send_fcm_to_license
+
+        rows = [
+            {"id": 1, "token": "good", "device_id": "d1", "platform": "android"},
+            {"id": 2, "token": "stale", "device_id": "d2", "platform": "android"},
+        ]
+        with patch("db_helper.get_db"), \
+             patch("db_helper.fetch_all", new_callable=AsyncMock, return_value=rows), \
+             patch("services.fcm_mobile_service.send_fcm_to_tokens",
+                   new_callable=AsyncMock, return_value=(1, [2])) as mock_send, \
+             patch("services.fcm_mobile_service.deactivate_fcm_tokens", new_callable=AsyncMock) as mock_deactivate:
+            sent = await send_fcm_to_license(1, "title", "body", badge_count=3)
+
+        assert sent == 1
+        assert mock_send.call_args.kwargs["badge_count"] == 3
+        mock_deactivate.assert_awaited_once_with([2])
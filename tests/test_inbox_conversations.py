@@ -0,0 +1,256 @@
+"""
+Al-Mudeer Inbox Conversation State Tests
+Incremental conversation updates vs. the full recompute, and contact aliases
+"""
+
+import pytest
+
+
+@pytest.fixture
+async def inbox_db(sqlite_pool):
+    """Throwaway SQLite database with the inbox schema"""
+    from db_helper import get_db
+
+    async with get_db() as db:
+        await db.execute("""
+            CREATE TABLE inbox_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                license_key_id INTEGER NOT NULL,
+                channel TEXT, channel_message_id TEXT, sender_id TEXT,
+                sender_name TEXT, sender_contact TEXT, subject TEXT, body TEXT,
+                received_at TIMESTAMP, attachments TEXT,
+                reply_to_platform_id TEXT, reply_to_body_preview TEXT,
+                reply_to_sender_name TEXT, reply_to_id INTEGER,
+                platform_message_id TEXT, platform_status TEXT, original_sender TEXT,
+                intent TEXT, urgency TEXT, sentiment TEXT, language TEXT, dialect TEXT,
+                ai_summary TEXT, ai_draft_response TEXT, processed_at TIMESTAMP,
+                status TEXT DEFAULT 'pending', is_read BOOLEAN DEFAULT 0,
+                deleted_at TIMESTAMP, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE outbox_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                inbox_message_id INTEGER, license_key_id INTEGER NOT NULL,
+                channel TEXT, recipient_id TEXT, recipient_email TEXT, subject TEXT,
+                body TEXT, attachments TEXT, status TEXT DEFAULT 'pending',
+                sent_at TIMESTAMP, deleted_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE inbox_conversations (
+                license_key_id INTEGER NOT NULL,
+                sender_contact TEXT NOT NULL,
+                sender_name TEXT, channel TEXT,
+                last_message_id INTEGER, last_message_body TEXT,
+                last_message_ai_summary TEXT, last_message_at DATETIME,
+                status TEXT DEFAULT 'pending',
+                unread_count INTEGER DEFAULT 0, message_count INTEGER DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (license_key_id, sender_contact)
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE contact_aliases (
+                license_key_id INTEGER NOT NULL,
+                alias TEXT NOT NULL, kind TEXT NOT NULL, canonical TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (license_key_id, alias, kind)
+            )
+        """)
+        await db.commit()
+
+    return sqlite_pool
+
+
+async def _conversation(contact: str) -> dict:
+    from db_helper import get_db, fetch_one
+
+    async with get_db() as db:
+        return await fetch_one(
+            db,
+            "SELECT * FROM inbox_conversations WHERE license_key_id = 1 AND sender_contact = ?",
+            [contact],
+        )
+
+
+class TestIncrementalConversationState:
+    """Deltas must agree with the full recompute"""
+
+    async def test_insert_read_delete_match_full_recompute(self, inbox_db):
+        from models import inbox
+
+        first = await inbox.save_inbox_message(
+            1, "whatsapp", "hello", sender_contact="+963900", received_at="2024-01-01T10:00:00", status="analyzed"
+        )
+        second = await inbox.save_inbox_message(
+            1, "whatsapp", "again", sender_contact="+963900", received_at="2024-01-01T11:00:00", status="analyzed"
+        )
+
+        state = await _conversation("+963900")
+        assert state["message_count"] == 2
+        assert state["unread_count"] == 2
+        assert state["last_message_id"] == second
+        assert state["last_message_body"] == "again"
+
+        await inbox.mark_message_as_read(first, 1)
+        assert (await _conversation("+963900"))["unread_count"] == 1
+
+        await inbox.soft_delete_inbox_message(first, 1)
+        incremental = await _conversation("+963900")
+        assert incremental["message_count"] == 1
+        assert incremental["last_message_id"] == second
+
+        await inbox.upsert_conversation_state(1, "+963900")
+        recomputed = await _conversation("+963900")
+        for field in ("message_count", "unread_count", "last_message_id", "last_message_body"):
+            assert incremental[field] == recomputed[field]
+
+    async def test_older_message_does_not_replace_last_message(self, inbox_db):
+        from models import inbox
+
+        newest = await inbox.save_inbox_message(
+            1, "telegram", "new", sender_contact="alice", received_at="2024-02-01T10:00:00", status="analyzed"
+        )
+        await inbox.save_inbox_message(
+            1, "telegram", "old", sender_contact="alice", received_at="2024-01-01T10:00:00", status="analyzed"
+        )
+
+        state = await _conversation("alice")
+        assert state["message_count"] == 2
+        assert state["last_message_id"] == newest
+
+    async def test_pending_message_is_counted_after_analysis(self, inbox_db):
+        from models import inbox
+
+        message_id = await inbox.save_inbox_message(
+            1, "telegram", "hi", sender_contact="bob", received_at="2024-01-01T10:00:00"
+        )
+        assert await _conversation("bob") is None
+
+        await inbox.update_inbox_analysis(message_id, "inquiry", "low", "neutral", "ar", None, "summary", "draft")
+
+        state = await _conversation("bob")
+        assert state["message_count"] == 1
+        assert state["unread_count"] == 1
+        assert state["status"] == "analyzed"
+
+    async def test_alias_message_updates_the_group_conversation(self, inbox_db):
+        from models import inbox
+
+        await inbox.save_inbox_message(
+            1, "telegram", "hi", sender_contact="@alice", sender_id="111", status="analyzed"
+        )
+        # Keyed by the tg: form of the platform ID, an alias of @alice
+        await inbox.save_synced_outbox_message(1, "telegram", "hello", recipient_email="tg:111")
+
+        incremental = await _conversation("@alice")
+        assert incremental["message_count"] == 2
+        assert incremental["last_message_body"] == "hello"
+        assert await _conversation("tg:111") is None
+
+        await inbox.upsert_conversation_state(1, "@alice")
+        recomputed = await _conversation("@alice")
+        for field in ("message_count", "unread_count", "last_message_id", "last_message_body"):
+            assert incremental[field] == recomputed[field]
+
+    async def test_reconcile_repairs_drift(self, inbox_db):
+        from models import inbox
+        from db_helper import get_db
+
+        await inbox.save_inbox_message(
+            1, "whatsapp", "hello", sender_contact="carol", received_at="2024-01-01T10:00:00", status="analyzed"
+        )
+        async with get_db() as db:
+            await db.execute("UPDATE inbox_conversations SET message_count = 7, unread_count = 5")
+            await db.commit()
+
+        result = await inbox.reconcile_conversation_states(license_id=1)
+
+        assert result == {"checked": 1, "repaired": 1}
+        state = await _conversation("carol")
+        assert state["message_count"] == 1
+        assert state["unread_count"] == 1
+
+
+class TestContactAliases:
+    """contact_aliases must resolve the same groups as the message scan"""
+
+    async def test_ingest_links_contact_and_id(self, inbox_db):
+        from models import inbox
+        from db_helper import get_db
+
+        await inbox.save_inbox_message(
+            1, "telegram", "hi", sender_contact="@alice", sender_id="111", status="analyzed"
+        )
+        await inbox.save_synced_outbox_message(1, "telegram", "hello", recipient_id="111")
+
+        async with get_db() as db:
+            contacts, ids = await inbox._get_sender_aliases(db, 1, "tg:111")
+
+        assert set(contacts) == {"tg:111", "@alice"}
+        assert set(ids) == {"111"}
+
+    async def test_linking_merges_groups(self, inbox_db):
+        from models import inbox
+        from db_helper import get_db
+
+        async with get_db() as db:
+            await inbox.link_contact_aliases(db, 1, ["+963900"], ["222"])
+            await inbox.link_contact_aliases(db, 1, ["@bob"], ["333"])
+            await inbox.link_contact_aliases(db, 1, ["@bob"], ["222"])
+            await inbox.link_contact_aliases(db, 2, ["@bob"], ["999"])
+            await db.commit()
+
+            contacts, ids = await inbox._get_sender_aliases(db, 1, "+963900")
+
+        assert set(contacts) == {"+963900", "@bob", "tg:222", "tg:333"}
+        assert set(ids) == {"222", "333"}
+
+    async def test_backfill_matches_scan(self, inbox_db):
+        from models import inbox
+        from db_helper import get_db
+
+        async with get_db() as db:
+            await db.execute(
+                "INSERT INTO inbox_messages (license_key_id, sender_contact, sender_id) VALUES "
+                "(1, '+963911', '444'), (1, '@carol', '444'), (1, '@dave', '555')"
+            )
+            await db.commit()
+            scanned = await inbox._get_sender_aliases(db, 1, "@carol")
+
+        assert await inbox.backfill_contact_aliases(license_id=1) == 3
+
+        async with get_db() as db:
+            count = await db.execute("SELECT COUNT(*) FROM contact_aliases")
+            assert (await count.fetchone())[0] == 7
+            indexed = await inbox._get_sender_aliases(db, 1, "@carol")
+
+        assert set(indexed[0]) == set(scanned[0]) == {"@carol", "+963911", "tg:444"}
+        assert set(indexed[1]) == set(scanned[1]) == {"444"}
+
+    async def test_migration_backfills_existing_messages(self, inbox_db):
+        from models import inbox
+        from db_helper import get_db
+        from migrations.contact_aliases_table import create_contact_aliases_table
+
+        async with get_db() as db:
+            await db.execute(
+                "INSERT INTO inbox_messages (license_key_id, sender_contact, sender_id) VALUES "
+                "(1, '+963922', '666'), (1, '@erin', '666')"
+            )
+            await db.commit()
+
+        await create_contact_aliases_table()
+        # Linking a new message must not hide the aliases of older ones
+        await inbox.save_inbox_message(
+            1, "telegram", "hi", sender_contact="@erin", status="analyzed"
+        )
+
+        async with get_db() as db:
+            contacts, ids = await inbox._get_sender_aliases(db, 1, "@erin")
+
+        assert set(contacts) == {"@erin", "+963922", "tg:666"}
+        assert set(ids) == {"666"}
@@ -0,0 +1,164 @@
+"""
+Al-Mudeer LLM Cache Tests
+In-process LRU, shared Redis/SQLite stores and the tiered cache in LLMService
+"""
+
+import pytest
+from unittest.mock import AsyncMock, patch
+
+
+class TestL1Cache:
+    """In-process LRU bounded by bytes"""
+
+    async def test_evicts_least_recently_used_over_byte_budget(self):
+        from services.llm_provider import LRUCache
+
+        cache = LRUCache(max_size=100, ttl_seconds=3600, max_bytes=10)
+        await cache.set_by_key("a", "xxxx")
+        await cache.set_by_key("b", "yyyy")
+        assert await cache.get_by_key("a") == "xxxx"  # b is now least recently used
+        await cache.set_by_key("c", "zzzz")
+
+        assert await cache.get_by_key("b") is None
+        assert await cache.get_by_key("a") == "xxxx"
+        assert cache.bytes == 8
+
+
+class TestSharedStores:
+    """L2 stores survive restarts and are shared between workers"""
+
+    async def test_sqlite_store_persists_and_trims(self, tmp_path):
+        from services.llm_cache import SQLiteResponseStore
+
+        path = str(tmp_path / "llm_cache.db")
+        store = SQLiteResponseStore(path, max_bytes=1000)
+        await store.set("k1", "cached answer", ttl_seconds=3600)
+        await store.set("expired", "old", ttl_seconds=-1)
+        store.close()
+
+        restarted = SQLiteResponseStore(path, max_bytes=1000)
+        assert await restarted.get("k1") == "cached answer"
+        assert await restarted.get("expired") is None
+
+        restarted.max_bytes = 300
+        for n in range(10):
+            await restarted.set(f"big{n}", "x" * 100, ttl_seconds=3600)
+        assert restarted.bytes <= 300
+        assert await restarted.get("big9") == "x" * 100
+        assert await restarted.get("big0") is None
+        restarted.close()
+
+    async def test_sqlite_running_total_tracks_overwrites_and_other_workers(self, tmp_path):
+        from services.llm_cache import SQLiteResponseStore
+
+        path = str(tmp_path / "llm_cache.db")
+        worker_a = SQLiteResponseStore(path, max_bytes=1000)
+        worker_b = SQLiteResponseStore(path, max_bytes=1000)
+
+        await worker_a.set("k", "x" * 100, ttl_seconds=3600)
+        await worker_a.set("k", "x" * 40, ttl_seconds=3600)
+        assert worker_a.bytes == 40
+
+        await worker_b.set("other", "y" * 60, ttl_seconds=3600)
+        assert worker_b.bytes == 100
+
+        await worker_a.set("expired", "z" * 10, ttl_seconds=-1)
+        assert await worker_a.get("expired") is None
+        assert worker_a._total_bytes() == 100
+        worker_a.close()
+        worker_b.close()
+
+    async def test_redis_store_shared_and_trimmed(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        from services.llm_cache import RedisResponseStore
+
+        server = fakeredis.FakeServer()
+        worker_a = RedisResponseStore(fakeredis.FakeRedis(server=server, decode_responses=True), max_bytes=250)
+        worker_b = RedisResponseStore(fakeredis.FakeRedis(server=server, decode_responses=True), max_bytes=250)
+
+        await worker_a.set("faq", "answer", ttl_seconds=3600)
+        assert await worker_b.get("faq") == "answer"
+
+        for n in range(5):
+            await worker_b.set(f"big{n}", "x" * 100, ttl_seconds=3600)
+        assert worker_b.bytes <= 250
+        assert await worker_a.get("big4") == "x" * 100
+        assert await worker_a.get("faq") is None
+
+
+class TestTieredCache:
+    """LLMService: L1 then L2, keyed by model and sampling settings"""
+
+    async def test_l2_hit_is_promoted_and_counted(self, tmp_path):
+        from services.llm_provider import LRUCache
+        from services.llm_cache import TieredLLMCache, SQLiteResponseStore
+
+        store = SQLiteResponseStore(str(tmp_path / "llm_cache.db"))
+        await store.set("key", "from another worker", ttl_seconds=3600)
+        cache = TieredLLMCache(LRUCache(max_size=10), store)
+
+        assert await cache.get("key") == "from another worker"
+        assert await cache.get("key") == "from another worker"
+        assert await cache.get("missing") is None
+
+        stats = cache.get_stats()
+        assert (stats["l2_hits"], stats["l1_hits"], stats["misses"]) == (1, 1, 1)
+        assert stats["l2_backend"] == "sqlite"
+        assert stats["l1_bytes"] == len("from another worker")
+        store.close()
+
+    async def test_generate_keys_on_temperature(self, tmp_path):
+        from services.llm_provider import LLMService, LLMConfig, LLMResponse
+        from services.llm_cache import SQLiteResponseStore
+
+        store = SQLiteResponseStore(str(tmp_path / "llm_cache.db"))
+        with patch("services.llm_cache.create_response_store", return_value=store):
+            service = LLMService(LLMConfig(cache_enabled=True))
+
+        provider = AsyncMock()
+        provider.name = "gemini"
+        provider.is_available = True
+        provider.generate.return_value = LLMResponse(content="answer", provider="gemini", model="m")
+        service.providers = [provider]
+
+        with patch("services.llm_provider.get_rate_limiter") as limiter:
+            limiter.return_value.is_in_cooldown.return_value = False
+            first = await service.generate("كم السعر؟", temperature=0.3)
+            again = await service.generate("كم السعر؟", temperature=0.3)
+            hotter = await service.generate("كم السعر؟", temperature=0.9)
+
+        assert first.cached is False
+        assert again.cached is True
+        assert hotter.cached is False
+        assert provider.generate.await_count == 2
+        stats = service.get_stats()["cache"]
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+        service.cache.l2.close()
+
+    async def test_fallback_answer_is_not_cached_as_primary(self, tmp_path):
+        from services.llm_provider import LLMService, LLMConfig, LLMResponse
+        from services.llm_cache import SQLiteResponseStore
+
+        store = SQLiteResponseStore(str(tmp_path / "llm_cache.db"))
+        with patch("services.llm_cache.create_response_store", return_value=store):
+            service = LLMService(LLMConfig(cache_enabled=True))
+
+        primary = AsyncMock()
+        primary.name = "gemini"
+        primary.is_available = True
+        primary.generate.side_effect = [None, LLMResponse(content="primary", provider="gemini", model="m")]
+        fallback = AsyncMock()
+        fallback.name = "openrouter"
+        fallback.is_available = True
+        fallback.generate.return_value = LLMResponse(content="fallback", provider="openrouter", model="m")
+        service.providers = [primary, fallback]
+
+        with patch("services.llm_provider.get_rate_limiter") as limiter:
+            limiter.return_value.is_in_cooldown.return_value = False
+            assert (await service.generate("كم السعر؟")).content == "fallback"
+            again = await service.generate("كم السعر؟")
+
+        assert again.content == "primary"
+        assert again.cached is False
+        service.cache.l2.close()
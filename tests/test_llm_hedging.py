@@ -0,0 +1,211 @@
+"""
+Al-Mudeer LLM Hedging Tests
+Latency histograms, circuit breakers and hedged provider calls
+"""
+
+import asyncio
+import time
+from unittest.mock import MagicMock, patch
+
+
+def _provider(name, content="ok", delay=0.0, queued=0.0):
+    """
+    Fake provider answering `content` (None = failure) after `delay` seconds,
+    once it has spent `queued` seconds waiting on the rate limiter
+    """
+    from services.llm_provider import LLMResponse
+    from services.rate_limiter import _queued_for_capacity
+
+    provider = MagicMock()
+    provider.name = name
+    provider.is_available = True
+    provider.calls = 0
+    provider.cancelled = 0
+
+    async def generate(**kwargs):
+        provider.calls += 1
+        try:
+            if queued:
+                with _queued_for_capacity():
+                    await asyncio.sleep(queued)
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            provider.cancelled += 1
+            raise
+        return LLMResponse(content=content, provider=name, model="m") if content else None
+
+    provider.generate = generate
+    return provider
+
+
+def _service(*providers):
+    from services.llm_provider import LLMService, LLMConfig
+
+    service = LLMService(LLMConfig(cache_enabled=False))
+    service.providers = list(providers)
+    return service
+
+
+class TestProviderHealth:
+    """Histogram percentiles and breaker states"""
+
+    def test_percentiles_follow_recent_latencies(self):
+        from services.llm_hedging import LatencyHistogram
+
+        histogram = LatencyHistogram(decay_at=100)
+        for _ in range(90):
+            histogram.record(400)
+        for _ in range(10):
+            histogram.record(9000)
+        assert histogram.percentile(50) == 500
+        assert histogram.percentile(95) == 10000
+
+        # Older samples are halved away as new ones arrive
+        for _ in range(200):
+            histogram.record(1800)
+        assert histogram.percentile(95) == 2000
+        assert histogram.get_stats()["samples"] == 300
+
+    def test_lost_hedges_do_not_raise_the_hedge_delay(self):
+        from services.llm_hedging import ProviderHealth, LLM_HEDGE_MIN_SAMPLES
+
+        health = ProviderHealth("gemini")
+        for _ in range(LLM_HEDGE_MIN_SAMPLES):
+            health.record_success(900)
+        delay = health.hedge_delay()
+        for _ in range(50):
+            health.record_slow()
+            health.breaker.record_success()
+
+        assert health.hedge_delay() == delay == 1.0
+        assert health.stats["slow"] == 50
+
+    def test_breaker_opens_then_lets_one_probe_through(self):
+        from services.llm_hedging import CircuitBreaker
+
+        breaker = CircuitBreaker(failures=2, cooldown=0.05)
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == "open"
+        assert not breaker.allow()
+
+        time.sleep(0.06)
+        assert breaker.allow()
+        assert not breaker.allow()  # Only one probe at a time
+        breaker.record_failure()
+        assert breaker.state == "open"
+
+        time.sleep(0.06)
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == "closed"
+        assert breaker.times_opened == 2
+
+
+class TestHedgedGenerate:
+    """LLMService.generate races a slow provider against the next one"""
+
+    async def test_slow_provider_is_hedged_and_cancelled(self):
+        slow = _provider("gemini", content="slow", delay=5)
+        fast = _provider("openrouter", content="fast", delay=0.01)
+        service = _service(slow, fast)
+
+        with patch("services.llm_provider.get_rate_limiter") as limiter, \
+             patch("services.llm_hedging.LLM_HEDGE_DEFAULT_DELAY", 0.05):
+            limiter.return_value.is_in_cooldown.return_value = False
+            response = await asyncio.wait_for(service.generate("prompt"), timeout=1)
+            await asyncio.sleep(0)
+
+        assert response.content == "fast"
+        assert slow.cancelled == 1
+        stats = service.get_stats()
+        assert (stats["hedged"], stats["hedge_wins"]) == (1, 1)
+        assert stats["providers"]["gemini"]["slow"] == 1
+        # The cut-off time is not a latency: the histogram only holds completed calls
+        assert stats["providers"]["gemini"]["latency"]["samples"] == 0
+        assert stats["providers"]["openrouter"]["latency"]["samples"] == 1
+
+    async def test_rate_limiter_queue_is_not_provider_latency(self):
+        queued = _provider("gemini", content="primary", delay=0.01, queued=0.3)
+        backup = _provider("openrouter")
+        service = _service(queued, backup)
+
+        with patch("services.llm_provider.get_rate_limiter") as limiter, \
+             patch("services.llm_hedging.LLM_HEDGE_DEFAULT_DELAY", 0.1):
+            limiter.return_value.is_in_cooldown.return_value = False
+            response = await asyncio.wait_for(service.generate("prompt"), timeout=1)
+
+        # Waiting for local quota neither triggers a hedge nor lands in the histogram
+        assert response.content == "primary"
+        assert backup.calls == 0
+        gemini = service.get_stats()["providers"]["gemini"]
+        assert (gemini["slow"], gemini["breaker"]) == (0, "closed")
+        assert gemini["latency"]["p99_ms"] == 100
+
+    async def test_fast_primary_is_not_hedged(self):
+        primary = _provider("gemini", content="primary", delay=0.01)
+        backup = _provider("openrouter")
+        service = _service(primary, backup)
+
+        with patch("services.llm_provider.get_rate_limiter") as limiter:
+            limiter.return_value.is_in_cooldown.return_value = False
+            response = await service.generate("prompt")
+
+        assert response.content == "primary"
+        assert backup.calls == 0
+        assert service.get_stats()["hedged"] == 0
+
+    async def test_open_breaker_skips_failing_provider(self):
+        broken = _provider("gemini", content=None)
+        backup = _provider("openrouter", content="backup")
+        service = _service(broken, backup)
+
+        with patch("services.llm_provider.get_rate_limiter") as limiter, \
+             patch("services.llm_hedging.LLM_BREAKER_FAILURES", 2):
+            limiter.return_value.is_in_cooldown.return_value = False
+            service.health.clear()
+            for _ in range(4):
+                assert (await service.generate("prompt", use_cache=False)).content == "backup"
+
+        assert broken.calls == 2
+        gemini = service.get_stats()["providers"]["gemini"]
+        assert gemini["breaker"] == "open"
+        assert gemini["skipped"] == 2
+
+    async def test_provider_that_keeps_losing_hedges_is_skipped(self):
+        hung = _provider("gemini", content="late", delay=5)
+        fast = _provider("openrouter", content="fast", delay=0.01)
+        service = _service(hung, fast)
+
+        with patch("services.llm_provider.get_rate_limiter") as limiter, \
+             patch("services.llm_hedging.LLM_HEDGE_DEFAULT_DELAY", 0.2), \
+             patch("services.llm_hedging.LLM_BREAKER_FAILURES", 2):
+            limiter.return_value.is_in_cooldown.return_value = False
+            service.health.clear()
+            for _ in range(2):
+                assert (await asyncio.wait_for(service.generate("prompt", use_cache=False), timeout=1)).content == "fast"
+
+            start = time.monotonic()
+            for _ in range(3):
+                assert (await service.generate("prompt", use_cache=False)).content == "fast"
+            elapsed = time.monotonic() - start
+            await asyncio.sleep(0)
+
+        # Skipped without waiting out the hedge delay again
+        assert elapsed < 0.2
+        assert hung.calls == 2
+        gemini = service.get_stats()["providers"]["gemini"]
+        assert gemini["breaker"] == "open"
+        assert (gemini["slow"], gemini["cancelled"]) == (2, 0)
+
+    def test_providers_fail_over_instead_of_retrying(self):
+        from services.llm_provider import LLMService, LLMConfig
+        from services.llm_hedging import LLM_PROVIDER_MAX_ATTEMPTS
+
+        config = LLMConfig(cache_enabled=False)
+        service = LLMService(config)
+
+        assert {provider.config.max_retries for provider in service.providers} == {LLM_PROVIDER_MAX_ATTEMPTS}
+        # Standalone providers (embeddings, scripts) keep their patient retries
+        assert config.max_retries == 20
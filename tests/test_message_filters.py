@@ -9,7 +9,11 @@ from message_filters import (
     filter_spam,
     filter_empty,
     apply_filters,
-    FilterManager
+    FilterManager,
+    AutomatedMessageMatcher,
+    AHOCORASICK_AVAILABLE,
+    RecentMessageIndex,
+    filter_duplicate,
 )
 
 
@@ -273,6 +277,40 @@ class TestFilterAutomatedMessages:
         assert reason is None
 
 
+class TestAutomatedMessageMatcher:
+    """The compiled matcher must keep the category order of the original checks"""
+
+    MESSAGES = [
+        {"body": "welcome to our unsubscribe page", "sender_contact": "friend@gmail.com"},
+        {"body": "عرض خاص", "sender_contact": "noreply@shop.com"},
+        {"body": "your invoice and a bonus", "sender_contact": "a@b.com"},
+        {"body": "your invoice and a bonus", "sender_contact": "a@b.com", "is_group": True},
+        {"body": "free gift for the group", "sender_contact": "@someone", "is_channel": True},
+        {"body": "free gift for you", "sender_contact": "@someone"},
+        {"body": "hello, is the shop open today?", "sender_contact": "x@github.com"},
+        {"body": "رمز التحقق الخاص بك", "sender_contact": "+963900"},
+    ]
+    EXPECTED = [
+        "Automated: Marketing/Ad",
+        "Automated: Sender pattern detected",
+        "Automated: System/Transactional",
+        "Automated: Marketing/Ad (Group/Channel Content)",
+        "Automated: Marketing/Ad (Group/Channel Content)",
+        None,
+        "Automated: Service Provider",
+        "Automated: OTP/Verification",
+    ]
+
+    def test_scan_fallback_reasons(self):
+        matcher = AutomatedMessageMatcher(use_automaton=False)
+        assert [matcher.match(m) for m in self.MESSAGES] == self.EXPECTED
+
+    @pytest.mark.skipif(not AHOCORASICK_AVAILABLE, reason="pyahocorasick not installed")
+    def test_automaton_matches_scan(self):
+        matcher = AutomatedMessageMatcher(use_automaton=True)
+        assert [matcher.match(m) for m in self.MESSAGES] == self.EXPECTED
+
+
 class TestFilterSpam:
     """Tests for spam filtering"""
 
@@ -340,3 +378,59 @@ class TestFilterManager:
         }
         should_process, reason = manager.should_process(message)
         assert should_process is True
+
+    def test_rules_do_not_grow_when_reused(self):
+        """Reusing a manager with recent messages keeps the rule list fixed"""
+        manager = FilterManager(license_id=1, blocked_senders=["+963911"], blocked_keywords=["Crypto"])
+        rules = len(manager.filter.rules)
+        recent = [{"sender_contact": "a@b.com", "body": "hello there friend"}]
+
+        for _ in range(3):
+            manager.should_process({"body": "hello there friend", "sender_contact": "a@b.com"}, recent)
+
+        assert len(manager.filter.rules) == rules
+        assert manager.should_process({"body": "hello again", "sender_contact": "+963911"}) == (False, "Sender is blocked")
+        assert manager.should_process({"body": "buy CRYPTO today", "sender_contact": "c@d.com"}) == (False, "Contains blocked keyword")
+
+    @pytest.mark.asyncio
+    async def test_manager_cached_until_invalidated(self, monkeypatch):
+        """Settings are loaded once per license and reloaded after invalidation"""
+        import message_filters
+
+        loads = []
+
+        async def fake_load(license_id):
+            loads.append(license_id)
+            return {"blocked_senders": ["+963911"], "blocked_keywords": [], "required_keywords": []}
+
+        monkeypatch.setattr(message_filters, "_load_filter_settings", fake_load)
+        message_filters.invalidate_filter_cache()
+
+        blocked = {"body": "مرحبا، عندي سؤال", "sender_contact": "+963911"}
+        assert await apply_filters(blocked, license_id=7) == (False, "Sender is blocked")
+        assert await apply_filters(blocked, license_id=7) == (False, "Sender is blocked")
+        assert loads == [7]
+
+        message_filters.invalidate_filter_cache(7)
+        await apply_filters(blocked, license_id=7)
+        assert loads == [7, 7]
+        message_filters.invalidate_filter_cache()
+
+
+class TestDuplicateIndex:
+    """filter_duplicate must agree with the recent-messages scan"""
+
+    def test_index_matches_sender_contact_or_id(self):
+        from datetime import datetime, timedelta
+
+        now = datetime.now()
+        recent = [
+            {"sender_contact": "+963900", "body": "price?", "received_at": (now - timedelta(minutes=30)).isoformat()},
+            {"sender_id": "42", "body": "price?", "received_at": now.isoformat()},
+            {"sender_contact": "old@x.com", "body": "hi there", "received_at": now - timedelta(hours=1)},
+        ]
+        index = RecentMessageIndex(recent)
+
+        assert filter_duplicate({"sender_id": "42", "body": "price?"}, index) == (False, "Duplicate message")
+        assert filter_duplicate({"sender_contact": "+963900", "body": "price?"}, index) == (True, None)
+        assert filter_duplicate({"sender_contact": "old@x.com", "body": "hi there"}, recent) == (True, None)
@@ -40,31 +40,23 @@ class TestSubscriptionRoutes:
             assert response.company_name == "Test Company"
 
     @pytest.mark.asyncio
-    async def test_list_subscriptions(self, mock_admin_auth):
+    async def test_list_subscriptions(self):
         from routes.subscription import list_subscriptions
         
         # Mock DB for SQLite path (default)
-        with patch("aiosqlite.connect") as mock_connect:
+        with patch("routes.subscription.get_db") as mock_get_db:
             mock_db = AsyncMock()
             mock_cursor = AsyncMock()
-            mock_connect.return_value.__aenter__.return_value = mock_db
+            mock_get_db.return_value.__aenter__.return_value = mock_db
+            mock_db.execute = MagicMock()
             mock_db.execute.return_value.__aenter__.return_value = mock_cursor
             
-            # Mock fetchall rows
-            mock_row = MagicMock()
-            mock_row.keys.return_value = ["id", "company_name", "created_at"]
-            # To make dict(row) work, we need __iter__ or similar behavior if it's not a real Row
-            # Simulating dict behavior:
-            row_data = {"id": 1, "company_name": "Test Co", "created_at": "2023-01-01"}
-            
-            # If the code does dict(row), it expects an iterable of (key, value) or similar
-            # aiosqlite.Row is dict-like.
-            # Let's just return a dict directly since the code converts it: `row_dict = dict(row)`
-            # Wait, `dict({})` is fine.
+            # aiosqlite.Row is dict-like and the route converts it with dict(row)
             mock_cursor.fetchall.return_value = [{"id": 1, "company_name": "Test Co", "is_active": 1}]
             
-            response = await list_subscriptions(limit=10)
+            response = await list_subscriptions(limit=10, auth={"is_admin": True, "license_id": None})
             
+            mock_get_db.assert_called_once_with(readonly=True)
             assert response.total == 1
             assert response.subscriptions[0]["company_name"] == "Test Co"
 
@@ -0,0 +1,163 @@
+"""
+Al-Mudeer Notification Outbox Tests
+Queued push deliveries, dedup, retries, admin broadcasts and the delivery worker
+"""
+
+import asyncio
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture
+async def outbox_db(sqlite_pool):
+    """Throwaway SQLite database with licenses, notifications and the outbox tables"""
+    from migrations.notification_outbox_table import create_notification_outbox_table
+    from db_helper import get_db, execute_sql, commit_db
+
+    await create_notification_outbox_table()
+    async with get_db() as db:
+        await execute_sql(db, "CREATE TABLE license_keys (id INTEGER PRIMARY KEY, is_active BOOLEAN DEFAULT TRUE)")
+        await execute_sql(db, """
+            CREATE TABLE notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, license_key_id INTEGER NOT NULL,
+                type TEXT NOT NULL, priority TEXT DEFAULT 'normal', title TEXT NOT NULL,
+                message TEXT NOT NULL, link TEXT, is_read BOOLEAN DEFAULT FALSE
+            )
+        """)
+        for license_id, active in ((1, True), (2, True), (3, True), (4, False)):
+            await execute_sql(db, "INSERT INTO license_keys (id, is_active) VALUES (?, ?)", [license_id, active])
+        await commit_db(db)
+
+    with patch("models.notification_outbox.available_push_channels", return_value=["fcm", "web_push"]):
+        yield sqlite_pool
+
+
+class TestOutboxQueue:
+    """One row per delivery, deduplicated and retried"""
+
+    async def test_same_notification_is_queued_once_per_channel(self, outbox_db):
+        from models.notification_outbox import enqueue_notification_push, claim_deliveries
+
+        assert await enqueue_notification_push(1, 10, "title", "body") == 2
+        assert await enqueue_notification_push(1, 10, "title", "body") == 0
+
+        fcm = await claim_deliveries("fcm", "w1", limit=10)
+        assert len(fcm) == 1
+        assert fcm[0]["license_id"] == 1
+        assert fcm[0]["payload"]["notification_id"] == 10
+        assert len(await claim_deliveries("web_push", "w1", limit=10)) == 1
+
+    async def test_failed_delivery_backs_off_then_dead_letters(self, outbox_db):
+        from models.notification_outbox import enqueue_notification_push, claim_deliveries, fail_delivery
+        from db_helper import get_db, execute_sql, commit_db
+
+        await enqueue_notification_push(1, 10, "title", "body", channels=["fcm"])
+        delivery = (await claim_deliveries("fcm", "w1", limit=1))[0]
+        delivery["max_attempts"] = 2
+        assert await fail_delivery(delivery, "w1", "FCM down") == "pending"
+        assert await claim_deliveries("fcm", "w1", limit=1) == []
+
+        async with get_db() as db:
+            await execute_sql(db, "UPDATE notification_outbox SET run_after = NULL")
+            await commit_db(db)
+
+        delivery = (await claim_deliveries("fcm", "w1", limit=1))[0]
+        assert delivery["attempts"] == 2
+        delivery["max_attempts"] = 2
+        assert await fail_delivery(delivery, "w1", "FCM still down") == "dead"
+
+    async def test_reaped_worker_cannot_touch_reclaimed_delivery(self, outbox_db):
+        from models.notification_outbox import (
+            enqueue_notification_push, claim_deliveries, reap_expired_deliveries,
+            complete_deliveries, fail_delivery, release_delivery,
+        )
+        from db_helper import get_db, fetch_one, execute_sql, commit_db
+
+        await enqueue_notification_push(1, 10, "title", "body", channels=["fcm"])
+        stale = (await claim_deliveries("fcm", "slow", limit=1))[0]
+        async with get_db() as db:
+            await execute_sql(db, "UPDATE notification_outbox SET lease_expires_at = '2000-01-01T00:00:00'")
+            await commit_db(db)
+        assert await reap_expired_deliveries() == 1
+        async with get_db() as db:
+            await execute_sql(db, "UPDATE notification_outbox SET run_after = NULL")
+            await commit_db(db)
+        assert [d["id"] for d in await claim_deliveries("fcm", "fresh", limit=1)] == [stale["id"]]
+
+        # The stale worker finishes late: none of its updates land
+        await complete_deliveries({stale["id"]: 1}, "slow")
+        assert await fail_delivery(stale, "slow", "late error") is None
+        await release_delivery(stale["id"], "slow")
+
+        async with get_db() as db:
+            row = await fetch_one(db, "SELECT status, worker_id, attempts FROM notification_outbox WHERE id = ?", [stale["id"]])
+        assert (row["status"], row["worker_id"], row["attempts"]) == ("processing", "fresh", 2)
+        await complete_deliveries({stale["id"]: 3}, "fresh")
+        async with get_db() as db:
+            row = await fetch_one(db, "SELECT status, sent_count FROM notification_outbox WHERE id = ?", [stale["id"]])
+        assert (row["status"], row["sent_count"]) == ("sent", 3)
+
+
+class TestBroadcast:
+    """Admin broadcasts are one bulk insert plus background fan-out"""
+
+    async def test_broadcast_queues_every_active_license(self, outbox_db):
+        from models.notification_outbox import create_broadcast, get_broadcast_progress
+        from db_helper import get_db, fetch_all
+
+        result = await create_broadcast("Update", "New features", license_ids=None)
+
+        assert result["total_targets"] == 3
+        assert result["notifications_created"] == 3
+        assert result["deliveries_queued"] == 6
+        async with get_db() as db:
+            rows = await fetch_all(db, "SELECT license_key_id FROM notifications ORDER BY license_key_id")
+        assert [row["license_key_id"] for row in rows] == [1, 2, 3]
+
+        progress = await get_broadcast_progress(result["broadcast_id"])
+        assert progress["deliveries"]["pending"] == 6
+        assert progress["progress"] == 0
+        assert progress["done"] is False
+        assert await get_broadcast_progress(999) is None
+
+    async def test_worker_drains_broadcast_with_per_channel_limits(self, outbox_db):
+        from workers import NotificationDeliveryWorker
+        from models.notification_outbox import create_broadcast, get_broadcast_progress
+
+        active = {"fcm": 0, "web_push": 0}
+        peak = {"fcm": 0, "web_push": 0}
+        calls = []
+
+        async def fake_deliver(channel, license_id, payload):
+            active[channel] += 1
+            peak[channel] = max(peak[channel], active[channel])
+            await asyncio.sleep(0.02)
+            active[channel] -= 1
+            calls.append((channel, license_id))
+            if channel == "web_push" and license_id == 2:
+                raise RuntimeError("push service unavailable")
+            return 2
+
+        result = await create_broadcast("Update", "New features", license_ids=[1, 2, 3, 1])
+
+        worker = NotificationDeliveryWorker(worker_id="test", concurrency={"fcm": 2, "web_push": 1})
+        worker.IDLE_POLL_SECONDS = 60
+        with patch.object(worker, "_deliver", side_effect=fake_deliver):
+            await worker.start()
+            try:
+                for _ in range(100):
+                    progress = await get_broadcast_progress(result["broadcast_id"])
+                    if progress["deliveries"]["sent"] == 5 and progress["deliveries"]["pending"] == 1:
+                        break
+                    await asyncio.sleep(0.02)
+            finally:
+                await worker.stop()
+
+        assert len(calls) == 6
+        assert peak == {"fcm": 2, "web_push": 1}
+        progress = await get_broadcast_progress(result["broadcast_id"])
+        assert progress["total_targets"] == 3
+        assert progress["deliveries"]["sent"] == 5
+        # The failed web push is waiting for its retry
+        assert progress["deliveries"]["pending"] == 1
+        assert progress["devices_reached"] == {"fcm": 6, "web_push": 4}
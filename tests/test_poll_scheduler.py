@@ -0,0 +1,152 @@
+"""
+Al-Mudeer MessagePoller Scheduler Tests
+Per-license due times and bounded concurrent polling
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from workers import MessagePoller
+
+
+class TestPollScheduler:
+    """Tests for the per-license polling schedule"""
+
+    def test_new_licenses_spread_over_one_interval(self):
+        """First due times fall within one interval; removed licenses are dropped"""
+        poller = MessagePoller()
+        poller._schedule_licenses([1, 2, 3], now=1000.0)
+
+        assert set(poller._next_due) == {1, 2, 3}
+        assert all(1000.0 <= due <= 1000.0 + poller.POLL_INTERVAL_SECONDS for due in poller._next_due.values())
+
+        poller._schedule_licenses([2, 3, 4], now=1010.0)
+        assert set(poller._next_due) == {2, 3, 4}
+
+    def test_due_licenses_skip_in_flight(self):
+        """Only overdue licenses that aren't polling already are returned, oldest first"""
+        poller = MessagePoller()
+        poller._next_due = {1: 50.0, 2: 10.0, 3: 200.0, 4: 20.0}
+        poller._in_flight = {4}
+
+        assert poller._due_licenses(100.0) == [2, 1]
+
+    @pytest.mark.asyncio
+    async def test_polls_run_concurrently_under_cap(self):
+        """Many licenses poll in parallel, never exceeding the concurrency cap"""
+        poller = MessagePoller()
+        poller.POLL_MAX_CONCURRENCY = 5
+        poller._poll_semaphore = asyncio.Semaphore(poller.POLL_MAX_CONCURRENCY)
+        poller._next_due = {license_id: 0.0 for license_id in range(20)}
+
+        active = 0
+        peak = 0
+
+        async def fake_poll(license_id):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.02)
+            active -= 1
+
+        with patch.object(poller, "_poll_email", side_effect=fake_poll), \
+             patch.object(poller, "_poll_telegram", AsyncMock()), \
+             patch.object(poller, "_retry_approved_outbox", AsyncMock()), \
+             patch.object(poller, "_poll_telegram_outbox_status", AsyncMock()), \
+             patch.object(poller, "_retry_pending_messages", AsyncMock()) as retry:
+            await asyncio.gather(*(poller._poll_license(license_id) for license_id in range(20)))
+
+        assert peak == 5
+        assert retry.await_count == 20
+        assert all(due > 0.0 for due in poller._next_due.values())
+        assert not poller._in_flight
+
+    @pytest.mark.asyncio
+    async def test_slow_llm_retries_do_not_hold_poll_slots(self):
+        """A license stuck in LLM retries doesn't keep others from polling"""
+        poller = MessagePoller()
+        poller.POLL_MAX_CONCURRENCY = 1
+        poller._poll_semaphore = asyncio.Semaphore(1)
+        poller._next_due = {1: 0.0, 2: 0.0}
+        release_retry = asyncio.Event()
+
+        async def slow_retry(license_id):
+            if license_id == 1:
+                await release_retry.wait()
+
+        with patch.object(poller, "_poll_email", AsyncMock()) as poll_email, \
+             patch.object(poller, "_poll_telegram", AsyncMock()), \
+             patch.object(poller, "_retry_approved_outbox", AsyncMock()), \
+             patch.object(poller, "_poll_telegram_outbox_status", AsyncMock()), \
+             patch.object(poller, "_retry_pending_messages", side_effect=slow_retry):
+            stuck = asyncio.create_task(poller._poll_license(1))
+            await asyncio.sleep(0.01)
+            await asyncio.wait_for(poller._poll_license(2), timeout=1)
+            assert poll_email.await_count == 2
+            release_retry.set()
+            await stuck
+
+    @pytest.mark.asyncio
+    async def test_failing_channel_poll_is_logged(self):
+        """An exception from one channel is logged with its license and channel"""
+        poller = MessagePoller()
+        poller._poll_semaphore = asyncio.Semaphore(1)
+        poller._next_due = {3: 0.0}
+
+        with patch.object(poller, "_poll_email", AsyncMock()) as poll_email, \
+             patch.object(poller, "_poll_telegram", AsyncMock(side_effect=RuntimeError("session revoked"))), \
+             patch.object(poller, "_retry_approved_outbox", AsyncMock()), \
+             patch.object(poller, "_poll_telegram_outbox_status", AsyncMock()), \
+             patch.object(poller, "_retry_pending_messages", AsyncMock()), \
+             patch("workers.logger") as logger:
+            await poller._poll_license(3)
+
+        poll_email.assert_awaited_once_with(3)
+        messages = [call.args[0] for call in logger.error.call_args_list]
+        assert messages == ["Error polling telegram for license 3: RuntimeError: session revoked"]
+
+
+class TestPendingMessageRetry:
+    """Messages still showing the analysis placeholder are re-analyzed"""
+
+    @pytest.fixture
+    async def inbox_db(self, sqlite_pool, monkeypatch):
+        from db_helper import get_db, execute_sql, commit_db
+
+        monkeypatch.setattr("workers.DB_TYPE", "sqlite")
+
+        async with get_db() as db:
+            await execute_sql(db, """
+                CREATE TABLE inbox_messages (
+                    id INTEGER PRIMARY KEY, license_key_id INTEGER, body TEXT,
+                    sender_contact TEXT, sender_name TEXT, channel TEXT,
+                    ai_draft_response TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await execute_sql(db, """
+                INSERT INTO inbox_messages (id, license_key_id, body, sender_contact, sender_name, channel, ai_draft_response)
+                VALUES (7, 1, 'hello', '+963900000000', 'Sara', 'whatsapp', '⏳ جاري تحليل الرسالة تلقائياً...')
+            """)
+            await commit_db(db)
+        return sqlite_pool
+
+    @pytest.mark.asyncio
+    async def test_retry_runs_analysis_at_background_priority(self, inbox_db):
+        from services.rate_limiter import current_request_context, PRIORITY_BACKGROUND
+
+        poller = MessagePoller()
+        seen = []
+
+        async def fake_analysis(message_id, body, license_id, attachments=None):
+            seen.append((message_id, body, current_request_context()))
+
+        with patch("services.llm_provider.get_rate_limiter") as limiter, \
+             patch("services.analysis_service.process_inbox_message_logic", side_effect=fake_analysis), \
+             patch.object(poller, "_check_user_rate_limit", AsyncMock(return_value=(True, ""))), \
+             patch.object(poller, "_increment_user_rate_limit", AsyncMock()) as counted:
+            limiter.return_value.is_in_cooldown.return_value = False
+            await poller._retry_pending_messages(1)
+
+        assert seen == [(7, "hello", (PRIORITY_BACKGROUND, 1))]
+        counted.assert_awaited_once_with(1)
@@ -0,0 +1,182 @@
+"""
+Al-Mudeer LLM Rate Limiter Tests
+Token buckets, shared stores, priorities and per-license fair queuing
+"""
+
+import asyncio
+import pytest
+
+
+class GateStore:
+    """Bucket store that grants one call per open() (to drive the queue by hand)"""
+    name = "gate"
+
+    def __init__(self):
+        self.permits = 0
+
+    def open(self, count: int = 1):
+        self.permits += count
+
+    async def take(self, buckets):
+        if self.permits > 0:
+            self.permits -= 1
+            return 0.0
+        return 0.01
+
+    async def drain(self, keys):
+        self.permits = 0
+
+
+class TestBuckets:
+    """Refill arithmetic and the background reserve"""
+
+    def test_burst_then_refill_with_background_reserve(self):
+        from services.rate_limiter import Bucket, refill_and_take
+
+        state = {}
+        background = [Bucket("gemini:*:rpm", capacity=10, rate=1, cost=1, reserve=2)]
+        for _ in range(8):
+            new_state, wait = refill_and_take(background, state, now=100.0)
+            assert wait == 0
+            state.update(new_state)
+
+        # Background callers stop at the reserve; interactive ones may use it
+        assert refill_and_take(background, state, now=100.0) == (None, 1.0)
+        interactive = [Bucket("gemini:*:rpm", capacity=10, rate=1, cost=1)]
+        for _ in range(2):
+            new_state, wait = refill_and_take(interactive, state, now=100.0)
+            state.update(new_state)
+        assert refill_and_take(interactive, state, now=100.0) == (None, 1.0)
+        # Refilled after a second of quiet
+        assert refill_and_take(interactive, state, now=101.0)[1] == 0
+
+    def test_request_is_taken_from_all_buckets_or_none(self):
+        from services.rate_limiter import Bucket, refill_and_take
+
+        state = {"tpm": (100.0, 0.0)}
+        buckets = [Bucket("rpm", 10, 1, 1), Bucket("tpm", 1000, 10, 500)]
+        new_state, wait = refill_and_take(buckets, state, now=0.0)
+        assert new_state is None
+        assert wait == 40.0
+        assert "rpm" not in state
+
+
+class TestSharedStores:
+    """Workers draw from one quota"""
+
+    async def test_sqlite_store_is_shared_between_workers(self, tmp_path):
+        from services.rate_limiter import Bucket, SQLiteBucketStore
+
+        path = str(tmp_path / "rate.db")
+        worker_a, worker_b = SQLiteBucketStore(path), SQLiteBucketStore(path)
+        buckets = [Bucket("gemini:*:rpm", capacity=2, rate=2 / 60, cost=1)]
+
+        assert await worker_a.take(buckets) == 0
+        assert await worker_b.take(buckets) == 0
+        assert await worker_a.take(buckets) > 0
+
+        await worker_b.drain(["gemini:*:rpm"])
+        assert await worker_a.take(buckets) == pytest.approx(30, rel=0.01)
+        worker_a.close()
+        worker_b.close()
+
+    async def test_redis_store_takes_atomically(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")  # fakeredis needs it for Lua scripts
+        from services.rate_limiter import Bucket, RedisBucketStore
+
+        server = fakeredis.FakeServer()
+        worker_a = RedisBucketStore(fakeredis.FakeRedis(server=server))
+        worker_b = RedisBucketStore(fakeredis.FakeRedis(server=server))
+        buckets = [Bucket("gemini:*:rpm", capacity=2, rate=2 / 60, cost=1)]
+
+        assert await worker_a.take(buckets) == 0
+        assert await worker_b.take(buckets) == 0
+        assert await worker_a.take(buckets) > 0
+
+
+class TestLLMRateLimiter:
+    """Queued callers: priority first, then round-robin across licenses"""
+
+    async def test_interactive_first_then_licenses_take_turns(self):
+        from services.rate_limiter import LLMRateLimiter, llm_request_context
+
+        store = GateStore()
+        limiter = LLMRateLimiter(store=store, limits={"gemini:*": (15, 0)})
+        served = []
+
+        async def call(name, priority, license_id):
+            with llm_request_context(priority=priority, license_id=license_id):
+                await limiter.wait_for_capacity("gemini", "gemini-2.5-flash")
+            served.append(name)
+
+        tasks = [
+            asyncio.create_task(call("bg-1a", "background", 1)),
+            asyncio.create_task(call("bg-1b", "background", 1)),
+            asyncio.create_task(call("bg-1c", "background", 1)),
+            asyncio.create_task(call("bg-2a", "background", 2)),
+        ]
+        await asyncio.sleep(0.05)
+        tasks.append(asyncio.create_task(call("draft-3", "interactive", 3)))
+        await asyncio.sleep(0.05)
+
+        for _ in range(len(tasks)):
+            store.open()
+            await asyncio.sleep(0.03)
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=2)
+
+        assert served == ["draft-3", "bg-1a", "bg-2a", "bg-1b", "bg-1c"]
+        stats = limiter.get_stats()
+        assert stats["granted"] == {"interactive": 1, "background": 4}
+        assert stats["waited"] == 5
+        assert stats["queued"] == 0
+
+    async def test_unlisted_provider_and_store_errors_do_not_block(self):
+        from services.rate_limiter import LLMRateLimiter
+
+        class BrokenStore:
+            name = "broken"
+
+            async def take(self, buckets):
+                raise ConnectionError("redis down")
+
+        limiter = LLMRateLimiter(store=BrokenStore(), limits={"gemini:*": (15, 0)})
+        await asyncio.wait_for(limiter.wait_for_capacity("openrouter", "any-model"), timeout=1)
+        await asyncio.wait_for(limiter.wait_for_capacity("gemini", "gemini-2.5-flash"), timeout=1)
+
+        stats = limiter.get_stats()
+        assert stats["store_errors"] == 1
+        assert stats["backend"] == "memory"
+
+    async def test_cooldown_only_holds_the_provider_that_got_429(self):
+        from services.rate_limiter import LLMRateLimiter
+
+        limiter = LLMRateLimiter(store=GateStore(), limits={})
+        limiter.report_rate_limit_hit("gemini", "gemini-2.5-flash")
+
+        assert limiter.is_in_cooldown("gemini")
+        assert not limiter.is_in_cooldown("openrouter")
+        await asyncio.wait_for(limiter.wait_for_capacity("openrouter", "any-model"), timeout=1)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.wait_for_capacity("gemini", "gemini-2.5-flash"), timeout=0.1)
+
+        limiter.report_success("openrouter")
+        assert limiter.is_in_cooldown("gemini")
+        assert set(limiter.get_stats()["cooldown_remaining"]) == {"gemini"}
+
+    async def test_capacity_wait_clock_stops_while_queued(self):
+        from services.rate_limiter import LLMRateLimiter, track_capacity_wait
+
+        store = GateStore()
+        limiter = LLMRateLimiter(store=store, limits={"gemini:*": (15, 0)})
+
+        with track_capacity_wait() as wait:
+            task = asyncio.create_task(limiter.wait_for_capacity("gemini", "gemini-2.5-flash"))
+        await asyncio.sleep(0.2)
+        assert wait.queued
+
+        store.open()
+        await asyncio.wait_for(task, timeout=1)
+        assert not wait.queued
+        assert wait.queued_seconds >= 0.2
+        assert wait.running_seconds() < 0.1
@@ -0,0 +1,89 @@
+"""
+Al-Mudeer Semantic Cache Tests
+Near-duplicate lookups per license, quality counters and the agent hook
+"""
+
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+
+class TestSemanticCache:
+    """Embedding-similarity lookups scoped per license"""
+
+    async def test_rephrased_question_hits_within_license_only(self):
+        from services.semantic_cache import SemanticCache
+
+        cache = SemanticCache(threshold=0.9)
+        shop_a = cache.scope(1, "system prompt")
+        shop_b = cache.scope(2, "system prompt")
+
+        first = await cache.lookup(shop_a, "كم السعر؟")
+        assert first.value is None
+        cache.store(shop_a, first, {"intent": "استفسار"})
+
+        hit = await cache.lookup(shop_a, "كَمْ سعره؟")
+        assert hit.value == {"intent": "استفسار"}
+        assert hit.similarity >= 0.9
+        assert (await cache.lookup(shop_b, "كم السعر؟")).value is None
+        assert (await cache.lookup(shop_a, "متى تفتحون المحل؟")).value is None
+
+        stats = cache.get_stats()
+        assert (stats["lookups"], stats["hits"], stats["misses"]) == (4, 1, 3)
+        assert stats["entries"] == 1
+        assert stats["avg_hit_similarity"] >= 0.9
+
+    async def test_near_misses_expiry_and_eviction_are_counted(self):
+        from services.semantic_cache import SemanticCache
+
+        cache = SemanticCache(threshold=0.95, max_entries=2, ttl_seconds=-1)
+        scope = cache.scope(1)
+        lookup = await cache.lookup(scope, "هل يوجد توصيل للرياض")
+        cache.store(scope, lookup, {"intent": "استفسار"})
+
+        # Identical text but the entry is past its TTL
+        assert (await cache.lookup(scope, "هل يوجد توصيل للرياض")).value is None
+        cache.ttl_seconds = 3600
+        near = await cache.lookup(scope, "هل يوجد توصيل للرياض اليوم")
+        assert near.value is None
+
+        for text in ("سؤال اول", "سؤال ثاني"):
+            cache.store(scope, await cache.lookup(scope, text), {"intent": "أخرى"})
+
+        stats = cache.get_stats()
+        assert stats["expired"] == 1
+        assert stats["near_misses"] == 1
+        assert stats["evictions"] == 1
+        assert stats["entries"] == 2
+
+
+class TestAgentSemanticCache:
+    """process_message reuses the analysis of a near-identical message"""
+
+    async def test_second_customer_reuses_analysis_without_their_name(self):
+        from services.semantic_cache import SemanticCache
+        from agent import process_message
+
+        analysis = {
+            "intent": "استفسار", "sentiment": "محايد", "urgency": "عادي",
+            "sender_name": "سارة", "summary": "يسأل عن السعر",
+            "draft_response": "السعر 50 ريال"
+        }
+        cache = SemanticCache(threshold=0.9)
+        knowledge_base = MagicMock()
+        knowledge_base.search = AsyncMock(return_value=[])
+        preferences = {"license_key_id": 7}
+
+        with patch("services.semantic_cache.get_semantic_cache", return_value=cache), \
+             patch("services.knowledge_base.get_knowledge_base", return_value=knowledge_base), \
+             patch("agent.apply_filters", AsyncMock(return_value=(True, ""))), \
+             patch("agent.call_llm", AsyncMock(return_value=json.dumps(analysis, ensure_ascii=False))) as llm:
+            first = await process_message("كم السعر؟", preferences=preferences)
+            second = await process_message("كم سعره؟", sender_name="خالد", preferences=preferences)
+            with_history = await process_message("كم سعره؟", history="User: مرحبا", preferences=preferences)
+
+        assert llm.await_count == 2
+        assert first["data"]["sender_name"] == "سارة"
+        assert second["data"]["draft_response"] == "السعر 50 ريال"
+        assert second["data"]["sender_name"] == "خالد"
+        assert with_history["success"] is True
+        assert cache.get_stats()["hits"] == 1
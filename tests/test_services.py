@@ -129,6 +129,60 @@ class TestRequestBatcher:
         # Different license = different key
         assert key1 != key3
 
+    @pytest.mark.asyncio
+    async def test_combined_batch_uses_one_llm_call(self):
+        """A batch is analyzed with a single multi-message prompt"""
+        import json
+        from services.request_batcher import RequestBatcher, BatchedRequest
+
+        response = json.dumps({"results": [
+            {"index": 1, "intent": "استفسار", "draft_response": "أهلاً"},
+            {"index": 2, "intent": "شكوى", "draft_response": "نعتذر"},
+        ]})
+        batcher = RequestBatcher(combined=True)
+        requests = [BatchedRequest(request_id=str(i), message=f"msg {i}", message_type="email", sender_name=None) for i in range(2)]
+        batcher._pending["1:short"] = list(requests)
+
+        knowledge_base = AsyncMock()
+        knowledge_base.search = AsyncMock(side_effect=lambda text, k: [{"text": f"KB for {text}"}] if text == "msg 1" else [])
+
+        with patch("agent.apply_filters", AsyncMock(return_value=(True, ""))), \
+             patch("services.knowledge_base.get_knowledge_base", return_value=knowledge_base), \
+             patch("agent.call_llm", AsyncMock(return_value=response)) as llm, \
+             patch("agent.process_message", AsyncMock()) as single:
+            await batcher._process_batch("1:short")
+
+        assert llm.await_count == 1
+        # Each message carries its own Knowledge Base results
+        prompt = llm.await_args.args[0]
+        assert "msg 1\n\n[System: Knowledge Base Info]\n- KB for msg 1" in prompt
+        assert prompt.count("[System: Knowledge Base Info]") == 1
+        single.assert_not_awaited()
+        assert requests[0].future.result()["data"]["intent"] == "استفسار"
+        assert requests[1].future.result()["data"]["draft_response"] == "نعتذر"
+        assert batcher.stats["calls_saved"] == 1
+
+    @pytest.mark.asyncio
+    async def test_combined_batch_falls_back_on_parse_failure(self):
+        """Messages missing from the combined response are processed individually"""
+        from services.request_batcher import RequestBatcher, BatchedRequest
+
+        batcher = RequestBatcher(combined=True)
+        requests = [BatchedRequest(request_id=str(i), message=f"msg {i}", message_type="email", sender_name=None) for i in range(3)]
+        batcher._pending["1:short"] = list(requests)
+        single_result = {"success": True, "data": {"intent": "أخرى"}}
+
+        with patch("agent.apply_filters", AsyncMock(return_value=(True, ""))), \
+             patch("services.knowledge_base.get_knowledge_base", return_value=AsyncMock(search=AsyncMock(return_value=[]))), \
+             patch("agent.call_llm", AsyncMock(return_value="not json at all")), \
+             patch("agent.process_message", AsyncMock(return_value=single_result)) as single:
+            await batcher._process_batch("1:short")
+
+        assert single.await_count == 3
+        assert all(r.future.result() == single_result for r in requests)
+        assert batcher.stats["parse_failures"] == 1
+        assert batcher.stats["calls_saved"] == -1
+
 
 # ============ Cache Service ============
 
@@ -0,0 +1,238 @@
+"""
+Al-Mudeer Task Queue Tests
+Batched claims, the concurrent event-driven TaskWorker, leases and retries
+"""
+
+import asyncio
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture
+async def queue_db(sqlite_pool):
+    """Throwaway SQLite database with the task_queue table"""
+    from migrations.task_queue_table import create_task_queue_table
+
+    await create_task_queue_table()
+    return sqlite_pool
+
+
+class TestBatchClaim:
+    """fetch_next_tasks claims several tasks per statement"""
+
+    async def test_claims_in_priority_order(self, queue_db):
+        from models.task_queue import enqueue_task, fetch_next_tasks
+
+        low = await enqueue_task("analyze", {"n": 1}, priority=0)
+        high = await enqueue_task("analyze", {"n": 2}, priority=5)
+        await enqueue_task("analyze", {"n": 3}, priority=0)
+
+        claimed = await fetch_next_tasks("w1", limit=2)
+
+        assert [task["id"] for task in claimed] == [high, low]
+        assert claimed[0]["payload"] == {"n": 2}
+
+    async def test_concurrent_claims_do_not_overlap(self, queue_db):
+        from models.task_queue import enqueue_task, fetch_next_tasks, fetch_next_task
+
+        ids = {await enqueue_task("analyze", {"n": n}) for n in range(10)}
+
+        batches = await asyncio.gather(*(fetch_next_tasks(f"w{n}", limit=3) for n in range(5)))
+        claimed = [task["id"] for batch in batches for task in batch]
+
+        assert len(claimed) == len(set(claimed)) == 10
+        assert set(claimed) == ids
+        assert await fetch_next_task("w9") is None
+
+
+class TestBulkOperations:
+    """Bulk enqueue/complete in one statement and one commit"""
+
+    async def test_bulk_enqueue_returns_ids_in_order(self, queue_db):
+        from models.task_queue import enqueue_tasks_bulk, fetch_next_tasks, BULK_INSERT_CHUNK
+
+        payloads = [{"n": n} for n in range(BULK_INSERT_CHUNK + 5)]
+        task_ids = await enqueue_tasks_bulk("analyze_message", payloads)
+
+        assert len(task_ids) == len(payloads)
+        claimed = await fetch_next_tasks("w1", limit=len(payloads))
+        by_id = {task["id"]: task["payload"] for task in claimed}
+        assert [by_id[task_id] for task_id in task_ids] == payloads
+        assert await enqueue_tasks_bulk("analyze_message", []) == []
+
+    async def test_bulk_complete_only_touches_processing(self, queue_db):
+        from models.task_queue import enqueue_tasks_bulk, fetch_next_tasks, complete_tasks_bulk
+
+        first, second, third = await enqueue_tasks_bulk("analyze", [{}, {}, {}])
+        await fetch_next_tasks("w1", limit=2)
+
+        assert await complete_tasks_bulk([first, second, third], "w1") == [first, second]
+        assert await complete_tasks_bulk([first], "w1") == []
+
+    async def test_poller_queues_analysis_in_bulk(self, queue_db):
+        from workers import MessagePoller
+        from db_helper import get_db, fetch_all
+
+        poller = MessagePoller()
+        jobs = [
+            {"message_id": n, "body": f"hello {n}", "channel": "telegram", "channel_message_id": str(n)}
+            for n in range(3)
+        ]
+        with patch.object(poller, "_increment_user_rate_limit"), \
+             patch.object(poller, "_mark_duplicate") as mark_duplicate:
+            await poller._enqueue_analysis(1, jobs)
+            # Redelivered message is skipped as an exact duplicate
+            await poller._enqueue_analysis(1, jobs[:1])
+
+        mark_duplicate.assert_awaited_once_with(0)
+        async with get_db() as db:
+            rows = await fetch_all(db, "SELECT task_type, payload FROM task_queue ORDER BY id")
+        assert [row["task_type"] for row in rows] == ["analyze_message"] * 3
+
+
+class TestRetriesAndLeases:
+    """Failed and abandoned tasks are retried with backoff, then dead-lettered"""
+
+    async def test_failure_backs_off_then_dead_letters(self, queue_db):
+        from models.task_queue import enqueue_task, fetch_next_tasks, fail_task
+        from db_helper import get_db, fetch_one, execute_sql
+
+        task_id = await enqueue_task("analyze", {}, max_attempts=2)
+
+        assert (await fetch_next_tasks("w1", limit=5))[0]["attempts"] == 1
+        assert await fail_task(task_id, "w1", "boom") == "pending"
+        # Backing off: not claimable yet
+        assert await fetch_next_tasks("w1", limit=5) == []
+
+        async with get_db() as db:
+            await execute_sql(db, "UPDATE task_queue SET run_after = NULL WHERE id = ?", [task_id])
+            await db.commit()
+
+        assert (await fetch_next_tasks("w1", limit=5))[0]["attempts"] == 2
+        assert await fail_task(task_id, "w1", "boom again") == "dead"
+
+        async with get_db() as db:
+            row = await fetch_one(db, "SELECT status, error_message FROM task_queue WHERE id = ?", [task_id])
+        assert row["status"] == "dead"
+        assert row["error_message"] == "boom again"
+
+    async def test_reaper_requeues_expired_leases(self, queue_db):
+        from models.task_queue import (
+            enqueue_task, fetch_next_tasks, heartbeat_tasks, retry_stuck_tasks,
+        )
+        from db_helper import get_db, fetch_one, execute_sql
+
+        abandoned = await enqueue_task("analyze", {"n": 1})
+        alive = await enqueue_task("analyze", {"n": 2})
+        await fetch_next_tasks("crashed", limit=1)
+        await fetch_next_tasks("healthy", limit=1)
+
+        async with get_db() as db:
+            await execute_sql(db, "UPDATE task_queue SET lease_expires_at = '2000-01-01T00:00:00'")
+            await db.commit()
+        await heartbeat_tasks([alive], "healthy")
+
+        assert await retry_stuck_tasks() == 1
+
+        async with get_db() as db:
+            reaped = await fetch_one(db, "SELECT status, worker_id, error_message FROM task_queue WHERE id = ?", [abandoned])
+            running = await fetch_one(db, "SELECT status FROM task_queue WHERE id = ?", [alive])
+        assert reaped["status"] == "pending"
+        assert reaped["worker_id"] is None
+        assert "crashed" in reaped["error_message"]
+        assert running["status"] == "processing"
+
+    async def test_reaped_worker_cannot_touch_reclaimed_task(self, queue_db):
+        from models.task_queue import (
+            enqueue_task, fetch_next_tasks, retry_stuck_tasks,
+            complete_task, complete_tasks_bulk, fail_task, release_task,
+        )
+        from db_helper import get_db, fetch_one, execute_sql
+
+        task_id = await enqueue_task("analyze", {})
+        await fetch_next_tasks("slow", limit=1)
+        async with get_db() as db:
+            await execute_sql(db, "UPDATE task_queue SET lease_expires_at = '2000-01-01T00:00:00', run_after = NULL")
+            await db.commit()
+        await retry_stuck_tasks()
+        async with get_db() as db:
+            await execute_sql(db, "UPDATE task_queue SET run_after = NULL")
+            await db.commit()
+        assert [task["id"] for task in await fetch_next_tasks("fresh", limit=1)] == [task_id]
+
+        # The stale worker finishes late: none of its updates land
+        assert await complete_tasks_bulk([task_id], "slow") == []
+        await complete_task(task_id, "slow")
+        assert await fail_task(task_id, "slow", "late error") is None
+        await release_task(task_id, "slow")
+
+        async with get_db() as db:
+            row = await fetch_one(db, "SELECT status, worker_id, attempts FROM task_queue WHERE id = ?", [task_id])
+        assert (row["status"], row["worker_id"], row["attempts"]) == ("processing", "fresh", 2)
+        assert await complete_tasks_bulk([task_id], "fresh") == [task_id]
+
+    async def test_queue_metrics_per_task_type(self, queue_db):
+        from models.task_queue import enqueue_task, fetch_next_tasks, get_queue_metrics
+
+        await enqueue_task("analyze_message", {"n": 1}, priority=1)
+        await enqueue_task("analyze_message", {"n": 2})
+        await enqueue_task("analyze", {"n": 3})
+        await fetch_next_tasks("w1", limit=1)
+
+        metrics = await get_queue_metrics()
+
+        assert metrics["task_types"]["analyze_message"]["pending"] == 1
+        assert metrics["task_types"]["analyze_message"]["processing"] == 1
+        assert metrics["task_types"]["analyze"]["pending"] == 1
+        assert metrics["task_types"]["analyze"]["oldest_pending_age_seconds"] >= 0
+        assert metrics["totals"] == {"pending": 2, "processing": 1, "dead": 0}
+
+
+class TestTaskWorker:
+    """TaskWorker runs claimed tasks concurrently and wakes on enqueue"""
+
+    async def test_runs_tasks_concurrently_and_wakes_on_enqueue(self, queue_db):
+        from workers import TaskWorker
+        from models.task_queue import enqueue_task
+        from db_helper import get_db, fetch_all
+
+        active = 0
+        peak = 0
+        done = asyncio.Event()
+        finished = []
+
+        async def fake_execute(task_type, payload):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.05)
+            active -= 1
+            finished.append(payload["n"])
+            if len(finished) == 6:
+                done.set()
+
+        worker = TaskWorker(worker_id="test", concurrency=3)
+        # A long idle poll: only the enqueue wakeup can deliver the tasks in time
+        worker.IDLE_POLL_SECONDS = 60
+        with patch.object(worker, "_execute", side_effect=fake_execute):
+            await worker.start()
+            try:
+                await asyncio.sleep(0.05)
+                for n in range(6):
+                    await enqueue_task("analyze", {"n": n})
+                await asyncio.wait_for(done.wait(), timeout=5)
+            finally:
+                await worker.stop()
+
+        assert peak == 3
+        assert sorted(finished) == list(range(6))
+        async with get_db() as db:
+            rows = await fetch_all(db, "SELECT status FROM task_queue")
+        assert {row["status"] for row in rows} == {"completed"}
+
+    def test_default_worker_ids_are_unique_per_instance(self):
+        from workers import TaskWorker, NotificationDeliveryWorker
+
+        assert TaskWorker().worker_id != TaskWorker().worker_id
+        assert NotificationDeliveryWorker().worker_id != NotificationDeliveryWorker().worker_id
+        assert TaskWorker().worker_id.startswith("tasks:")
@@ -168,6 +168,174 @@ class TestEventBroadcasting:
         await manager.broadcast(msg)
 
 
+# ============ Fan-out Queues ============
+
+class TestFanOut:
+    """Per-socket send queues, slow consumers and coalescing"""
+    
+    @pytest.fixture
+    def manager(self):
+        """Manager without Redis so sends go straight to local sockets"""
+        with patch('services.websocket_manager.RedisPubSubManager') as mock:
+            mock_instance = mock.return_value
+            mock_instance.is_available = False
+            mock_instance.initialize = AsyncMock(return_value=False)
+            from services.websocket_manager import ConnectionManager
+            yield ConnectionManager()
+    
+    @staticmethod
+    def _socket(delay: float = 0.0):
+        import asyncio
+        
+        ws = AsyncMock()
+        ws.frames = []
+        
+        async def send_text(frame):
+            if delay:
+                await asyncio.sleep(delay)
+            ws.frames.append(json.loads(frame))
+        
+        ws.send_text = AsyncMock(side_effect=send_text)
+        return ws
+    
+    @pytest.mark.asyncio
+    async def test_slow_client_does_not_stall_others(self, manager):
+        """A stalled socket only delays itself"""
+        import asyncio
+        from services.websocket_manager import WebSocketMessage
+        
+        slow = self._socket(delay=5)
+        fast = [self._socket() for _ in range(3)]
+        for ws in [slow] + fast:
+            await manager.connect(ws, license_id=1)
+        
+        await asyncio.wait_for(
+            manager.send_to_license(1, WebSocketMessage(event="new_message", data={"id": 1})), timeout=0.5
+        )
+        await asyncio.sleep(0.05)
+        
+        assert all(ws.frames and ws.frames[0]["data"] == {"id": 1} for ws in fast)
+        assert slow.frames == []
+        stats = manager.get_stats()
+        assert stats["connections"] == 4
+        assert stats["sockets"][0]["license_id"] == 1
+        
+        await manager.close()
+    
+    @pytest.mark.asyncio
+    async def test_overflowing_client_is_closed(self, manager):
+        """Queue overflow closes the slow consumer under the close policy"""
+        import asyncio
+        from services.websocket_manager import ClientConnection, WebSocketMessage
+        
+        slow = self._socket(delay=5)
+        await manager.connect(slow, license_id=2)
+        client = manager._clients[slow]
+        await client.close()
+        manager._clients[slow] = ClientConnection(slow, 2, manager._on_client_dead, max_queue=2, policy="close")
+        
+        for n in range(4):
+            await manager.send_to_license(2, WebSocketMessage(event="new_message", data={"id": n}))
+        await asyncio.sleep(0.05)
+        
+        slow.close.assert_awaited()
+        assert manager.get_stats()["slow_consumer_closes"] == 1
+        assert 2 not in manager._connections
+    
+    @pytest.mark.asyncio
+    async def test_send_timeout_closes_socket(self, manager):
+        """A send that times out closes the socket so the client reconnects"""
+        import asyncio
+        from services.websocket_manager import WebSocketMessage
+        
+        stalled = self._socket(delay=5)
+        await manager.connect(stalled, license_id=4)
+        
+        with patch('services.websocket_manager.WS_SEND_TIMEOUT_SECONDS', 0.05):
+            await manager.send_to_license(4, WebSocketMessage(event="new_message", data={"id": 1}))
+            await asyncio.sleep(0.2)
+        
+        stalled.close.assert_awaited_once_with(code=1013)
+        assert manager.get_stats()["slow_consumer_closes"] == 1
+        assert 4 not in manager._connections
+    
+    @pytest.mark.asyncio
+    async def test_typing_indicators_coalesce(self, manager):
+        """Bursts of typing events for one contact deliver only the latest"""
+        import asyncio
+        from services.websocket_manager import WebSocketMessage
+        
+        ws = self._socket()
+        await manager.connect(ws, license_id=3)
+        
+        for is_typing in (True, False, True, False):
+            await manager.send_to_license(3, WebSocketMessage(
+                event="typing_indicator", data={"sender_contact": "alice", "is_typing": is_typing}
+            ))
+        await manager.send_to_license(3, WebSocketMessage(
+            event="typing_indicator", data={"sender_contact": "bob", "is_typing": True}
+        ))
+        await asyncio.sleep(0.3)
+        
+        delivered = {frame["data"]["sender_contact"]: frame["data"]["is_typing"] for frame in ws.frames}
+        assert len(ws.frames) == 2
+        assert delivered == {"alice": False, "bob": True}
+        assert manager.get_stats()["coalesced"] == 3
+        
+        await manager.close()
+
+
+# ============ Cross-worker Pub/Sub ============
+
+class TestPatternPubSub:
+    """One PSUBSCRIBE per worker, dispatch by license id (needs fakeredis)"""
+    
+    @staticmethod
+    async def _manager(server, encoding="json"):
+        from fakeredis import aioredis as fake_aioredis
+        from services.websocket_manager import ConnectionManager, RedisPubSubManager
+        
+        manager = ConnectionManager()
+        manager._pubsub = RedisPubSubManager(redis_client=fake_aioredis.FakeRedis(server=server), encoding=encoding)
+        await manager._pubsub.initialize()
+        manager._pubsub_initialized = True
+        return manager
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("encoding", ["json", "msgpack"])
+    async def test_messages_reach_sockets_on_other_workers(self, encoding):
+        import asyncio
+        fakeredis = pytest.importorskip("fakeredis")
+        if encoding == "msgpack":
+            pytest.importorskip("msgpack")
+        from services.websocket_manager import WebSocketMessage
+        
+        server = fakeredis.FakeServer()
+        workers = [await self._manager(server, encoding) for _ in range(2)]
+        sockets = {}
+        for index, manager in enumerate(workers):
+            for license_id in (1, 2):
+                ws = TestFanOut._socket()
+                await manager.connect(ws, license_id=license_id)
+                sockets[(index, license_id)] = ws
+        await asyncio.sleep(0.1)
+        
+        await asyncio.gather(*(
+            workers[0].send_to_license(1, WebSocketMessage(event="new_message", data={"id": n}))
+            for n in range(20)
+        ))
+        await asyncio.sleep(0.2)
+        
+        for index in range(2):
+            assert sorted(frame["data"]["id"] for frame in sockets[(index, 1)].frames) == list(range(20))
+            assert sockets[(index, 2)].frames == []
+        # Concurrent publishes share pipeline round-trips
+        assert workers[0]._pubsub.stats["publish_batches"] < 20
+        
+        for manager in workers:
+            await manager.close()
+
+
 # ============ Global Manager ============
 
 class TestGlobalManager:
@@ -60,7 +60,7 @@ class TestBurstHandling(unittest.IsolatedAsyncioTestCase):
             # Instantiate poller
             poller = MessagePoller()
             poller._check_existing_message = AsyncMock(return_value=False)
-            poller._analyze_and_process_message = AsyncMock()
+            poller._enqueue_analysis = AsyncMock()
             poller._check_user_rate_limit = MagicMock(return_value=(True, ""))
             
             # Mock save_inbox_message to return dummy IDs
@@ -73,16 +73,16 @@ class TestBurstHandling(unittest.IsolatedAsyncioTestCase):
             # 1. Verify all 3 saved to DB
             self.assertEqual(mock_save.call_count, 3)
             
-            # 2. Verify analyze called ONCE (for the group)
-            self.assertEqual(poller._analyze_and_process_message.call_count, 1)
+            # 2. Verify analysis queued ONCE (one job for the group)
+            self.assertEqual(poller._enqueue_analysis.call_count, 1)
+            jobs = poller._enqueue_analysis.call_args[0][1]
+            self.assertEqual(len(jobs), 1)
             
-            # 3. Verify arguments correctly passed combined text
-            call_args = poller._analyze_and_process_message.call_args
-            # Args: message_id, body, ...
+            # 3. Verify the job carries the combined text
             # Message ID should be the latest (103)
-            self.assertEqual(call_args[0][0], 103)
+            self.assertEqual(jobs[0]["message_id"], 103)
             # Body should contain all 3 texts
-            combined_body = call_args[0][1]
+            combined_body = jobs[0]["body"]
             print(f"Combined Body: {combined_body}")
             self.assertIn("Hello", combined_body)
             self.assertIn("message 2", combined_body)
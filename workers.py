@@ -6,45 +6,57 @@ Automatic message polling and processing for Email, WhatsApp, and Telegram
 import asyncio
 import os
 import random
+import time
 import hashlib
+import socket
 import base64
 import tempfile
 import mimetypes
 from services.file_storage_service import get_file_storage
 from datetime import datetime, timedelta, timezone
+from uuid import uuid4
 from typing import Optional, Dict, List, Set, Any
 
 from logging_config import get_logger
-from models.task_queue import fetch_next_task, complete_task, fail_task
+from models.task_queue import (
+    fetch_next_tasks,
+    enqueue_tasks_bulk,
+    complete_tasks_bulk,
+    fail_task,
+    release_task,
+    heartbeat_tasks,
+    retry_stuck_tasks,
+    TASK_VISIBILITY_TIMEOUT_SECONDS,
+    register_task_waker,
+    unregister_task_waker,
+)
+from models.notification_outbox import (
+    CHANNEL_FCM,
+    CHANNEL_WEB_PUSH,
+    OUTBOX_CHANNELS,
+    NOTIFICATION_OUTBOX_LEASE_SECONDS,
+    claim_deliveries,
+    complete_deliveries,
+    fail_delivery,
+    release_delivery,
+    heartbeat_deliveries,
+    reap_expired_deliveries,
+    register_outbox_waker,
+    unregister_outbox_waker,
+)
 from db_helper import (
     get_db,
     fetch_one,
     fetch_all,
     execute_sql,
     commit_db,
+    POSTGRES_AVAILABLE,
 )
 
 logger = get_logger(__name__)
 
-# Database configuration
+# Database configuration (connections come from db_pool via db_helper)
 DB_TYPE = os.getenv("DB_TYPE", "sqlite").lower()
-DATABASE_PATH = os.getenv("DATABASE_PATH", "almudeer.db")
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-# Import appropriate database driver
-if DB_TYPE == "postgresql":
-    try:
-        import asyncpg
-        POSTGRES_AVAILABLE = True
-        aiosqlite = None
-    except ImportError:
-        raise ImportError(
-            "PostgreSQL selected but asyncpg not installed. "
-            "Install with: pip install asyncpg"
-        )
-else:
-    import aiosqlite
-    POSTGRES_AVAILABLE = False
 
 # Import services
 from services.telegram_service import TelegramService
@@ -54,10 +66,12 @@ from services.gmail_api_service import GmailAPIService, GmailRateLimitError
 from services.telegram_phone_service import TelegramPhoneService
 from services.backfill_service import get_backfill_service
 from cache import cache
+from services.dedup_store import get_dedup_store, inbound_message_key
+from services.rate_limiter import llm_request_context, PRIORITY_BACKGROUND
 
 # Import models
 from models import (
-    get_email_config, get_email_oauth_tokens,
+    get_email_config, get_email_oauth_tokens, update_gmail_history_id,
     get_telegram_config,
     get_whatsapp_config,
     save_inbox_message,
@@ -88,12 +102,31 @@ class MessagePoller:
     MAX_MESSAGES_PER_USER_PER_DAY = int(os.getenv("MAX_MESSAGES_PER_USER_DAY", "50"))
     MAX_MESSAGES_PER_USER_PER_MINUTE = int(os.getenv("MAX_MESSAGES_PER_USER_MINUTE", "1"))
     
+    # Scheduler: each license is polled every POLL_INTERVAL_SECONDS, with at most
+    # POLL_MAX_CONCURRENCY licenses polling at once. LLM work is paced separately
+    # by the LLM rate limiter, so adding licenses doesn't stretch the cycle.
+    POLL_INTERVAL_SECONDS = float(os.getenv("POLL_INTERVAL_SECONDS", "300"))
+    POLL_MAX_CONCURRENCY = int(os.getenv("POLL_MAX_CONCURRENCY", "10"))
+    POLL_TICK_SECONDS = 5.0
+    LICENSE_REFRESH_SECONDS = 60.0
+    
     def __init__(self):
         self.running = False
         self.tasks: Dict[int, asyncio.Task] = {}
-        # Track recently processed message hashes to avoid duplicate AI calls
-        self._processed_hashes: Set[str] = set()
-        self._hash_cache_max_size = 1000  # Limit memory usage
+        # Per-license schedule (time.monotonic() deadlines) and licenses being polled
+        self._next_due: Dict[int, float] = {}
+        self._in_flight: Set[int] = set()
+        self._poll_semaphore: Optional[asyncio.Semaphore] = None
+        # Licenses with a Gmail push notification waiting to be synced
+        self._push_pending: Set[int] = set()
+        # Gmail watch expiry per license (epoch seconds), renewed before it lapses
+        self._gmail_watch_expiry: Dict[int, float] = {}
+        # Recently analyzed messages (skip duplicate AI calls), synced outgoing
+        # messages, and incoming platform messages already stored -- the last is
+        # shared with the Telegram listener and WhatsApp webhook
+        self._analyzed_messages = get_dedup_store("analysis")
+        self._outbox_synced = get_dedup_store("outbox_sync")
+        self._inbound_seen = get_dedup_store("inbound")
         # Lightweight in‑memory status used by /api/integrations/workers/status
         self.status: Dict[str, Dict[str, Optional[str]]] = {
             "email_polling": {
@@ -121,9 +154,9 @@ class MessagePoller:
         # Track recent message hashes for duplicate detection
         self._recent_message_hashes: Set[str] = set()
         
-        # Track messages retried this poll cycle (cleared each cycle)
+        # Track messages retried this poll cycle, per license (cleared each cycle)
         # Prevents rapid retry loops within the same 5-minute cycle
-        self._retried_this_cycle: Set[int] = set()
+        self._retried_this_cycle: Dict[int, Set[int]] = {}
         
         # Per-user rate limiting is now handled via Redis/CacheManager
     
@@ -176,8 +209,8 @@ class MessagePoller:
         self.status["email_polling"]["status"] = "running"
         self.status["telegram_polling"]["status"] = "running"
         logger.info("Starting message polling workers...")
+        self._poll_semaphore = asyncio.Semaphore(self.POLL_MAX_CONCURRENCY)
         
-        # Start polling loop
         # Start polling loop
         task = asyncio.create_task(self._polling_loop())
         self.background_tasks.add(task)
@@ -194,54 +227,96 @@ class MessagePoller:
         logger.info("Stopped message polling workers")
     
     async def _polling_loop(self):
-        """Main polling loop - runs every minute"""
+        """
+        Scheduler loop: starts a poll for every license whose next-due time
+        has passed, running up to POLL_MAX_CONCURRENCY licenses concurrently.
+        """
+        licenses_refreshed_at = None
         while self.running:
             try:
-                # Clear retry tracking at the start of each cycle
-                # This allows messages to be retried in this new 5-min window
-                self._retried_this_cycle.clear()
+                now = time.monotonic()
+                if licenses_refreshed_at is None or now - licenses_refreshed_at >= self.LICENSE_REFRESH_SECONDS:
+                    # Get all active licenses with integrations
+                    self._schedule_licenses(await self._get_active_licenses(), now)
+                    licenses_refreshed_at = now
                 
-                # Get all active licenses with integrations
-                active_licenses = await self._get_active_licenses()
-                now_iso = datetime.now(timezone.utc).isoformat()
-                self.status["email_polling"]["last_check"] = now_iso
-                self.status["telegram_polling"]["last_check"] = now_iso
+                for license_id in self._due_licenses(now):
+                    self._in_flight.add(license_id)
+                    task = asyncio.create_task(self._poll_license(license_id))
+                    self.background_tasks.add(task)
+                    task.add_done_callback(self.background_tasks.discard)
                 
-                for license_id in active_licenses:
-                    # Stagger polling: increased delay between licenses to spread AI load
-                    # 10-15s gap ensures we stay under Gemini's 15 RPM limit across users
-                    await asyncio.sleep(random.uniform(10.0, 15.0))
-                    # Poll each integration type
-                    t1 = asyncio.create_task(self._poll_email(license_id))
-                    self.background_tasks.add(t1)
-                    t1.add_done_callback(self.background_tasks.discard)
-                    
-                    t2 = asyncio.create_task(self._poll_telegram(license_id))
-                    self.background_tasks.add(t2)
-                    t2.add_done_callback(self.background_tasks.discard)
-                    # WhatsApp uses webhooks, so no polling needed
-                    
-                    await self._retry_pending_messages(license_id)
-                    await self._retry_approved_outbox(license_id)
-                    
-                    # Poll Telegram delivery statuses (read receipts)
-                    # We run this less frequently or just part of the loop
-                    # Using create_task to run concurrently
-                    t3 = asyncio.create_task(self._poll_telegram_outbox_status(license_id))
-                    self.background_tasks.add(t3)
-                    t3.add_done_callback(self.background_tasks.discard)
+                if self._next_due:
+                    seconds_to_next = max(0.0, min(self._next_due.values()) - time.monotonic())
+                    next_ts = (datetime.now(timezone.utc) + timedelta(seconds=seconds_to_next)).isoformat()
+                    self.status["email_polling"]["next_check"] = next_ts
                 
-                # Wait 300 seconds (5 minutes) before next poll - optimized for Gemini free tier
-                # This ensures we stay well within 15 RPM limit even with 10 users
-                next_ts = (datetime.now(timezone.utc) + timedelta(seconds=300)).isoformat()
-                self.status["email_polling"]["next_check"] = next_ts
-                await asyncio.sleep(300)
+                await asyncio.sleep(self.POLL_TICK_SECONDS)
                 
             except Exception as e:
                 logger.error(f"Error in polling loop: {e}", exc_info=True)
                 self.status["email_polling"]["status"] = "error"
                 self.status["telegram_polling"]["status"] = "error"
-                await asyncio.sleep(300)  # Wait before retry
+                await asyncio.sleep(self.POLL_TICK_SECONDS * 6)  # Wait before retry
+    
+    def _schedule_licenses(self, active_licenses: List[int], now: float):
+        """
+        Sync the schedule with the active license list.
+        New licenses get a random first due time within one interval, so a
+        restart spreads the load instead of polling everyone at once.
+        """
+        active = set(active_licenses)
+        for license_id in list(self._next_due):
+            if license_id not in active:
+                del self._next_due[license_id]
+                self._retried_this_cycle.pop(license_id, None)
+        for license_id in active:
+            if license_id not in self._next_due:
+                self._next_due[license_id] = now + random.uniform(0, self.POLL_INTERVAL_SECONDS)
+    
+    def _due_licenses(self, now: float) -> List[int]:
+        """Licenses whose next poll is due and that aren't being polled already"""
+        due = [
+            license_id for license_id, due_at in self._next_due.items()
+            if due_at <= now and license_id not in self._in_flight
+        ]
+        return sorted(due, key=self._next_due.get)
+    
+    async def _poll_license(self, license_id: int):
+        """Run one poll cycle for a license, then schedule its next one"""
+        try:
+            async with self._poll_semaphore:
+                # This allows messages to be retried in this new 5-min window
+                self._retried_this_cycle.pop(license_id, None)
+                now_iso = datetime.now(timezone.utc).isoformat()
+                self.status["email_polling"]["last_check"] = now_iso
+                self.status["telegram_polling"]["last_check"] = now_iso
+                
+                # I/O-bound channel work runs concurrently; WhatsApp uses webhooks
+                channel_polls = {
+                    "email": self._poll_email(license_id),
+                    "telegram": self._poll_telegram(license_id),
+                    "outbox_retry": self._retry_approved_outbox(license_id),
+                    # Telegram delivery statuses (read receipts)
+                    "telegram_outbox_status": self._poll_telegram_outbox_status(license_id),
+                }
+                results = await asyncio.gather(*channel_polls.values(), return_exceptions=True)
+                for channel, result in zip(channel_polls, results):
+                    if isinstance(result, Exception):
+                        logger.error(
+                            f"Error polling {channel} for license {license_id}: {type(result).__name__}: {result}",
+                            exc_info=result
+                        )
+            
+            # LLM-bound retries are paced by the global rate limiter; they run
+            # outside the poll slot so slow analysis never holds up other licenses
+            await self._retry_pending_messages(license_id)
+        except Exception as e:
+            logger.error(f"Error polling license {license_id}: {e}", exc_info=True)
+        finally:
+            self._in_flight.discard(license_id)
+            if license_id in self._next_due:
+                self._next_due[license_id] = time.monotonic() + self.POLL_INTERVAL_SECONDS
     
     async def _get_active_licenses(self) -> List[int]:
         """Get list of license IDs with active integrations"""
@@ -249,11 +324,7 @@ class MessagePoller:
         
         try:
             if DB_TYPE == "postgresql" and POSTGRES_AVAILABLE:
-                if not DATABASE_URL:
-                    logger.warning("DATABASE_URL not set for PostgreSQL")
-                    return []
-                conn = await asyncpg.connect(DATABASE_URL)
-                try:
+                async with get_db(readonly=True) as conn:
                     # Get licenses with email configs
                     rows = await conn.fetch("""
                         SELECT DISTINCT license_key_id 
@@ -269,10 +340,8 @@ class MessagePoller:
                         WHERE is_active = TRUE
                     """)
                     licenses.extend([row['license_key_id'] for row in rows])
-                finally:
-                    await conn.close()
             else:
-                async with aiosqlite.connect(DATABASE_PATH) as db:
+                async with get_db(readonly=True) as db:
                     # Get licenses with email configs
                     async with db.execute("""
                         SELECT DISTINCT license_key_id 
@@ -308,20 +377,20 @@ class MessagePoller:
     async def _retry_pending_messages(self, license_id: int):
         """Retry AI analysis for messages with placeholder responses"""
         try:
-            # Check global rate limiter cooldown first
+            # Check the primary provider's rate limit cooldown first
             # This prevents multiple licenses from queuing up requests when we're already rate limited
             from services.llm_provider import get_rate_limiter
             rate_limiter = get_rate_limiter()
             
-            if rate_limiter.is_in_cooldown():
-                remaining = rate_limiter.get_cooldown_remaining()
-                logger.debug(f"License {license_id}: Global rate limit cooldown active ({remaining:.1f}s), skipping retries")
+            if rate_limiter.is_in_cooldown("gemini"):
+                remaining = rate_limiter.get_cooldown_remaining("gemini")
+                logger.debug(f"License {license_id}: Gemini rate limit cooldown active ({remaining:.1f}s), skipping retries")
                 return
 
             # Find messages with pending placeholder response
             placeholder = "⏳ جاري تحليل الرسالة تلقائياً..."
             
-            async with get_db() as db:
+            async with get_db(readonly=True) as db:
                 # Query messages with placeholder ai_draft_response
                 # Use different datetime syntax for PostgreSQL vs SQLite
                 if DB_TYPE == "postgresql":
@@ -348,55 +417,53 @@ class MessagePoller:
                 rows = await fetch_all(db, query, [license_id, placeholder])
                 logger.debug(f"License {license_id}: Query returned {len(rows) if rows else 0} rows")
                 
-                if not rows:
-                    return
+            if not rows:
+                return
+            
+            logger.info(f"License {license_id}: Found {len(rows)} pending messages to retry")
+            
+            for row in rows:
+                message_id = row.get("id")
+                body = row.get("body")
+                sender_contact = row.get("sender_contact")
+                sender_name = row.get("sender_name")
+                channel = row.get("channel")
                 
-                logger.info(f"License {license_id}: Found {len(rows)} pending messages to retry")
+                # Skip if already retried this cycle (prevents rapid retry loops)
+                retried = self._retried_this_cycle.setdefault(license_id, set())
+                if message_id in retried:
+                    logger.debug(f"Skipping message {message_id}: already retried this cycle")
+                    continue
                 
-                for row in rows:
-                    message_id = row.get("id")
-                    body = row.get("body")
-                    sender_contact = row.get("sender_contact")
-                    sender_name = row.get("sender_name")
-                    channel = row.get("channel")
-                    
-                    # Skip if already retried this cycle (prevents rapid retry loops)
-                    if message_id in self._retried_this_cycle:
-                        logger.debug(f"Skipping message {message_id}: already retried this cycle")
-                        continue
-                    
-                    # Check rate limit before retrying
-                    allowed, reason = await self._check_user_rate_limit(license_id)
-                    if not allowed:
-                        logger.debug(f"Rate limit for license {license_id}: {reason}. Retry skipped.")
-                        break  # Stop retrying for this license
-                    
-                    # Mark as retried this cycle
-                    self._retried_this_cycle.add(message_id)
-                    
-                    # Add delay between retries
-                    await asyncio.sleep(random.uniform(5.0, 10.0))
-                    
-                    # Re-analyze the message
+                # Check rate limit before retrying
+                allowed, reason = await self._check_user_rate_limit(license_id)
+                if not allowed:
+                    logger.debug(f"Rate limit for license {license_id}: {reason}. Retry skipped.")
+                    break  # Stop retrying for this license
+                
+                # Mark as retried this cycle
+                retried.add(message_id)
+                
+                # Re-analyze the message (paced by the LLM rate limiter, behind interactive calls)
+                with llm_request_context(priority=PRIORITY_BACKGROUND, license_id=license_id):
                     await self._analyze_and_process_message(
                         message_id=message_id,
                         body=body,
                         license_id=license_id,
-                        auto_reply=False,  # Don't auto-reply on retry
                         channel=channel,
                         recipient=sender_contact,
                         sender_name=sender_name
                     )
-                    
-                    logger.info(f"Retried AI analysis for message {message_id}")
-                    
+                
+                logger.info(f"Retried AI analysis for message {message_id}")
+                
         except Exception as e:
             logger.error(f"Error retrying pending messages for license {license_id}: {type(e).__name__}: {e}", exc_info=True)
 
     async def _retry_approved_outbox(self, license_id: int):
         """Retry sending messages that are approved but not yet sent"""
         try:
-            async with get_db() as db:
+            async with get_db(readonly=True) as db:
                 if DB_TYPE == "postgresql":
                     query = """
                         SELECT id, channel 
@@ -420,27 +487,47 @@ class MessagePoller:
                 
                 rows = await fetch_all(db, query, [license_id])
                 
-                if not rows:
-                    return
+            if not rows:
+                return
+            
+            logger.info(f"License {license_id}: Retrying {len(rows)} approved outbox messages")
+            
+            for row in rows:
+                outbox_id = row.get("id")
+                channel = row.get("channel")
+                
+                # Add small delay between sends
+                await asyncio.sleep(1.0)
                 
-                logger.info(f"License {license_id}: Retrying {len(rows)} approved outbox messages")
+                # Reuse existing _send_message logic
+                try:
+                    await self._send_message(outbox_id, license_id, channel)
+                except Exception as send_e:
+                    logger.error(f"Failed to retry outbox {outbox_id}: {send_e}")
                 
-                for row in rows:
-                    outbox_id = row.get("id")
-                    channel = row.get("channel")
-                    
-                    # Add small delay between sends
-                    await asyncio.sleep(1.0)
-                    
-                    # Reuse existing _send_message logic
-                    try:
-                        await self._send_message(outbox_id, license_id, channel)
-                    except Exception as send_e:
-                        logger.error(f"Failed to retry outbox {outbox_id}: {send_e}")
-                    
         except Exception as e:
             logger.error(f"Error retrying approved outbox for license {license_id}: {e}")
     
+    def request_poll(self, license_id: int):
+        """Poll a license on the next scheduler tick (Gmail push notification)"""
+        self._push_pending.add(license_id)
+        if license_id in self._next_due:
+            self._next_due[license_id] = 0.0
+    
+    async def _ensure_gmail_watch(self, license_id: int, gmail_service: GmailAPIService):
+        """Register (or renew) Gmail push notifications when a Pub/Sub topic is configured"""
+        topic = os.getenv("GMAIL_PUBSUB_TOPIC")
+        if not topic:
+            return
+        # Renew a day before the 7-day watch expires
+        if self._gmail_watch_expiry.get(license_id, 0) - time.time() > 24 * 3600:
+            return
+        try:
+            result = await gmail_service.watch(topic)
+            self._gmail_watch_expiry[license_id] = int(result.get("expiration", 0)) / 1000
+        except Exception as e:
+            logger.warning(f"Gmail watch registration failed for license {license_id}: {e}")
+    
     async def _poll_email(self, license_id: int):
         """Poll email for new messages using Gmail API"""
         try:
@@ -448,11 +535,15 @@ class MessagePoller:
             if not config or not config.get("is_active"):
                 return
             
+            # A push notification means there is new mail; skip the interval check
+            pushed = license_id in self._push_pending
+            self._push_pending.discard(license_id)
+            
             # Check if it's time to poll (based on check_interval_minutes)
             last_checked = config.get("last_checked_at")
             check_interval = config.get("check_interval_minutes", 5)
             
-            if last_checked:
+            if last_checked and not pushed:
                 # Support both string (SQLite) and datetime (PostgreSQL) values
                 if isinstance(last_checked, str):
                     try:
@@ -482,6 +573,7 @@ class MessagePoller:
                 tokens.get("refresh_token"),
                 oauth_service
             )
+            await self._ensure_gmail_watch(license_id, gmail_service)
             
             # Get our own email address to filter out self-messages
             # This prevents AI from processing emails WE sent
@@ -532,7 +624,7 @@ class MessagePoller:
             # If backfill, fetch more (e.g. 500), otherwise standard limit
             limit = 500 if is_backfill else 200
             # Fetch messages
-            # Fetch messages
+            history_id = None
             try:
                 if is_backfill:
                     # Smart Backfill: Fetch threads that are UNREPLIED (last message not from us)
@@ -541,13 +633,20 @@ class MessagePoller:
                     emails = await gmail_service.fetch_unreplied_threads(days=backfill_days, limit=100)
                     logger.info(f"Backfill: Fetched {len(emails)} unreplied emails")
                 else:
-                    emails = await gmail_service.fetch_new_emails(since_hours=since_hours, limit=limit)
+                    # Incremental history.list sync; full search when there is no usable history ID
+                    emails, history_id = await gmail_service.sync_emails(
+                        config.get("gmail_history_id"),
+                        since_hours=since_hours,
+                        limit=limit
+                    )
             except GmailRateLimitError as e:
                 logger.warning(f"Rate limit hit for license {license_id}, skipping email poll cycle: {e}")
                 return
 
             
             if not emails:
+                if history_id and history_id != config.get("gmail_history_id"):
+                    await update_gmail_history_id(license_id, history_id)
                 return
 
             # If backfill is active, queue ALL fetched messages and skip standard processing
@@ -602,102 +701,103 @@ class MessagePoller:
             # Use higher limit to avoid missing duplicates when inbox is large
             recent_messages = await get_inbox_messages(license_id, limit=500)
             
-            # Process each email
-            for email_data in emails:
-                # CRITICAL: Skip emails sent BY US to prevent AI loop
-                sender_email = (email_data.get("sender_contact") or "").lower()
-                if our_email_address and sender_email == our_email_address:
-                    # NEW: Sync outgoing emails to outbox
-                    logger.debug(f"Syncing self-sent email to outbox: {email_data.get('subject')}")
+            # Process each email; stored messages are queued for analysis in one batch
+            analysis_jobs = []
+            try:
+                for email_data in emails:
+                    # CRITICAL: Skip emails sent BY US to prevent AI loop
+                    sender_email = (email_data.get("sender_contact") or "").lower()
+                    if our_email_address and sender_email == our_email_address:
+                        # NEW: Sync outgoing emails to outbox
+                        logger.debug(f"Syncing self-sent email to outbox: {email_data.get('subject')}")
                     
-                    # Parse 'To' header to get primary recipient
-                    to_header = email_data.get("to", "")
-                    recipient_email = ""
-                    recipient_name = ""
+                        # Parse 'To' header to get primary recipient
+                        to_header = email_data.get("to", "")
+                        recipient_email = ""
+                        recipient_name = ""
                     
-                    if to_header:
-                        # Simple extraction, first email found
-                        # You might use self.gmail_service._extract_email_address if accessible, or simple split
-                        # gmail_service is available in local scope
-                        recipient_name, recipient_email = gmail_service._extract_email_address(to_header)
+                        if to_header:
+                            # Simple extraction, first email found
+                            # You might use self.gmail_service._extract_email_address if accessible, or simple split
+                            # gmail_service is available in local scope
+                            recipient_name, recipient_email = gmail_service._extract_email_address(to_header)
                     
-                    if not recipient_email:
-                        recipient_email = "Unknown"
+                        if not recipient_email:
+                            recipient_email = "Unknown"
+
+                        from models.inbox import save_synced_outbox_message
+                        await save_synced_outbox_message(
+                            license_id=license_id,
+                            channel="email",
+                            body=email_data["body"] or "",
+                            recipient_email=recipient_email,
+                            recipient_name=recipient_name,
+                            subject=email_data.get("subject"),
+                            attachments=email_data.get("attachments", []),
+                            sent_at=email_data.get("received_at"),
+                            platform_message_id=email_data.get("channel_message_id")
+                        )
+                        continue 
 
-                    from models.inbox import save_synced_outbox_message
-                    await save_synced_outbox_message(
-                        license_id=license_id,
-                        channel="email",
-                        body=email_data["body"] or "",
-                        recipient_email=recipient_email,
-                        recipient_name=recipient_name,
-                        subject=email_data.get("subject"),
-                        attachments=email_data.get("attachments", []),
-                        sent_at=email_data.get("received_at"),
-                        platform_message_id=email_data.get("channel_message_id")
+                    # Check if we already have this message
+                    existing = await self._check_existing_message(
+                        license_id, "email", email_data.get("channel_message_id")
                     )
-                    continue 
-
-                # Check if we already have this message
-                existing = await self._check_existing_message(
-                    license_id, "email", email_data.get("channel_message_id")
-                )
                 
-                if existing:
-                    continue  # Already processed
+                    if existing:
+                        continue  # Already processed
                 
-                # Apply filters
-                message_dict = {
-                    "body": email_data["body"],
-                    "sender_contact": email_data.get("sender_contact"),
-                    "sender_name": email_data.get("sender_name"),
-                    "subject": email_data.get("subject"),
-                    "channel": "email",
-                    "attachments": email_data.get("attachments", []),
-                }
+                    # Apply filters
+                    message_dict = {
+                        "body": email_data["body"],
+                        "sender_contact": email_data.get("sender_contact"),
+                        "sender_name": email_data.get("sender_name"),
+                        "subject": email_data.get("subject"),
+                        "channel": "email",
+                        "attachments": email_data.get("attachments", []),
+                    }
                 
-                should_process, filter_reason = await apply_filters(
-                    message_dict, license_id, recent_messages
-                )
+                    should_process, filter_reason = await apply_filters(
+                        message_dict, license_id, recent_messages
+                    )
                 
-                if not should_process:
-                    logger.info(f"Message filtered: {filter_reason}")
-                    continue
+                    if not should_process:
+                        logger.info(f"Message filtered: {filter_reason}")
+                        continue
                 
-                # Attachments are already handled by GmailAPIService (downloaded & stored)
-                attachments = email_data.get("attachments", [])
+                    # Attachments are already handled by GmailAPIService (downloaded & stored)
+                    attachments = email_data.get("attachments", [])
 
-                # Save to inbox
-                msg_id = await save_inbox_message(
-                    license_id=license_id,
-                    channel="email",
-                    body=email_data["body"],
-                    sender_name=email_data["sender_name"],
-                    sender_contact=email_data["sender_contact"],
-                    sender_id=None,
-                    subject=email_data.get("subject"),
-                    channel_message_id=email_data.get("channel_message_id"),
-                    received_at=email_data.get("received_at"),
-                    attachments=attachments
-                )
-                
-                # Analyze with AI
-                await self._analyze_and_process_message(
-                    message_id=msg_id,
-                    body=email_data["body"],
-                    license_id=license_id,
-                    channel="email",
-                    recipient=email_data.get("sender_contact"),
-                    sender_name=email_data.get("sender_name"),
-                    channel_message_id=email_data.get("channel_message_id"),
-                    attachments=attachments
-                )
+                    # Save to inbox
+                    msg_id = await save_inbox_message(
+                        license_id=license_id,
+                        channel="email",
+                        body=email_data["body"],
+                        sender_name=email_data["sender_name"],
+                        sender_contact=email_data["sender_contact"],
+                        sender_id=None,
+                        subject=email_data.get("subject"),
+                        channel_message_id=email_data.get("channel_message_id"),
+                        received_at=email_data.get("received_at"),
+                        attachments=attachments
+                    )
                 
-                # Small stagger to avoid hitting rate limits
-                await asyncio.sleep(1.0)
+                    # Queue for AI analysis (enqueued together after the loop)
+                    analysis_jobs.append({
+                        "message_id": msg_id,
+                        "body": email_data["body"],
+                        "channel": "email",
+                        "sender_name": email_data.get("sender_name"),
+                        "channel_message_id": email_data.get("channel_message_id"),
+                        "attachments": attachments,
+                    })
+            finally:
+                await self._enqueue_analysis(license_id, analysis_jobs)
             
-            # Update last_checked_at
+            # Update last_checked_at and the sync cursor once everything is stored
             await self._update_email_last_checked(license_id)
+            if history_id:
+                await update_gmail_history_id(license_id, history_id)
             
         except Exception as e:
             logger.error(f"Error polling email for license {license_id}: {e}", exc_info=True)
@@ -881,10 +981,9 @@ class MessagePoller:
                         platform_message_id=msg.get("channel_message_id")
                     )
                     # Add to cache to prevent duplicate syncs
-                    cache_key = f"outbox_{license_id}_telegram_{msg.get('channel_message_id')}"
-                    if not hasattr(self, '_outbox_sync_cache'):
-                        self._outbox_sync_cache = set()
-                    self._outbox_sync_cache.add(cache_key)
+                    await self._outbox_synced.add(
+                        inbound_message_key(license_id, "telegram", msg.get("channel_message_id"))
+                    )
                     logger.debug(f"Synced outgoing Telegram message to outbox: {msg.get('channel_message_id')}")
                     continue  # Skip inbox processing and AI analysis
 
@@ -935,7 +1034,8 @@ class MessagePoller:
                 grouped_messages[sender_key].append(msg)
 
 
-            # Process groups (Burst Handling)
+            # Process groups (Burst Handling); analysis is queued in one batch
+            analysis_jobs = []
             for sender_key, group in grouped_messages.items():
                 if not group:
                     continue
@@ -946,16 +1046,14 @@ class MessagePoller:
                 if len(group) == 1:
                     # Single message case
                     msg = group[0]
-                    await self._analyze_and_process_message(
-                        msg["db_id"],
-                        msg["body"],
-                        license_id,
-                        "telegram",
-                        msg.get("sender_contact"),
-                        msg.get("sender_name"),
-                        msg.get("channel_message_id"),
-                        attachments=msg.get("attachments")
-                    )
+                    analysis_jobs.append({
+                        "message_id": msg["db_id"],
+                        "body": msg["body"],
+                        "channel": "telegram",
+                        "sender_name": msg.get("sender_name"),
+                        "channel_message_id": msg.get("channel_message_id"),
+                        "attachments": msg.get("attachments"),
+                    })
                 else:
                     # Burst case - merge messages
                     # We process only the LATEST message, but include context from others
@@ -995,16 +1093,16 @@ class MessagePoller:
                         if m.get("attachments"): 
                             all_attachments.extend(m["attachments"])
                     
-                    await self._analyze_and_process_message(
-                        latest_msg["db_id"],
-                        combined_body, # Use combined body for AI understanding
-                        license_id,
-                        "telegram",
-                        latest_msg.get("sender_contact"),
-                        latest_msg.get("sender_name"),
-                        latest_msg.get("channel_message_id"),
-                        attachments=all_attachments
-                    )
+                    analysis_jobs.append({
+                        "message_id": latest_msg["db_id"],
+                        "body": combined_body, # Use combined body for AI understanding
+                        "channel": "telegram",
+                        "sender_name": latest_msg.get("sender_name"),
+                        "channel_message_id": latest_msg.get("channel_message_id"),
+                        "attachments": all_attachments,
+                    })
+
+            await self._enqueue_analysis(license_id, analysis_jobs)
 
             # Update last sync time
             await update_telegram_phone_session_sync_time(license_id)
@@ -1025,7 +1123,14 @@ class MessagePoller:
             content = f"{sender or 'unknown'}:{body.strip().lower()}"
         return hashlib.md5(content.encode()).hexdigest()
     
-    def _is_duplicate_content(self, body: str, sender: Optional[str] = None, channel_message_id: Optional[str] = None) -> bool:
+    async def _is_duplicate_content(
+        self,
+        body: str,
+        sender: Optional[str] = None,
+        channel_message_id: Optional[str] = None,
+        license_id: Optional[int] = None,
+        channel: Optional[str] = None
+    ) -> bool:
         """
         Check if we've recently processed the EXACT same message.
         Only returns True if channel_message_id matches (same message received twice).
@@ -1038,16 +1143,11 @@ class MessagePoller:
         
         msg_hash = self._get_message_hash(body, sender, channel_message_id)
         
-        if msg_hash in self._processed_hashes:
+        # Bounded LRU/TTL store: records the hash and reports whether it was already there
+        if await self._analyzed_messages.seen(f"{license_id}:{channel}:{msg_hash}"):
             logger.debug(f"Exact duplicate message detected (same channel_message_id): {channel_message_id}")
             return True
         
-        # Add to cache and limit size
-        self._processed_hashes.add(msg_hash)
-        if len(self._processed_hashes) > self._hash_cache_max_size:
-            # Remove oldest entries (convert to list, remove first half)
-            self._processed_hashes = set(list(self._processed_hashes)[self._hash_cache_max_size // 2:])
-        
         return False
     
     async def _check_existing_message(self, license_id: int, channel: str, channel_message_id: Optional[str]) -> bool:
@@ -1055,6 +1155,11 @@ class MessagePoller:
         if not channel_message_id:
             return False
         
+        # Already stored by this poller, the Telegram listener or the WhatsApp webhook
+        key = inbound_message_key(license_id, channel, channel_message_id)
+        if await self._inbound_seen.contains(key):
+            return True
+        
         try:
             async with get_db() as db:
                 row = await fetch_one(
@@ -1062,7 +1167,9 @@ class MessagePoller:
                     "SELECT id FROM inbox_messages WHERE license_key_id = ? AND channel = ? AND channel_message_id = ?",
                     [license_id, channel, channel_message_id],
                 )
-                return row is not None
+            if row is not None:
+                await self._inbound_seen.add(key)
+            return row is not None
         except Exception as e:
             logger.error(f"Error checking existing message: {e}")
             return False
@@ -1077,15 +1184,10 @@ class MessagePoller:
         if not platform_message_id:
             return False
         
-        # Check in-memory cache first (to avoid duplicate inserts within same polling cycle)
-        cache_key = f"outbox_{license_id}_{channel}_{platform_message_id}"
-        if hasattr(self, '_outbox_sync_cache') and cache_key in self._outbox_sync_cache:
+        # Check the dedup store first (to avoid duplicate inserts across polling cycles)
+        if await self._outbox_synced.contains(inbound_message_key(license_id, channel, platform_message_id)):
             return True
         
-        # Initialize cache if needed
-        if not hasattr(self, '_outbox_sync_cache'):
-            self._outbox_sync_cache = set()
-        
         # Also check inbox_messages table since outgoing messages from Telegram listener
         # may already be stored there via the live handler
         try:
@@ -1106,6 +1208,63 @@ class MessagePoller:
             return False
 
     
+    async def _mark_duplicate(self, message_id: int):
+        """Close out an exact duplicate without running the AI"""
+        from models import update_inbox_analysis
+        try:
+            await update_inbox_analysis(
+                message_id=message_id,
+                intent="duplicate",
+                urgency="low",
+                sentiment="neutral",
+                language=None,
+                dialect=None,
+                summary="تم تخطي التحليل: محتوى مكرر",
+                draft_response=""
+            )
+        except Exception as e:
+            logger.error(f"Failed to update duplicate message status: {e}")
+
+    async def _enqueue_analysis(self, license_id: int, jobs: List[Dict[str, Any]]) -> List[int]:
+        """
+        Queue AI analysis for messages stored by a poll in one bulk insert.
+        The TaskWorker pool runs them (analyze_message tasks) with retries,
+        instead of the poller analyzing one message at a time.
+        Each job has message_id, body, channel, sender_name, channel_message_id, attachments.
+        """
+        payloads = []
+        for job in jobs:
+            if await self._is_duplicate_content(
+                job["body"], job.get("sender_name"), job.get("channel_message_id"), license_id, job["channel"]
+            ):
+                logger.info(f"Skipping AI for message {job['message_id']}: exact duplicate")
+                await self._mark_duplicate(job["message_id"])
+                continue
+            payloads.append({
+                "message_id": job["message_id"],
+                "body": job["body"],
+                "license_id": license_id,
+                "attachments": job.get("attachments"),
+            })
+        if not payloads:
+            return []
+        
+        try:
+            task_ids = await enqueue_tasks_bulk("analyze_message", payloads)
+        except Exception as e:
+            # Queue unavailable: fall back to analyzing inline
+            logger.error(f"Failed to queue analysis for license {license_id}, analyzing inline: {e}")
+            from services.analysis_service import process_inbox_message_logic
+            for payload in payloads:
+                async with self.ai_semaphore:
+                    await process_inbox_message_logic(**payload)
+            task_ids = []
+        
+        for _ in payloads:
+            await self._increment_user_rate_limit(license_id)
+        logger.info(f"License {license_id}: queued {len(payloads)} messages for analysis")
+        return task_ids
+
     async def _analyze_and_process_message(
         self,
         message_id: int,
@@ -1124,22 +1283,9 @@ class MessagePoller:
         """
         try:
             # Check for duplicate content (channel_message_id) 
-            if self._is_duplicate_content(body, sender_name, channel_message_id):
+            if await self._is_duplicate_content(body, sender_name, channel_message_id, license_id, channel):
                 logger.info(f"Skipping AI for message {message_id}: exact duplicate")
-                from models import update_inbox_analysis
-                try:
-                    await update_inbox_analysis(
-                        message_id=message_id,
-                        intent="duplicate",
-                        urgency="low",
-                        sentiment="neutral",
-                        language=None,
-                        dialect=None,
-                        summary="تم تخطي التحليل: محتوى مكرر",
-                        draft_response=""
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to update duplicate message status: {e}")
+                await self._mark_duplicate(message_id)
                 return
 
             async with self.ai_semaphore:
@@ -1169,7 +1315,7 @@ class MessagePoller:
         from services.delivery_status import save_platform_message_id
         try:
             # Get outbox message (works for both SQLite and PostgreSQL)
-            async with get_db() as db:
+            async with get_db(readonly=True) as db:
                 rows = await fetch_all(
                     db,
                     """
@@ -1232,13 +1378,13 @@ class MessagePoller:
                                 if res: last_platform_id = str(res.get("id"))
 
                     elif channel == "telegram_bot":
-                        async with get_db() as db:
+                        async with get_db(readonly=True) as db:
                             row = await fetch_one(db, "SELECT bot_token FROM telegram_configs WHERE license_key_id = ?", [license_id])
-                            if row and row.get("bot_token"):
-                                ts = TelegramService(row["bot_token"])
-                                res = await ts.send_message(chat_id=message["recipient_id"], text=body)
-                                sent_anything = True
-                                if res: last_platform_id = str(res.get("message_id"))
+                        if row and row.get("bot_token"):
+                            ts = TelegramService(row["bot_token"])
+                            res = await ts.send_message(chat_id=message["recipient_id"], text=body)
+                            sent_anything = True
+                            if res: last_platform_id = str(res.get("message_id"))
 
                     elif channel == "whatsapp":
                         config = await get_whatsapp_config(license_id)
@@ -1286,18 +1432,18 @@ class MessagePoller:
                                             sent_anything = True
                                             last_platform_id = res.get("message_id")
                             elif channel == "telegram_bot":
-                                async with get_db() as db:
+                                async with get_db(readonly=True) as db:
                                     row = await fetch_one(db, "SELECT bot_token FROM telegram_configs WHERE license_key_id = ?", [license_id])
-                                    if row and row.get("bot_token"):
-                                        ts = TelegramService(row["bot_token"])
-                                        res = None
-                                        if mime_type.startswith("image/"): res = await ts.send_photo(chat_id=message["recipient_id"], photo_path=tmp_path)
-                                        elif mime_type.startswith("video/"): res = await ts.send_video(chat_id=message["recipient_id"], video_path=tmp_path)
-                                        elif mime_type.startswith("audio/"): res = await ts.send_audio(chat_id=message["recipient_id"], audio_path=tmp_path)
-                                        else: res = await ts.send_document(chat_id=message["recipient_id"], document_path=tmp_path)
-                                        if res:
-                                            sent_anything = True
-                                            last_platform_id = str(res.get("message_id"))
+                                if row and row.get("bot_token"):
+                                    ts = TelegramService(row["bot_token"])
+                                    res = None
+                                    if mime_type.startswith("image/"): res = await ts.send_photo(chat_id=message["recipient_id"], photo_path=tmp_path)
+                                    elif mime_type.startswith("video/"): res = await ts.send_video(chat_id=message["recipient_id"], video_path=tmp_path)
+                                    elif mime_type.startswith("audio/"): res = await ts.send_audio(chat_id=message["recipient_id"], audio_path=tmp_path)
+                                    else: res = await ts.send_document(chat_id=message["recipient_id"], document_path=tmp_path)
+                                    if res:
+                                        sent_anything = True
+                                        last_platform_id = str(res.get("message_id"))
                             elif channel == "telegram":
                                 session = await get_telegram_phone_session_data(license_id)
                                 if session:
@@ -1327,15 +1473,15 @@ class MessagePoller:
                                     last_platform_id = res.get("message_id")
                     
                     elif channel == "telegram_bot":
-                        async with get_db() as db:
+                        async with get_db(readonly=True) as db:
                             row = await fetch_one(db, "SELECT bot_token FROM telegram_configs WHERE license_key_id = ?", [license_id])
-                            if row and row.get("bot_token"):
-                                ts = TelegramService(row["bot_token"])
-                                await asyncio.sleep(1)
-                                res = await ts.send_voice(chat_id=message["recipient_id"], audio_path=audio_path)
-                                if res:
-                                    sent_anything = True
-                                    last_platform_id = str(res.get("message_id"))
+                        if row and row.get("bot_token"):
+                            ts = TelegramService(row["bot_token"])
+                            await asyncio.sleep(1)
+                            res = await ts.send_voice(chat_id=message["recipient_id"], audio_path=audio_path)
+                            if res:
+                                sent_anything = True
+                                last_platform_id = str(res.get("message_id"))
 
                     elif channel == "telegram":
                         session = await get_telegram_phone_session_data(license_id)
@@ -1456,6 +1602,12 @@ class MessagePoller:
 _poller: Optional[MessagePoller] = None
 
 
+def request_email_poll(license_id: int):
+    """Ask the running poller to sync a license's mailbox as soon as possible"""
+    if _poller is not None:
+        _poller.request_poll(license_id)
+
+
 async def start_message_polling():
     """Start the message polling service"""
     global _poller
@@ -1510,7 +1662,7 @@ async def check_subscription_reminders():
     from models import create_notification
     
     try:
-        async with get_db() as db:
+        async with get_db(readonly=True) as db:
             # Find subscriptions expiring in exactly 3 days
             if DB_TYPE == "postgresql":
                 # PostgreSQL: use CURRENT_DATE + INTERVAL
@@ -1537,28 +1689,28 @@ async def check_subscription_reminders():
                     []
                 )
             
-            if not rows:
-                logger.info("No subscriptions expiring in 3 days")
-                return
+        if not rows:
+            logger.info("No subscriptions expiring in 3 days")
+            return
+        
+        # Send reminder notifications
+        for row in rows:
+            license_id = row["id"]
+            company_name = row.get("company_name", "Unknown")
             
-            # Send reminder notifications
-            for row in rows:
-                license_id = row["id"]
-                company_name = row.get("company_name", "Unknown")
+            try:
+                await create_notification(
+                    license_id=license_id,
+                    notification_type="subscription_expiring",
+                    title="⚠️ اشتراكك ينتهي قريباً",
+                    message=f"اشتراكك في المدير ينتهي خلال 3 أيام. يرجى تجديد الاشتراك لضمان استمرار الخدمة.",
+                    priority="high",
+                    link="/dashboard/settings"
+                )
+                logger.info(f"Sent subscription reminder to license {license_id} ({company_name})")
+            except Exception as e:
+                logger.warning(f"Failed to send reminder to license {license_id}: {e}")
                 
-                try:
-                    await create_notification(
-                        license_id=license_id,
-                        notification_type="subscription_expiring",
-                        title="⚠️ اشتراكك ينتهي قريباً",
-                        message=f"اشتراكك في المدير ينتهي خلال 3 أيام. يرجى تجديد الاشتراك لضمان استمرار الخدمة.",
-                        priority="high",
-                        link="/dashboard/settings"
-                    )
-                    logger.info(f"Sent subscription reminder to license {license_id} ({company_name})")
-                except Exception as e:
-                    logger.warning(f"Failed to send reminder to license {license_id}: {e}")
-                    
     except Exception as e:
         logger.error(f"Error checking subscription reminders: {e}", exc_info=True)
 
@@ -1630,79 +1782,397 @@ async def stop_token_cleanup_worker():
         _token_cleanup_task = None
         logger.info("Stopped FCM token cleanup worker")
 
+# ============ Conversation State Reconciliation Worker ============
+
+_conversation_reconcile_task: Optional[asyncio.Task] = None
+
+
+async def _conversation_reconcile_loop():
+    """Background loop that periodically repairs drift in inbox_conversations."""
+    interval_hours = float(os.getenv("CONVERSATION_RECONCILE_HOURS", "6"))
+    while True:
+        # Run after the first interval; startup already has enough to do
+        await asyncio.sleep(interval_hours * 60 * 60 + random.randint(0, 600))
+        try:
+            from models.inbox import reconcile_conversation_states
+            result = await reconcile_conversation_states()
+            if result["repaired"]:
+                logger.info(f"Conversation reconcile: repaired {result['repaired']}/{result['checked']} conversations")
+        except Exception as e:
+            logger.error(f"Error in conversation reconcile loop: {e}", exc_info=True)
+
+
+async def start_conversation_reconcile_worker():
+    """Start the conversation state reconciliation background task."""
+    global _conversation_reconcile_task
+    if _conversation_reconcile_task is None:
+        _conversation_reconcile_task = asyncio.create_task(_conversation_reconcile_loop())
+        logger.info("Started conversation reconcile worker")
+
+
+async def stop_conversation_reconcile_worker():
+    """Stop the conversation state reconciliation background task."""
+    global _conversation_reconcile_task
+    if _conversation_reconcile_task:
+        _conversation_reconcile_task.cancel()
+        _conversation_reconcile_task = None
+        logger.info("Stopped conversation reconcile worker")
+
 # ============ Task Queue Worker ============
 
+def worker_instance_id(role: str) -> str:
+    """
+    Id unique to this process, for queue leases and heartbeats. Replicas
+    sharing a default id would complete and renew each other's claims.
+    """
+    return f"{role}:{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
 class TaskWorker:
      """
      Persistent Worker for DB-backed Task Queue.
+     
+     Claims up to the number of free worker slots per query and runs the
+     tasks concurrently. Instead of polling, it sleeps until an in-process
+     enqueue or a Postgres NOTIFY on the task_queue channel wakes it, with a
+     slow safety poll for anything missed. Several processes can run workers
+     against the same Postgres queue (claims use SKIP LOCKED).
+     
+     Claimed tasks are leased: a maintenance loop renews the leases of running
+     tasks and reaps tasks whose lease expired (crashed workers elsewhere),
+     which are retried with backoff or dead-lettered by the queue.
      """
-     def __init__(self, worker_id: str = "worker-main"):
-         self.worker_id = worker_id
+     CONCURRENCY = int(os.getenv("TASK_WORKER_CONCURRENCY", "4"))
+     IDLE_POLL_SECONDS = float(os.getenv("TASK_WORKER_IDLE_POLL_SECONDS", "30"))
+     REAPER_INTERVAL_SECONDS = float(os.getenv("TASK_REAPER_INTERVAL_SECONDS", "60"))
+     
+     def __init__(self, worker_id: Optional[str] = None, concurrency: Optional[int] = None):
+         self.worker_id = worker_id or worker_instance_id("tasks")
+         self.concurrency = max(1, concurrency or self.CONCURRENCY)
          self.running = False
          self._loop_task = None
+         self._wakeup = asyncio.Event()
+         self._active: Dict[asyncio.Task, int] = {}
+         self._finished: List[int] = []
+         self._listen_conn = None
+         self._maintenance_task = None
          
      async def start(self):
          self.running = True
-         logger.info(f"TaskWorker {self.worker_id} started")
+         register_task_waker(self._wakeup)
+         await self._start_listener()
+         logger.info(f"TaskWorker {self.worker_id} started (concurrency={self.concurrency})")
          self._loop_task = asyncio.create_task(self._process_loop())
+         self._maintenance_task = asyncio.create_task(self._maintenance_loop())
          
-     async def stop(self):
+     async def stop(self, timeout: float = 30.0):
          self.running = False
-         if self._loop_task:
-             self._loop_task.cancel()
-             try:
-                 await self._loop_task
-             except: pass
+         unregister_task_waker(self._wakeup)
+         self._wakeup.set()
+         for loop_task in (self._loop_task, self._maintenance_task):
+             if loop_task:
+                 loop_task.cancel()
+                 try:
+                     await loop_task
+                 except: pass
+         if self._active:
+             # Let claimed tasks finish before cancelling them
+             _, pending = await asyncio.wait(self._active, timeout=timeout)
+             for task in pending:
+                 task.cancel()
+             await asyncio.gather(*pending, return_exceptions=True)
+         await self._flush_completed()
+         await self._stop_listener()
          logger.info(f"TaskWorker {self.worker_id} stopped")
- 
+
+     async def _start_listener(self):
+         """Hold a dedicated Postgres connection LISTENing for new tasks"""
+         if DB_TYPE != "postgresql":
+             return
+         try:
+             from db_pool import db_pool
+             from models.task_queue import TASK_NOTIFY_CHANNEL
+             if not db_pool.pool:
+                 return
+             self._listen_conn = await db_pool.pool.acquire()
+             await self._listen_conn.add_listener(TASK_NOTIFY_CHANNEL, self._on_notify)
+         except Exception as e:
+             logger.warning(f"TaskWorker LISTEN unavailable, polling instead: {e}")
+             self._listen_conn = None
+
+     def _on_notify(self, connection, pid, channel, payload):
+         self._wakeup.set()
+
+     async def _stop_listener(self):
+         if not self._listen_conn:
+             return
+         from db_pool import db_pool
+         from models.task_queue import TASK_NOTIFY_CHANNEL
+         try:
+             await self._listen_conn.remove_listener(TASK_NOTIFY_CHANNEL, self._on_notify)
+             await db_pool.pool.release(self._listen_conn)
+         except Exception as e:
+             logger.debug(f"TaskWorker LISTEN cleanup failed: {e}")
+         self._listen_conn = None
+
      async def _process_loop(self):
          while self.running:
              try:
-                 # 1. Fetch Task
-                 task = await fetch_next_task(self.worker_id)
-                 
-                 if not task:
-                     await asyncio.sleep(1.0) # Idle wait
+                 await self._flush_completed()
+                 free_slots = self.concurrency - len(self._active)
+                 if free_slots <= 0:
+                     await asyncio.wait(self._active, return_when=asyncio.FIRST_COMPLETED)
                      continue
                  
-                 task_id = task["id"]
-                 task_type = task["task_type"]
-                 payload = task["payload"]
+                 # 1. Claim a batch (clear first so an enqueue during the claim isn't lost)
+                 self._wakeup.clear()
+                 tasks = await fetch_next_tasks(self.worker_id, limit=free_slots)
                  
-                 logger.info(f"Processing task {task.get('id')}: {task_type}")
+                 if not tasks:
+                     try:
+                         await asyncio.wait_for(self._wakeup.wait(), timeout=self.IDLE_POLL_SECONDS)
+                     except asyncio.TimeoutError:
+                         pass
+                     continue
                  
-                 # 2. Execute Logic
-                 try:
-                     result = None
-                     if task_type == "analyze_message":
-                          # Process and analyze using centralized service
-                        from services.analysis_service import process_inbox_message_logic
-                        
-                        await process_inbox_message_logic(
-                            message_id=payload.get("message_id"),
-                            body=payload.get("body"),
-                            license_id=payload.get("license_id"),
-                            telegram_chat_id=payload.get("telegram_chat_id"),
-                            attachments=payload.get("attachments")
-                        )
-                     elif task_type == "analyze":
-                          # Generic analyze from main.py endpoint
-                          from agent import process_message
-                          result = await process_message(
-                              message=payload.get("message"),
-                              message_type=payload.get("message_type"),
-                              sender_name=payload.get("sender_name"),
-                              sender_contact=payload.get("sender_contact"),
-                          )
-                     
-                     # 3. Complete
-                     await complete_task(task_id)
-                     logger.info(f"Task {task_id} completed")
-                     
-                 except Exception as e:
-                     logger.error(f"Task {task_id} failed: {e}", exc_info=True)
-                     await fail_task(task_id, str(e))
+                 # 2. Run concurrently
+                 for task in tasks:
+                     runner = asyncio.create_task(self._run_task(task))
+                     self._active[runner] = task["id"]
+                     runner.add_done_callback(lambda done: self._active.pop(done, None))
                      
+             except asyncio.CancelledError:
+                 raise
              except Exception as outer_e:
                  logger.error(f"Worker loop error: {outer_e}")
                  await asyncio.sleep(5.0)
+
+     async def _run_task(self, task: Dict):
+         task_id = task["id"]
+         task_type = task["task_type"]
+         logger.info(f"Processing task {task_id}: {task_type}")
+         try:
+             # Queued work: its LLM calls yield to interactive ones
+             with llm_request_context(priority=PRIORITY_BACKGROUND, license_id=task["payload"].get("license_id")):
+                 await self._execute(task_type, task["payload"])
+             # Recorded in bulk by the process loop, which this also wakes to refill the slot
+             self._finished.append(task_id)
+             self._wakeup.set()
+             logger.info(f"Task {task_id} completed")
+         except asyncio.CancelledError:
+             await release_task(task_id, self.worker_id)
+             raise
+         except Exception as e:
+             logger.error(f"Task {task_id} failed: {e}", exc_info=True)
+             status = await fail_task(task_id, self.worker_id, str(e))
+             if status is None:
+                 logger.warning(f"Task {task_id} lease was lost to another worker, not recording the failure")
+             elif status == "pending":
+                 logger.info(f"Task {task_id} will be retried (attempt {task.get('attempts')}/{task.get('max_attempts')})")
+             else:
+                 logger.error(f"Task {task_id} dead-lettered after {task.get('attempts')} attempts")
+
+     async def _flush_completed(self):
+         """Mark every task finished since the last flush completed in one statement"""
+         if not self._finished:
+             return
+         # Dropped only once recorded, so a failed or cancelled flush is retried
+         task_ids = list(self._finished)
+         completed = await complete_tasks_bulk(task_ids, self.worker_id)
+         if len(completed) < len(task_ids):
+             lost = sorted(set(task_ids) - set(completed))
+             logger.warning(f"Tasks {lost} were reaped before completion was recorded; another worker owns them now")
+         del self._finished[:len(task_ids)]
+
+     async def _maintenance_loop(self):
+         """Renew leases of running tasks and reap expired ones"""
+         interval = max(1.0, min(TASK_VISIBILITY_TIMEOUT_SECONDS / 3, self.REAPER_INTERVAL_SECONDS))
+         while self.running:
+             await asyncio.sleep(interval)
+             try:
+                 await heartbeat_tasks(list(self._active.values()), self.worker_id)
+                 reaped = await retry_stuck_tasks()
+                 if reaped:
+                     logger.warning(f"Requeued {reaped} tasks with expired leases")
+             except Exception as e:
+                 logger.error(f"Task maintenance error: {e}")
+
+     async def _execute(self, task_type: str, payload: Dict):
+         if task_type == "analyze_message":
+             # Process and analyze using centralized service
+             from services.analysis_service import process_inbox_message_logic
+             
+             await process_inbox_message_logic(
+                 message_id=payload.get("message_id"),
+                 body=payload.get("body"),
+                 license_id=payload.get("license_id"),
+                 telegram_chat_id=payload.get("telegram_chat_id"),
+                 attachments=payload.get("attachments")
+             )
+         elif task_type == "analyze":
+             # Generic analyze from main.py endpoint
+             from agent import process_message
+             await process_message(
+                 message=payload.get("message"),
+                 message_type=payload.get("message_type"),
+                 sender_name=payload.get("sender_name"),
+                 sender_contact=payload.get("sender_contact"),
+             )
+
+
+# ============ Notification Delivery Worker ============
+
+class NotificationDeliveryWorker:
+    """
+    Drains the notification outbox (models.notification_outbox).
+    
+    Each channel (FCM, web push) has its own claim loop and concurrency
+    limit, so a slow channel never holds up the other. Loops sleep until
+    deliveries are queued in this process, with a safety poll for rows
+    queued elsewhere. Failed deliveries are retried with backoff by the
+    outbox; leases of running sends are renewed and expired ones reaped.
+    """
+    CHANNEL_CONCURRENCY = {
+        CHANNEL_FCM: int(os.getenv("NOTIFICATION_FCM_CONCURRENCY", "8")),
+        CHANNEL_WEB_PUSH: int(os.getenv("NOTIFICATION_WEB_PUSH_CONCURRENCY", "4")),
+    }
+    IDLE_POLL_SECONDS = float(os.getenv("NOTIFICATION_OUTBOX_IDLE_POLL_SECONDS", "15"))
+    
+    def __init__(self, worker_id: Optional[str] = None, concurrency: Optional[Dict[str, int]] = None):
+        self.worker_id = worker_id or worker_instance_id("notifications")
+        self.concurrency = {
+            channel: max(1, limit) for channel, limit in {**self.CHANNEL_CONCURRENCY, **(concurrency or {})}.items()
+        }
+        self.running = False
+        self._wakeups = {channel: asyncio.Event() for channel in OUTBOX_CHANNELS}
+        self._active: Dict[str, Dict[asyncio.Task, int]] = {channel: {} for channel in OUTBOX_CHANNELS}
+        self._sent: Dict[int, int] = {}
+        self._loops: List[asyncio.Task] = []
+    
+    async def start(self):
+        self.running = True
+        for channel, event in self._wakeups.items():
+            register_outbox_waker(event)
+            self._loops.append(asyncio.create_task(self._channel_loop(channel)))
+        self._loops.append(asyncio.create_task(self._maintenance_loop()))
+        logger.info(f"NotificationDeliveryWorker {self.worker_id} started (concurrency={self.concurrency})")
+    
+    async def stop(self, timeout: float = 30.0):
+        self.running = False
+        for event in self._wakeups.values():
+            unregister_outbox_waker(event)
+        for loop_task in self._loops:
+            loop_task.cancel()
+        await asyncio.gather(*self._loops, return_exceptions=True)
+        self._loops = []
+        active = [task for tasks in self._active.values() for task in tasks]
+        if active:
+            _, pending = await asyncio.wait(active, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        await self._flush_sent()
+        logger.info(f"NotificationDeliveryWorker {self.worker_id} stopped")
+    
+    async def _channel_loop(self, channel: str):
+        active = self._active[channel]
+        wakeup = self._wakeups[channel]
+        while self.running:
+            try:
+                await self._flush_sent()
+                free_slots = self.concurrency[channel] - len(active)
+                if free_slots <= 0:
+                    await asyncio.wait(active, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                
+                wakeup.clear()
+                deliveries = await claim_deliveries(channel, self.worker_id, free_slots)
+                if not deliveries:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), timeout=self.IDLE_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                
+                for delivery in deliveries:
+                    runner = asyncio.create_task(self._run_delivery(delivery))
+                    active[runner] = delivery["id"]
+                    runner.add_done_callback(lambda done: active.pop(done, None))
+            
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notification outbox loop error ({channel}): {e}")
+                await asyncio.sleep(5.0)
+    
+    async def _run_delivery(self, delivery: Dict):
+        channel = delivery["channel"]
+        try:
+            self._sent[delivery["id"]] = await self._deliver(channel, delivery["license_id"], delivery["payload"])
+            self._wakeups[channel].set()
+        except asyncio.CancelledError:
+            await release_delivery(delivery["id"], self.worker_id)
+            raise
+        except Exception as e:
+            status = await fail_delivery(delivery, self.worker_id, str(e))
+            if status is None:
+                logger.warning(f"Notification delivery {delivery['id']} lease was lost to another worker, not recording the failure")
+                return
+            logger.warning(
+                f"Notification delivery {delivery['id']} ({channel}) failed, "
+                f"attempt {delivery['attempts']}/{delivery['max_attempts']}, now {status}: {e}"
+            )
+    
+    async def _flush_sent(self):
+        """Record finished deliveries in one transaction"""
+        if not self._sent:
+            return
+        # Dropped only once recorded, so a failed flush is retried
+        sent = dict(self._sent)
+        await complete_deliveries(sent, self.worker_id)
+        for delivery_id in sent:
+            self._sent.pop(delivery_id, None)
+    
+    async def _maintenance_loop(self):
+        """Renew leases of running sends and reap expired ones"""
+        interval = max(1.0, NOTIFICATION_OUTBOX_LEASE_SECONDS / 3)
+        while self.running:
+            await asyncio.sleep(interval)
+            try:
+                await heartbeat_deliveries(
+                    [delivery_id for tasks in self._active.values() for delivery_id in tasks.values()],
+                    self.worker_id
+                )
+                reaped = await reap_expired_deliveries()
+                if reaped:
+                    logger.warning(f"Requeued {reaped} notification deliveries with expired leases")
+            except Exception as e:
+                logger.error(f"Notification outbox maintenance error: {e}")
+    
+    async def _deliver(self, channel: str, license_id: int, payload: Dict) -> int:
+        """Send one queued notification on its channel. Returns devices reached."""
+        notification_id = payload.get("notification_id")
+        if channel == CHANNEL_FCM:
+            from services.fcm_mobile_service import send_fcm_to_license
+            return await send_fcm_to_license(
+                license_id=license_id,
+                title=payload["title"],
+                body=payload["body"],
+                data=payload.get("data"),
+                link=payload.get("link"),
+                image=payload.get("image"),
+                notification_id=notification_id,
+                raise_on_failure=True
+            )
+        if channel == CHANNEL_WEB_PUSH:
+            from services.push_service import send_push_to_license
+            return await send_push_to_license(
+                license_id=license_id,
+                title=payload["title"],
+                message=payload["body"],
+                link=payload.get("link") or "/dashboard/notifications",
+                tag=f"notification-{notification_id}",
+                priority=payload.get("priority", "normal"),
+                notification_id=notification_id
+            )
+        raise ValueError(f"Unknown notification channel: {channel}")